@@ -26,10 +26,18 @@ AI Database Routines
 
 '''
 
+import bisect
+import logging
+import operator
+import os
 import Queue
+import re
+import string
 import threading
 import sys
+import weakref
 
+from itertools import groupby
 from osol_install.auto_install.installadm_common import _
 from sqlite3 import dbapi2 as sqlite
 
@@ -39,23 +47,121 @@ PROFILES_TABLE = 'profiles'    # DB table name for profiles
 # Defined list of criteria that we treat as case sensitive.
 CRIT_LIST_CASE_SENSITIVE = ['zonename']
 
+# How findManifest() locates the best matching manifest:
+#    FIND_WITH_INDEX - evaluate the criteria against an in-memory
+#                      CriteriaIndex, falling back to SQL if the index
+#                      can not answer the request
+#    FIND_WITH_SQL   - issue the build_query() query
+#    FIND_CROSSCHECK - do both, log any difference and return the SQL answer
+FIND_WITH_INDEX = 'index'
+FIND_WITH_SQL = 'sql'
+FIND_CROSSCHECK = 'crosscheck'
+FIND_MANIFEST_MODE = FIND_WITH_INDEX
+
+
+# Number of reader connections (and threads) opened by each DB object
+READERS = 2
+
+# Seconds a connection retries an operation on a database locked by another
+# connection before failing with "database is locked"
+BUSY_TIMEOUT = 15
+
+# Seconds DBrequest.waitAns() waits for an answer by default; longer than
+# BUSY_TIMEOUT so that a request waiting for a lock is not abandoned early
+REQUEST_TIMEOUT = BUSY_TIMEOUT + 15
+
+# Number of prepared statements each connection keeps for reuse. The
+# matching queries are parameterized (see build_query) so that their text,
+# the statement cache key, only varies with the criteria in use.
+STATEMENT_CACHE = 100
+
+# SQLite journal mode set by DB objects opened for commit, or None to leave
+# the database's journal mode unchanged. In "wal" mode readers are never
+# blocked by a writer, but every process reading the database then needs
+# write access to the service directory to create the AI.db-shm file, which
+# the web server does not have by default.
+JOURNAL_MODE = None
+
 
 class DB:
     ''' Class to connect to, and look-up entries in the SQLite database '''
 
-    def __init__(self, db, commit=False):
-        ''' Here we initialize the queue the DB thread will run, the
-        DB thread itself (as well as daemonize it, and start it)
+    def __init__(self, db, commit=False, readers=None, journal_mode=None):
+        ''' Here we initialize the queues the DB threads will run, the
+        DB threads themselves (as well as daemonize them, and start them).
+
+        Queries are answered by a pool of reader threads, each with its own
+        connection, so independent requests run concurrently. If commit is
+        True, a single writer thread handles the requests needing commit.
+
+        Args
+            db           - path to the database file
+            commit       - True if requests needing commit will be issued
+            readers      - number of reader connections (READERS if None)
+            journal_mode - journal mode set by the writer connection
+                           (JOURNAL_MODE if None)
         '''
-        self._requests = Queue.Queue()
-        self._runner = DBthread(db, self._requests, commit)
-        self._runner.setDaemon(True)
-        self._runner.start()
+        if readers is None:
+            readers = READERS
+        if journal_mode is None:
+            journal_mode = JOURNAL_MODE
+        self._dbfile = db
+        self._runners = list()
+
+        read_queue = Queue.Queue()
+        for i in range(max(readers, 1)):
+            self._runners.append(DBthread(db, read_queue, False))
+
+        write_queue = None
+        if commit:
+            write_queue = Queue.Queue()
+            self._runners.append(DBthread(db, write_queue, True,
+                                          journal_mode=journal_mode))
+
+        self._requests = DBqueue(read_queue, write_queue,
+                                 schema=DBSchema(db))
+        for runner in self._runners:
+            runner.setNotify(self._requests)
+            runner.setDaemon(True)
+            runner.start()
 
     def getQueue(self):
         ''' Return the database request queue.'''
         return self._requests
 
+    def getPath(self):
+        ''' Return the path of the database file.'''
+        return self._dbfile
+
+    def submit(self, query, commit=False, params=None):
+        ''' Queue the SQL query and return its DBrequest without waiting for
+        the answer; collect it later with the DBrequest's result().
+        '''
+        request = DBrequest(query, commit=commit, params=params)
+        self._requests.put(request)
+        return request
+
+    def close(self):
+        ''' Stop the DB threads and close their connections. Requests
+        already queued are processed first.
+        '''
+        _stopRunners(self._runners)
+
+    def closeWhenUnused(self, refs):
+        ''' Close the DB, as close() does, once this object is no longer
+        referenced, rather than under the requests still using it. The weak
+        reference doing so is added to the set refs, which must be kept
+        until then, and removed from it when the DB is closed.
+        '''
+        runners = self._runners
+
+        def unused(ref):
+            ''' Called once the DB object is gone '''
+            refs.discard(ref)
+            _stopRunners(runners)
+
+        refs.add(weakref.ref(self, unused))
+
     def verifyDBStructure(self):
         '''Ensures reasonable DB schema and columns or else
         raises a SystemExit
@@ -92,20 +198,59 @@ class DB:
             raise SystemExit(_("Error:\tDatabase columns appear malformed"))
 
 
+def _stopRunners(runners):
+    ''' Stop the DB threads runners, see DB.close() '''
+    # the readers share a queue, so flag them all before waking any
+    for runner in runners:
+        runner.stop(wake=False)
+    for runner in runners:
+        runner.wake()
+
+
+class DBqueue(object):
+    ''' Request queue of a DB object. Requests needing commit go to the
+    writer thread, all others to the pool of reader threads.
+    '''
+
+    def __init__(self, read_queue, write_queue=None, schema=None):
+        self._read_queue = read_queue
+        self._write_queue = write_queue
+        # DBSchema caching the database's criteria columns, see getCriteria
+        self.schema = schema
+
+    def put(self, request):
+        ''' Queue a DBrequest for the appropriate DB thread. Requests needing
+        commit on a DB not opened for commit are answered with an error by a
+        reader.
+        '''
+        if request.needsCommit() and self._write_queue is not None:
+            self._write_queue.put(request)
+        else:
+            self._read_queue.put(request)
+
+    def committed(self):
+        ''' Called by the writer thread after each commit '''
+        if self.schema is not None:
+            self.schema.invalidate()
+
+
 class DBrequest(object):
     ''' Class to hold SQL queries and their responses '''
 
-    def __init__(self, query, commit=False):
+    def __init__(self, query, commit=False, params=None):
         ''' Set the private SQL query and create the event to flag when
-        the query has returned.
+        the query has returned. params are the values bound to the query's
+        "?" placeholders, if any.
         '''
         self._sql = str(query)
+        self._params = tuple(params or ())
         self._e = threading.Event()
         self._ans = None
         self._committable = commit
 
     def __repr__(self):
         result = ["DBrequest:_sql:%s" % self._sql]
+        result += ["          _params:%s" % (self._params,)]
         result += ["          _ans:%s" % self._ans]
         result += ["          _committable:%s" % self._committable]
         return "\n".join(result)
@@ -120,6 +265,16 @@ class DBrequest(object):
         ''' Use getSql() to access the SQL query string. '''
         return(self._sql)
 
+    def getParams(self):
+        ''' Use getParams() to access the values bound to the query. '''
+        return(self._params)
+
+    def getStatements(self):
+        ''' Use getStatements() to access the (SQL query, values) tuples
+        to execute for this request.
+        '''
+        return [(self._sql, self._params)]
+
     def setResponse(self, resp):
         ''' Use setResponse() to set the DB response and update the event flag.
         (Will throw a RuntimeError if already set.)
@@ -148,17 +303,59 @@ class DBrequest(object):
         '''
         return(self._e.isSet())
 
-    def waitAns(self):
+    def waitAns(self, timeout=REQUEST_TIMEOUT):
         ''' Use waitAns() to wait for setResponse() to set the event '''
 
-        # 15 second timeout is arbitrary to prevent possible deadlock
-        self._e.wait(15)
+        # the timeout prevents a possible deadlock should a DB thread die
+        self._e.wait(timeout)
+
+    def result(self, timeout=REQUEST_TIMEOUT):
+        ''' Use result() to wait for the DB response and retrieve it, as
+        getResponse() does.
+        '''
+        self.waitAns(timeout)
+        return self.getResponse()
+
+
+class DBtransaction(DBrequest):
+    ''' A DBrequest executing several SQL statements in one transaction, so
+    that they are committed together or not at all. The response is that of
+    the last statement.
+    '''
+
+    def __init__(self, statements, commit=True):
+        ''' statements is a non-empty list of SQL queries, or of (SQL query,
+        values) tuples for queries with "?" placeholders.
+        '''
+        self._statements = list()
+        for statement in statements:
+            if isinstance(statement, basestring):
+                statement = (statement, None)
+            self._statements.append((str(statement[0]),
+                                     tuple(statement[1] or ())))
+        if not self._statements:
+            raise ValueError("no statements in transaction")
+        DBrequest.__init__(self, self._statements[-1][0], commit=commit,
+                           params=self._statements[-1][1])
+
+    def __repr__(self):
+        result = ["DBtransaction:_statements:%d" % len(self._statements)]
+        result += [DBrequest.__repr__(self)]
+        return "\n".join(result)
+
+    def getStatements(self):
+        ''' Use getStatements() to access the (SQL query, values) tuples
+        to execute in the transaction.
+        '''
+        return list(self._statements)
 
 
 class DBthread(threading.Thread):
-    '''Class to interface with SQLite as the provider is single threaded'''
+    '''Class to interface with SQLite as the provider is single threaded.
+    Each DBthread owns one connection and serves the requests of one queue.
+    '''
 
-    def __init__(self, db, queue, commit):
+    def __init__(self, db, queue, commit, journal_mode=None):
         ''' Here we create a new thread object, create a DB connection object,
         keep track of the DB filename and track the request queue to run on.
         '''
@@ -168,12 +365,55 @@ class DBthread(threading.Thread):
         self._dBfile = db
         self._requests = queue
         self._committable = commit
+        self._journal_mode = journal_mode
+        self._notify = None
+        self._stopped = False
 
     def __del__(self):
         ''' On destruction, close the DB connection if still open '''
         if self._con is not None:
             self._con.close()
 
+    def setNotify(self, notify):
+        ''' Set an object whose committed() method is called after each
+        successful commit
+        '''
+        self._notify = notify
+
+    def stop(self, wake=True):
+        ''' Flag the thread to exit once it has drained the request queue.
+        Unless wake is False, also queue the None request which wakes up the
+        thread; threads sharing a queue must all be flagged before any of
+        them is woken up.
+        '''
+        self._stopped = True
+        if wake:
+            # wake up the thread in case it is waiting on an empty queue
+            self._requests.put(None)
+
+    def wake(self):
+        ''' Queue a None request to wake up a thread flagged by stop() '''
+        self._requests.put(None)
+
+    def _set_journal_mode(self):
+        ''' Switch the database to the requested journal mode. In WAL mode the
+        -wal and -shm files are given the database file's permissions and
+        ownership so that the processes able to read the database can use
+        them.
+        '''
+        self._con.execute("PRAGMA journal_mode=%s" % self._journal_mode)
+        if self._journal_mode.lower() != 'wal':
+            return
+        try:
+            dbstat = os.stat(self._dBfile)
+            for name in (self._dBfile + '-wal', self._dBfile + '-shm'):
+                if os.path.exists(name):
+                    os.chmod(name, dbstat.st_mode & 0777)
+                    if os.geteuid() == 0:
+                        os.chown(name, dbstat.st_uid, dbstat.st_gid)
+        except OSError as err:
+            logging.debug("unable to set permissions of WAL files: %s", err)
+
     def run(self):
         '''Here we simply iterate over the request queue executing queries
         and reporting responses. Errors are set as strings for that DBrequest.
@@ -184,15 +424,23 @@ class DBthread(threading.Thread):
                 # changing the DB while we are working on it (but don't use
                 # EXCLUSIVE since there may be persistent readers)
                 self._con = sqlite.connect(self._dBfile,
+                                           timeout=BUSY_TIMEOUT,
+                                           cached_statements=STATEMENT_CACHE,
                                            isolation_level="IMMEDIATE")
+                if self._journal_mode:
+                    self._set_journal_mode()
             else:
-                self._con = sqlite.connect(self._dBfile)
+                self._con = sqlite.connect(self._dBfile,
+                                           timeout=BUSY_TIMEOUT,
+                                           cached_statements=STATEMENT_CACHE)
         except sqlite.OperationalError:
             while True:
-                self._requests.get().setResponse(
-                        _("Database open error."))
-            self._con.close()
-            return
+                request = self._requests.get()
+                if request is None:
+                    if self._stopped:
+                        return
+                    continue
+                request.setResponse(_("Database open error."))
 
         sqlite.enable_callback_tracebacks(1)
 
@@ -206,30 +454,46 @@ class DBthread(threading.Thread):
         # iterate over each DBrequest object in the queue
         while True:
             request = self._requests.get()
+            # a None request after stop() means no more work is coming
+            if request is None and self._stopped:
+                self._con.close()
+                self._con = None
+                return
             # skip already processed DBrequest's
             if request is not None and not request.isFinished():
                 # if the connection and query are committable then execute the
                 # query and commit it
                 if request.needsCommit() and self._committable:
+                    # all the statements of the request are committed in a
+                    # single transaction
+                    sql = request.getSql()
                     try:
-                        self._cursor.execute(request.getSql())
+                        for sql, params in request.getStatements():
+                            self._cursor.execute(sql, params)
                         self._con.commit()
+                        if self._notify is not None:
+                            self._notify.committed()
                     except StandardError as ex:
+                        # release the write lock so other connections are
+                        # not kept waiting on the failed transaction
+                        self._con.rollback()
                         # save error string for caller to trigger
                         request.setResponse(_("Database failure with "
-                                              "SQL: %s") % request.getSql() +
+                                              "SQL: %s") % sql +
                                             "\n\t" +
                                             _("Error: %s") % str(ex))
                         # ensure we do not continue processing this request
                         continue
                 # the query does not need to commit
                 elif not request.needsCommit():
+                    sql = request.getSql()
                     try:
-                        self._cursor.execute(request.getSql())
+                        for sql, params in request.getStatements():
+                            self._cursor.execute(sql, params)
                     except StandardError as ex:
                         # save error string for caller to trigger
                         request.setResponse(_("Database failure with "
-                                              "SQL: %s") % request.getSql() +
+                                              "SQL: %s") % sql +
                                             "\n\t" +
                                             _("Error: %s") % str(ex))
                         # ensure we do not continue processing this request
@@ -285,21 +549,23 @@ def is_in_list(crit_name, value, value_list, list_separator=None):
     return 0
 
 
+# characters removed by sanitizeSQL()
+_SQL_SPECIAL = '%*,;()'
+
+
 def sanitizeSQL(text):
     ''' Use to remove special SQL characters which could cause damage or
     unintended results if unexpectedly embedded in an SQL query.
     This shouldn't be expected to make a SQL injection attack somehow
     return valid data, but it should cause it to not be a threat to the DB.
     '''
-    text = text.replace('%', '')
-    text = text.replace('*', '')
-    text = text.replace(',', '')
-    text = text.replace(';', '')
-    text = text.replace('(', '')
-    text = text.replace(')', '')
     # note: "'" should not get stripped as x'<hex>' is how one flags a hex
     # value to SQLite3 so that it returns the string in a string not byte
     # format
+    if isinstance(text, str):
+        return text.translate(None, _SQL_SPECIAL)
+    for char in _SQL_SPECIAL:
+        text = text.replace(char, '')
     return str(text)
 
 
@@ -374,6 +640,9 @@ def tableExists(queue, dbtable):
         queue - database queue
         dbtable - name of database table in question
     '''
+    schema = getattr(queue, 'schema', None)
+    if schema is not None:
+        return schema.getColumns(queue, dbtable) is not None
     query = DBrequest('SELECT * from sqlite_master where name="' + dbtable +
                       '" and type="table"')
     queue.put(query)
@@ -381,6 +650,124 @@ def tableExists(queue, dbtable):
     return len(query.getResponse()) > 0
 
 
+def getColumns(queue, dbtable):
+    '''
+    Returns the list of column names of a database table, empty if the
+    table does not exist
+    Args:
+        queue - database queue
+        dbtable - name of database table in question
+    '''
+    schema = getattr(queue, 'schema', None)
+    if schema is not None:
+        return list(schema.getColumns(queue, dbtable) or [])
+    return _queryColumns(queue, dbtable)
+
+
+def _queryColumns(queue, dbtable):
+    ''' Returns the column names of dbtable as reported by PRAGMA
+    table_info, empty if the table does not exist
+    '''
+    query = DBrequest("PRAGMA table_info(" + dbtable + ")")
+    queue.put(query)
+    query.waitAns()
+    return [col['name'] for col in iter(query.getResponse() or [])]
+
+
+def _queryUsedColumns(queue, dbtable, columns):
+    ''' Returns the set of the given columns of dbtable which are set
+    (non-NULL) in at least one row
+    '''
+    if not columns:
+        return set()
+    # use the SQL COUNT() aggregator to determine if the criteria is in use
+    query = DBrequest("SELECT " +
+                      ", ".join(["COUNT(" + col_name + ") as " + col_name
+                                 for col_name in columns]) +
+                      " FROM " + dbtable)
+    queue.put(query)
+    query.waitAns()
+    counts = query.getResponse()[0]
+    return set([col_name for col_name in columns
+                if counts[str(col_name)] > 0])
+
+
+class DBSchema(object):
+    ''' Cache of the table columns of an AI database and of which criteria
+    columns are in use, shared by all users of a DB object.
+
+    The columns are reloaded when the database's schema_version changes.
+    Which criteria are in use is recomputed after every commit by the DB's
+    writer thread (see DBqueue.committed) and whenever the database file
+    is changed by another process. The schema_version is only queried
+    after such a change, so lookups on an unchanged database need no
+    queries at all.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._signature = None
+        self._version = None
+        self._tables = dict()   # table name -> list of columns or None
+        self._used = dict()     # table name -> (key, set of used columns)
+
+    def invalidate(self):
+        ''' Note a change to the database made through this DB '''
+        self._generation += 1
+
+    def _key(self, queue):
+        ''' Returns the key identifying the current state of the database,
+        reloading the columns if the schema_version changed
+        '''
+        generation = self._generation
+        signature = (dbSignature(self._path), generation)
+        with self._lock:
+            if signature == self._signature:
+                return (self._version, signature)
+        query = DBrequest("PRAGMA schema_version")
+        queue.put(query)
+        query.waitAns()
+        rsp = query.getResponse()
+        version = rsp[0][0] if rsp else None
+        with self._lock:
+            if version is None or version != self._version:
+                self._tables.clear()
+                self._used.clear()
+            self._version = version
+            self._signature = signature
+        return (version, signature)
+
+    def getColumns(self, queue, dbtable):
+        ''' Returns the list of columns of dbtable, None if the table does
+        not exist. The list returned must not be modified.
+        '''
+        self._key(queue)
+        with self._lock:
+            if dbtable in self._tables:
+                return self._tables[dbtable]
+        # every table has at least one column
+        columns = _queryColumns(queue, dbtable) or None
+        with self._lock:
+            self._tables[dbtable] = columns
+        return columns
+
+    def getUsedColumns(self, queue, dbtable, columns):
+        ''' Returns the set of the given criteria columns of dbtable which
+        are in use. The set returned must not be modified.
+        '''
+        key = self._key(queue) + (tuple(columns),)
+        with self._lock:
+            cached = self._used.get(dbtable)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        used = _queryUsedColumns(queue, dbtable, columns)
+        with self._lock:
+            self._used[dbtable] = (key, used)
+        return used
+
+
 def getSpecificCriteria(queue, criteria, criteria2=None,
                         provideManNameAndInstance=False,
                         excludeManifests=None):
@@ -434,29 +821,15 @@ def getCriteria(queue, table=MANIFESTS_TABLE, onlyUsed=True, strip=True):
     needs to be queried on the client). If strip is False, return
     exact DB column names not (more) human names.
     '''
-    # first get the names of the columns (criteria) by using the SQL PRAGMA
-    # statement on the manifest table
-    query = DBrequest("PRAGMA table_info(" + table + ")")
-    queue.put(query)
-    query.waitAns()
-
-    columns = list()
-    query_str = "SELECT "
-    # build a query so we can determine which columns (criteria) are in use
-    # using the output from the PRAGMA statement
-    for col in iter(query.getResponse()):
-        col_name = col['name']
-        # skip columns which are not criteria
-        if col_name in  ["file", "instance", "name"]:
-            continue
-        # use the SQL COUNT() aggregator to determine if the criteria is in use
-        query_str += "COUNT(" + col_name + ") as " + col_name + ", "
-        # add the column name to the list of columns
-        columns.append(col_name)
+    # first get the names of the columns (criteria), skipping the columns
+    # which are not criteria
+    schema = getattr(queue, 'schema', None)
+    if schema is not None:
+        all_columns = schema.getColumns(queue, table) or []
     else:
-        # strip extra ", " from the query
-        query_str = query_str[:-2]
-        query_str += " FROM " + table
+        all_columns = _queryColumns(queue, table)
+    columns = [col_name for col_name in all_columns
+               if col_name not in ["file", "instance", "name"]]
 
     if not (onlyUsed or strip):
         # if we are not gleaning the unused columns and not stripping the
@@ -469,18 +842,18 @@ def getCriteria(queue, table=MANIFESTS_TABLE, onlyUsed=True, strip=True):
                 for column in columns if not column.startswith('MAX')]
 
     else:
-        # we need to run the query from above and determine which columns are
-        # in use we will gather used criteria for the response from the above
-        # query which is like:
+        # we need to determine which columns are in use, by counting the
+        # non-NULL values of each column as in:
         # "SELECT COUNT(memMIN), COUNT(memMAX), ... FROM manifests"
-        query = DBrequest(query_str)
-        queue.put(query)
-        query.waitAns()
+        if schema is not None:
+            used = schema.getUsedColumns(queue, table, columns)
+        else:
+            used = _queryUsedColumns(queue, table, columns)
         rlist = list()
         # iterate over each column
         for col_name in columns:
             # only take columns which have a positive count
-            if query.getResponse()[0][str(col_name)] > 0:
+            if col_name in used:
                 if strip:
                     # take only the criteria name, not a qualifier
                     # (i.e. MIN, MAX) but use both MAX and MIN in case one is
@@ -562,12 +935,45 @@ def getTableCriteria(name, instance, queue, table, humanOutput=False,
     return None
 
 
-def findManifest(criteria, db):
+def findManifest(criteria, db, mode=None):
     '''Used to find a non-default manifest.
     Provided a criteria dictionary, findManifest returns a query
     response containing a single manifest (or None if there are no matching
     manifests).  Manifests with no criteria set (as they are either
     inactive or the default) are screened out.
+
+    mode selects how the manifest is located (FIND_WITH_INDEX,
+    FIND_WITH_SQL or FIND_CROSSCHECK); FIND_MANIFEST_MODE if not given.
+    '''
+    # If we didn't get any criteria, bail providing no manifest
+    if len(criteria) == 0:
+        return None
+
+    if mode is None:
+        mode = FIND_MANIFEST_MODE
+    if mode == FIND_WITH_SQL:
+        return findManifestSQL(criteria, db)
+
+    try:
+        manifest = getCriteriaIndex(db).find(criteria)
+    except CriteriaIndexError as err:
+        logging.debug("criteria index not usable, using SQL: %s", err)
+        return findManifestSQL(criteria, db)
+
+    if mode == FIND_CROSSCHECK:
+        sql_manifest = findManifestSQL(criteria, db)
+        if sql_manifest != manifest:
+            logging.warning(_("Manifest index returned %(index)s but SQL "
+                              "returned %(sql)s for criteria %(crit)s") %
+                            {'index': manifest, 'sql': sql_manifest,
+                             'crit': criteria})
+        return sql_manifest
+    return manifest
+
+
+def findManifestSQL(criteria, db):
+    '''Used to find a non-default manifest by querying the database.
+    See findManifest().
     '''
     # If we didn't get any criteria, bail providing no manifest
     if len(criteria) == 0:
@@ -582,13 +988,12 @@ def findManifest(criteria, db):
     all_criteria_in_db = list(getCriteria(db.getQueue(), strip=False,
         onlyUsed=False))
 
-    # generate query string to obtain best match and
-    # then make the db request
-    query_str = build_query_str(criteria, criteria_set_in_db,
-                                all_criteria_in_db)
+    # generate query to obtain best match and then make the db request
+    query_str, params = build_query(criteria, criteria_set_in_db,
+                                    all_criteria_in_db)
     if not query_str:
         return None
-    query = DBrequest(query_str)
+    query = DBrequest(query_str, params=params)
     db.getQueue().put(query)
     query.waitAns()
 
@@ -600,6 +1005,792 @@ def findManifest(criteria, db):
         return None
 
 
+class CriteriaIndexError(StandardError):
+    '''Raised when a CriteriaIndex can not be built for a database, or can
+    not answer a request the same way the SQL query would (for instance if
+    a client value would not form a valid SQL literal).
+    '''
+    pass
+
+
+# SQLite orders values of different storage classes as
+# NULL < INTEGER/REAL < TEXT < BLOB; _sql_key() maps a value to a tuple
+# ordered the same way. The unbounded end of a range sorts beyond any value.
+_LOWEST = (-2,)
+_NULL_KEY = (-1,)
+_HIGHEST = (3,)
+
+_INTEGER_LITERAL = re.compile(r'^[+-]?[0-9]+$')
+_REAL_LITERAL = re.compile(r'^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)'
+                           r'([eE][+-]?[0-9]+)?$')
+_HEX_LITERAL = re.compile(r'^([0-9a-fA-F]{2})*$')
+
+# Range criteria weighted by the ORDER BY clause of build_query_str(), in
+# precedence order. A value criterion is ordered by its value instead.
+_PRECEDENCE = (('range', 'mac'), ('range', 'ipv4'), ('value', 'platform'),
+               ('value', 'arch'), ('value', 'cpu'), ('range', 'network'),
+               ('range', 'mem'))
+
+
+# Number of client values whose matching rows an index remembers, and of
+# distinct sets of matching profiles a ProfileIndex remembers
+MATCH_CACHE = 4096
+PROFILE_SETS = 1024
+
+# Client values of range criteria converted by _rangeKey()
+_RANGE_KEYS = dict()
+_UNKNOWN = object()
+
+
+def _sql_key(value):
+    '''Return a key ordering value as SQLite orders column values'''
+    if value is None:
+        return _NULL_KEY
+    if isinstance(value, (int, long, float)):
+        return (0, value)
+    if isinstance(value, basestring):
+        return (1, value)
+    return (2, str(value))
+
+
+class _IntervalMap(object):
+    '''Static map from a point to the union of the masks of the closed
+    intervals containing it. Holds intervals given as (low, high, bits),
+    where bits is a bit mask of the rows the interval belongs to, a row
+    belonging to one interval at most. The distinct bounds of the intervals
+    split the values into segments, each bound and each gap between two
+    bounds, contained in the same intervals, so a point is looked up in a
+    hash map of the bounds, or else with one binary search among them.
+    '''
+
+    def __init__(self, intervals):
+        starts = dict()
+        ends = dict()
+        for low, high, bits in intervals:
+            if low > high:
+                # matches no value, as in SQL
+                continue
+            starts[low] = starts.get(low, 0) | bits
+            ends[high] = ends.get(high, 0) | bits
+        self._bounds = sorted(set(starts) | set(ends))
+        # mask of each segment: 2 * n is the gap before bound n (or after
+        # the last one), 2 * n + 1 bound n
+        self.masks = list()
+        self._at = dict()
+        mask = 0
+        for bound in self._bounds:
+            self.masks.append(mask)
+            mask |= starts.get(bound, 0)
+            self._at[bound] = len(self.masks)
+            self.masks.append(mask)
+            mask &= ~ends.get(bound, 0)
+        self.masks.append(mask)
+        if not [gap for gap in self.masks[::2] if gap]:
+            # single point intervals only, such as the mac address of one
+            # client each: every other point is in the empty first gap
+            self._bounds = list()
+
+    def segment(self, point):
+        '''Return the segment of point'''
+        found = self._at.get(point)
+        if found is None:
+            found = 2 * bisect.bisect_left(self._bounds, point)
+        return found
+
+    def segmentEach(self, points):
+        '''Return the list of the segment() of each of a list of points'''
+        count = len(points)
+        if self._bounds:
+            gaps = map(operator.mul, [2] * count,
+                       map(bisect.bisect_left, [self._bounds] * count, points))
+        else:
+            gaps = [0] * count
+        return map(self._at.get, points, gaps)
+
+    def stab(self, point):
+        '''Return the union of the masks of the intervals containing point'''
+        return self.masks[self.segment(point)]
+
+
+def _rangeKey(crit, value):
+    '''Return the _sql_key() of rangeParam(crit, value), or None if the
+    client value would not form a valid SQL literal. The manifest and the
+    profile index of a database convert the same client values, so the
+    conversions are remembered.
+    '''
+    key = _RANGE_KEYS.get((crit, value), _UNKNOWN)
+    if key is _UNKNOWN:
+        param = rangeParam(crit, value)
+        if param is not None:
+            key = _sql_key(param)
+        else:
+            key = None
+        _remember(_RANGE_KEYS, (crit, value), key, MATCH_CACHE)
+    return key
+
+
+def _rangeKeys(crit, values):
+    '''Return the list of the _rangeKey() of each of a list of client
+    values. Values in their usual form, text holding the digits of a number
+    or of a mac address, are converted all at once.
+    '''
+    count = len(values)
+    if set(map(type, values)) == set([str]):
+        values = map(str.translate, values, [None] * count,
+                     [_SQL_SPECIAL] * count)
+        if crit.endswith('mac'):
+            if None not in map(_HEX_LITERAL.match, values):
+                return zip([1] * count, map(unicode, map(str.upper, values)))
+        elif None not in map(_INTEGER_LITERAL.match, values):
+            numbers = map(long, values)
+            if -2 ** 63 <= min(numbers) and max(numbers) < 2 ** 63:
+                return zip([0] * count, numbers)
+    return [_rangeKey(crit, value) for value in values]
+
+
+def _remember(cache, key, value, size):
+    '''Store value under key in cache, first emptying cache if it holds
+    size entries already
+    '''
+    if len(cache) >= size:
+        cache.clear()
+    cache[key] = value
+
+
+# Position of the bit set in each hex digit of a power of 2
+_HEX_BIT = {'1': 0, '2': 1, '4': 2, '8': 3}
+
+
+def _lowest_bit(mask):
+    '''Return the position of the lowest bit set in mask (non-zero)'''
+    # hex digits are a quarter of the binary ones to produce
+    digits = '%x' % (mask & -mask)
+    return 4 * (len(digits) - 1) + _HEX_BIT[digits[0]]
+
+
+# bin() digits as the bytes 0 and 1
+_BIT_BYTES = string.maketrans('01', '\0\1')
+
+
+def _select(entries, mask):
+    '''Return the list of the entries, which must all be true, whose
+    positions are set in mask'''
+    digits = bin(mask)[:1:-1]
+    count = digits.count('1')
+    if count * 16 < len(entries):
+        # few entries, found one by one
+        selected = list()
+        position = -1
+        for i in xrange(count):
+            position = digits.index('1', position + 1)
+            selected.append(entries[position])
+        return selected
+    # an entry multiplied by its 0 or 1 byte is either empty or itself
+    selected = bytearray(digits.translate(_BIT_BYTES).ljust(len(entries),
+                                                            '\0'))
+    return filter(None, map(operator.mul, entries, selected))
+
+
+class ClientColumns(object):
+    '''The values each criterion takes in a list of client criteria
+    dictionaries, read from the dictionaries once for all the indexes
+    matching the clients (see CriteriaIndex.findEach()).
+    '''
+
+    def __init__(self, clients):
+        self.clients = clients
+        # criteria -> (column, distinct values)
+        self._columns = dict()
+        # range criteria -> (distinct values provided, their keys)
+        self._points = dict()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def column(self, crit):
+        '''Return the list of the values of crit of each client, None for
+        clients not providing it, and the list of its distinct values.
+        '''
+        found = self._columns.get(crit)
+        if found is None:
+            column = map(dict.get, self.clients, [crit] * len(self.clients))
+            found = self._columns[crit] = (column, list(set(column)))
+        return found
+
+    def points(self, crit):
+        '''Return the list of the distinct values clients provide for
+        range criteria crit, and the list of their _rangeKey().
+        '''
+        found = self._points.get(crit)
+        if found is None:
+            values = [value for value in self.column(crit)[1]
+                      if value is not None]
+            found = self._points[crit] = (values, _rangeKeys(crit, values))
+        return found
+
+
+def _findEach(clients, crits, rows, match, result):
+    '''Return result(mask) for each client of a ClientColumns, where mask
+    is the intersection of the rows mask and of the masks of the rows
+    matching the client value of each of crits. As the find() methods do,
+    the criteria are matched in turn until no row is left, and a
+    CriteriaIndexError found by match() is returned instead of the result.
+
+    The clients are matched criterion by criterion rather than client by
+    client: match(crit, clients) returns a dictionary of the mask (or the
+    CriteriaIndexError) of each distinct value of crit among the clients,
+    None for clients not providing it. The clients whose values all match
+    the same rows are then grouped, result() being called once for each
+    group.
+    '''
+    if not crits:
+        return [result(rows)] * len(clients)
+    # the distinct masks (or errors) returned by match(), and their indexes
+    masks = list()
+    mask_ids = dict()
+    columns = list()
+    for crit in crits:
+        column = clients.column(crit)[0]
+        value_masks = match(crit, clients)
+        found = value_masks.values()
+        # values often share the same mask object, compared once
+        mask_objects = dict(zip(map(id, found), found))
+        object_ids = dict()
+        for object_id, mask in mask_objects.iteritems():
+            mask_id = mask_ids.get(mask)
+            if mask_id is None:
+                mask_id = mask_ids[mask] = len(masks)
+                masks.append(mask)
+            object_ids[object_id] = mask_id
+        value_ids = dict(zip(value_masks.iterkeys(),
+                             map(object_ids.__getitem__, map(id, found))))
+        columns.append(map(value_ids.__getitem__, column))
+
+    groups = zip(*columns)
+    found = dict()
+    for group in set(groups):
+        group_rows = rows
+        group_result = _UNKNOWN
+        for mask_id in group:
+            mask = masks[mask_id]
+            if isinstance(mask, CriteriaIndexError):
+                group_result = mask
+                break
+            group_rows &= mask
+            if not group_rows:
+                break
+        if group_result is _UNKNOWN:
+            group_result = result(group_rows)
+        found[group] = group_result
+    return map(found.__getitem__, groups)
+
+
+def _matchEach(match, crit, values):
+    '''Return a dictionary of match(crit, value) for each of values, or of
+    the CriteriaIndexError it raises
+    '''
+    found = dict()
+    for value in values:
+        try:
+            found[value] = match(crit, value)
+        except CriteriaIndexError as err:
+            found[value] = err
+    return found
+
+
+class CriteriaIndex(object):
+    '''In-memory index of the manifests table answering findManifest()
+    requests without issuing SQL.
+
+    Range criteria (MINx/MAXx columns) are held in interval maps and value
+    criteria (whitespace separated lists such as arch or platform) in hash
+    maps from value to manifest rows. Sets of rows are bit masks, with the
+    rows numbered from the best to the worst match in the precedence order
+    of build_query_str(). A lookup intersects the rows matching each
+    criterion set in the database and picks the lowest numbered one.
+    '''
+
+    def __init__(self, rows, columns):
+        '''Build the index.
+
+        Args:
+            rows: sequence of rows from the manifests table, each a mapping
+                  with keys 'rowid', 'name' and each of columns. Mac
+                  columns hold the HEX() of the stored value.
+            columns: all criteria columns of the manifests table (see
+                  getCriteria(onlyUsed=False, strip=False))
+        '''
+        # criteria set in the database: name -> (kind, index, null_rows)
+        self._criteria = dict()
+        # rows matching a client value: (criteria, value) -> mask
+        self._matches = dict()
+
+        ranges = list()
+        values = list()
+        for col in columns:
+            if col.startswith('MIN'):
+                ranges.append(col[3:])
+            elif not col.startswith('MAX'):
+                values.append(col)
+
+        # rows with no criteria set are inactive or the default manifest,
+        # neither is ever matched
+        rows = [row for row in rows
+                if [col for col in columns if row[col] is not None]]
+
+        def order(row):
+            '''precedence of a row, highest for the best match'''
+            order = list()
+            for kind, crit in _PRECEDENCE:
+                if kind == 'range':
+                    order.append(int(row.get('MIN' + crit) is not None or
+                                     row.get('MAX' + crit) is not None))
+                else:
+                    order.append(_sql_key(row.get(crit)))
+            # equally good matches go to the first row, as with SQL
+            order.append(-row['rowid'])
+            return tuple(order)
+
+        rows.sort(key=order, reverse=True)
+        self._names = [row['name'] for row in rows]
+        self._all = (1 << len(rows)) - 1
+
+        for crit in ranges:
+            intervals = list()
+            null_rows = 0
+            for bit, row in enumerate(rows):
+                low = row['MIN' + crit]
+                high = row['MAX' + crit]
+                if low is None and high is None:
+                    null_rows |= 1 << bit
+                    continue
+                low = _LOWEST if low is None else _sql_key(low)
+                high = _HIGHEST if high is None else _sql_key(high)
+                intervals.append((low, high, 1 << bit))
+            if intervals:
+                self._criteria[crit] = ('range', _IntervalMap(intervals),
+                                        null_rows)
+
+        for crit in values:
+            lists = dict()
+            null_rows = 0
+            for bit, row in enumerate(rows):
+                value_list = row[crit]
+                if value_list is None:
+                    null_rows |= 1 << bit
+                    continue
+                if not isinstance(value_list, basestring):
+                    raise CriteriaIndexError(_("non-text value for "
+                                               "criteria %s") % crit)
+                for value in value_list.split():
+                    value = self._fold(crit, value)
+                    lists[value] = lists.get(value, 0) | 1 << bit
+            if lists:
+                self._criteria[crit] = ('value', lists, null_rows)
+
+    @classmethod
+    def from_queue(cls, queue):
+        '''Build a CriteriaIndex from the manifests table of the database
+        behind queue.
+        '''
+        columns = getCriteria(queue, onlyUsed=False, strip=False)
+        return cls(getCriteriaRows(queue, MANIFESTS_TABLE,
+                                   "rowid, name", columns), columns)
+
+    @staticmethod
+    def _fold(crit, value):
+        '''Normalize a value the way is_in_list() compares it'''
+        if crit.lower() in CRIT_LIST_CASE_SENSITIVE:
+            return value
+        return value.lower()
+
+    @staticmethod
+    def _point(crit, value):
+        '''Convert a client value for range criteria crit to a key, as
+        build_query_str() would place it in the query, see _rangeKey().
+        '''
+        key = _rangeKey(crit, value)
+        if key is None:
+            raise CriteriaIndexError(_("invalid value: %s") % value)
+        return key
+
+    def _valueRows(self, crit, value):
+        '''Return the mask of the rows matching the client value of crit,
+        None if the client does not provide it.
+        '''
+        kind, index, null_rows = self._criteria[crit]
+        if value is None:
+            # only manifests not using this criteria can match
+            return null_rows
+        if kind == 'range':
+            return index.stab(self._point(crit, value)) | null_rows
+        value = sanitizeSQL(value)
+        if "'" in value:
+            # would not form a valid SQL string literal
+            raise CriteriaIndexError(_("invalid value: %s") % value)
+        return index.get(self._fold(crit, value), 0) | null_rows
+
+    def _eachValueRows(self, crit, clients):
+        '''Return a dictionary of the mask of the rows matching each
+        distinct value of crit among a ClientColumns, or of the
+        CriteriaIndexError _valueRows() raises for it.
+        '''
+        kind, index, null_rows = self._criteria[crit]
+        if kind == 'range':
+            given, points = clients.points(crit)
+            if None not in points:
+                segments = index.segmentEach(points)
+                masks = dict()
+                for segment in set(segments):
+                    masks[segment] = index.masks[segment] | null_rows
+                found = dict(zip(given, map(masks.__getitem__, segments)))
+                found[None] = null_rows
+                return found
+        return _matchEach(self._valueRows, crit, clients.column(crit)[1])
+
+    def _name(self, rows):
+        '''Return the name of the best manifest among the rows mask'''
+        if not rows:
+            return None
+        return self._names[_lowest_bit(rows)]
+
+    def find(self, criteria):
+        '''Return the name of the manifest best matching the client
+        criteria dictionary, or None. Gives the same answer as
+        findManifestSQL().
+        '''
+        if not criteria or not self._criteria:
+            return None
+
+        rows = self._all
+        for crit in self._criteria:
+            value = criteria.get(crit)
+            match = self._matches.get((crit, value))
+            if match is None:
+                match = self._valueRows(crit, value)
+                _remember(self._matches, (crit, value), match, MATCH_CACHE)
+            rows &= match
+            if not rows:
+                return None
+        return self._name(rows)
+
+    def findEach(self, clients):
+        '''Return a list holding, for each of a list of client criteria
+        dictionaries, what find() would return for it, or the
+        CriteriaIndexError it would raise. See _findEach().
+
+        Args:
+            clients: list of client criteria dictionaries, or their
+                  ClientColumns when the ProfileIndex matches them too
+        '''
+        if not self._criteria:
+            return [None] * len(clients)
+        if not isinstance(clients, ClientColumns):
+            clients = ClientColumns(clients)
+        return _findEach(clients, self._criteria.keys(), self._all,
+                         self._eachValueRows, self._name)
+
+
+def getCriteriaRows(queue, dbtable, fields, columns):
+    '''Return the rows of dbtable as dictionaries holding fields and the
+    criteria columns, for building an in-memory index. Mac columns hold the HEX() of
+    the stored value, which is how the queries compare them.
+
+    Raises CriteriaIndexError if the table can not be read.
+    '''
+    query_str = "SELECT " + fields
+    for col in columns:
+        if col.endswith('mac'):
+            query_str += (", CASE WHEN %(col)s IS NULL THEN NULL "
+                          "ELSE HEX(%(col)s) END AS %(col)s" % {'col': col})
+        else:
+            query_str += ", " + col
+    query_str += " FROM " + dbtable + " ORDER BY rowid"
+    query = DBrequest(query_str)
+    queue.put(query)
+    query.waitAns()
+    rsp = query.getResponse()
+    if rsp is None:
+        raise CriteriaIndexError(_("unable to read %s table") % dbtable)
+    rows = list()
+    for row in rsp:
+        entry = dict()
+        for key in row.keys():
+            entry[str(key)] = row[key]
+        rows.append(entry)
+    return rows
+
+
+class ProfileIndex(object):
+    '''In-memory index of the profiles table, giving the profiles matching
+    a client as the query built by cgi_get_manifest.build_profile_query()
+    selects them. Range criteria are held in interval maps and value
+    criteria in hash maps, with sets of rows as bit masks, as in
+    CriteriaIndex; a profile matches when every criterion set on it
+    matches the client.
+    '''
+
+    def __init__(self, rows, columns):
+        '''Build the index.
+
+        Args:
+            rows: sequence of rows from the profiles table, each a mapping
+                  with keys 'rowid', 'name', 'file' and each of columns.
+                  Mac columns hold the HEX() of the stored value.
+            columns: all criteria columns of the profiles table (see
+                  getCriteria(onlyUsed=False, strip=False))
+        '''
+        # rows are numbered in (name, file) order, so that the profiles of
+        # a set of rows are found sorted
+        rows = sorted(rows, key=lambda row: (row['name'], row['file']))
+        self._files = [(row['name'], row['file']) for row in rows]
+        self._unique = len(set([row['name'] for row in rows])) == len(rows)
+        self._all = (1 << len(rows)) - 1
+        # every criteria column: name -> (kind, index, null_rows, set_rows)
+        # where set_rows are the rows having all of its columns set
+        self._criteria = dict()
+        # rows matching a client value:
+        # (criteria, value, no_default) -> mask
+        self._matches = dict()
+        # profiles of each set of matching rows found
+        self._found = dict()
+
+        for col in columns:
+            if col.startswith('MIN'):
+                crit = col[3:]
+                intervals = list()
+                null_rows = 0
+                set_rows = 0
+                for bit, row in enumerate(rows):
+                    low = row['MIN' + crit]
+                    high = row['MAX' + crit]
+                    if low is None and high is None:
+                        null_rows |= 1 << bit
+                        continue
+                    if low is not None and high is not None:
+                        set_rows |= 1 << bit
+                    low = _LOWEST if low is None else _sql_key(low)
+                    high = _HIGHEST if high is None else _sql_key(high)
+                    intervals.append((low, high, 1 << bit))
+                self._criteria[crit] = ('range', _IntervalMap(intervals),
+                                        null_rows, set_rows)
+            elif not col.startswith('MAX'):
+                lists = dict()
+                null_rows = 0
+                for bit, row in enumerate(rows):
+                    value_list = row[col]
+                    if value_list is None:
+                        null_rows |= 1 << bit
+                        continue
+                    if not isinstance(value_list, basestring):
+                        raise CriteriaIndexError(_("non-text value for "
+                                                   "criteria %s") % col)
+                    for value in value_list.split():
+                        value = CriteriaIndex._fold(col, value)
+                        lists[value] = lists.get(value, 0) | 1 << bit
+                self._criteria[col] = ('value', lists, null_rows, None)
+
+    @classmethod
+    def from_queue(cls, queue):
+        '''Build a ProfileIndex from the profiles table of the database
+        behind queue.
+        '''
+        columns = getCriteria(queue, table=PROFILES_TABLE, onlyUsed=False,
+                              strip=False)
+        return cls(getCriteriaRows(queue, PROFILES_TABLE,
+                                   "rowid, name, file", columns), columns)
+
+    def find(self, criteria, no_default=False):
+        '''Return the sorted tuple of the (name, file) tuples of the profiles
+        matching the client criteria dictionary.
+
+        Args:
+            criteria: dictionary of client criteria
+            no_default: if True, a profile not setting a criteria the client
+                  provided does not match (see build_profile_query())
+
+        Raises CriteriaIndexError if a client value could not be compared
+        as the query would.
+        '''
+        return self._profiles(self._match(criteria, no_default))[0]
+
+    def findNames(self, criteria, no_default=False):
+        '''Return the sorted tuple of the distinct names of the profiles
+        matching the client criteria dictionary, see find().
+        '''
+        return self._profiles(self._match(criteria, no_default))[1]
+
+    def findNamesEach(self, clients, no_default=False):
+        '''Return a list holding, for each of a list of client criteria
+        dictionaries, what findNames() would return for it, or the
+        CriteriaIndexError it would raise. See _findEach().
+
+        Args:
+            clients: list of client criteria dictionaries, or their
+                  ClientColumns (see CriteriaIndex.findEach())
+            no_default: see find()
+        '''
+        if not self._criteria:
+            return [()] * len(clients)
+        if not isinstance(clients, ClientColumns):
+            clients = ClientColumns(clients)
+        crits = list()
+        for crit, (kind, index, null_rows, set_rows) in \
+            self._criteria.iteritems():
+            if kind == 'value' and not index and null_rows == self._all \
+                and not no_default:
+                # set on no profile, matches them all whatever the value
+                continue
+            crits.append(crit)
+        return _findEach(clients, crits, self._all,
+                         lambda crit, clients: self._eachValueRows(
+                             crit, clients, no_default),
+                         lambda rows: self._profiles(rows)[1])
+
+    def _eachValueRows(self, crit, clients, no_default):
+        '''Return a dictionary of the mask of the rows matching each
+        distinct value of crit among a ClientColumns, or of the
+        CriteriaIndexError _valueRows() raises for it.
+        '''
+        kind, index, null_rows, set_rows = self._criteria[crit]
+        if kind == 'range':
+            given, points = clients.points(crit)
+            if None not in points:
+                segments = index.segmentEach(points)
+                masks = dict()
+                for segment in set(segments):
+                    if no_default:
+                        masks[segment] = index.masks[segment] & set_rows
+                    else:
+                        masks[segment] = index.masks[segment] | null_rows
+                found = dict(zip(given, map(masks.__getitem__, segments)))
+                found[None] = null_rows
+                return found
+        return _matchEach(lambda crit, value: self._valueRows(crit, value,
+                                                              no_default),
+                          crit, clients.column(crit)[1])
+
+    def _valueRows(self, crit, value, no_default):
+        '''Return the mask of the rows matching the client value of crit,
+        None if the client does not provide it, see find().
+        '''
+        kind, index, null_rows, set_rows = self._criteria[crit]
+        if value is None:
+            # only profiles destined for all clients
+            return null_rows
+        if kind == 'range':
+            point = _rangeKey(crit, value)
+            if point is None:
+                if crit != 'mac':
+                    raise CriteriaIndexError(_("invalid value: %s") %
+                                             sanitizeSQL(value))
+                # a mac address not in hex matches no profile
+                return 0
+            match = index.stab(point)
+            if no_default:
+                match &= set_rows
+        else:
+            match = index.get(CriteriaIndex._fold(crit, sanitizeSQL(value)),
+                              0)
+        if not no_default:
+            match |= null_rows
+        return match
+
+    def _match(self, criteria, no_default):
+        '''Return the mask of the rows matching the client, see find()'''
+        if not self._criteria:
+            # no criteria to build a query from, no profile is selected
+            return 0
+
+        rows = self._all
+        for crit in self._criteria:
+            key = (crit, criteria.get(crit), no_default)
+            match = self._matches.get(key)
+            if match is None:
+                match = self._valueRows(crit, key[1], no_default)
+                _remember(self._matches, key, match, MATCH_CACHE)
+            rows &= match
+            if not rows:
+                break
+        return rows
+
+    def _profiles(self, rows):
+        '''Return the (name, file) tuples and the names of the profiles in
+        the rows mask, as returned by find() and findNames()
+        '''
+        found = self._found.get(rows)
+        if found is None:
+            files = _select(self._files, rows)
+            if self._unique:
+                names = map(operator.itemgetter(0), files)
+            else:
+                # as rows are numbered in (name, file) order, the entries
+                # of the same profile follow each other
+                files = [entry for entry, same in groupby(files)]
+                names = [name for name, same in
+                         groupby([entry[0] for entry in files])]
+            found = (tuple(files), tuple(names))
+            _remember(self._found, rows, found, PROFILE_SETS)
+        return found
+
+
+_INDEX_CACHE = dict()
+_INDEX_LOCK = threading.Lock()
+
+
+def dbSignature(path):
+    '''Returns a value which changes whenever the database at path is
+    modified or replaced, including changes still held in its write-ahead
+    log.
+    '''
+    signature = list()
+    for name in (path, path + '-wal'):
+        try:
+            stat = os.stat(name)
+        except OSError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_dev, stat.st_ino, stat.st_size,
+                          stat.st_mtime))
+    return tuple(signature)
+
+
+def getCriteriaIndex(db):
+    '''Returns the CriteriaIndex for the database behind db (an AIdb.DB),
+    building it if the database file changed since it was last built.
+
+    Raises CriteriaIndexError if the index can not be built.
+    '''
+    return _getIndex(db, CriteriaIndex)
+
+
+def getProfileIndex(db):
+    '''Returns the ProfileIndex for the database behind db (an AIdb.DB),
+    building it if the database file changed since it was last built.
+
+    Raises CriteriaIndexError if the index can not be built.
+    '''
+    return _getIndex(db, ProfileIndex)
+
+
+def _getIndex(db, cls):
+    '''Returns the index of class cls for the database behind db, see
+    getCriteriaIndex()
+    '''
+    path = db.getPath()
+    signature = dbSignature(path)
+    with _INDEX_LOCK:
+        cached = _INDEX_CACHE.get((path, cls))
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    # build outside the lock; a concurrent build of the same database
+    # just produces an equivalent index
+    index = cls.from_queue(db.getQueue())
+    with _INDEX_LOCK:
+        _INDEX_CACHE[(path, cls)] = (signature, index)
+    return index
+
+
 def build_query_str(criteria, criteria_set_in_db, all_criteria_in_db):
     '''  build a query to find out which manifest is the best
     match for the client, based on criteria set in the db.
@@ -709,6 +1900,117 @@ def build_query_str(criteria, criteria_set_in_db, all_criteria_in_db):
     return query_str
 
 
+def rangeParam(crit, value):
+    '''Returns the value to bind in place of the client value for range
+    criteria crit in the manifest matching query, converted as SQLite reads
+    the literal build_query_str() would place in the query.
+    Args:
+        crit: range criteria name, with or without its MIN/MAX prefix
+        value: client value
+    Returns: a number, an upper case hex string for mac criteria, or None
+        if the value would not form a valid SQL literal
+    '''
+    value = sanitizeSQL(value)
+    if crit.endswith('mac'):
+        if not _HEX_LITERAL.match(value):
+            return None
+        # HEX(x'<value>') as in the query
+        return unicode(value.upper())
+    if _INTEGER_LITERAL.match(value):
+        number = long(value)
+        if -2 ** 63 <= number < 2 ** 63:
+            return number
+        # SQLite reads integer literals too large for 64 bits as reals
+        return float(value)
+    if _REAL_LITERAL.match(value):
+        return float(value)
+    return None
+
+
+def build_query(criteria, criteria_set_in_db, all_criteria_in_db):
+    '''  build a parameterized query to find out which manifest is the best
+    match for the client, based on criteria set in the db. The query
+    selects the same manifest as the build_query_str() one, but the client
+    values are bound to "?" placeholders so that the query text only
+    depends on the criteria set in the db and provided by the client,
+    letting SQLite reuse the prepared statement for every client.
+    Args:
+        criteria: dictionary of client criteria
+        criteria_set_in_db: list of unstripped criteria currently set in the db
+        all_criteria_in_db: complete list of criteria.
+        - If given, filter manifests which have no criteria set.
+        - If None, don't filter manifests which have no criteria set.
+    Returns: (query string, list of parameters) or (0, None) if there is
+        an error
+    '''
+    # the selected values are described in build_query_str()
+    query_str = ("SELECT name, "
+                 "(COALESCE(MAXmac, MINmac) IS NOT NULL) as mac_val, "
+                 "(COALESCE(MAXipv4, MINipv4) IS NOT NULL) as ipv4_val, "
+                 "(COALESCE(MAXnetwork, MINnetwork) IS NOT NULL) as net_val, "
+                 "(COALESCE(MAXmem, MINmem) IS NOT NULL) as mem_val "
+                 "FROM manifests WHERE ")
+    clauses = list()
+    params = list()
+
+    # For each criterion, add clause to match either on that criterion
+    # or NULL
+    for crit in criteria_set_in_db:
+        try:
+            if crit.startswith("MIN") or crit.startswith("MAX"):
+                name = crit[3:]
+                if name not in criteria:
+                    clauses.append("(" + crit + " IS NULL)")
+                    continue
+                param = rangeParam(crit, criteria[name])
+                if param is None:
+                    # build_query_str() would produce an invalid query,
+                    # which matches no manifest
+                    clauses.append("0")
+                    continue
+                if crit.startswith("MIN"):
+                    operator = " <= "
+                else:
+                    operator = " >= "
+                if crit.endswith("mac"):
+                    # setup a clause like (HEX(MINmac) <= ? OR MINmac IS NULL)
+                    clauses.append("(HEX(" + crit + ")" + operator + "? OR " +
+                                   crit + " IS NULL)")
+                else:
+                    # setup a clause like (MINmem <= ? OR MINmem IS NULL)
+                    clauses.append("(" + crit + operator + "? OR " + crit +
+                                   " IS NULL)")
+                params.append(param)
+            elif crit in criteria:
+                # For non-range criteria, the value stored in the DB may be
+                # a whitespace separated list of single values, matched with
+                # the is_in_list() user-defined function
+                clauses.append("(" + crit + " IS NULL OR is_in_list('" +
+                               crit + "', ?, " + crit + ", 'None') == 1)")
+                params.append(sanitizeSQL(criteria[crit]))
+            else:
+                clauses.append("(" + crit + " IS NULL)")
+
+        except KeyError:
+            print >> sys.stderr, _("Missing criteria: %s; returning 0") % crit
+            return (0, None)
+
+    if all_criteria_in_db is not None:
+        # non-criteria manifests have all criteria fields set to NULL.
+        clauses.append("(NOT (" +
+                       " AND ".join(["(" + crit + " IS NULL)"
+                                     for crit in all_criteria_in_db]) +
+                       "))")
+
+    query_str += " AND ".join(clauses)
+    # ORDER so that the best match is first, as in build_query_str()
+    query_str += (" ORDER BY "
+                  "mac_val desc, ipv4_val desc, "
+                  "platform desc, arch desc, cpu desc, "
+                  "net_val desc, mem_val desc LIMIT 1")
+    return (query_str, params)
+
+
 def formatValue(key, value, units=True):
     ''' Format and stringify database values.
 
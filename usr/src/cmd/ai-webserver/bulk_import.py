@@ -0,0 +1,484 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+import - publish a directory or archive of manifests and profiles at once
+
+The directory (or tar or zip archive) holds the manifests and scripts to
+publish in a "manifests" subdirectory and the profiles in a "profiles"
+subdirectory. The criteria of a manifest or profile are read from a
+criteria file named after it, with its extension replaced by
+CRITERIA_SUFFIX (e.g. manifests/x86.criteria.xml for manifests/x86.xml).
+
+All the files are validated, in parallel, and the manifest criteria are
+checked for collisions against the service's manifests and each other
+before anything is written; the manifests and profiles are then added to
+the database in a single transaction.
+'''
+import gettext
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+import lxml.etree
+
+import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.common_profile as sc
+import osol_install.auto_install.create_profile as create_profile
+import osol_install.auto_install.data_files as df
+import osol_install.auto_install.publish_manifest as pub_man
+import osol_install.auto_install.service_config as config
+
+from optparse import OptionParser
+
+from osol_install.auto_install.installadm_common import _, run_parallel, \
+    validate_service_name
+from osol_install.auto_install.service import AIService
+
+
+MANIFEST_DIR = 'manifests'
+PROFILE_DIR = 'profiles'
+CRITERIA_SUFFIX = '.criteria.xml'
+
+# default number of files validated concurrently
+JOBS = 4
+
+# errors reported for an invalid manifest or profile
+LOAD_ERRORS = (SystemExit, StandardError, lxml.etree.LxmlError)
+
+
+def get_usage():
+    ''' get usage for import'''
+    return _('import\t-n|--service <svcname>\n'
+             '\t\t-f|--file <directory|archive>\n'
+             '\t\t[-j|--jobs <number of validation threads>]')
+
+
+def parse_options(cmd_options=None):
+    '''Parse and validate options
+    Args: Optional cmd_options, used for unit testing. Otherwise, cmd line
+          options handled by OptionParser
+    Returns: command line options
+    Raises: SystemExit on invalid options
+    '''
+    parser = OptionParser(usage='\n' + get_usage(), prog="import")
+    parser.add_option('-n', '--service', dest='service_name',
+                      default=None, help=_("Name of install service."))
+    parser.add_option('-f', '--file', dest='source', default=None,
+                      help=_("Directory, tar or zip archive holding the "
+                             "manifests and profiles to publish."))
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=JOBS,
+                      help=_("Number of files validated concurrently."))
+
+    (options, args) = parser.parse_args(cmd_options)
+
+    if args:
+        parser.error(_("Unexpected argument(s): %s" % args))
+
+    if not options.service_name:
+        parser.error(_("Service name is required."))
+    try:
+        validate_service_name(options.service_name)
+    except ValueError as err:
+        parser.error(err)
+
+    if not options.source:
+        parser.error(_("A directory or archive to import is required."))
+    if options.jobs < 1:
+        parser.error(_("The number of jobs must be at least 1."))
+
+    logging.debug("options = %s", options)
+    return options
+
+
+class PhaseTimes(object):
+    '''Wall clock time spent in each phase of an import'''
+
+    def __init__(self):
+        self.phases = list()
+        self._name = None
+        self._start = None
+
+    def start(self, name):
+        '''End the current phase, if any, and start phase name'''
+        self.stop()
+        self._name = name
+        self._start = time.time()
+
+    def stop(self):
+        '''End the current phase, if any'''
+        if self._name is not None:
+            self.phases.append((self._name, time.time() - self._start))
+            self._name = None
+
+    def report(self, outfile):
+        '''Write the time of each phase to outfile'''
+        self.stop()
+        for name, seconds in self.phases:
+            outfile.write("  %-10s %8.3fs\n" % (name, seconds))
+        outfile.write("  %-10s %8.3fs\n" %
+                      (_("total"), sum([phase[1] for phase in self.phases])))
+
+
+def unpack(source, target):
+    '''Extract the tar or zip archive source into directory target.
+    Manifests and profiles are plain files, so links and special files are
+    refused: a link could lead the members extracted after it outside of
+    target.
+    Raises: ValueError if source is not an archive, a member would be
+            extracted outside of target or a member of a tar archive is
+            neither a file nor a directory
+    '''
+    if tarfile.is_tarfile(source):
+        archive = tarfile.open(source)
+        members = archive.getmembers()
+        names = [member.name for member in members]
+        special = [member.name for member in members
+                   if not (member.isfile() or member.isdir())]
+    elif zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        names = archive.namelist()
+        special = list()
+    else:
+        raise ValueError(_("%s is neither a directory nor a tar or zip "
+                           "archive") % source)
+    try:
+        if special:
+            raise ValueError(_("archive member %s is neither a file nor a "
+                               "directory") % special[0])
+        for name in names:
+            path = os.path.normpath(os.path.join(target, name))
+            if os.path.isabs(name) or \
+               not path.startswith(os.path.join(target, '')):
+                raise ValueError(_("archive member %s is outside of the "
+                                   "archive") % name)
+        archive.extractall(target)
+    finally:
+        archive.close()
+
+
+def find_files(directory):
+    '''Returns: a list of (file, criteria file) path tuples for the files of
+    directory, in name order, the criteria file being None if there is none.
+    Returns an empty list if directory does not exist.
+    '''
+    if not os.path.isdir(directory):
+        return list()
+    names = sorted(os.listdir(directory))
+    files = list()
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.endswith(CRITERIA_SUFFIX) or not os.path.isfile(path):
+            continue
+        criteria_path = os.path.join(directory,
+                                     os.path.splitext(name)[0] +
+                                     CRITERIA_SUFFIX)
+        if not os.path.isfile(criteria_path):
+            criteria_path = None
+        files.append((path, criteria_path))
+    return files
+
+
+def load_manifest(service, db, paths):
+    '''Returns: the DataFiles object of a manifest to publish
+    Args: service - AIService to publish to
+          db - AI_database object for the install service
+          paths - (manifest file, criteria file or None) tuple
+    Raises: SystemExit, AssertionError, IOError, ValueError or LxmlError if
+            the manifest or criteria are invalid
+    '''
+    files = df.DataFiles(service_dir=service.config_dir,
+                         image_path=service.image.path,
+                         database=db, manifest_file=paths[0],
+                         criteria_file=paths[1],
+                         service_name=service.name)
+    criteria = files.criteria
+    for crit in criteria:
+        if AIdb.isRangeCriteria(db.getQueue(), crit, AIdb.MANIFESTS_TABLE):
+            pub_man.validate_range(crit, list(criteria[crit]))
+    return files
+
+
+def load_profile(service, db, paths):
+    '''Returns: a (profile name, Criteria object, profile string) tuple for
+    a profile to publish
+    Args: service - AIService to publish to
+          db - AI_database object for the install service
+          paths - (profile file, criteria file or None) tuple
+    Raises: SystemExit or ValueError if the profile or criteria are invalid
+    '''
+    name = os.path.basename(paths[0])
+    root = None
+    if paths[1] is not None:
+        root = df.verifyCriteria(df.DataFiles.criteriaSchema, paths[1], db,
+                                 AIdb.PROFILES_TABLE)
+    criteria = df.Criteria(root)
+    sc.validate_criteria_from_user(criteria, db, AIdb.PROFILES_TABLE)
+    raw_profile = df.validate_file(name, paths[0], service.image.path,
+                                   verbose=False)
+    if not raw_profile:
+        raise ValueError(_("Error:\tprofile %s is not valid") % name)
+    return name, criteria, raw_profile
+
+
+def check_names(manifests, profiles, manifest_names, profile_names):
+    '''Returns: a list of error messages for manifests and profiles whose
+    name is already used, either by another one being imported or in the
+    service
+    Args: manifests - DataFiles objects of the manifests to import
+          profiles - (name, criteria, profile) tuples of the profiles to
+                     import
+          manifest_names, profile_names - names of the manifests and profiles
+                                          of the service
+    '''
+    errors = list()
+    seen = set(manifest_names)
+    for files in manifests:
+        if files.manifest_name in seen:
+            errors.append(_("Error:\tName %s is already registered with "
+                            "this service.") % files.manifest_name)
+        seen.add(files.manifest_name)
+    seen = set(profile_names)
+    for profile in profiles:
+        if profile[0] in seen:
+            errors.append(_("Error:\tA profile named %s is already in the "
+                            "database.") % profile[0])
+        seen.add(profile[0])
+    return errors
+
+
+def check_collisions(manifests, rows, columns):
+    '''Returns: a list of error messages for the manifests to import whose
+    criteria collide with those of another manifest, being imported or
+    already published
+    Args: manifests - DataFiles objects of the manifests to import
+          rows - the manifests of the service, as AIdb.getCriteriaRows()
+                 returns them
+          columns - the criteria columns of the manifests table
+    '''
+    new_rows = list()
+    for files in manifests:
+        if files.criteria:
+            new_rows.append(pub_man.criteria_row(files.manifest_name, 0,
+                                                 files.criteria, columns))
+    if not new_rows:
+        return list()
+    new = set([(row['name'], row['instance']) for row in new_rows])
+
+    errors = list()
+    criteria = pub_man.ManifestCriteria(list(rows) + new_rows, columns)
+    for first, second, clash in criteria.audit():
+        if first not in new and second not in new:
+            # collisions between published manifests are not ours to report
+            continue
+        # report the later of the manifests being imported
+        if second in new:
+            first, second = second, first
+        if clash:
+            errors.append(_("Error:\tManifest %(name)s has a range "
+                            "collision with manifest:%(other)s/%(instance)i"
+                            "\n\tin criteria: %(crit)s!") %
+                          {'name': first[0], 'other': second[0],
+                           'instance': second[1], 'crit': clash})
+        else:
+            errors.append(_("Error:\tManifest %(name)s has same criteria as "
+                            "manifest: %(other)s/%(instance)i!") %
+                          {'name': first[0], 'other': second[0],
+                           'instance': second[1]})
+    return errors
+
+
+def _report(errors):
+    '''Print errors and exit if there are any'''
+    if errors:
+        for error in errors:
+            print >> sys.stderr, error
+        raise SystemExit(1)
+
+
+def import_files(service, directory, jobs=JOBS, outfile=sys.stdout,
+                 times=None):
+    '''Publish the manifests and profiles of directory to service.
+
+    Args: service - AIService to publish to
+          directory - directory holding the manifests and profiles
+          jobs - number of files validated concurrently
+          outfile - file object the summary and phase times are written to
+          times - PhaseTimes to add the phases of the import to
+
+    Returns: the PhaseTimes of the import
+
+    Raises: SystemExit if any file is invalid, collides or can not be
+            published; nothing is published then.
+    '''
+    if times is None:
+        times = PhaseTimes()
+    times.start(_("validate"))
+    manifest_paths = find_files(os.path.join(directory, MANIFEST_DIR))
+    profile_paths = find_files(os.path.join(directory, PROFILE_DIR))
+    if not manifest_paths and not profile_paths:
+        raise SystemExit(_("Error:\tNo manifests or profiles found in %s") %
+                         directory)
+
+    db = AIdb.DB(service.database_path, commit=True)
+    try:
+        manifests, profiles = _import(service, db, manifest_paths,
+                                      profile_paths, jobs, times)
+    finally:
+        db.close()
+
+    times.stop()
+    outfile.write(_("Imported %(manifests)d manifests and %(profiles)d "
+                    "profiles into service %(service)s.\n") %
+                  {'manifests': len(manifests), 'profiles': len(profiles),
+                   'service': service.name})
+    times.report(outfile)
+    return times
+
+
+def _import(service, db, manifest_paths, profile_paths, jobs, times):
+    '''Validate, check, write and commit the manifests and profiles of
+    an import, see import_files().
+    Returns: the DataFiles objects of the manifests and the (name, criteria,
+             profile) tuples of the profiles imported
+    '''
+    db.verifyDBStructure()
+    queue = db.getQueue()
+    if profile_paths and not AIdb.tableExists(queue, AIdb.PROFILES_TABLE):
+        raise SystemExit(_("Error:\tService %s does not support profiles") %
+                         service.name)
+
+    results = run_parallel(lambda paths: load_manifest(service, db, paths),
+                           manifest_paths, jobs, errors=LOAD_ERRORS)
+    results += run_parallel(lambda paths: load_profile(service, db, paths),
+                            profile_paths, jobs, errors=LOAD_ERRORS)
+    errors = list()
+    for (path, criteria_path), (result, error) in \
+            zip(manifest_paths + profile_paths, results):
+        if error is not None:
+            errors.append(_("Error:\t%(file)s: %(error)s") %
+                          {'file': path, 'error': error})
+    _report(errors)
+    manifests = [result for result, error in results[:len(manifest_paths)]]
+    profiles = [result for result, error in results[len(manifest_paths):]]
+
+    times.start(_("check"))
+    columns = AIdb.getCriteria(queue, onlyUsed=False, strip=False)
+    try:
+        rows = AIdb.getCriteriaRows(queue, AIdb.MANIFESTS_TABLE,
+                                    "name, instance", columns)
+        profile_names = list()
+        if profiles:
+            profile_names = [row['name'] for row in
+                             AIdb.getCriteriaRows(queue, AIdb.PROFILES_TABLE,
+                                                  "name", [])]
+    except AIdb.CriteriaIndexError as err:
+        raise SystemExit(_("Error:\t%s") % err)
+    manifest_names = set([row['name'] for row in rows])
+    manifest_names.update(os.listdir(service.manifest_dir))
+    errors = check_names(manifests, profiles, manifest_names, profile_names)
+    if not errors:
+        errors = check_collisions(manifests, rows, columns)
+    _report(errors)
+
+    times.start(_("write"))
+    statements = list()
+    written = list()
+    committed = False
+    try:
+        for files in manifests:
+            manifest_path = os.path.join(service.manifest_dir,
+                                         files.manifest_name)
+            df.place_manifest(files, manifest_path)
+            written.append(manifest_path)
+            statements.append(df.insert_query(files, 0))
+        for name, criteria, raw_profile in profiles:
+            profile_path = create_profile.copy_profile_internally(raw_profile)
+            if not profile_path:
+                raise SystemExit(1)
+            written.append(profile_path)
+            statements += create_profile.profile_statements(criteria, name,
+                profile_path, queue, AIdb.PROFILES_TABLE)
+
+        times.start(_("commit"))
+        query = AIdb.DBtransaction(statements)
+        queue.put(query)
+        query.waitAns()
+        if query.getResponse() is None:
+            raise SystemExit(_("Error:\tNothing was imported."))
+        committed = True
+    finally:
+        if not committed:
+            # back out the files placed for the import
+            for path in written:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+    return manifests, profiles
+
+
+def do_import(cmd_options=None):
+    '''Publish a directory or archive of manifests and profiles.
+    Called from installadm.
+    '''
+    # check that we are root
+    if os.geteuid() != 0:
+        raise SystemExit(_("Error:\tRoot privileges are required for "
+                           "this command."))
+
+    options = parse_options(cmd_options)
+
+    if not config.is_service(options.service_name):
+        raise SystemExit(_("No such service: %s") % options.service_name)
+    service = AIService(options.service_name)
+
+    if os.path.isdir(options.source):
+        import_files(service, options.source, options.jobs)
+        return 0
+
+    times = PhaseTimes()
+    times.start(_("unpack"))
+    directory = tempfile.mkdtemp(prefix='ai_import_')
+    try:
+        try:
+            unpack(options.source, directory)
+        except (ValueError, IOError, tarfile.TarError,
+                zipfile.BadZipfile) as err:
+            raise SystemExit(_("Error:\tunable to unpack %(file)s: "
+                               "%(error)s") % {'file': options.source,
+                                               'error': err})
+        import_files(service, directory, options.jobs, times=times)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    gettext.install("ai", "/usr/lib/locale")
+    sys.exit(do_import())
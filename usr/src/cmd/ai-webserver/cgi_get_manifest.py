@@ -25,12 +25,17 @@
 cgi_get_manifest retrieves the manifest based upon certain criteria
 '''
 import cgi
+import csv
 import gettext
+import hashlib
+import json
 import logging
 import mimetypes
 import os
+import random
 import socket
 import sys
+import threading
 
 import lxml.etree
 import osol_install.auto_install.AI_database as AIdb
@@ -57,6 +62,328 @@ COMPATIBILITY_VERSION = '0.5'
 AI_DBGLVL_NONE = 0
 AI_DBGLVL_INFO = 4
 
+# Services and databases opened while handling requests. A CGI process
+# only handles one request, but a persistent server (see manifest_server)
+# reuses them until the underlying configuration or database changes.
+_SERVICE_CACHE = dict()
+_DB_CACHE = dict()
+_RETIRED_DBS = set()    # see AIdb.DB.closeWhenUnused
+_PROFILE_CACHE = dict()
+_CACHE_LOCK = threading.Lock()
+
+# Fraction of the profiles sent to clients which are validated again after
+# template substitution. Profile templates are validated when first read
+# (see get_profile_template); a template failing that validation has every
+# substituted profile validated.
+PROFILE_VALIDATION_RATE = 0.0
+
+# Replies to manifest requests, kept by a persistent server so that repeated
+# requests from clients with the same relevant criteria are answered without
+# matching and assembling the reply again (see get_cached_reply). At most
+# RESPONSE_CACHE_SIZE replies are kept.
+RESPONSE_CACHE_SIZE = 1024
+_RESPONSE_CACHE = dict()
+_RESPONSE_COUNT = [0]
+
+
+def _file_signature(path):
+    '''Returns a tuple identifying the current version of a file, or None
+    if the file does not exist. A file replaced by rename or rewritten in
+    place gets a different signature.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+def _service_config_path(servicename):
+    '''Returns the path of the configuration file of a service'''
+    return os.path.join(com.AI_SERVICE_DIR_PATH, servicename, config.CFGFILE)
+
+
+def get_service(servicename):
+    '''Returns an AIService object for servicename, reusing the one created
+    by an earlier request unless the service's configuration file changed.
+
+    Args
+        servicename - the name of the service
+
+    Returns
+        AIService object
+
+    Raises
+        Exceptions raised by AIService()
+    '''
+    cfg_sig = _file_signature(_service_config_path(servicename))
+    with _CACHE_LOCK:
+        cached = _SERVICE_CACHE.get(servicename)
+        if cached is not None and cached[0] == cfg_sig:
+            return cached[1]
+    service = AIService(servicename)
+    with _CACHE_LOCK:
+        _SERVICE_CACHE[servicename] = (cfg_sig, service)
+    return service
+
+
+def get_profile_template(path, image_dir):
+    '''Returns the common_profile.ProfileTemplate for the profile file at
+    path, reusing the one read by an earlier request unless the file or the
+    image's service_bundle DTD changed.
+
+    Args
+        path      - path of the profile file
+        image_dir - path of the service image
+
+    Returns
+        common_profile.ProfileTemplate object
+
+    Raises
+        IOError if the profile can not be read
+    '''
+    dtd_file = os.path.join(image_dir, 'auto_install', 'service_bundle.dtd.1')
+    key = (image_dir, _file_signature(path), _file_signature(dtd_file))
+    with _CACHE_LOCK:
+        cached = _PROFILE_CACHE.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    with open(path, 'r') as pfp:
+        template = sc.ProfileTemplate(pfp.read(), image_dir)
+    with _CACHE_LOCK:
+        _PROFILE_CACHE[path] = (key, template)
+    return template
+
+
+class CachedReplies(object):
+    '''The replies sent for one response_key(), valid as long as the files
+    they were assembled from are unchanged. As the profiles may substitute
+    any of the client's values, the replies are further keyed by the values
+    of the template variables used by the matched profiles.
+    '''
+
+    def __init__(self, dependencies, variables):
+        '''Args
+            dependencies - list of file_dependency() tuples
+            variables    - names of the template variables used by the
+                           profiles in the replies
+        '''
+        self.dependencies = tuple(dependencies)
+        self.variables = tuple(sorted(variables))
+        self.replies = dict()
+
+    def is_current(self):
+        '''Returns True if none of the files the replies were assembled
+        from changed
+        '''
+        for path, database, signature in self.dependencies:
+            if file_dependency(path, database) != (path, database,
+                                                   signature):
+                return False
+        return True
+
+    def values(self, template_dict):
+        '''Returns the key of a reply among self.replies'''
+        return tuple([template_dict.get(name) for name in self.variables])
+
+
+def file_dependency(path, database=False):
+    '''Returns a (path, database, signature) tuple recording the current
+    version of a file a reply is assembled from. The signature of an AI
+    database (database True) also covers its write-ahead log.
+    '''
+    if database:
+        return (path, database, AIdb.dbSignature(path))
+    return (path, database, _file_signature(path))
+
+
+def response_key(path, servicename, protocolversion, no_default, criteria,
+                 queue):
+    '''Returns the key identifying the reply to a manifest request among
+    the cached replies. Besides the request parameters, the key contains
+    the names of the criteria sent by the client, which affect the messages
+    sent back, and the values of those criteria which are used by a
+    manifest or profile in the database, the only ones affecting the match.
+    A mac value which is not hex matches no profile even where no profile
+    uses mac (see build_profile_query), so whether it is valid is also part
+    of the key.
+
+    Args
+        path            - path to the service's AI.db
+        servicename     - the name of the service
+        protocolversion - the version of the AI service RE: handshake
+        no_default      - see send_manifest
+        criteria        - dictionary of client criteria
+        queue           - the AI database request queue
+
+    Returns
+        a hashable key
+    '''
+    used = set(AIdb.getCriteria(queue, strip=True))
+    used.update(AIdb.getCriteria(queue, table=AIdb.PROFILES_TABLE,
+                                 strip=True))
+    values = [(crit, criteria[crit]) for crit in sorted(criteria)
+              if crit in used]
+    if 'mac' in criteria and 'mac' not in used:
+        values.append(('mac',
+                       AIdb.rangeParam('mac', criteria['mac']) is not None))
+    return (path, servicename, protocolversion, bool(no_default),
+            tuple(sorted(criteria)), tuple(values))
+
+
+def get_cached_reply(key, template_dict):
+    '''Returns the (etag, reply) tuple cached for a request, or None
+
+    Args
+        key           - the request's response_key()
+        template_dict - the request's template variable values
+    '''
+    with _CACHE_LOCK:
+        cached = _RESPONSE_CACHE.get(key)
+    if cached is None or not cached.is_current():
+        return None
+    with _CACHE_LOCK:
+        return cached.replies.get(cached.values(template_dict))
+
+
+def cache_reply(key, dependencies, variables, template_dict, etag, reply):
+    '''Caches the reply to a request, see get_cached_reply.
+
+    Args
+        key           - the request's response_key()
+        dependencies  - file_dependency() tuples of the files the reply was
+                        assembled from, recorded before reading them
+        variables     - names of the template variables used by the
+                        profiles in the reply
+        template_dict - the request's template variable values
+        etag          - the reply's entity tag
+        reply         - the reply, including its headers
+    '''
+    with _CACHE_LOCK:
+        cached = _RESPONSE_CACHE.get(key)
+        if cached is None or cached.dependencies != tuple(dependencies) or \
+                cached.variables != tuple(sorted(variables)):
+            if cached is not None:
+                _RESPONSE_COUNT[0] -= len(cached.replies)
+            cached = CachedReplies(dependencies, variables)
+            _RESPONSE_CACHE[key] = cached
+        if _RESPONSE_COUNT[0] >= RESPONSE_CACHE_SIZE:
+            # start over rather than track the use of each reply
+            _RESPONSE_CACHE.clear()
+            _RESPONSE_COUNT[0] = 0
+            _RESPONSE_CACHE[key] = cached
+            cached.replies.clear()
+        values = cached.values(template_dict)
+        if values not in cached.replies:
+            _RESPONSE_COUNT[0] += 1
+        cached.replies[values] = (etag, reply)
+
+
+def mime_reply(outermime):
+    '''Returns the (etag, reply) tuple for a MIME multipart reply. The MIME
+    boundary is derived from the parts rather than chosen at random, so
+    that the same parts always make the same reply, and the same entity tag,
+    even when assembled by different processes.
+
+    Args
+        outermime - the MIMEMultipart message to send
+
+    Returns
+        (etag, reply) where reply is the message, headers included
+    '''
+    digest = hashlib.sha1()
+    for part in outermime.get_payload():
+        digest.update(part.as_string())
+    outermime.set_boundary('=' * 15 + digest.hexdigest() + '==')
+    reply = outermime.as_string()
+    return ('"%s"' % hashlib.sha1(reply).hexdigest(), reply)
+
+
+def etag_matches(etag, if_none_match):
+    '''Returns True if etag is among the entity tags of an If-None-Match
+    request header
+    '''
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or tag == '*':
+            return True
+    return False
+
+
+def send_reply(etag, reply, if_none_match=None):
+    '''Writes a MIME reply, or a "304 Not Modified" response if the client
+    already has it, to standard output.
+
+    Args
+        etag          - the reply's entity tag
+        reply         - the MIME reply, headers included
+        if_none_match - the request's If-None-Match header, if any
+    '''
+    if etag_matches(etag, if_none_match):
+        print 'Status: 304 Not Modified'
+        print 'ETag:', etag
+        print                               # blank line, end of headers
+        return
+    print 'ETag:', etag      # followed by the MIME headers of the reply
+    print reply  # send MIME-formatted message
+
+
+def _db_identity(path):
+    '''Returns a tuple identifying the database file at path, or None if
+    it does not exist. Unlike _file_signature, it only changes when the file
+    is replaced: SQLite connections already see the changes committed to
+    the file in place.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino)
+
+
+def get_service_db(path):
+    '''Returns a verified AIdb.DB object for the database at path, reusing
+    the one opened by an earlier request unless the database file was
+    replaced. The DB of a replaced file is closed once the requests still
+    using it are done with it.
+
+    Args
+        path - path to the service's AI.db
+
+    Returns
+        AIdb.DB object
+
+    Raises
+        SystemExit if verifyDBStructure() fails
+    '''
+    db_id = _db_identity(path)
+    with _CACHE_LOCK:
+        cached = _DB_CACHE.get(path)
+        if cached is not None and cached[0] == db_id:
+            return cached[1]
+    aisql = AIdb.DB(path)
+    try:
+        aisql.verifyDBStructure()
+    except:
+        aisql.close()
+        raise
+    with _CACHE_LOCK:
+        stale = _DB_CACHE.get(path)
+        if stale is not None and stale[0] == db_id:
+            # opened by a concurrent request meanwhile, which may be using
+            # it already; ours was never handed out
+            aisql.close()
+            return stale[1]
+        _DB_CACHE[path] = (db_id, aisql)
+    if stale is not None:
+        # other requests may still be using the DB of the replaced file
+        stale[1].closeWhenUnused(_RETIRED_DBS)
+    return aisql
+
 
 def get_parameters(form):
     '''Gets the CGI parameters.
@@ -149,8 +476,7 @@ def send_needed_criteria(port):
     path = os.path.join(com.AI_SERVICE_DIR_PATH, str(port), 'AI.db')
     if os.path.exists(path):
         try:
-            aisql = AIdb.DB(path)
-            aisql.verifyDBStructure()
+            aisql = get_service_db(path)
         except StandardError as err:
             # internal error, record the error in the server error_log
             sys.stderr.write(_('error:AI database access error\n%s\n') % err)
@@ -187,8 +513,100 @@ def send_needed_criteria(port):
     print xmlstr
 
 
+def build_profile_query(criteria, queue, no_default=False):
+    '''Formulates the query selecting the profiles matching the client
+    criteria. Client values are bound to "?" placeholders so that the query
+    text is the same for every client and its prepared statement is reused.
+
+    Args
+        criteria   - dictionary of client criteria
+        queue      - the AI database request queue
+        no_default - boolean flag to signify whether profiles not specifying
+                     a criteria should be excluded
+
+    Returns
+        (q_str, params, messages) where q_str is the query, or None if the
+        profiles table has no criteria, params the values to bind to it and
+        messages a list of warnings for the AI client
+
+    Raises
+        None
+    '''
+    messages = list()  # accumulate message output for AI client
+    params = list()  # values bound to the query placeholders
+    # search for any profiles matching client criteria
+    # formulate database query to profiles table
+    q_str = "SELECT DISTINCT name, file FROM " + \
+        AIdb.PROFILES_TABLE + " WHERE "
+    nvpairs = list()  # accumulate criteria values from post-data
+    # for all AI client criteria
+    for crit in AIdb.getCriteria(queue, table=AIdb.PROFILES_TABLE,
+                                 onlyUsed=False):
+        if crit not in criteria:
+            msgtxt = _("Warning: client criteria \"%s\" not provided in "
+                       "request.  Setting value to NULL for profile lookup.") \
+                       % crit
+            messages += [msgtxt]
+            logging.warn(msgtxt)
+            # fetch only global profiles destined for all clients
+            if AIdb.isRangeCriteria(queue, crit, AIdb.PROFILES_TABLE):
+                nvpairs += ["MIN" + crit + " IS NULL"]
+                nvpairs += ["MAX" + crit + " IS NULL"]
+            else:
+                nvpairs += [crit + " IS NULL"]
+            continue
+
+        # prepare criteria value to add to query
+        envval = AIdb.sanitizeSQL(criteria[crit])
+        if AIdb.isRangeCriteria(queue, crit, AIdb.PROFILES_TABLE):
+            if crit == "mac":
+                # compare with HEX(MINmac), as HEX(X'<value>') would
+                envval = AIdb.rangeParam(crit, envval)
+                if envval is None:
+                    # not a hex value; matches no profile
+                    nvpairs += ["0"]
+                    continue
+                minval = "HEX(MIN" + crit + ")<=?"
+                maxval = "HEX(MAX" + crit + ")>=?"
+            else:
+                minval = "MIN" + crit + "<=?"
+                maxval = "MAX" + crit + ">=?"
+            # If no default profiles are requested, then we mustn't allow
+            # this criteria to be NULL.  It must match the client's given
+            # value for this criteria.
+            if no_default:
+                nvpairs += ["(" + minval + ")"]
+                nvpairs += ["(" + maxval + ")"]
+            else:
+                nvpairs += ["(MIN" + crit + " IS NULL OR " + minval + ")"]
+                nvpairs += ["(MAX" + crit + " IS NULL OR " + maxval + ")"]
+            params += [envval, envval]
+        else:
+            # If no default profiles are requested, then we mustn't allow
+            # this criteria to be NULL.  It must match the client's given
+            # value for this criteria.
+            #
+            # Also, since this is a non-range criteria, the value stored
+            # in the DB may be a whitespace separated list of single
+            # values.  We use a special user-defined function in the
+            # determine if the given criteria is in that textual list.
+            if no_default:
+                nvpairs += ["(is_in_list('" + crit + "', ?, " + crit +
+                            ", 'None') == 1)"]
+            else:
+                nvpairs += ["(" + crit + " IS NULL OR is_in_list('" + crit +
+                            "', ?, " + crit + ", 'None') == 1)"]
+            params += [envval]
+
+    if not nvpairs:
+        return (None, params, messages)
+    q_str += " AND ".join(nvpairs)
+    return (q_str, params, messages)
+
+
 def send_manifest(form_data, port=0, servicename=None,
-        protocolversion=COMPATIBILITY_VERSION, no_default=False):
+        protocolversion=COMPATIBILITY_VERSION, no_default=False,
+        if_none_match=None):
     '''Replies to the client with matching service for a service.
     
     Args
@@ -199,6 +617,9 @@ def send_manifest(form_data, port=0, servicename=None,
         no_default  - boolean flag to signify whether or not we should hand
                       back the default manifest and profiles if one cannot
                       be matched based on the client criteria.
+        if_none_match - the If-None-Match header of the request, if any.
+                      A "304 Not Modified" response is sent if it holds the
+                      entity tag of the reply.
 
     Returns
         None
@@ -219,15 +640,13 @@ def send_manifest(form_data, port=0, servicename=None,
     port = str(port)
     
     if servicename:
-        service = AIService(servicename)
+        service = get_service(servicename)
         path = service.database_path
     else:
-        for name in config.get_all_service_names():
-            if config.get_service_port(name) == port:
-                found_servicename = name
-                service = AIService(name)
-                path = service.database_path
-                break
+        found_servicename = config.find_service_by_port(port)
+        if found_servicename:
+            service = get_service(found_servicename)
+            path = service.database_path
     
     # Check to insure that a valid path was found
     if not path or not os.path.exists(path):
@@ -251,8 +670,7 @@ def send_manifest(form_data, port=0, servicename=None,
         servicename = found_servicename
 
     # load to the AI database
-    aisql = AIdb.DB(path)
-    aisql.verifyDBStructure()
+    aisql = get_service_db(path)
 
     # convert the form data into a criteria dictionary
     criteria = dict()
@@ -274,7 +692,33 @@ def send_manifest(form_data, port=0, servicename=None,
     for crit in criteria:
         template_dict["AI_" + crit.upper()] = \
                 AIdb.formatValue(crit, criteria[crit], units=False)
-            
+
+    # MIME replies are cached, see get_cached_reply
+    reply_key = None
+    dependencies = list()  # files the reply is assembled from
+    variables = set()  # template variables used by the profiles
+    if servicename is not None and \
+            float(protocolversion) >= float(PROFILES_VERSION):
+        dependencies.append(file_dependency(path, database=True))
+        dependencies.append(file_dependency(
+            _service_config_path(servicename)))
+        reply_key = response_key(path, servicename, protocolversion,
+                                 no_default, criteria, aisql.getQueue())
+        cached = get_cached_reply(reply_key, template_dict)
+        if cached is not None:
+            logging.info('Reply sent from cache.')
+            send_reply(cached[0], cached[1], if_none_match)
+            return
+
+    # queue the profile query so that it runs while the manifest is found
+    q_str, params, profile_msgs = build_profile_query(criteria,
+                                                      aisql.getQueue(),
+                                                      no_default)
+    profile_query = None
+    if q_str is not None:
+        logging.info("Profile query: %s %s" % (q_str, params))
+        profile_query = aisql.submit(q_str, params=params)
+
     # find the appropriate manifest
     try:
         manifest = AIdb.findManifest(criteria, aisql)
@@ -303,6 +747,7 @@ def send_manifest(form_data, port=0, servicename=None,
             # construct the fully qualified filename
             filename = os.path.abspath(os.path.join(service.manifest_dir,
                                                     manifest))
+            dependencies.append(file_dependency(filename))
             # open and read the manifest
             with open(filename, 'rb') as mfp:
                 manifest_str = mfp.read()
@@ -330,11 +775,14 @@ def send_manifest(form_data, port=0, servicename=None,
             return
 
     # get AI service image path
-    service = AIService(servicename)
+    service = get_service(servicename)
     image_dir = service.image.path
+    dependencies.append(file_dependency(os.path.join(image_dir,
+        'auto_install', 'service_bundle.dtd.1')))
     # construct object to contain MIME multipart message
     outermime = MIMEMultipart()
-    client_msg = list()  # accumulate message output for AI client
+    # accumulate message output for AI client
+    client_msg = list(profile_msgs)
 
     # If we have a manifest, attach it to the return message
     if manifest is not None:
@@ -345,79 +793,9 @@ def send_manifest(form_data, port=0, servicename=None,
                       filename=sc.AI_MANIFEST_ATTACHMENT_NAME)
         outermime.attach(msg)  # add manifest as an attachment
 
-    # search for any profiles matching client criteria
-    # formulate database query to profiles table
-    q_str = "SELECT DISTINCT name, file FROM " + \
-        AIdb.PROFILES_TABLE + " WHERE "
-    nvpairs = list()  # accumulate criteria values from post-data
-    # for all AI client criteria
-    for crit in AIdb.getCriteria(aisql.getQueue(), table=AIdb.PROFILES_TABLE,
-                                 onlyUsed=False):
-        if crit not in criteria:
-            msgtxt = _("Warning: client criteria \"%s\" not provided in "
-                       "request.  Setting value to NULL for profile lookup.") \
-                       % crit
-            client_msg += [msgtxt]
-            logging.warn(msgtxt)
-            # fetch only global profiles destined for all clients
-            if AIdb.isRangeCriteria(aisql.getQueue(), crit,
-                                    AIdb.PROFILES_TABLE):
-                nvpairs += ["MIN" + crit + " IS NULL"]
-                nvpairs += ["MAX" + crit + " IS NULL"]
-            else:
-                nvpairs += [crit + " IS NULL"]
-            continue
-
-        # prepare criteria value to add to query
-        envval = AIdb.sanitizeSQL(criteria[crit])
-        if AIdb.isRangeCriteria(aisql.getQueue(), crit, AIdb.PROFILES_TABLE):
-            # If no default profiles are requested, then we mustn't allow
-            # this criteria to be NULL.  It must match the client's given
-            # value for this criteria.
-            if no_default:
-                if crit == "mac":
-                    nvpairs += ["(HEX(MIN" + crit + ")<=HEX(X'" + envval + \
-                        "'))"]
-
-                    nvpairs += ["(HEX(MAX" + crit + ")>=HEX(X'" + envval + \
-                        "'))"]
-                else:
-                    nvpairs += ["(MIN" + crit + "<='" + envval + "')"]
-                    nvpairs += ["(MAX" + crit + ">='" + envval + "')"]
-            else:
-                if crit == "mac":
-                    nvpairs += ["(MIN" + crit + " IS NULL OR "
-                        "HEX(MIN" + crit + ")<=HEX(X'" + envval + "'))"]
-                    nvpairs += ["(MAX" + crit + " IS NULL OR HEX(MAX" +
-                        crit + ")>=HEX(X'" + envval + "'))"]
-                else:
-                    nvpairs += ["(MIN" + crit + " IS NULL OR MIN" +
-                        crit + "<='" + envval + "')"]
-                    nvpairs += ["(MAX" + crit + " IS NULL OR MAX" +
-                        crit + ">='" + envval + "')"]
-        else:
-            # If no default profiles are requested, then we mustn't allow
-            # this criteria to be NULL.  It must match the client's given
-            # value for this criteria.
-            #
-            # Also, since this is a non-range criteria, the value stored
-            # in the DB may be a whitespace separated list of single
-            # values.  We use a special user-defined function in the
-            # determine if the given criteria is in that textual list.
-            if no_default:
-                nvpairs += ["(is_in_list('" + crit + "', '" + envval + \
-                    "', " + crit + ", 'None') == 1)"]
-            else:
-                nvpairs += ["(" + crit + " IS NULL OR is_in_list('" + crit + \
-                    "', '" + envval + "', " + crit + ", 'None') == 1)"]
-
-    if len(nvpairs) > 0:
-        q_str += " AND ".join(nvpairs)
-
-        # issue database query
-        logging.info("Profile query: " + q_str)
-        query = AIdb.DBrequest(q_str)
-        aisql.getQueue().put(query)
+    # collect the answer to the profile query queued above
+    if profile_query is not None:
+        query = profile_query
         query.waitAns()
         if query.getResponse() is None or len(query.getResponse()) == 0:
             msgtxt = _("No profiles found.")
@@ -439,15 +817,18 @@ def send_manifest(form_data, port=0, servicename=None,
                     msgtxt = _('Processing profile %s') % profname
                     client_msg += [msgtxt]
                     logging.info(msgtxt)
-                    with open(profpath, 'r') as pfp:
-                        raw_profile = pfp.read()
+                    dependencies.append(file_dependency(profpath))
+                    template = get_profile_template(profpath, image_dir)
+                    variables.update(template.variables)
+                    raw_profile = template.profile
                     # do any template variable replacement {{AI_xxx}}
-                    tmpl_profile = sc.perform_templating(raw_profile,
-                                                         template_dict)
+                    tmpl_profile = template.substitute(template_dict)
                     # precautionary validation of profile, logging only
-                    sc.validate_profile_string(tmpl_profile, image_dir,
-                                               dtd_validation=True,
-                                               warn_if_dtd_missing=True)
+                    if not template.valid or \
+                            random.random() < PROFILE_VALIDATION_RATE:
+                        sc.validate_profile_string(tmpl_profile, image_dir,
+                                                   dtd_validation=True,
+                                                   warn_if_dtd_missing=True)
                 except IOError as err:
                     msgtxt = _("Error:  I/O error: ") + str(err)
                     client_msg += [msgtxt]
@@ -477,8 +858,8 @@ def send_manifest(form_data, port=0, servicename=None,
                         msgtxt = _('Error:  ') + error.message
                         client_msg += [msgtxt]
                         logging.error(msgtxt)
-                    logging.info([_('Profile failing validation:  ') +
-                                 lxml.etree.tostring(root)])
+                    logging.info(_('Profile failing validation:  ') +
+                                 tmpl_profile)
                 # build MIME message and attach to outer MIME message
                 msg = MIMEText(tmpl_profile, 'xml')
                 # indicate in header that this is an attachment
@@ -501,7 +882,210 @@ def send_manifest(form_data, port=0, servicename=None,
         msg = MIMEText(outtxt, 'plain')  # create MIME message
         outermime.attach(msg)  # attach MIME message to response
 
-    print outermime.as_string()  # send MIME-formatted message
+    etag, reply = mime_reply(outermime)
+    if reply_key is not None:
+        cache_reply(reply_key, dependencies, variables, template_dict, etag,
+                    reply)
+    send_reply(etag, reply, if_none_match)
+
+
+def client_value(crit, value):
+    '''Converts a client criteria value given in the form installadm
+    accepts (e.g. a colon separated mac address or a dotted IPv4 address)
+    to the form AI clients send it in. Other values are returned unchanged.
+    '''
+    value = unicode(value).encode('utf-8').strip()
+    if crit == 'mac':
+        try:
+            return str(com.MACAddress(value))
+        except com.MACAddress.MACAddressError:
+            return value
+    if crit in ('ipv4', 'network') and '.' in value:
+        octets = value.split('.')
+        if len(octets) == 4 and False not in [octet.isdigit() and
+                                              int(octet) <= 255
+                                              for octet in octets]:
+            return '%03d%03d%03d%03d' % tuple([int(octet)
+                                               for octet in octets])
+    return value
+
+
+def read_clients(data):
+    '''Parses the criteria of a list of clients, given either as a JSON
+    list of objects mapping criteria names to values, or as CSV text whose
+    first row names the criteria. Empty CSV fields and JSON null values
+    leave a criteria out for that client.
+
+    Args
+        data - the JSON or CSV text
+
+    Returns
+        a list of client criteria dictionaries, values as sent by AI clients
+
+    Raises
+        ValueError if data can not be parsed
+    '''
+    clients = list()
+    if data.lstrip()[:1] == '[':
+        entries = json.loads(data)
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise ValueError(_("client criteria must be JSON objects"))
+    else:
+        reader = csv.reader(StringIO(data.strip()))
+        try:
+            names = [name.strip() for name in reader.next()]
+        except StopIteration:
+            return clients
+        except csv.Error as err:
+            raise ValueError(err)
+        entries = list()
+        try:
+            for row in reader:
+                if len(row) > len(names):
+                    raise ValueError(_("too many fields on line %d") %
+                                     reader.line_num)
+                entries.append(dict(zip(names, row)))
+        except csv.Error as err:
+            raise ValueError(err)
+
+    for entry in entries:
+        criteria = dict()
+        for crit, value in entry.iteritems():
+            crit = str(crit).strip().lower()
+            if value is None or unicode(value).strip() == '':
+                continue
+            criteria[crit] = client_value(crit, value)
+        clients.append(criteria)
+    return clients
+
+
+def resolution_indexes(aisql):
+    '''Returns the (CriteriaIndex, ProfileIndex) of an AI database, both
+    built from the same version of the database.
+
+    Raises
+        AIdb.CriteriaIndexError if an index can not be built
+    '''
+    path = aisql.getPath()
+    while True:
+        signature = AIdb.dbSignature(path)
+        manifest_index = AIdb.getCriteriaIndex(aisql)
+        profile_index = AIdb.getProfileIndex(aisql)
+        if AIdb.dbSignature(path) == signature:
+            return (manifest_index, profile_index)
+
+
+def resolve_clients(servicename, clients, no_default=False):
+    '''Finds the manifest and profiles each of a list of clients would be
+    sent by send_manifest(), see resolve_database_clients.
+
+    Args
+        servicename - the name of the service
+        clients     - list of client criteria dictionaries, see read_clients
+        no_default  - see send_manifest
+
+    Returns
+        a list holding a (manifest, profiles) tuple for each client, where
+        manifest is the name of the manifest or None, and profiles the
+        sorted tuple of profile names
+
+    Raises
+        Exceptions raised by AIService()
+    '''
+    service = get_service(servicename)
+    default_manifest = None
+    if not no_default:
+        default_manifest = service.get_default_manifest()
+    return resolve_database_clients(get_service_db(service.database_path),
+                                    clients, no_default, default_manifest)
+
+
+def resolve_database_clients(aisql, clients, no_default=False,
+                             default_manifest=None):
+    '''Finds the manifest and profiles each of a list of clients would be
+    sent, in one pass over a single version of an AI database. The
+    criteria indexes match the clients criterion by criterion, so that each
+    distinct client value is looked up once, and resolve clients whose
+    values match the same manifests and profiles once. Clients the indexes
+    can not answer for are resolved with the queries of send_manifest().
+
+    Args
+        aisql            - the AIdb.DB object of the service's database
+        clients          - list of client criteria dictionaries
+        no_default       - see send_manifest
+        default_manifest - the manifest of clients matching none
+
+    Returns
+        see resolve_clients
+    '''
+    try:
+        manifest_index, profile_index = resolution_indexes(aisql)
+    except AIdb.CriteriaIndexError as err:
+        logging.debug("criteria indexes not usable, using SQL: %s", err)
+        manifests = profiles = [err] * len(clients)
+    else:
+        columns = AIdb.ClientColumns(clients)
+        manifests = manifest_index.findEach(columns)
+        profiles = profile_index.findNamesEach(columns, no_default)
+
+    results = list()
+    for criteria, manifest, names in zip(clients, manifests, profiles):
+        if isinstance(manifest, AIdb.CriteriaIndexError):
+            manifest = AIdb.findManifestSQL(criteria, aisql)
+        if manifest is None:
+            manifest = default_manifest
+        if isinstance(names, AIdb.CriteriaIndexError):
+            names = _query_profile_names(criteria, aisql, no_default)
+        results.append((manifest, names))
+    return results
+
+
+def _query_profile_names(criteria, aisql, no_default):
+    '''Returns the sorted tuple of the names of the profiles of one
+    client, as selected by build_profile_query()
+    '''
+    q_str, params, messages = build_profile_query(criteria, aisql.getQueue(),
+                                                  no_default)
+    if q_str is None:
+        return ()
+    rows = aisql.submit(q_str, params=params).result() or list()
+    return tuple(sorted(set([row['name'] for row in rows])))
+
+
+def send_resolution(servicename, data, no_default=False):
+    '''Replies to a request for the manifest and profiles of a list of
+    clients (see resolve_clients) with a JSON list holding an object with
+    the criteria, manifest and profiles of each client.
+
+    Args
+        servicename - the name of the service
+        data        - the clients' criteria, see read_clients
+        no_default  - see send_manifest
+
+    Returns
+        None
+
+    Raises
+        Exceptions raised by AIService()
+    '''
+    try:
+        clients = read_clients(data)
+    except ValueError as err:
+        print 'Content-Type: text/html'     # HTML is following
+        print                               # blank line, end of headers
+        print '<pre><b>Error</b>:unable to read client criteria:', \
+            cgi.escape(str(err)), '</pre>'
+        return
+
+    reply = list()
+    for criteria, (manifest, profiles) in \
+            zip(clients, resolve_clients(servicename, clients, no_default)):
+        reply.append({'criteria': criteria, 'manifest': manifest,
+                      'profiles': profiles})
+    print 'Content-Type: application/json'
+    print                               # blank line, end of headers
+    print json.dumps(reply)
 
 
 def list_manifests(service):
@@ -543,15 +1127,14 @@ def list_manifests(service):
 
     found = False
     if config.is_service(service):
-        service_ctrl = AIService(service)
+        service_ctrl = get_service(service)
         found = True
 
         # assume new service setup
         path = service_ctrl.database_path
         if os.path.exists(path):
             try:
-                aisql = AIdb.DB(path)
-                aisql.verifyDBStructure()
+                aisql = get_service_db(path)
             except StandardError as err:
                 # report the internal error to error_log and
                 # requesting client
@@ -655,17 +1238,32 @@ def list_manifests(service):
 
     print '</body></html>'
 
-if __name__ == '__main__':
-    gettext.install("ai", "/usr/lib/locale")
-    DEFAULT_PORT = libaimdns.getinteger_property(com.SRVINST, com.PORTPROP)
-    (PARAM_VERSION, SERVICE, NO_DEFAULT, FORM_DATA) = \
-        get_parameters(cgi.FieldStorage())
-    print >> sys.stderr, PARAM_VERSION, SERVICE, NO_DEFAULT, FORM_DATA
-    if PARAM_VERSION == COMPATIBILITY_VERSION or SERVICE is None:
+
+def process_request(form, request_method, request_port, default_port,
+                    if_none_match=None):
+    '''Dispatches a client request to the appropriate handler. The reply,
+    including CGI headers, is written to standard output.
+
+    Args
+        form           - the CGI form data (cgi.FieldStorage)
+        request_method - either GET or POST (see get_environment_information)
+        request_port   - the port the request was received on
+        default_port   - the port of the default (non-compatibility) AI
+                         webserver
+        if_none_match  - the If-None-Match header of the request, if any
+
+    Returns
+        None
+
+    Raises
+        None
+    '''
+    (param_version, service, no_default, form_data) = get_parameters(form)
+    print >> sys.stderr, param_version, service, no_default, form_data
+    if param_version == COMPATIBILITY_VERSION or service is None:
         # Old client
-        (REQUEST_METHOD, REQUEST_PORT) = get_environment_information()
-        if REQUEST_PORT == DEFAULT_PORT:  # only new clients use default port
-            HOST = socket.gethostname()
+        if request_port == default_port:  # only new clients use default port
+            host = socket.gethostname()
             print 'Content-Type: text/html'     # HTML is following
             print                               # blank line, end of headers
             print '<pre>'
@@ -673,33 +1271,45 @@ if __name__ == '__main__':
             sys.stdout.write(_('The request should look like:\n'))
             sys.stdout.write('<ol>http://%s:%d/cgi_get_manifest.py?'
                              'version=%s&service=<i>servicename</i></ol>' %
-                             (HOST, DEFAULT_PORT, VERSION))
+                             (host, default_port, VERSION))
             print '</pre>'
-            sys.exit(0)
-        if REQUEST_METHOD == 'GET':
-            send_needed_criteria(REQUEST_PORT)
+            return
+        if request_method == 'GET':
+            send_needed_criteria(request_port)
         else:
-            send_manifest(FORM_DATA, port=REQUEST_PORT)
-    elif FORM_DATA is None:
+            send_manifest(form_data, port=request_port)
+    elif 'resolveData' in form:
+        # do criteria match of a list of clients
+        send_resolution(service, form['resolveData'].value, no_default)
+    elif form_data is None:
         # do manifest table list
-        list_manifests(SERVICE)
+        list_manifests(service)
     else:
         # do manifest criteria match
         try:
-            send_manifest(FORM_DATA, servicename=SERVICE,
-                          protocolversion=PARAM_VERSION,
-                          no_default=NO_DEFAULT)
+            send_manifest(form_data, servicename=service,
+                          protocolversion=param_version,
+                          no_default=no_default,
+                          if_none_match=if_none_match)
         except:
             # send error report to client (through stdout), log
             print "Content-Type: text/html"     # HTML is following
             print                               # blank line, end of headers
-            ERRMSG = _(
+            errmsg = _(
                 'Unexpected error in AI server script locating SC profiles. '
                 'Script traceback from server:')
-            print ERRMSG
-            logging.error(ERRMSG)
+            print errmsg
+            logging.error(errmsg)
             # traceback to stdout and log
             import traceback
-            TB = traceback.format_exc() # traceback to stdout and log
-            logging.error(TB)
-            print TB
+            tb = traceback.format_exc() # traceback to stdout and log
+            logging.error(tb)
+            print tb
+
+
+if __name__ == '__main__':
+    gettext.install("ai", "/usr/lib/locale")
+    DEFAULT_PORT = libaimdns.getinteger_property(com.SRVINST, com.PORTPROP)
+    (REQUEST_METHOD, REQUEST_PORT) = get_environment_information()
+    process_request(cgi.FieldStorage(), REQUEST_METHOD, REQUEST_PORT,
+                    DEFAULT_PORT, os.environ.get('HTTP_IF_NONE_MATCH'))
@@ -76,11 +76,54 @@ class AICriteriaTemplate(Template):
     '''
 
 
+class ProfileTemplate(object):
+    ''' A profile read from a file, with its template variables parsed and
+    the unsubstituted profile validated once, so that producing the profile
+    for a client only requires template substitution.
+    '''
+
+    def __init__(self, profile_str, image_dir=None):
+        ''' Parse and validate the profile template
+        Args:
+            profile_str - profile as a string
+            image_dir - path of service image, see validate_profile_string
+        '''
+        import lxml.etree as etree
+
+        self.profile = profile_str
+        self.template = AICriteriaTemplate(profile_str)
+        # names of the template variables used by the profile
+        self.variables = set()
+        for match in self.template.pattern.finditer(profile_str):
+            name = match.group('named') or match.group('braced')
+            if name:
+                self.variables.add(name)
+        # The unsubstituted profile may fail validation where the profile
+        # of every client would pass (e.g. a variable used in an
+        # enumerated attribute), so valid only tells whether the result of
+        # substitution needs to be validated again.
+        try:
+            validate_profile_string(profile_str, image_dir,
+                                    dtd_validation=True,
+                                    warn_if_dtd_missing=True)
+            self.valid = True
+        except etree.XMLSyntaxError:
+            self.valid = False
+
+    def substitute(self, template_dict):
+        ''' Return the profile with the template variables substituted
+        from template_dict, see perform_templating
+        '''
+        # perform_templating() modifies the dictionary it is given
+        return perform_templating(self.template, dict(template_dict))
+
+
 def perform_templating(profile_str, template_dict=dict(TEMPLATE_VARIABLES)):
     ''' Given profile string, do all template substitutions using either a
     provided dictionary or the default dictionary.
     Args:
-        profile_str - profile as a string
+        profile_str - profile as a string, or an already parsed
+            AICriteriaTemplate
         template_dict - Optional dictionary to use for templating
     Returns:
         profile string with any templating substitution performed
@@ -88,7 +131,10 @@ def perform_templating(profile_str, template_dict=dict(TEMPLATE_VARIABLES)):
         KeyError when template variable missing
     '''
     # instantiate our template object derived from string Template class
-    tmpl = AICriteriaTemplate(profile_str)
+    if isinstance(profile_str, AICriteriaTemplate):
+        tmpl = profile_str
+    else:
+        tmpl = AICriteriaTemplate(profile_str)
     # Force any MAC value to all uppercase
     if 'AI_MAC' in template_dict:
         template_dict['AI_MAC'] = template_dict['AI_MAC'].upper()
@@ -201,15 +247,7 @@ def get_columns(queue, table):
         queue - database queue object
         table - database table name
     '''
-    query = AIdb.DBrequest("PRAGMA table_info(" + table + ")")
-    queue.put(query)
-    query.waitAns()
-    columns = list()
-    # build a query so we can determine which columns (criteria) are in use
-    # using the output from the PRAGMA statement
-    for col in iter(query.getResponse()):
-        columns += [col['name']]
-    return columns
+    return AIdb.getColumns(queue, table)
 
 
 def validate_profile_string(profile_str, image_dir=None, resolve_entities=True,
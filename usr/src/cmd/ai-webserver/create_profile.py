@@ -134,34 +134,49 @@ def add_profile(criteria, profile_name, profile_file, queue, table):
         database record added
         stored resulting profile in internal profile directory
     """
+    # clear any profiles exactly matching the criteria, then add profile to
+    # database
+    for q_str in profile_statements(criteria, profile_name, profile_file,
+                                    queue, table):
+        query = AIdb.DBrequest(q_str, commit=True)
+        queue.put(query)
+        query.waitAns()
+        if query.getResponse() is None:
+            return False
+
+    print >> sys.stderr, _('Profile %s added to database.') % profile_name
+    return True
+
+
+def profile_statements(criteria, profile_name, profile_file, queue, table):
+    """
+    Return the SQL statements setting a profile record in the database with
+    the criteria provided.
+    Args:
+        criteria - criteria object
+        profile_name - name of profile to add
+        profile_file - path of profile to add
+        queue - database request queue
+        table - profile table in database
+    Returns: list of the DELETE statement clearing any profile exactly
+        matching the criteria and the INSERT statement adding the profile
+    """
     # get lists prepared for SQLite WHERE, INSERT VALUES from command line
     (wherel, insertl, valuesl) = \
         sc.sql_values_from_criteria(criteria, queue, table)
 
     # clear any profiles exactly matching the criteria
     wherel += ["name=" + AIdb.format_value('name', profile_name)]
-    q_str = "DELETE FROM " + table + " WHERE " + " AND ".join(wherel)
-    query = AIdb.DBrequest(q_str, commit=True)
-    queue.put(query)
-    query.waitAns()
-    if query.getResponse() is None:
-        return False
+    delete = "DELETE FROM " + table + " WHERE " + " AND ".join(wherel)
 
     # add profile to database
     insertl += ["name"]
     valuesl += [AIdb.format_value('name', profile_name)]
     insertl += ["file"]
     valuesl += [AIdb.format_value('name', profile_file)]
-    q_str = "INSERT INTO " + table + "(" + ", ".join(insertl) + \
-            ") VALUES (" + ", ".join(valuesl) + ")"
-    query = AIdb.DBrequest(q_str, commit=True)
-    queue.put(query)
-    query.waitAns()
-    if query.getResponse() is None:
-        return False
-
-    print >> sys.stderr, _('Profile %s added to database.') % profile_name
-    return True
+    insert = "INSERT INTO " + table + "(" + ", ".join(insertl) + \
+             ") VALUES (" + ", ".join(valuesl) + ")"
+    return [delete, insert]
 
 
 def copy_profile_internally(profile_string):
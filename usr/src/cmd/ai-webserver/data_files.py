@@ -195,10 +195,6 @@ def insert_SQL(files):
     Args: None
     Returns: None
     """
-    query = "INSERT INTO manifests VALUES("
-
-    # add the manifest name to the query string
-    query += "'" + AIdb.sanitizeSQL(files.manifest_name) + "',"
     # check to see if manifest name is already in database (affects instance
     # number)
     if AIdb.sanitizeSQL(files.manifest_name) in \
@@ -211,6 +207,28 @@ def insert_SQL(files):
     else:
         instance = 0
 
+    # update the database
+    query = AIdb.DBrequest(insert_query(files, instance), commit=True)
+    files.database.getQueue().put(query)
+    query.waitAns()
+    # in case there's an error call the response function (which will print the
+    # error)
+    query.getResponse()
+
+
+def insert_query(files, instance):
+    """
+    Returns the sanitized SQL statement inserting a manifest into the
+    database
+    Args: files - DataFiles object holding the verified manifest and criteria
+          instance - instance number of the manifest
+    Returns: SQL string
+    """
+    query = "INSERT INTO manifests VALUES("
+
+    # add the manifest name to the query string
+    query += "'" + AIdb.sanitizeSQL(files.manifest_name) + "',"
+
     # actually add the instance to the query string
     query += str(instance) + ","
 
@@ -258,15 +276,7 @@ def insert_SQL(files):
                     query += AIdb.sanitizeSQL(str(value).upper()) + ","
 
     # strip trailing comma and close parentheses
-    query = query[:-1] + ")"
-
-    # update the database
-    query = AIdb.DBrequest(query, commit=True)
-    files.database.getQueue().put(query)
-    query.waitAns()
-    # in case there's an error call the response function (which will print the
-    # error)
-    query.getResponse()
+    return query[:-1] + ")"
 
 
 def place_manifest(files, manifest_path):
@@ -497,11 +507,13 @@ class DataFiles(object):
                  database_path=None, manifest_file=None,
                  criteria_dict=None, criteria_file=None,
                  manifest_name=None, service_name=None,
-                 set_as_default=False):
+                 set_as_default=False, database=None):
 
         """
         Initialize DataFiles instance. All parameters optional, however, proper
         setup order asurred, if all data provided upon instantiation.
+        An already open AI_database object may be passed as database instead
+        of database_path, to share it between DataFiles objects.
         """
 
         #
@@ -569,7 +581,9 @@ class DataFiles(object):
 
         # Holds database object for criteria database
         self._db = None
-        if database_path:
+        if database is not None:
+            self._db = database
+        elif database_path:
             # Set Database Path and Open SQLite3 Object
             self.database = database_path
             # verify the database's table/column structure (or exit if errors)
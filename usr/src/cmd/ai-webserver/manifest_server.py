@@ -0,0 +1,324 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+manifest_server is a long-lived alternative to running cgi_get_manifest.py
+as a CGI program. It speaks the same protocol (send_needed_criteria,
+send_manifest and list_manifests) but keeps the interpreter, the imported
+modules and each service's open AI database between requests.
+
+It can be used either as a WSGI application (see application()) under a
+WSGI capable web server, or standalone as a threaded HTTP server:
+
+    python2.6 -m osol_install.auto_install.manifest_server -p 5555
+
+Services are reloaded only when the service's .config file changes, and
+databases only when the AI.db file is replaced (see
+cgi_get_manifest.get_service and get_service_db).
+'''
+import cgi
+import gettext
+import logging
+import sys
+import threading
+
+import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.cgi_get_manifest as cgi_get_manifest
+import osol_install.auto_install.installadm_common as com
+import osol_install.libaimdns as libaimdns
+
+from optparse import OptionParser
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from wsgiref.simple_server import make_server, WSGIRequestHandler, \
+    WSGIServer
+
+from osol_install.auto_install.installadm_common import _
+
+# Request paths handled, as set up by ScriptAlias in ai-httpd.conf
+SCRIPT_PATHS = ('/cgi-bin/cgi_get_manifest.py', '/manifest.xml')
+
+# Status reported when the handler produces no explicit Status header
+DEFAULT_STATUS = '200 OK'
+
+
+class RequestOutput(object):
+    '''A sys.stdout replacement which sends output written by a thread
+    handling a request to that request's buffer. Output from any other
+    thread goes to the original stream.
+    '''
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def start_capture(self):
+        '''Start collecting the calling thread's output in a new buffer'''
+        self._local.buffer = StringIO()
+
+    def stop_capture(self):
+        '''Stop collecting the calling thread's output and return it'''
+        output = self._local.buffer.getvalue()
+        self._local.buffer = None
+        return output
+
+    def _target(self):
+        '''Return the stream to write to for the calling thread'''
+        return getattr(self._local, 'buffer', None) or self._stream
+
+    def write(self, data):
+        '''Write data to the calling thread's stream'''
+        self._target().write(data)
+
+    def writelines(self, lines):
+        '''Write a sequence of strings to the calling thread's stream'''
+        self._target().writelines(lines)
+
+    def flush(self):
+        '''Flush the calling thread's stream'''
+        self._target().flush()
+
+
+_OUTPUT = None
+_OUTPUT_LOCK = threading.Lock()
+
+
+def _get_output():
+    '''Install (once) and return the RequestOutput used as sys.stdout'''
+    global _OUTPUT
+    with _OUTPUT_LOCK:
+        if _OUTPUT is None:
+            _OUTPUT = RequestOutput(sys.stdout)
+            sys.stdout = _OUTPUT
+    return _OUTPUT
+
+
+def parse_cgi_output(output):
+    '''Split the output of a CGI handler into a status, a list of headers
+    and a body.
+
+    Args
+        output - string as written by the handler, headers first, then a
+                 blank line, then the body
+
+    Returns
+        (status, headers, body) where headers is a list of (name, value)
+        tuples suitable for a WSGI start_response callable
+
+    Raises
+        None
+    '''
+    status = DEFAULT_STATUS
+    headers = list()
+    head, sep, body = output.partition('\n\n')
+    if not sep:
+        # no header block; treat everything as an HTML body
+        return (status, [('Content-Type', 'text/html')], output)
+
+    for line in head.splitlines():
+        if line[:1].isspace() and headers:
+            # folded continuation of the previous header
+            name, value = headers[-1]
+            headers[-1] = (name, value + ' ' + line.strip())
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        name = name.strip()
+        value = value.strip()
+        if name.lower() == 'status':
+            status = value
+        elif name.lower() == 'content-length':
+            # recomputed below, the handlers count the body before print
+            # adds its trailing newline
+            continue
+        else:
+            headers.append((name, value))
+    headers.append(('Content-Length', str(len(body))))
+    return (status, headers, body)
+
+
+class ManifestApplication(object):
+    '''WSGI application serving AI manifest and profile requests'''
+
+    def __init__(self, default_port=None):
+        '''Args
+            default_port - port of the default (non-compatibility) AI
+                           webserver. Looked up from SMF if not given.
+        '''
+        if default_port is None:
+            default_port = libaimdns.getinteger_property(com.SRVINST,
+                                                         com.PORTPROP)
+        self.default_port = default_port
+        self._output = _get_output()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '') not in SCRIPT_PATHS:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [_('error:unknown request path\n')]
+
+        method = environ.get('REQUEST_METHOD', 'GET')
+        port = int(environ.get('SERVER_PORT', self.default_port))
+        form = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
+
+        self._output.start_capture()
+        try:
+            try:
+                cgi_get_manifest.process_request(
+                    form, method, port, self.default_port,
+                    if_none_match=environ.get('HTTP_IF_NONE_MATCH'))
+            except SystemExit:
+                # handlers exit after reporting fatal errors to the client
+                pass
+        finally:
+            output = self._output.stop_capture()
+
+        status, headers, body = parse_cgi_output(output)
+        start_response(status, headers)
+        return [body]
+
+
+_APPLICATION = None
+
+
+def application(environ, start_response):
+    '''WSGI entry point, for use by WSGI capable web servers'''
+    global _APPLICATION
+    if _APPLICATION is None:
+        _APPLICATION = ManifestApplication()
+    return _APPLICATION(environ, start_response)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    '''WSGI server handling each request in its own thread'''
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    '''Request handler logging through the logging module'''
+
+    def log_message(self, fmt, *args):
+        logging.info("%s - %s", self.address_string(), fmt % args)
+
+
+def serve(ports, address='', default_port=None):
+    '''Serve requests on each of the given ports until interrupted. One
+    server thread is started per port; compatibility services are
+    distinguished by the port a request arrives on.
+
+    Args
+        ports        - list of ports to listen on
+        address      - address to bind to, all addresses by default
+        default_port - port of the default AI webserver, see
+                       ManifestApplication
+
+    Returns
+        None
+
+    Raises
+        socket.error if a port cannot be bound
+    '''
+    app = ManifestApplication(default_port=default_port)
+    servers = list()
+    for port in ports:
+        servers.append(make_server(address, port, app,
+                                   server_class=ThreadingWSGIServer,
+                                   handler_class=QuietRequestHandler))
+
+    threads = list()
+    for server in servers[1:]:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    try:
+        servers[0].serve_forever()
+    finally:
+        for server in servers[1:]:
+            server.shutdown()
+
+
+def parse_options(cmd_options=None):
+    '''Parses and validates options
+
+    Args
+        cmd_options - command line options (sys.argv[1:] if None)
+
+    Returns
+        the parsed options
+
+    Raises
+        None (exits on invalid options)
+    '''
+    usage = _("usage: %prog -p <port> [-p <port> ...] [-a <address>] "
+              "[-c] [-r <rate>] [-v]")
+    parser = OptionParser(usage=usage)
+    parser.add_option('-p', '--port', dest='ports', default=[],
+                      action='append', type='int',
+                      help=_('port to listen on (may be repeated)'))
+    parser.add_option('-a', '--address', dest='address', default='',
+                      help=_('address to listen on (default: all)'))
+    parser.add_option('-c', '--crosscheck', dest='crosscheck',
+                      default=False, action='store_true',
+                      help=_('verify each manifest match found by the '
+                             'criteria index against the SQL query'))
+    parser.add_option('-r', '--profile-validation', dest='validation_rate',
+                      default=cgi_get_manifest.PROFILE_VALIDATION_RATE,
+                      type='float',
+                      help=_('fraction (0 to 1) of the profiles sent which '
+                             'are validated again after template '
+                             'substitution'))
+    parser.add_option('-v', '--verbose', dest='verbose', default=False,
+                      action='store_true',
+                      help=_('log each request'))
+
+    (options, args) = parser.parse_args(cmd_options)
+    if args:
+        parser.error(_('unknown argument(s): %s') % args)
+    if not options.ports:
+        parser.error(_('at least one port must be specified'))
+    if not 0 <= options.validation_rate <= 1:
+        parser.error(_('profile validation rate must be between 0 and 1'))
+    return options
+
+
+def main(cmd_options=None):
+    '''Run the standalone manifest server'''
+    gettext.install("ai", "/usr/lib/locale")
+    options = parse_options(cmd_options)
+    if options.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+    if options.crosscheck:
+        AIdb.FIND_MANIFEST_MODE = AIdb.FIND_CROSSCHECK
+    cgi_get_manifest.PROFILE_VALIDATION_RATE = options.validation_rate
+    try:
+        serve(options.ports, options.address)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,7 +23,9 @@
 """
 AI publish_manifest
 """
+import bisect
 import gettext
+import heapq
 import logging
 import os
 
@@ -208,7 +210,365 @@ def criteria_to_dict(criteria):
     return cri_dict
 
 
-def find_colliding_criteria(criteria, db, exclude_manifests=None):
+def _db_range(crit, low, high):
+    """
+    Returns: the range of a range criteria stored in the database as a
+             (minimum, maximum) tuple of longs, with NULL bounds replaced by
+             0 and +inf
+    Args:    crit - the criteria name (without MIN or MAX)
+             low, high - the MIN and MAX column values (HEX() for mac)
+    """
+    # arbitrarily large number in case this Python does not support IEEE754
+    db_criterion = ["0", INFINITY]
+
+    # now populate in valid database values (i.e. non-NULL values)
+    if low:
+        db_criterion[0] = low
+    if high:
+        db_criterion[1] = high
+    if crit == "mac":
+        # use a hexadecimal conversion
+        return (long(str(db_criterion[0]), 16),
+                long(str(db_criterion[1]), 16))
+    # these are decimal numbers
+    return (long(str(db_criterion[0])), long(str(db_criterion[1])))
+
+
+class ManifestCriteria(object):
+    """
+    The criteria of all the manifests of an install service, read from the
+    database in a single query. Value criteria are indexed by value, and the
+    ranges of each range criteria are sorted by their minimum, so that the
+    manifests colliding with a set of criteria are found without a query
+    per criteria or per manifest, and overlaps between all the manifests of
+    the service are found by sweeping over the sorted ranges.
+    """
+
+    def __init__(self, rows, columns):
+        """
+        Args: rows - the manifests as dictionaries holding name, instance
+                     and the criteria columns, as AIdb.getCriteriaRows()
+                     returns them
+              columns - the criteria columns of the manifests table
+        """
+        self.columns = list(columns)
+        # manifest name and instance tuples, in database order
+        self._keys = list()
+        self._rows = dict()
+        # value criteria -> normalized value -> manifests listing that value
+        self._values = dict()
+        # range criteria -> (minimum, maximum, manifest) sorted by minimum
+        self._ranges = dict()
+        # range criteria -> the minimums of self._ranges, for bisection
+        self._lows = dict()
+        # range criteria -> maximum -> positions in self._ranges
+        self._highs = dict()
+
+        range_crits = list()
+        for col in self.columns:
+            if col.startswith('MIN') or col.startswith('MAX'):
+                if col[3:] not in range_crits:
+                    range_crits.append(col[3:])
+            else:
+                self._values[col] = dict()
+
+        for row in rows:
+            key = (row['name'], row['instance'])
+            self._keys.append(key)
+            self._rows[key] = row
+            for crit, index in self._values.iteritems():
+                if row.get(crit) is None:
+                    continue
+                values = set(self._fold(crit, value)
+                             for value in str(row[crit]).split())
+                for value in values:
+                    index.setdefault(value, list()).append(key)
+
+        for crit in range_crits:
+            entries = list()
+            for key in self._keys:
+                low = self._rows[key].get('MIN' + crit)
+                high = self._rows[key].get('MAX' + crit)
+                if low is None and high is None:
+                    continue
+                entries.append(_db_range(crit, low, high) + (key,))
+            entries.sort()
+            self._ranges[crit] = entries
+            self._lows[crit] = [entry[0] for entry in entries]
+            highs = dict()
+            for position, entry in enumerate(entries):
+                highs.setdefault(entry[1], list()).append(position)
+            self._highs[crit] = highs
+
+    @classmethod
+    def from_db(cls, db):
+        """
+        Returns: the ManifestCriteria of the manifests in the database
+        Args:    db - AI_database object for the install service.
+        Raises:  SystemExit if the manifests can not be read
+        """
+        queue = db.getQueue()
+        columns = list(AIdb.getCriteria(queue, onlyUsed=False, strip=False))
+        try:
+            rows = AIdb.getCriteriaRows(queue, AIdb.MANIFESTS_TABLE,
+                                        "name, instance", columns)
+        except AIdb.CriteriaIndexError as err:
+            raise SystemExit(_("Error:\t%s") % err)
+        return cls(rows, columns)
+
+    @staticmethod
+    def _fold(crit, value):
+        """Normalize a value the way AIdb.is_in_list() compares it"""
+        if crit.lower() in AIdb.CRIT_LIST_CASE_SENSITIVE:
+            return value
+        return value.lower()
+
+    def get(self, name, instance):
+        """
+        Returns: a dictionary of the criteria columns of a manifest, with
+                 None for NULL columns and HEX() values for mac, or None if
+                 there is no such manifest
+        """
+        return self._rows.get((name, instance))
+
+    def criteria(self, name, instance):
+        """
+        Returns: the criteria of a manifest in the form of a Criteria
+                 object, i.e. a dictionary mapping criteria names to a list
+                 of values or a [minimum, maximum] list of strings, or to
+                 None when the criteria is not set
+        """
+        row = self._rows[name, instance]
+        criteria = dict()
+        for crit in self._values:
+            if row.get(crit) is None:
+                criteria[crit] = None
+            else:
+                criteria[crit] = str(row[crit]).split()
+        for crit in self._ranges:
+            low = row.get('MIN' + crit)
+            high = row.get('MAX' + crit)
+            if low is None and high is None:
+                criteria[crit] = None
+            else:
+                criteria[crit] = [value if value is None else str(value)
+                                  for value in (low, high)]
+        return criteria
+
+    def find_values(self, crit, values):
+        """
+        Returns: a list of the manifest name and instance tuples listing one
+                 of values for value criteria crit, with a manifest repeated
+                 for each of values it lists
+        """
+        index = self._values.get(crit, dict())
+        found = list()
+        for value in values:
+            if value is None:
+                continue
+            found.extend(index.get(self._fold(crit, value), list()))
+        return found
+
+    def find_range(self, crit, low, high):
+        """
+        Returns: a list of the manifest name and instance tuples whose range
+                 for range criteria crit overlaps the range low to high (as
+                 converted by _db_range())
+        """
+        entries = self._ranges.get(crit)
+        if not entries:
+            return list()
+        # only the ranges with a minimum up to high can overlap
+        stop = bisect.bisect_right(self._lows[crit], high)
+        found = [entry[2] for entry in entries[:stop] if entry[1] >= low]
+        # as well as any range ending where this one starts
+        for position in self._highs[crit].get(low, list()):
+            if position >= stop:
+                found.append(entries[position][2])
+        return found
+
+    def overlaps(self):
+        """
+        Returns: a list of ((name, instance), (name, instance), collisions)
+                 tuples for the pairs of manifests which may collide, in
+                 database order, with collisions being the comma-separated
+                 string of colliding DB column names as
+                 find_colliding_criteria() produces it.
+
+        Manifests only collide if they have overlapping ranges, or if they
+        set the same value criteria, sharing a value for each, and no range
+        criteria. The ranges of each range criteria are swept in order of
+        their minimum while keeping a heap of the ranges still open, so the
+        overlapping pairs are found in O(n log n + pairs); the other pairs
+        are looked up in the index of the least common of their values.
+        """
+        position = dict((key, pos) for pos, key in enumerate(self._keys))
+        pairs = dict()
+
+        def record(first, second, colliding):
+            """add colliding to the collisions of a pair of manifests"""
+            if position[first] > position[second]:
+                first, second = second, first
+            pairs[first, second] = pairs.get((first, second), '') + colliding
+
+        for crit in self.columns:
+            if crit.startswith('MIN') and crit[3:] in self._ranges:
+                active = list()
+                for low, high, key in self._ranges[crit[3:]]:
+                    # drop the ranges ending before this one starts
+                    while active and active[0][0] < low:
+                        heapq.heappop(active)
+                    for entry in active:
+                        record(entry[1], key, crit + ",MAX" + crit[3:] + ",")
+                    heapq.heappush(active, (high, key))
+
+        for key in self._keys:
+            row = self._rows[key]
+            if [crit for crit in self._ranges
+                if row.get('MIN' + crit) is not None or
+                   row.get('MAX' + crit) is not None]:
+                continue
+            crits = [crit for crit in self.columns
+                     if crit in self._values and row.get(crit) is not None]
+            if not crits:
+                continue
+            shared = dict()
+            for crit in crits:
+                shared[crit] = set(self.find_values(crit,
+                                                    str(row[crit]).split()))
+            smallest = min(crits, key=lambda crit: len(shared[crit]))
+            for other in shared[smallest]:
+                if position[other] <= position[key]:
+                    continue
+                if [crit for crit in self._values
+                    if (self._rows[other].get(crit) is None) !=
+                       (row.get(crit) is None)]:
+                    continue
+                if [crit for crit in crits if other not in shared[crit]]:
+                    continue
+                for crit in crits:
+                    record(key, other, crit + ",")
+
+        return sorted(pairs.iteritems(), key=lambda item:
+                      (position[item[0][0]], position[item[0][1]]))
+
+    def audit(self):
+        """
+        Returns: a list of ((name, instance), (name, instance), clash)
+                 tuples for every pair of manifests whose criteria collide,
+                 where clash is the name of the range criteria whose ranges
+                 overlap, or an empty string if the manifests have the same
+                 criteria
+        """
+        clashes = list()
+        for (first, second), colliding in self.overlaps():
+            clash = _criteria_clash(self.criteria(*first),
+                                    self.get(*second), colliding,
+                                    self.columns)
+            if clash is not None:
+                clashes.append((first, second, clash))
+        return clashes
+
+
+def audit_collisions(db):
+    """
+    Returns: a list of ((name, instance), (name, instance), clash) tuples
+             for every pair of manifests of the install service whose
+             criteria collide, as ManifestCriteria.audit() gives them
+    Args:    db - AI_database object for the install service.
+    Raises:  SystemExit if the manifests can not be read
+    """
+    return ManifestCriteria.from_db(db).audit()
+
+
+def validate_range(crit, man_criterion):
+    """
+    Returns: the range of a range criteria as a [minimum, maximum] list of
+             longs, with "unbounded" replaced by 0 and +inf. The list of a
+             mac range is converted in place.
+    Args:    crit - the criteria name (without MIN or MAX)
+             man_criterion - the [minimum, maximum] list of the criteria
+    Raises:  SystemExit if: value is not valid for type (integer and
+                            hexadecimal checks)
+                            range is improper
+    """
+    # Clean-up NULL's and change "unbounded"s to 0 and
+    # really large numbers in case this Python does
+    # not support IEEE754.  Note "unbounded"s are already
+    # converted to lower case during manifest processing.
+    if man_criterion[0] == "unbounded":
+        man_criterion[0] = "0"
+    if man_criterion[1] == "unbounded":
+        man_criterion[1] = INFINITY
+    if crit == "mac":
+        # convert hex mac address (w/o colons) to a number
+        try:
+            man_criterion[0] = long(str(man_criterion[0]).upper(), 16)
+            man_criterion[1] = long(str(man_criterion[1]).upper(), 16)
+        except ValueError:
+            raise SystemExit(_("Error:\tCriteria %s "
+                               "is not a valid hexadecimal value") %
+                             crit)
+    else:
+        # this is a decimal value
+        try:
+            man_criterion = [long(str(man_criterion[0]).upper()),
+                             long(str(man_criterion[1]).upper())]
+        except ValueError:
+            raise SystemExit(_("Error:\tCriteria %s "
+                               "is not a valid integer value") % crit)
+
+    # Check for a properly ordered range (with unbounded being 0 or
+    # Inf.) but ensure both are not unbounded.
+    # Check for:
+    #       a range of zero to inf -- not a valid range
+    #  and
+    #       min > max -- range order reversed
+    #
+    if (man_criterion[0] == 0 and man_criterion[1] == long(INFINITY)):
+        raise SystemExit(_("Error:\tCriteria %s is not a valid range, "
+                           "MIN and MAX unbounded.") % crit)
+
+    if ((man_criterion[0] != 0 and
+         man_criterion[1] != long(INFINITY)) and
+        (long(man_criterion[0]) > long(man_criterion[1]))):
+        raise SystemExit(_("Error:\tCriteria %s is not a valid range, "
+                           "MIN > MAX.") % crit)
+    return man_criterion
+
+
+def criteria_row(name, instance, criteria, columns):
+    """
+    Returns: a dictionary holding the name, instance and criteria columns of
+             a manifest as AIdb.getCriteriaRows() returns them, for adding
+             a manifest not yet in the database to a ManifestCriteria
+    Args:    name, instance - the manifest name and instance
+             criteria - Criteria object holding the criteria of the manifest
+             columns - the criteria columns of the manifests table
+    """
+    row = {'name': name, 'instance': instance}
+    for col in columns:
+        if col.startswith('MIN') or col.startswith('MAX'):
+            values = criteria[col[3:]]
+            value = None
+            if values:
+                value = values[0 if col.startswith('MIN') else 1]
+            if value is None or value == "unbounded":
+                row[col] = None
+            elif col.endswith('mac'):
+                # as HEX() returns it
+                row[col] = str(value).upper()
+            else:
+                # as stored with INTEGER affinity
+                row[col] = long(str(value))
+        else:
+            values = criteria[col]
+            row[col] = " ".join(values) if values else None
+    return row
+
+
+def find_colliding_criteria(criteria, db, exclude_manifests=None,
+                            manifests=None):
     """
     Returns: A dictionary of colliding criteria with keys being manifest name
              and instance tuples and values being the DB column names which
@@ -220,31 +580,28 @@ def find_colliding_criteria(criteria, db, exclude_manifests=None):
                                 This arg is passed in when we're calling this
                                 function to find criteria collisions for an
                                 already published manifest.
+             manifests - ManifestCriteria of the manifests in db, read from
+                         db if not given.
     Raises:  SystemExit if: criteria is not found in database
                             value is not valid for type (integer and
                             hexadecimal checks)
                             range is improper
     """
-    class Fields(object):
-        """
-        Define convenience indexes
-        """
-        # manifest name is row index 0
-        MANNAME = 0
-        # manifest instance is row index 1
-        MANINST = 1
-        # criteria is row index 2 (when a single valued criteria)
-        CRIT = 2
-        # minimum criteria is row index 2 (when a range valued criteria)
-        MINCRIT = 2
-        # maximum criteria is row index 3 (when a range valued criteria)
-        MAXCRIT = 3
-
     # collisions is a dictionary to hold keys of the form (manifest name,
     # instance) which will point to a comma-separated string of colliding
     # criteria
     collisions = dict()
 
+    def record(man_inst, colliding):
+        """add colliding to the collisions of a manifest not excluded"""
+        if exclude_manifests is not None and \
+           man_inst[0] in exclude_manifests:
+            return
+        try:
+            collisions[man_inst] += colliding
+        except KeyError:
+            collisions[man_inst] = colliding
+
     # verify each range criteria in the manifest is well formed and collect
     # collisions with database entries
     for crit in criteria:
@@ -264,127 +621,134 @@ def find_colliding_criteria(criteria, db, exclude_manifests=None):
                 raise SystemExit(_("Error:\tCriteria %s is not a " +
                                    "valid criteria!") % crit)
 
-            # get all values in the database for this criteria (and
-            # manifest/instance pairs for each value)
-            db_criteria = AIdb.getSpecificCriteria(
-                db.getQueue(), crit,
-                provideManNameAndInstance=True,
-                excludeManifests=exclude_manifests)
-
-            # will iterate over a list of the form [manName, manInst, crit,
-            # None]
-            for row in db_criteria:
-                # check if a value in the list of values to be added is equal
-                # to a value in the list of values for this criteria for this
-                # row
-                for value in man_criterion:
-                    if AIdb.is_in_list(crit, value, str(row[Fields.CRIT]),
-                        None):
-                        # record manifest name, instance and criteria name
-                        try:
-                            collisions[row[Fields.MANNAME],
-                                       row[Fields.MANINST]] += crit + ","
-                        except KeyError:
-                            collisions[row[Fields.MANNAME],
-                                       row[Fields.MANINST]] = crit + ","
+            if manifests is None:
+                manifests = ManifestCriteria.from_db(db)
+
+            # record manifest name, instance and criteria name for each
+            # manifest listing a value in the list of values to be added
+            for man_inst in manifests.find_values(crit, man_criterion):
+                record(man_inst, crit + ",")
 
         # This is a range criteria.  (Check that ranges are valid, that
         # "unbounded" gets set to 0/+inf, ensure the criteria exists
         # in the DB, then look for collisions.)
         else:
-            # Clean-up NULL's and change "unbounded"s to 0 and
-            # really large numbers in case this Python does
-            # not support IEEE754.  Note "unbounded"s are already
-            # converted to lower case during manifest processing.
-            if man_criterion[0] == "unbounded":
-                man_criterion[0] = "0"
-            if man_criterion[1] == "unbounded":
-                man_criterion[1] = INFINITY
-            if crit == "mac":
-                # convert hex mac address (w/o colons) to a number
-                try:
-                    man_criterion[0] = long(str(man_criterion[0]).upper(), 16)
-                    man_criterion[1] = long(str(man_criterion[1]).upper(), 16)
-                except ValueError:
-                    raise SystemExit(_("Error:\tCriteria %s "
-                                       "is not a valid hexadecimal value") %
-                                     crit)
-            else:
-                # this is a decimal value
-                try:
-                    man_criterion = [long(str(man_criterion[0]).upper()),
-                                     long(str(man_criterion[1]).upper())]
-                except ValueError:
-                    raise SystemExit(_("Error:\tCriteria %s "
-                                       "is not a valid integer value") % crit)
-
-            # Check for a properly ordered range (with unbounded being 0 or
-            # Inf.) but ensure both are not unbounded.
-            # Check for:
-            #       a range of zero to inf -- not a valid range
-            #  and
-            #       min > max -- range order reversed
-            #
-            if (man_criterion[0] == 0 and man_criterion[1] == long(INFINITY)):
-                raise SystemExit(_("Error:\tCriteria %s is not a valid range, "
-                                   "MIN and MAX unbounded.") % crit)
-
-            if ((man_criterion[0] != 0 and
-                 man_criterion[1] != long(INFINITY)) and
-                (long(man_criterion[0]) > long(man_criterion[1]))):
-                raise SystemExit(_("Error:\tCriteria %s is not a valid range, "
-                                   "MIN > MAX.") % crit)
+            man_criterion = validate_range(crit, man_criterion)
+
             # check to see that this criteria exists in the database columns
             man_crit = AIdb.getCriteria(db.getQueue(), onlyUsed=False,
                                         strip=False)
             if 'MIN' + crit not in man_crit and 'MAX' + crit not in man_crit:
                 raise SystemExit(_("Error:\tCriteria %s is not a "
                                    "valid criteria!") % crit)
-            db_criteria = AIdb.getSpecificCriteria(
-                db.getQueue(), 'MIN' + crit, 'MAX' + crit,
-                provideManNameAndInstance=True,
-                excludeManifests=exclude_manifests)
-
-            # will iterate over a list of the form [manName, manInst, mincrit,
-            # maxcrit]
-            for row in db_criteria:
-                # arbitrarily large number in case this Python does
-                # not support IEEE754
-                db_criterion = ["0", INFINITY]
-
-                # now populate in valid database values (i.e. non-NULL values)
-                if row[Fields.MINCRIT]:
-                    db_criterion[0] = row[Fields.MINCRIT]
-                if row[Fields.MAXCRIT]:
-                    db_criterion[1] = row[Fields.MAXCRIT]
-                if crit == "mac":
-                    # use a hexadecimal conversion
-                    db_criterion = [long(str(db_criterion[0]), 16),
-                                    long(str(db_criterion[1]), 16)]
-                else:
-                    # these are decimal numbers
-                    db_criterion = [long(str(db_criterion[0])),
-                                    long(str(db_criterion[1]))]
-
-                # these three criteria can determine if there's a range overlap
-                if((man_criterion[1] >= db_criterion[0] and
-                   db_criterion[1] >= man_criterion[0]) or
-                   man_criterion[0] == db_criterion[1]):
-                    # range overlap so record the collision
-                    try:
-                        collisions[row[Fields.MANNAME],
-                                   row[Fields.MANINST]] += "MIN" + crit + ","
-                        collisions[row[Fields.MANNAME],
-                                   row[Fields.MANINST]] += "MAX" + crit + ","
-                    except KeyError:
-                        collisions[row[Fields.MANNAME],
-                                   row[Fields.MANINST]] = "MIN" + crit + ","
-                        collisions[row[Fields.MANNAME],
-                                   row[Fields.MANINST]] += "MAX" + crit + ","
+
+            if manifests is None:
+                manifests = ManifestCriteria.from_db(db)
+
+            # range overlap so record the collision
+            for man_inst in manifests.find_range(crit, man_criterion[0],
+                                                 man_criterion[1]):
+                record(man_inst, "MIN" + crit + "," + "MAX" + crit + ",")
     return collisions
 
 
-def find_colliding_manifests(criteria, db, collisions, append_manifest=None):
+def _criteria_clash(criteria, db_criteria, colliding, columns,
+                    published_criteria=None):
+    """
+    Check whether a set of criteria diverges from (i.e. is not exactly the
+    same as) the criteria of a manifest in the database, and that ranges do
+    not collide.
+    Returns: None if the criteria diverge, the name of a range criteria
+             (without MIN or MAX) whose ranges collide, or an empty string if
+             the criteria are the same as db_criteria
+    Args: criteria - Criteria object holding the criteria to check
+          db_criteria - the criteria of the manifest in the database, as
+                        AIdb.getManifestCriteria() or ManifestCriteria.get()
+                        return them
+          colliding - the comma-separated string of colliding DB column
+                      names for the manifest, as find_colliding_criteria()
+                      produces it
+          columns - the criteria columns of the manifests table
+          published_criteria - the criteria already published for the
+                               manifest criteria are being appended to
+    """
+    # iterate over every criteria in the database
+    for crit in columns:
+
+        # Get the criteria name (i.e. no MIN or MAX)
+        crit_name = crit.replace('MIN', '', 1).replace('MAX', '', 1)
+        # Set man_criterion to the key of the DB criteria or None
+        man_criterion = criteria[crit_name]
+
+        if man_criterion and crit.startswith('MIN'):
+            man_criterion = man_criterion[0]
+        elif man_criterion and crit.startswith('MAX'):
+            man_criterion = man_criterion[1]
+
+        # If man_criterion is still None, and if we're appending criteria
+        # to an already published manifest, look for criteria in the
+        # published set of criteria for the manifest we're appending to
+        # as well, because existing criteria might cause a collision,
+        # which we need to compare for.
+        if man_criterion is None and published_criteria is not None:
+            man_criterion = published_criteria[str(crit)]
+            # replace database NULL's with Python None
+            if man_criterion == '':
+                man_criterion = None
+
+        # set the database criteria
+        if db_criteria[str(crit)] == '':
+            # replace database NULL's with a Python None
+            db_criterion = None
+        else:
+            db_criterion = db_criteria[str(crit)]
+
+        # Replace unbounded's in the criteria (i.e. 0/+inf)
+        # with a Python None.
+        if isinstance(man_criterion, basestring) and \
+           man_criterion == "unbounded":
+            man_criterion = None
+
+        # check to determine if this is a range collision by using
+        # collisions and if not are the manifests divergent
+
+        if((crit.startswith('MIN') and
+            colliding.find(crit + ",") != -1) or
+           (crit.startswith('MAX') and
+            colliding.find(crit + ",") != -1)
+          ):
+            if str(db_criterion).lower() != str(man_criterion).lower():
+                return crit_name
+
+        # Either the range did not collide or this is not a range
+        # criteria.  (If the value of this criteria in the db does
+        # not equal the value of this criteria for the set of criteria
+        # to check, we can break out knowing we diverge for this
+        # manifest/instance)
+        elif not db_criterion and not man_criterion:
+            # Neither the value for this criteria in the db nor
+            # the value for for this criteria in the given set of
+            # criteria to check are populated.  Loop around to
+            # check the next criteria.
+            continue
+        elif not db_criterion or not man_criterion:
+            # One of the two are not populated, we know they're different.
+            return None
+        else:
+            # Both are populated.  If none of values in the list for
+            # this criteria to be added are equal to any of the values
+            # in the list for this criteria from the db, there will be
+            # no collision.
+            if not [value for value in man_criterion if \
+                AIdb.is_in_list(crit, value, str(db_criterion), None)]:
+                return None
+
+    # end of for loop and we never broke out (collision)
+    return ''
+
+
+def find_colliding_manifests(criteria, db, collisions, append_manifest=None,
+                             manifests=None):
     """
     For each manifest/instance pair in collisions check that the manifest
     criteria diverge (i.e. are not exactly the same) and that the ranges do not
@@ -402,106 +766,43 @@ def find_colliding_manifests(criteria, db, collisions, append_manifest=None):
                             function to find criteria collisions for an
                             already published manifest that we're appending
                             criteria to.
+          manifests - ManifestCriteria of the manifests in db. If not given,
+                      the criteria of each colliding manifest are queried
+                      from db.
     """
+    if manifests is not None:
+        get_criteria = manifests.get
+        columns = manifests.columns
+    else:
+        def get_criteria(name, instance):
+            """query the criteria of a manifest from the database"""
+            return AIdb.getManifestCriteria(name, instance, db.getQueue(),
+                                            humanOutput=True, onlyUsed=False)
+        columns = None
 
     # If we're appending criteria to an already published manifest, get a
     # dictionary of the criteria that's already published for that manifest.
+    published_criteria = None
     if append_manifest is not None:
-        published_criteria = AIdb.getManifestCriteria(append_manifest, 0,
-                                                      db.getQueue(),
-                                                      humanOutput=True,
-                                                      onlyUsed=False)
+        published_criteria = get_criteria(append_manifest, 0)
 
     # check every manifest in collisions to see if manifest collides (either
     # identical criteria, or overlaping ranges)
     for man_inst in collisions:
         # get all criteria from this manifest/instance pair
-        db_criteria = AIdb.getManifestCriteria(man_inst[0],
-                                               man_inst[1],
-                                               db.getQueue(),
-                                               humanOutput=True,
-                                               onlyUsed=False)
-
-        # iterate over every criteria in the database
-        for crit in AIdb.getCriteria(db.getQueue(),
-                                     onlyUsed=False, strip=False):
-
-            # Get the criteria name (i.e. no MIN or MAX)
-            crit_name = crit.replace('MIN', '', 1).replace('MAX', '', 1)
-            # Set man_criterion to the key of the DB criteria or None
-            man_criterion = criteria[crit_name]
-
-            if man_criterion and crit.startswith('MIN'):
-                man_criterion = man_criterion[0]
-            elif man_criterion and crit.startswith('MAX'):
-                man_criterion = man_criterion[1]
-
-            # If man_criterion is still None, and if we're appending criteria
-            # to an already published manifest, look for criteria in the
-            # published set of criteria for the manifest we're appending to
-            # as well, because existing criteria might cause a collision,
-            # which we need to compare for.
-            if man_criterion is None and append_manifest is not None:
-                man_criterion = published_criteria[str(crit)]
-                # replace database NULL's with Python None
-                if man_criterion == '':
-                    man_criterion = None
-
-            # set the database criteria
-            if db_criteria[str(crit)] == '':
-                # replace database NULL's with a Python None
-                db_criterion = None
-            else:
-                db_criterion = db_criteria[str(crit)]
-
-            # Replace unbounded's in the criteria (i.e. 0/+inf)
-            # with a Python None.
-            if isinstance(man_criterion, basestring) and \
-               man_criterion == "unbounded":
-                man_criterion = None
-
-            # check to determine if this is a range collision by using
-            # collisions and if not are the manifests divergent
-
-            if((crit.startswith('MIN') and
-                collisions[man_inst].find(crit + ",") != -1) or
-               (crit.startswith('MAX') and
-                collisions[man_inst].find(crit + ",") != -1)
-              ):
-                if str(db_criterion).lower() != str(man_criterion).lower():
-                    raise SystemExit(_("Error:\tManifest has a range "
-                                       "collision with manifest:%s/%i"
-                                       "\n\tin criteria: %s!") %
-                                     (man_inst[0], man_inst[1],
-                                      crit.replace('MIN', '', 1).
-                                      replace('MAX', '', 1)))
-
-            # Either the range did not collide or this is not a range
-            # criteria.  (If the value of this criteria in the db does
-            # not equal the value of this criteria for the set of criteria
-            # to check, we can break out knowing we diverge for this
-            # manifest/instance)
-            elif not db_criterion and not man_criterion:
-                # Neither the value for this criteria in the db nor
-                # the value for for this criteria in the given set of
-                # criteria to check are populated.  Loop around to
-                # check the next criteria.
-                continue
-            elif not db_criterion or not man_criterion:
-                # One of the two are not populated, we can break knowing
-                # they're different.
-                break
-            else:
-                # Both are populated.  If none of values in the list for
-                # this criteria to be added are equal to any of the values
-                # in the list for this criteria from the db, there will be
-                # no collision.  We can break out.
-                if not [value for value in man_criterion if \
-                    AIdb.is_in_list(crit, value, str(db_criterion), None)]:
-                    break
-
-        # end of for loop and we never broke out (collision)
-        else:
+        db_criteria = get_criteria(man_inst[0], man_inst[1])
+        if columns is None:
+            columns = AIdb.getCriteria(db.getQueue(), onlyUsed=False,
+                                       strip=False)
+
+        clash = _criteria_clash(criteria, db_criteria, collisions[man_inst],
+                                columns, published_criteria)
+        if clash:
+            raise SystemExit(_("Error:\tManifest has a range "
+                               "collision with manifest:%s/%i"
+                               "\n\tin criteria: %s!") %
+                             (man_inst[0], man_inst[1], clash))
+        elif clash is not None:
             raise SystemExit(_("Error:\tManifest has same criteria as " +
                                "manifest: %s/%i!") %
                              (man_inst[0], man_inst[1]))
@@ -529,8 +830,11 @@ def do_publish_manifest(cmd_options=None):
 
     # if criteria are provided, make sure they are a unique set.
     if data.criteria:
+        manifests = ManifestCriteria.from_db(data.database)
         find_colliding_manifests(data.criteria, data.database,
-            find_colliding_criteria(data.criteria, data.database))
+            find_colliding_criteria(data.criteria, data.database,
+                                    manifests=manifests),
+            manifests=manifests)
 
     # Add all manifests to the database, whether default or not, and whether
     # they have criteria or not.
@@ -0,0 +1,205 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+resolve - show the manifest and profiles a list of clients would be sent
+'''
+import csv
+import gettext
+import json
+import logging
+import sys
+import time
+
+import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.cgi_get_manifest as cgi_get_manifest
+import osol_install.auto_install.installadm_common as com
+import osol_install.auto_install.service_config as config
+
+from optparse import OptionParser
+
+from osol_install.auto_install.installadm_common import _, \
+    validate_service_name
+
+
+FORMATS = ('text', 'csv', 'json')
+
+
+def get_usage():
+    ''' get usage for resolve'''
+    return _('resolve\t-n|--service <svcname>\n'
+             '\t\t-f|--file <clients.csv|clients.json>\n'
+             '\t\t[-F|--format text|csv|json]\n'
+             '\t\t[-o|--output <pathname>]')
+
+
+def parse_options(cmd_options=None):
+    '''Parse and validate options
+    Args: Optional cmd_options, used for unit testing. Otherwise, cmd line
+          options handled by OptionParser
+    Returns: command line options
+    Raises: SystemExit on invalid options
+    '''
+    parser = OptionParser(usage='\n' + get_usage(), prog="resolve")
+    parser.add_option('-n', '--service', dest='service_name',
+                      default=None, help=_("Name of install service."))
+    parser.add_option('-f', '--file', dest='client_file', default=None,
+                      help=_("CSV file whose first line names the criteria, "
+                             "or JSON list of criteria objects, giving the "
+                             "clients to resolve ('-' for standard input)."))
+    parser.add_option('-F', '--format', dest='format', default='text',
+                      choices=FORMATS,
+                      help=_("Output format: text, csv or json."))
+    parser.add_option('-o', '--output', dest='output_name', default=None,
+                      help=_("Name of output file."))
+
+    (options, args) = parser.parse_args(cmd_options)
+
+    if args:
+        parser.error(_("Unexpected argument(s): %s" % args))
+
+    if not options.service_name:
+        parser.error(_("Service name is required."))
+    try:
+        validate_service_name(options.service_name)
+    except ValueError as err:
+        parser.error(err)
+
+    if not options.client_file:
+        parser.error(_("A file of client criteria is required."))
+
+    logging.debug("options = %s", options)
+    return options
+
+
+def client_label(index, criteria):
+    '''Returns the name under which a client is shown: its mac address,
+    hostname or ipv4 address if given, else its position in the input.
+    '''
+    if 'mac' in criteria:
+        try:
+            return com.MACAddress(criteria['mac']).join()
+        except com.MACAddress.MACAddressError:
+            return criteria['mac']
+    for crit in ('hostname', 'ipv4'):
+        if crit in criteria:
+            return AIdb.formatValue(crit, criteria[crit])
+    return _("client %d") % (index + 1)
+
+
+def write_results(outfile, fmt, clients, results):
+    '''Writes the manifest and profiles of each client to outfile
+
+    Args
+        outfile - file object to write to
+        fmt     - one of FORMATS
+        clients - list of client criteria dictionaries
+        results - list of (manifest, profiles) tuples, see
+                  cgi_get_manifest.resolve_clients
+
+    Returns
+        None
+    '''
+    if fmt == 'json':
+        reply = list()
+        for criteria, (manifest, profiles) in zip(clients, results):
+            reply.append({'criteria': criteria, 'manifest': manifest,
+                          'profiles': profiles})
+        json.dump(reply, outfile, indent=1)
+        outfile.write('\n')
+        return
+
+    rows = list()
+    for index, (criteria, (manifest, profiles)) in \
+            enumerate(zip(clients, results)):
+        rows.append((client_label(index, criteria), manifest or '-',
+                     ' '.join(profiles) or '-'))
+
+    if fmt == 'csv':
+        writer = csv.writer(outfile)
+        writer.writerow(['client', 'manifest', 'profiles'])
+        writer.writerows(rows)
+        return
+
+    header = (_('Client'), _('Manifest'), _('Profiles'))
+    client_width = max([len(row[0]) for row in rows] + [len(header[0])])
+    manifest_width = max([len(row[1]) for row in rows] + [len(header[1])])
+    line = '%-*s  %-*s  %s\n'
+    outfile.write(line % (client_width, header[0], manifest_width,
+                          header[1], header[2]))
+    outfile.write(line % (client_width, '-' * len(header[0]),
+                          manifest_width, '-' * len(header[1]),
+                          '-' * len(header[2])))
+    for row in rows:
+        outfile.write(line % (client_width, row[0], manifest_width, row[1],
+                              row[2]))
+
+
+def do_resolve(cmd_options=None):
+    '''Show the manifest and profiles each client of a list would be sent.
+    Called from installadm.
+    '''
+    options = parse_options(cmd_options)
+
+    if not config.is_service(options.service_name):
+        raise SystemExit(_("No such service: %s") % options.service_name)
+
+    try:
+        if options.client_file == '-':
+            data = sys.stdin.read()
+        else:
+            with open(options.client_file, 'r') as client_fh:
+                data = client_fh.read()
+    except IOError as err:
+        raise SystemExit(_("Error:\tunable to read %(file)s: %(error)s") %
+                         {'file': options.client_file,
+                          'error': err.strerror})
+
+    try:
+        clients = cgi_get_manifest.read_clients(data)
+    except ValueError as err:
+        raise SystemExit(_("Error:\tunable to read client criteria from "
+                           "%(file)s: %(error)s") %
+                         {'file': options.client_file, 'error': err})
+
+    start = time.time()
+    results = cgi_get_manifest.resolve_clients(options.service_name, clients)
+    logging.debug("resolved %d clients in %.3f seconds", len(clients),
+                  time.time() - start)
+
+    if options.output_name:
+        try:
+            with open(options.output_name, 'w') as outfile:
+                write_results(outfile, options.format, clients, results)
+        except IOError as err:
+            raise SystemExit(_("Error:\tunable to write %(file)s: "
+                               "%(error)s") % {'file': options.output_name,
+                                               'error': err.strerror})
+    else:
+        write_results(sys.stdout, options.format, clients, results)
+    return 0
+
+
+if __name__ == '__main__':
+    gettext.install("ai", "/usr/lib/locale")
+    sys.exit(do_resolve())
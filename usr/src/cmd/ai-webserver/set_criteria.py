@@ -279,15 +279,19 @@ def do_set_criteria(cmd_options=None):
     if options.manifest_name:
         # Ensure the criteria we're adding/setting for this manifest doesn't
         # cause a criteria collision in the DB.
+        manifests = pub_man.ManifestCriteria.from_db(dbn)
         colliding_criteria = pub_man.find_colliding_criteria(criteria, dbn,
-                             exclude_manifests=[options.manifest_name])
+                             exclude_manifests=[options.manifest_name],
+                             manifests=manifests)
         # If we're appending criteria pass the manifest name
         if options.criteria_a:
             pub_man.find_colliding_manifests(criteria, dbn, colliding_criteria,
-                    append_manifest=options.manifest_name)
+                    append_manifest=options.manifest_name,
+                    manifests=manifests)
         else:
             pub_man.find_colliding_manifests(criteria, dbn, colliding_criteria,
-                                             append_manifest=None)
+                                             append_manifest=None,
+                                             manifests=manifests)
     # validate criteria for profile
     for pname in options.profile_name:
         if not sc.is_name_in_table(pname, dbn.getQueue(), AIdb.PROFILES_TABLE):
@@ -334,6 +334,61 @@ class build_query_str(unittest.TestCase):
         self.assertTrue(query_str.endswith("LIMIT 1"))
 
 
+class build_query(unittest.TestCase):
+    '''Tests for build_query'''
+
+    def test_building_query(self):
+        ''' test that client values are bound rather than inlined '''
+        cri_list = ['MINipv4', 'MAXipv4', 'arch', 'cpu',
+                  'MINmac', 'MAXmac', 'MINmem', 'MAXmem']
+        my_crit_dict = {
+                        'ipv4': '020025224125',
+                        'arch': 'i86pc',
+                        'mem': '2048',
+                        'mac': 'aabbccddeeff'
+                       }
+        query_str, params = AIdb.build_query(my_crit_dict, cri_list,
+                                             ['arch'])
+        self.assertTrue(query_str.startswith("SELECT name"))
+        self.assertTrue("(MINipv4 <= ? OR MINipv4 IS NULL)" in query_str)
+        self.assertTrue("(HEX(MAXmac) >= ? OR MAXmac IS NULL)" in query_str)
+        self.assertTrue("is_in_list('arch', ?, arch, 'None')" in query_str)
+        self.assertTrue("(cpu IS NULL)" in query_str)
+        self.assertTrue("NOT ((arch IS NULL))" in query_str)
+        self.assertTrue(query_str.endswith("LIMIT 1"))
+        self.assertEqual(params, [20025224125L, 20025224125L, 'i86pc',
+                                  u'AABBCCDDEEFF', u'AABBCCDDEEFF',
+                                  2048, 2048])
+        self.assertFalse('i86pc' in query_str)
+
+    def test_same_query(self):
+        ''' test that the query text does not depend on client values '''
+        cri_list = ['arch', 'MINmem', 'MAXmem']
+        first = AIdb.build_query({'arch': 'i86pc', 'mem': '2048'}, cri_list,
+                                 cri_list)
+        second = AIdb.build_query({'arch': 'sparc', 'mem': '512'}, cri_list,
+                                  cri_list)
+        self.assertEqual(first[0], second[0])
+
+    def test_invalid_value(self):
+        ''' test that an invalid range value matches nothing '''
+        query_str, params = AIdb.build_query({'mem': 'lots'},
+                                             ['MINmem', 'MAXmem'], None)
+        self.assertTrue(query_str.startswith("SELECT name"))
+        self.assertTrue(" WHERE 0 AND 0 ORDER BY" in query_str)
+        self.assertEqual(params, [])
+
+    def test_range_param(self):
+        ''' test values are converted as SQLite reads literals '''
+        self.assertEqual(AIdb.rangeParam('mem', '2048'), 2048)
+        self.assertEqual(AIdb.rangeParam('MINmem', '1.5'), 1.5)
+        self.assertEqual(AIdb.rangeParam('ipv4', '99999999999999999999'),
+                         1e20)
+        self.assertEqual(AIdb.rangeParam('MAXmac', 'aaBBcc'), u'AABBCC')
+        self.assertEqual(AIdb.rangeParam('mac', 'abc'), None)
+        self.assertEqual(AIdb.rangeParam('mem', '2G'), None)
+
+
 class findManifest(unittest.TestCase):
     '''Tests for findManifest'''
 
@@ -512,6 +567,357 @@ class findManifest(unittest.TestCase):
         self.assertEquals(manifest, None)
 
 
+class findManifestSQL(findManifest):
+    '''Tests for findManifest using the SQL query'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.mode = AIdb.FIND_MANIFEST_MODE
+        AIdb.FIND_MANIFEST_MODE = AIdb.FIND_WITH_SQL
+
+    def tearDown(self):
+        '''unit test tear down'''
+        AIdb.FIND_MANIFEST_MODE = self.mode
+
+
+class findManifestCrossCheck(findManifest):
+    '''Tests for findManifest comparing the index and SQL answers'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.mode = AIdb.FIND_MANIFEST_MODE
+        AIdb.FIND_MANIFEST_MODE = AIdb.FIND_CROSSCHECK
+
+    def tearDown(self):
+        '''unit test tear down'''
+        AIdb.FIND_MANIFEST_MODE = self.mode
+
+
+class CriteriaIndex(unittest.TestCase):
+    '''Tests for CriteriaIndex'''
+
+    COLUMNS = ['arch', 'MINmac', 'MAXmac', 'MINmem', 'MAXmem', 'zonename']
+
+    def make_index(self, *rows):
+        '''build an index from rows of (name, arch, MINmac, MAXmac,
+        MINmem, MAXmem, zonename)
+        '''
+        entries = list()
+        for rowid, row in enumerate(rows):
+            entry = dict(zip(['name'] + self.COLUMNS, row))
+            entry['rowid'] = rowid + 1
+            entries.append(entry)
+        return AIdb.CriteriaIndex(entries, self.COLUMNS)
+
+    def test_range_bounds(self):
+        '''Verify bounded and unbounded ranges'''
+        index = self.make_index(
+            ('low', None, None, None, None, 1023, None),
+            ('mid', None, None, None, 1024, 2047, None),
+            ('high', None, None, None, 2048, None, None))
+        self.assertEqual(index.find({'mem': '512'}), 'low')
+        self.assertEqual(index.find({'mem': '1024'}), 'mid')
+        self.assertEqual(index.find({'mem': '2047'}), 'mid')
+        self.assertEqual(index.find({'mem': '100000'}), 'high')
+        self.assertEqual(index.find({'arch': 'i86pc'}), None)
+
+    def test_mac_range(self):
+        '''Verify mac ranges compare as hex values'''
+        index = self.make_index(
+            ('macs', None, u'AABBCCDDEE00', u'AABBCCDDEEFF', None, None,
+             None))
+        self.assertEqual(index.find({'mac': 'aabbccddee10'}), 'macs')
+        self.assertEqual(index.find({'mac': 'aabbccddef00'}), None)
+
+    def test_value_lists(self):
+        '''Verify value lists and case sensitivity'''
+        index = self.make_index(
+            ('arch', u'i86pc SPARC', None, None, None, None, None),
+            ('zone', None, None, None, None, None, u'Zone1'))
+        self.assertEqual(index.find({'arch': 'sparc'}), 'arch')
+        self.assertEqual(index.find({'zonename': 'Zone1'}), 'zone')
+        self.assertEqual(index.find({'zonename': 'zone1'}), None)
+
+    def test_precedence(self):
+        '''Verify a mac match wins over an arch match'''
+        index = self.make_index(
+            ('arch', u'i86pc', None, None, None, None, None),
+            ('mac', None, u'AABBCCDDEEFF', u'AABBCCDDEEFF', None, None,
+             None))
+        self.assertEqual(index.find({'arch': 'i86pc',
+                                     'mac': 'aabbccddeeff'}), 'mac')
+
+    def test_no_criteria_rows(self):
+        '''Verify manifests without criteria are never matched'''
+        index = self.make_index(
+            ('default', None, None, None, None, None, None))
+        self.assertEqual(index.find({'arch': 'i86pc'}), None)
+
+    def test_unsupported_values(self):
+        '''Verify values SQL would reject are refused'''
+        index = self.make_index(
+            ('mem', None, None, None, 1024, None, None),
+            ('mac', None, u'AABBCCDDEEFF', None, None, None, None),
+            ('arch', u'i86pc', None, None, None, None, None))
+        self.assertRaises(AIdb.CriteriaIndexError, index.find,
+                          {'mem': 'lots'})
+        self.assertRaises(AIdb.CriteriaIndexError, index.find,
+                          {'mac': 'aabbccddeef'})
+        self.assertRaises(AIdb.CriteriaIndexError, index.find,
+                          {'arch': "i86'pc"})
+
+
+class ProfileIndex(unittest.TestCase):
+    '''Tests for ProfileIndex'''
+
+    COLUMNS = ['arch', 'MINmac', 'MAXmac', 'MINmem', 'MAXmem']
+
+    def setUp(self):
+        '''unit test set up'''
+        rows = [('global', None, None, None, None, None),
+                ('x86', u'i86pc sun4v', None, None, None, None),
+                ('mac', None, u'080027138669', u'080027138669', None, None),
+                ('bigmem', None, None, None, 2048, None)]
+        entries = list()
+        for rowid, row in enumerate(rows):
+            entry = dict(zip(['name'] + self.COLUMNS, row))
+            entry['rowid'] = rowid + 1
+            entry['file'] = '/profiles/' + row[0]
+            entries.append(entry)
+        self.index = AIdb.ProfileIndex(entries, self.COLUMNS)
+
+    def test_match(self):
+        '''Verify profiles are matched as build_profile_query does'''
+        self.assertEqual(self.index.findNames({'arch': 'I86PC',
+                                               'mac': '080027138669',
+                                               'mem': '4096'}),
+                         ('bigmem', 'global', 'mac', 'x86'))
+        self.assertEqual(self.index.findNames({'arch': 'sparc',
+                                               'mac': '080027138670',
+                                               'mem': '1024'}),
+                         ('global',))
+        self.assertEqual(self.index.find({'arch': 'sparc',
+                                          'mac': '080027138670',
+                                          'mem': '1024'}),
+                         (('global', '/profiles/global'),))
+
+    def test_missing_criteria(self):
+        '''Verify only profiles without a criteria match clients not
+        providing it
+        '''
+        self.assertEqual(self.index.findNames({'arch': 'i86pc'}),
+                         ('global', 'x86'))
+
+    def test_no_default(self):
+        '''Verify no_default excludes profiles without the criteria'''
+        self.assertEqual(self.index.findNames({'arch': 'i86pc',
+                                               'mac': '080027138669',
+                                               'mem': '4096'},
+                                              no_default=True), ())
+
+    def test_invalid_mac(self):
+        '''Verify a value which is not a mac address matches nothing'''
+        self.assertEqual(self.index.findNames({'arch': 'i86pc', 'mac': 'xyz',
+                                               'mem': '4096'}), ())
+        self.assertRaises(AIdb.CriteriaIndexError, self.index.find,
+                          {'arch': 'i86pc', 'mac': '080027138669',
+                           'mem': 'lots'})
+
+    def test_no_columns(self):
+        '''Verify no profile is selected without criteria columns'''
+        index = AIdb.ProfileIndex([{'rowid': 1, 'name': 'global',
+                                    'file': '/profiles/global'}], [])
+        self.assertEqual(index.findNames({'arch': 'i86pc'}), ())
+
+
+class DBconnections(unittest.TestCase):
+    '''Tests for the DB reader and writer connections'''
+
+    def setUp(self):
+        '''unit test set up'''
+        dbname = tempfile.NamedTemporaryFile(dir="/tmp", delete=False)
+        self.dbname = dbname.name
+        con = sqlite3.connect(self.dbname)
+        con.execute("CREATE TABLE manifests(name TEXT, instance INTEGER, "
+                    "arch TEXT)")
+        con.execute("INSERT INTO manifests VALUES('man', 0, 'i86pc')")
+        con.commit()
+        con.close()
+        self.aidb = None
+
+    def tearDown(self):
+        '''unit test tear down'''
+        if self.aidb is not None:
+            self.aidb.close()
+        os.remove(self.dbname)
+
+    def test_readers(self):
+        '''Verify each reader runs in its own thread'''
+        self.aidb = AIdb.DB(self.dbname, readers=3)
+        self.assertEqual(len(self.aidb._runners), 3)
+        requests = [self.aidb.submit("SELECT name FROM manifests")
+                    for i in range(10)]
+        for request in requests:
+            self.assertEqual(request.result()[0]['name'], 'man')
+
+    def test_writer(self):
+        '''Verify committed changes are seen by the readers'''
+        self.aidb = AIdb.DB(self.dbname, commit=True)
+        request = self.aidb.submit("INSERT INTO manifests "
+                                   "VALUES('man2', 0, 'sparc')", commit=True)
+        self.assertEqual(request.result(), [])
+        request = self.aidb.submit("SELECT COUNT(*) FROM manifests")
+        self.assertEqual(request.result()[0][0], 2)
+
+    def test_not_committable(self):
+        '''Verify requests needing commit fail without a writer'''
+        self.aidb = AIdb.DB(self.dbname)
+        request = self.aidb.submit("DELETE FROM manifests", commit=True)
+        self.assertEqual(request.result(), None)
+        self.assertTrue("not committable" in request._ans)
+
+    def test_failed_commit(self):
+        '''Verify a failed commit does not keep the database locked'''
+        self.aidb = AIdb.DB(self.dbname, commit=True)
+        request = self.aidb.submit("INSERT INTO nosuchtable VALUES(1)",
+                                   commit=True)
+        self.assertEqual(request.result(), None)
+        con = sqlite3.connect(self.dbname, timeout=1)
+        con.execute("DELETE FROM manifests")
+        con.commit()
+        con.close()
+
+    def test_transaction(self):
+        '''Verify a transaction commits all of its statements'''
+        self.aidb = AIdb.DB(self.dbname, commit=True)
+        request = AIdb.DBtransaction(["INSERT INTO manifests "
+                                      "VALUES('man2', 0, 'sparc')",
+                                      ("INSERT INTO manifests VALUES(?, 0, ?)",
+                                       ('man3', 'i86pc'))])
+        self.aidb.getQueue().put(request)
+        self.assertEqual(request.result(), [])
+        request = self.aidb.submit("SELECT COUNT(*) FROM manifests")
+        self.assertEqual(request.result()[0][0], 3)
+
+    def test_failed_transaction(self):
+        '''Verify a failed transaction commits none of its statements'''
+        self.aidb = AIdb.DB(self.dbname, commit=True)
+        request = AIdb.DBtransaction(["INSERT INTO manifests "
+                                      "VALUES('man2', 0, 'sparc')",
+                                      "INSERT INTO nosuchtable VALUES(1)"])
+        self.aidb.getQueue().put(request)
+        self.assertEqual(request.result(), None)
+        self.assertTrue("nosuchtable" in request._ans)
+        request = self.aidb.submit("SELECT COUNT(*) FROM manifests")
+        self.assertEqual(request.result()[0][0], 1)
+
+    def test_empty_transaction(self):
+        '''Verify a transaction needs statements'''
+        self.assertRaises(ValueError, AIdb.DBtransaction, [])
+
+    def test_close(self):
+        '''Verify close() stops every DB thread'''
+        aidb = AIdb.DB(self.dbname, commit=True, readers=4)
+        request = aidb.submit("SELECT name FROM manifests")
+        aidb.close()
+        self.assertEqual(request.result()[0]['name'], 'man')
+        for runner in aidb._runners:
+            runner.join(5)
+            self.assertFalse(runner.isAlive())
+
+    def test_wal(self):
+        '''Verify the writer sets the requested journal mode'''
+        self.aidb = AIdb.DB(self.dbname, commit=True, journal_mode='wal')
+        request = self.aidb.submit("INSERT INTO manifests "
+                                   "VALUES('man2', 0, 'sparc')", commit=True)
+        request.result()
+        request = self.aidb.submit("PRAGMA journal_mode")
+        self.assertEqual(request.result()[0][0], 'wal')
+        self.aidb.close()
+        for runner in self.aidb._runners:
+            runner.join(5)
+        self.aidb = None
+        for name in (self.dbname + '-wal', self.dbname + '-shm'):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+class DBSchema(unittest.TestCase):
+    '''Tests for the DBSchema criteria cache'''
+
+    def setUp(self):
+        '''unit test set up'''
+        dbname = tempfile.NamedTemporaryFile(dir="/tmp", delete=False)
+        self.dbname = dbname.name
+        con = sqlite3.connect(self.dbname)
+        con.execute("CREATE TABLE manifests(name TEXT, instance INTEGER, "
+                    "arch TEXT, MINmem INTEGER, MAXmem INTEGER, cpu TEXT)")
+        con.execute("INSERT INTO manifests VALUES"
+                    "('man', 0, 'i86pc', 1024, NULL, NULL)")
+        con.commit()
+        con.close()
+        self.aidb = AIdb.DB(self.dbname, commit=True)
+        self.queue = self.aidb.getQueue()
+        self.requests = list()
+        self.put_orig = self.queue.put
+
+        def put(request):
+            self.requests.append(request.getSql())
+            self.put_orig(request)
+        self.queue.put = put
+
+    def tearDown(self):
+        '''unit test tear down'''
+        self.aidb.close()
+        os.remove(self.dbname)
+
+    def test_cached(self):
+        '''Verify an unchanged database is not queried again'''
+        self.assertEqual(AIdb.getCriteria(self.queue), ['arch', 'mem'])
+        self.assertTrue(AIdb.isRangeCriteria(self.queue, 'mem'))
+        self.assertTrue(AIdb.tableExists(self.queue, AIdb.MANIFESTS_TABLE))
+        self.requests = list()
+        self.assertEqual(AIdb.getCriteria(self.queue), ['arch', 'mem'])
+        self.assertEqual(AIdb.getCriteria(self.queue, onlyUsed=False,
+                                          strip=False),
+                         ['arch', 'MINmem', 'MAXmem', 'cpu'])
+        self.assertTrue(AIdb.isRangeCriteria(self.queue, 'mem'))
+        self.assertFalse(AIdb.isRangeCriteria(self.queue, 'cpu'))
+        self.assertTrue(AIdb.tableExists(self.queue, AIdb.MANIFESTS_TABLE))
+        self.assertEqual(self.requests, [])
+
+    def test_missing_table(self):
+        '''Verify a missing table has no columns and no criteria'''
+        self.assertFalse(AIdb.tableExists(self.queue, AIdb.PROFILES_TABLE))
+        self.assertEqual(AIdb.getColumns(self.queue, AIdb.PROFILES_TABLE),
+                         [])
+        self.assertEqual(AIdb.getCriteria(self.queue, AIdb.PROFILES_TABLE),
+                         [])
+
+    def test_commit(self):
+        '''Verify used criteria are updated after a commit'''
+        self.assertEqual(AIdb.getCriteria(self.queue), ['arch', 'mem'])
+        query = AIdb.DBrequest("UPDATE manifests SET cpu='i386'",
+                               commit=True)
+        self.queue.put(query)
+        query.waitAns()
+        self.assertEqual(AIdb.getCriteria(self.queue),
+                         ['arch', 'mem', 'cpu'])
+
+    def test_schema_change(self):
+        '''Verify a schema change by another connection is noticed'''
+        self.assertFalse(AIdb.tableExists(self.queue, AIdb.PROFILES_TABLE))
+        con = sqlite3.connect(self.dbname)
+        con.execute("CREATE TABLE profiles(name TEXT, file TEXT, "
+                    "arch TEXT)")
+        con.execute("ALTER TABLE manifests ADD COLUMN zonename TEXT")
+        con.commit()
+        con.close()
+        self.assertTrue(AIdb.tableExists(self.queue, AIdb.PROFILES_TABLE))
+        self.assertEqual(AIdb.getCriteria(self.queue, onlyUsed=False),
+                         ['arch', 'mem', 'cpu', 'zonename'])
+
+
 class is_in_list(unittest.TestCase):
     '''Tests for is_in_list'''
 
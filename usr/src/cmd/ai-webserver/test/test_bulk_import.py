@@ -0,0 +1,239 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+
+'''
+To run these tests, see the instructions in usr/src/tools/tests/README.
+Remember that since the proto area is used for the PYTHONPATH, the gate
+must be rebuilt for these tests to pick up any changes in the tested code.
+
+'''
+
+import gettext
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import osol_install.auto_install.bulk_import as bulk_import
+
+from StringIO import StringIO
+
+gettext.install("ai-test")
+
+
+class MockCriteria(dict):
+    '''Class for mock Criteria, giving None for criteria not set '''
+    def __getitem__(self, key):
+        return self.get(key)
+
+
+class MockDataFiles(object):
+    '''Class for mock DataFiles'''
+    def __init__(self, name, **criteria):
+        self.manifest_name = name
+        self.criteria = MockCriteria(criteria)
+
+
+class ParseOptions(unittest.TestCase):
+    '''Tests for parse_options. Some tests correctly output usage msg'''
+
+    def test_parse_no_options(self):
+        '''Ensure no options caught'''
+        self.assertRaises(SystemExit, bulk_import.parse_options, [])
+
+    def test_parse_no_source(self):
+        '''Ensure the directory or archive is required'''
+        self.assertRaises(SystemExit, bulk_import.parse_options,
+                          ['-n', 'mysvc'])
+
+    def test_parse_invalid_jobs(self):
+        '''Ensure at least one job is required'''
+        self.assertRaises(SystemExit, bulk_import.parse_options,
+                          ['-n', 'mysvc', '-f', 'import.tar', '-j', '0'])
+
+    def test_parse_valid(self):
+        '''Ensure valid options are accepted'''
+        options = bulk_import.parse_options(['-n', 'mysvc', '-f',
+                                             'import.tar', '-j', '8'])
+        self.assertEqual(options.service_name, 'mysvc')
+        self.assertEqual(options.source, 'import.tar')
+        self.assertEqual(options.jobs, 8)
+
+
+class Files(unittest.TestCase):
+    '''Tests for find_files and unpack'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp")
+        self.manifests = os.path.join(self.tmpdir, bulk_import.MANIFEST_DIR)
+        os.mkdir(self.manifests)
+        for name in ('x86.xml', 'x86.criteria.xml', 'derived.sh'):
+            with open(os.path.join(self.manifests, name), 'w') as fh:
+                fh.write(name)
+
+    def tearDown(self):
+        '''unit test tear down'''
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_files(self):
+        '''Ensure files are paired with their criteria file'''
+        self.assertEqual(bulk_import.find_files(self.manifests),
+                         [(os.path.join(self.manifests, 'derived.sh'), None),
+                          (os.path.join(self.manifests, 'x86.xml'),
+                           os.path.join(self.manifests, 'x86.criteria.xml'))])
+
+    def test_find_no_files(self):
+        '''Ensure a missing directory has no files'''
+        self.assertEqual(bulk_import.find_files(os.path.join(self.tmpdir,
+            bulk_import.PROFILE_DIR)), [])
+
+    def test_unpack(self):
+        '''Ensure an archive is extracted'''
+        archive = os.path.join(self.tmpdir, 'import.tar')
+        tar = tarfile.open(archive, 'w')
+        tar.add(self.manifests, bulk_import.MANIFEST_DIR)
+        tar.close()
+        target = os.path.join(self.tmpdir, 'target')
+        os.mkdir(target)
+        bulk_import.unpack(archive, target)
+        self.assertEqual(len(bulk_import.find_files(os.path.join(target,
+            bulk_import.MANIFEST_DIR))), 2)
+
+    def test_unpack_outside(self):
+        '''Ensure members outside of the archive are refused'''
+        archive = os.path.join(self.tmpdir, 'import.tar')
+        tar = tarfile.open(archive, 'w')
+        tar.add(os.path.join(self.manifests, 'x86.xml'), '../x86.xml')
+        tar.close()
+        self.assertRaises(ValueError, bulk_import.unpack, archive,
+                          self.manifests)
+
+    def test_unpack_links(self):
+        '''Ensure links, which could lead members outside, are refused'''
+        outside = os.path.join(self.tmpdir, 'outside')
+        os.mkdir(outside)
+        target = os.path.join(self.tmpdir, 'target')
+        os.mkdir(target)
+
+        # a link to a directory outside, then a member through the link
+        archive = os.path.join(self.tmpdir, 'symlink.tar')
+        tar = tarfile.open(archive, 'w')
+        link = tarfile.TarInfo('d')
+        link.type = tarfile.SYMTYPE
+        link.linkname = outside
+        tar.addfile(link)
+        tar.add(os.path.join(self.manifests, 'x86.xml'), 'd/foo')
+        tar.close()
+        self.assertRaises(ValueError, bulk_import.unpack, archive, target)
+        self.assertEqual(os.listdir(outside), [])
+        self.assertEqual(os.listdir(target), [])
+
+        # a hard link to a file outside
+        archive = os.path.join(self.tmpdir, 'hardlink.tar')
+        tar = tarfile.open(archive, 'w')
+        link = tarfile.TarInfo('x86.xml')
+        link.type = tarfile.LNKTYPE
+        link.linkname = os.path.join(outside, 'x86.xml')
+        tar.addfile(link)
+        tar.close()
+        self.assertRaises(ValueError, bulk_import.unpack, archive, target)
+        self.assertEqual(os.listdir(target), [])
+
+    def test_unpack_not_archive(self):
+        '''Ensure other files are refused'''
+        self.assertRaises(ValueError, bulk_import.unpack,
+                          os.path.join(self.manifests, 'x86.xml'),
+                          self.tmpdir)
+
+
+class Checks(unittest.TestCase):
+    '''Tests for check_names and check_collisions'''
+
+    COLUMNS = ['MINmem', 'MINipv4', 'MAXmem', 'MAXipv4', 'arch']
+
+    def setUp(self):
+        '''unit test set up'''
+        rows = [('x86', None, None, None, None, u'i86pc'),
+                ('lab', None, 10000000001, None, 10000000100, None)]
+        self.rows = list()
+        for row in rows:
+            entry = dict(zip(['name'] + self.COLUMNS, row))
+            entry['instance'] = 0
+            self.rows.append(entry)
+
+    def test_names(self):
+        '''Ensure names already in use are reported'''
+        manifests = [MockDataFiles('x86'), MockDataFiles('new'),
+                     MockDataFiles('new')]
+        profiles = [('global', None, ''), ('new', None, '')]
+        errors = bulk_import.check_names(manifests, profiles, ['x86'],
+                                         ['global'])
+        self.assertEqual(len(errors), 3)
+
+    def test_collisions(self):
+        '''Ensure collisions with published and imported manifests'''
+        manifests = [MockDataFiles('amd64', arch=['I86PC']),
+                     MockDataFiles('lab2', ipv4=['010000000050',
+                                                 '010000000150']),
+                     MockDataFiles('sparc', arch=['sun4v']),
+                     MockDataFiles('sparc2', arch=['sun4v'])]
+        errors = bulk_import.check_collisions(manifests, self.rows,
+                                              self.COLUMNS)
+        self.assertEqual(len(errors), 3)
+        self.assertTrue("amd64 has same criteria as manifest: x86/0" in
+                        errors[0])
+        self.assertTrue("lab2 has a range collision" in errors[1])
+        self.assertTrue("sparc2 has same criteria as manifest: sparc/0" in
+                        errors[2])
+
+    def test_no_collisions(self):
+        '''Ensure diverging manifests are accepted'''
+        manifests = [MockDataFiles('lab2', ipv4=['010000000101',
+                                                 '010000000150']),
+                     MockDataFiles('bigmem', arch=['i86pc'],
+                                   mem=['2048', 'unbounded']),
+                     MockDataFiles('default')]
+        self.assertEqual(bulk_import.check_collisions(manifests, self.rows,
+                                                      self.COLUMNS), [])
+
+
+class PhaseTimes(unittest.TestCase):
+    '''Tests for PhaseTimes'''
+
+    def test_report(self):
+        '''Ensure each phase and the total are reported'''
+        times = bulk_import.PhaseTimes()
+        times.start('validate')
+        times.start('commit')
+        outfile = StringIO()
+        times.report(outfile)
+        lines = outfile.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines],
+                         ['validate', 'commit', 'total'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,9 +27,14 @@ import cgi
 import gettext
 import os
 import sys
+import tempfile
 import unittest
 
+from sqlite3 import dbapi2 as sqlite3
+
+import lxml.etree
 import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.common_profile as sc
 import osol_install.auto_install.service as service
 import osol_install.auto_install.service_config as config
 import osol_install.libaiscf as smf
@@ -451,6 +456,509 @@ class testSendManifest(unittest.TestCase):
                    'service (%s) was found' % self.SERVICE
 
 
+class testGetServiceDB(unittest.TestCase):
+    '''Tests for get_service_db'''
+
+    def setUp(self):
+        '''unit test set up'''
+        dbfile = tempfile.NamedTemporaryFile(dir="/tmp", delete=False)
+        self.dbname = dbfile.name
+        self.create_db(self.dbname)
+
+    def tearDown(self):
+        '''unit test tear down'''
+        cached = cgi_get_manifest._DB_CACHE.pop(self.dbname, None)
+        if cached is not None:
+            cached[1].close()
+        os.remove(self.dbname)
+
+    @staticmethod
+    def create_db(dbname):
+        '''create a minimal manifests table'''
+        con = sqlite3.connect(dbname, isolation_level=None)
+        con.execute("CREATE TABLE manifests (name TEXT, instance INTEGER, "
+                    "arch TEXT)")
+        con.close()
+
+    def test_reused(self):
+        '''verify an unchanged database is opened only once'''
+        aisql = cgi_get_manifest.get_service_db(self.dbname)
+        self.assertTrue(cgi_get_manifest.get_service_db(self.dbname) is aisql)
+
+    def test_reloaded(self):
+        '''verify a replaced database is reopened'''
+        aisql = cgi_get_manifest.get_service_db(self.dbname)
+        newname = self.dbname + ".new"
+        self.create_db(newname)
+        os.rename(newname, self.dbname)
+        self.assertFalse(cgi_get_manifest.get_service_db(self.dbname) is
+                         aisql)
+
+    def test_reused_after_commit(self):
+        '''verify a database changed in place keeps its DB object'''
+        aisql = cgi_get_manifest.get_service_db(self.dbname)
+        con = sqlite3.connect(self.dbname, isolation_level=None)
+        con.execute("INSERT INTO manifests VALUES ('new', 0, 'i86pc')")
+        con.close()
+        self.assertTrue(cgi_get_manifest.get_service_db(self.dbname) is aisql)
+        query = aisql.submit("SELECT name FROM manifests")
+        self.assertEqual([row['name'] for row in query.result()], ['new'])
+
+    def test_replaced_in_use(self):
+        '''verify the DB of a replaced database is only closed once the
+        requests using it are done
+        '''
+        aisql = cgi_get_manifest.get_service_db(self.dbname)
+        runners = list(aisql._runners)
+        newname = self.dbname + ".new"
+        self.create_db(newname)
+        os.rename(newname, self.dbname)
+        self.assertFalse(cgi_get_manifest.get_service_db(self.dbname) is
+                         aisql)
+
+        # still usable by the request holding it
+        query = aisql.submit("SELECT name FROM manifests")
+        self.assertEqual(query.result(timeout=5), [])
+        self.assertTrue(cgi_get_manifest._RETIRED_DBS)
+
+        del aisql, query
+        for runner in runners:
+            runner.join(5)
+            self.assertFalse(runner.isAlive())
+        self.assertFalse(cgi_get_manifest._RETIRED_DBS)
+
+    def test_concurrent_open(self):
+        '''verify a database opened by a concurrent request is kept'''
+        opened = list()
+        db_orig = AIdb.DB
+
+        def racing_db(path):
+            '''mock DB, another request opening the database meanwhile'''
+            aisql = db_orig(path)
+            opened.append(aisql)
+            if len(opened) == 1:
+                cgi_get_manifest.get_service_db(path)
+            return aisql
+
+        AIdb.DB = racing_db
+        try:
+            aisql = cgi_get_manifest.get_service_db(self.dbname)
+        finally:
+            AIdb.DB = db_orig
+        self.assertTrue(aisql is opened[1])
+        self.assertTrue(cgi_get_manifest.get_service_db(self.dbname) is
+                        aisql)
+
+
+class testBuildProfileQuery(unittest.TestCase):
+    '''Tests for build_profile_query'''
+
+    @classmethod
+    def setUpClass(cls):
+        '''unit test set up'''
+        dbfile = tempfile.NamedTemporaryFile(dir="/tmp", delete=False)
+        cls.dbname = dbfile.name
+        con = sqlite3.connect(cls.dbname, isolation_level=None)
+        con.execute("CREATE TABLE manifests (name TEXT, instance INTEGER, "
+                    "arch TEXT)")
+        con.execute("CREATE TABLE profiles (name TEXT, file TEXT, "
+                    "arch TEXT, MINmac INTEGER, MAXmac INTEGER, "
+                    "MINmem INTEGER, MAXmem INTEGER)")
+        con.execute("INSERT INTO profiles VALUES ('global', 'g', NULL, "
+                    "NULL, NULL, NULL, NULL)")
+        con.execute("INSERT INTO profiles VALUES ('x86', 'x', 'i86pc sun4v', "
+                    "NULL, NULL, NULL, NULL)")
+        con.execute("INSERT INTO profiles VALUES ('mac', 'm', NULL, "
+                    "x'080027138669', x'080027138669', NULL, NULL)")
+        con.execute("INSERT INTO profiles VALUES ('bigmem', 'b', NULL, "
+                    "NULL, NULL, 2048, NULL)")
+        con.close()
+        cls.aisql = AIdb.DB(cls.dbname)
+
+    @classmethod
+    def tearDownClass(cls):
+        '''unit test tear down'''
+        cls.aisql.close()
+        os.remove(cls.dbname)
+
+    def find(self, criteria, no_default=False):
+        '''return the names of the profiles matching criteria'''
+        q_str, params, messages = cgi_get_manifest.build_profile_query(
+            criteria, self.aisql.getQueue(), no_default)
+        rsp = self.aisql.submit(q_str, params=params).result()
+        return sorted([row['name'] for row in rsp])
+
+    def test_match(self):
+        '''verify profiles are matched on bound client values'''
+        self.assertEqual(self.find({'arch': 'I86PC', 'mac': '080027138669',
+                                    'mem': '4096'}),
+                         ['bigmem', 'global', 'mac', 'x86'])
+        self.assertEqual(self.find({'arch': 'sparc', 'mac': '080027138670',
+                                    'mem': '1024'}),
+                         ['global'])
+
+    def test_no_default(self):
+        '''verify no_default excludes profiles without the criteria'''
+        self.assertEqual(self.find({'arch': 'i86pc', 'mac': '080027138669',
+                                    'mem': '4096'}, no_default=True), [])
+
+    def test_invalid_mac(self):
+        '''verify a value which is not a mac address matches nothing'''
+        self.assertEqual(self.find({'arch': 'i86pc', 'mac': 'xyz',
+                                    'mem': '4096'}), [])
+
+    def test_quoted_value(self):
+        '''verify values are not interpreted as SQL'''
+        self.assertEqual(self.find({'arch': "x' OR 'a'='a", 'mac': '00',
+                                    'mem': '0'}), ['global'])
+
+    def test_same_query(self):
+        '''verify the query text does not depend on the client values'''
+        queue = self.aisql.getQueue()
+        first = cgi_get_manifest.build_profile_query(
+            {'arch': 'i86pc', 'mac': '080027138669', 'mem': '4096'}, queue)
+        second = cgi_get_manifest.build_profile_query(
+            {'arch': 'sparc', 'mac': '0800271386aa', 'mem': '512'}, queue)
+        self.assertEqual(first[0], second[0])
+        self.assertNotEqual(first[1], second[1])
+
+    def test_missing_criteria(self):
+        '''verify a warning is returned for each missing criteria'''
+        q_str, params, messages = cgi_get_manifest.build_profile_query(
+            {'arch': 'i86pc'}, self.aisql.getQueue())
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(params, ['i86pc'])
+
+
+class MockValidateProfileString(object):
+    '''Class for mock validate_profile_string'''
+    def __init__(self, valid=True):
+        self.valid = valid
+        self.calls = 0
+
+    def __call__(self, profile_str, image_dir=None, resolve_entities=True,
+                 dtd_validation=False, warn_if_dtd_missing=False):
+        self.calls += 1
+        if not self.valid:
+            raise lxml.etree.XMLSyntaxError('invalid profile', 1, 1, 1)
+        return profile_str
+
+
+class testGetProfileTemplate(unittest.TestCase):
+    '''Tests for get_profile_template'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.image_dir = tempfile.mkdtemp(dir="/tmp")
+        profile = tempfile.NamedTemporaryFile(dir="/tmp", delete=False)
+        profile.write('<profile name="{{AI_HOSTNAME}}"/>')
+        profile.close()
+        self.profile = profile.name
+        self.validate_orig = sc.validate_profile_string
+        self.validate = MockValidateProfileString()
+        sc.validate_profile_string = self.validate
+
+    def tearDown(self):
+        '''unit test tear down'''
+        sc.validate_profile_string = self.validate_orig
+        cgi_get_manifest._PROFILE_CACHE.clear()
+        os.remove(self.profile)
+        os.rmdir(self.image_dir)
+
+    def test_reused(self):
+        '''verify a profile is read and validated only once'''
+        template = cgi_get_manifest.get_profile_template(self.profile,
+                                                         self.image_dir)
+        self.assertTrue(template.valid)
+        self.assertTrue(cgi_get_manifest.get_profile_template(
+            self.profile, self.image_dir) is template)
+        self.assertEqual(self.validate.calls, 1)
+        self.assertEqual(template.substitute({'AI_HOSTNAME': 'host1'}),
+                         '<profile name="host1"/>')
+        self.assertEqual(template.substitute({'AI_HOSTNAME': 'host2'}),
+                         '<profile name="host2"/>')
+
+    def test_reloaded(self):
+        '''verify a changed profile is read again'''
+        template = cgi_get_manifest.get_profile_template(self.profile,
+                                                         self.image_dir)
+        with open(self.profile, 'w') as pfp:
+            pfp.write('<profile host="{{AI_HOSTNAME}}"/>')
+        template = cgi_get_manifest.get_profile_template(self.profile,
+                                                         self.image_dir)
+        self.assertEqual(template.substitute({'AI_HOSTNAME': 'h'}),
+                         '<profile host="h"/>')
+        self.assertEqual(self.validate.calls, 2)
+
+    def test_invalid(self):
+        '''verify a template failing validation is flagged'''
+        self.validate.valid = False
+        template = cgi_get_manifest.get_profile_template(self.profile,
+                                                         self.image_dir)
+        self.assertFalse(template.valid)
+
+    def test_missing(self):
+        '''verify a missing profile raises IOError'''
+        self.assertRaises(IOError, cgi_get_manifest.get_profile_template,
+                          self.profile + '.missing', self.image_dir)
+
+
+class testReadClients(unittest.TestCase):
+    '''Tests for read_clients and client_value'''
+
+    def test_csv(self):
+        '''verify CSV clients, with empty fields left out'''
+        clients = cgi_get_manifest.read_clients(
+            "mac,arch,ipv4\n"
+            "8:0:27:13:86:69,i86pc,10.0.2.15\n"
+            ",sparc,\n")
+        self.assertEqual(clients, [{'mac': '080027138669', 'arch': 'i86pc',
+                                    'ipv4': '010000002015'},
+                                   {'arch': 'sparc'}])
+
+    def test_json(self):
+        '''verify JSON clients, with null values left out'''
+        clients = cgi_get_manifest.read_clients(
+            '[{"MAC": "08:00:27:13:86:69", "mem": 2048, "cpu": null}]')
+        self.assertEqual(clients, [{'mac': '080027138669', 'mem': '2048'}])
+
+    def test_empty(self):
+        '''verify no clients are read from empty text'''
+        self.assertEqual(cgi_get_manifest.read_clients(''), [])
+
+    def test_invalid(self):
+        '''verify malformed input raises ValueError'''
+        self.assertRaises(ValueError, cgi_get_manifest.read_clients,
+                          '[{"mac": ')
+        self.assertRaises(ValueError, cgi_get_manifest.read_clients,
+                          '["i86pc"]')
+        self.assertRaises(ValueError, cgi_get_manifest.read_clients,
+                          'arch\ni86pc,extra\n')
+
+    def test_client_value(self):
+        '''verify values are given the form AI clients send'''
+        self.assertEqual(cgi_get_manifest.client_value('network',
+                                                       '192.168.1.0'),
+                         '192168001000')
+        self.assertEqual(cgi_get_manifest.client_value('ipv4', '10.0.0'),
+                         '10.0.0')
+        self.assertEqual(cgi_get_manifest.client_value('mac', 'xyz'), 'xyz')
+        self.assertEqual(cgi_get_manifest.client_value('arch', u' i86pc '),
+                         'i86pc')
+
+
+class testResolveClients(unittest.TestCase):
+    '''Tests for resolve_database_clients'''
+
+    COLUMNS = ("arch TEXT, hostname TEXT, MINmac INTEGER, MAXmac INTEGER, "
+               "MINipv4 INTEGER, MAXipv4 INTEGER, cpu TEXT, platform TEXT, "
+               "MINnetwork INTEGER, MAXnetwork INTEGER, MINmem INTEGER, "
+               "MAXmem INTEGER, zonename TEXT")
+    CLIENTS = [{'arch': 'i86pc', 'mac': '080027138669', 'mem': '4096'},
+               {'arch': 'sparc', 'mac': '080027138670', 'mem': '1024'},
+               {'arch': 'i86pc', 'mac': '080027138669', 'mem': '4096',
+                'zonename': 'z1'}]
+
+    def setUp(self):
+        '''unit test set up'''
+        dbfile = tempfile.NamedTemporaryFile(dir="/tmp", delete=False)
+        self.dbname = dbfile.name
+        con = sqlite3.connect(self.dbname, isolation_level=None)
+        con.execute("CREATE TABLE manifests (name TEXT, instance INTEGER, "
+                    "%s)" % self.COLUMNS)
+        con.execute("CREATE TABLE profiles (name TEXT, file TEXT, %s)" %
+                    self.COLUMNS)
+        con.execute("INSERT INTO manifests (name, instance, arch) "
+                    "VALUES ('x86', 0, 'i86pc')")
+        con.execute("INSERT INTO manifests (name, instance, MINmac, MAXmac) "
+                    "VALUES ('mac', 0, x'080027138669', x'080027138669')")
+        con.execute("INSERT INTO profiles (name, file) "
+                    "VALUES ('global', 'g')")
+        con.execute("INSERT INTO profiles (name, file, MINmem) "
+                    "VALUES ('bigmem', 'b', 2048)")
+        con.close()
+        self.aisql = AIdb.DB(self.dbname)
+        self.getCriteriaIndex_orig = AIdb.getCriteriaIndex
+
+    def tearDown(self):
+        '''unit test tear down'''
+        AIdb.getCriteriaIndex = self.getCriteriaIndex_orig
+        self.aisql.close()
+        os.remove(self.dbname)
+
+    def test_resolve(self):
+        '''verify the manifest and profiles of each client'''
+        results = cgi_get_manifest.resolve_database_clients(
+            self.aisql, self.CLIENTS, default_manifest='default')
+        self.assertEqual(results, [('mac', ('bigmem', 'global')),
+                                   ('default', ('global',)),
+                                   ('mac', ('bigmem', 'global'))])
+
+    def test_no_default(self):
+        '''verify no_default excludes profiles without the criteria'''
+        results = cgi_get_manifest.resolve_database_clients(
+            self.aisql, self.CLIENTS[:2], no_default=True)
+        self.assertEqual(results, [('mac', ()), (None, ())])
+
+    def test_without_index(self):
+        '''verify the database is queried if no index can be built'''
+        expected = cgi_get_manifest.resolve_database_clients(
+            self.aisql, self.CLIENTS, default_manifest='default')
+
+        def no_index(aisql):
+            '''mock getCriteriaIndex'''
+            raise AIdb.CriteriaIndexError('no index')
+        AIdb.getCriteriaIndex = no_index
+        self.assertEqual(cgi_get_manifest.resolve_database_clients(
+            self.aisql, self.CLIENTS, default_manifest='default'), expected)
+
+
+class testResponseCache(unittest.TestCase):
+    '''Tests for the cache of manifest replies'''
+
+    def setUp(self):
+        '''unit test set up'''
+        profile = tempfile.NamedTemporaryFile(dir="/tmp", delete=False)
+        profile.write('<profile name="{{AI_HOSTNAME}}"/>')
+        profile.close()
+        self.profile = profile.name
+        self.dependencies = [cgi_get_manifest.file_dependency(self.profile)]
+        self.size_orig = cgi_get_manifest.RESPONSE_CACHE_SIZE
+        self.getCriteria_orig = AIdb.getCriteria
+        AIdb.getCriteria = lambda queue, table=AIdb.MANIFESTS_TABLE, \
+            onlyUsed=True, strip=True: \
+            {AIdb.MANIFESTS_TABLE: ['arch'],
+             AIdb.PROFILES_TABLE: ['mac']}[table]
+
+    def tearDown(self):
+        '''unit test tear down'''
+        AIdb.getCriteria = self.getCriteria_orig
+        cgi_get_manifest.RESPONSE_CACHE_SIZE = self.size_orig
+        cgi_get_manifest._RESPONSE_CACHE.clear()
+        cgi_get_manifest._RESPONSE_COUNT[0] = 0
+        os.remove(self.profile)
+
+    def key(self, criteria):
+        '''return the response key of a client'''
+        return cgi_get_manifest.response_key('/tmp/AI.db', 'svc', '1.0',
+                                             False, criteria, None)
+
+    def test_key(self):
+        '''verify only the values of used criteria are in the key'''
+        key = self.key({'arch': 'i86pc', 'mac': '0', 'mem': '2048'})
+        self.assertEqual(key, self.key({'arch': 'i86pc', 'mac': '0',
+                                        'mem': '4096'}))
+        self.assertNotEqual(key, self.key({'arch': 'sun4v', 'mac': '0',
+                                           'mem': '2048'}))
+        self.assertNotEqual(key, self.key({'arch': 'i86pc', 'mac': '1',
+                                           'mem': '2048'}))
+        # the criteria sent affect the messages of the reply
+        self.assertNotEqual(key, self.key({'arch': 'i86pc', 'mac': '0'}))
+
+    def test_key_invalid_mac(self):
+        '''verify an invalid mac value has its own key where no manifest
+        or profile uses mac, as it matches no profile'''
+        AIdb.getCriteria = lambda queue, table=AIdb.MANIFESTS_TABLE, \
+            onlyUsed=True, strip=True: ['arch']
+        key = self.key({'arch': 'i86pc', 'mac': '080027138670'})
+        self.assertEqual(key, self.key({'arch': 'i86pc',
+                                        'mac': '080027138671'}))
+        self.assertNotEqual(key, self.key({'arch': 'i86pc', 'mac': 'xyz'}))
+        self.assertEqual(self.key({'arch': 'i86pc', 'mac': 'xyz'}),
+                         self.key({'arch': 'i86pc', 'mac': 'xy'}))
+
+    def test_cached(self):
+        '''verify replies are kept per template variable values'''
+        key = self.key({'arch': 'i86pc'})
+        cgi_get_manifest.cache_reply(key, self.dependencies,
+                                     ['AI_HOSTNAME'], {'AI_HOSTNAME': 'h1'},
+                                     '"1"', 'reply1')
+        cgi_get_manifest.cache_reply(key, self.dependencies,
+                                     ['AI_HOSTNAME'], {'AI_HOSTNAME': 'h2'},
+                                     '"2"', 'reply2')
+        self.assertEqual(cgi_get_manifest.get_cached_reply(key,
+            {'AI_HOSTNAME': 'h1', 'AI_MEM': '1'}), ('"1"', 'reply1'))
+        self.assertEqual(cgi_get_manifest.get_cached_reply(key,
+            {'AI_HOSTNAME': 'h2'}), ('"2"', 'reply2'))
+        self.assertEqual(cgi_get_manifest.get_cached_reply(key,
+            {'AI_HOSTNAME': 'h3'}), None)
+        self.assertEqual(cgi_get_manifest.get_cached_reply(
+            self.key({'arch': 'sun4v'}), {'AI_HOSTNAME': 'h1'}), None)
+
+    def test_dependency_changed(self):
+        '''verify replies are dropped when a file they depend on changes'''
+        key = self.key({'arch': 'i86pc'})
+        cgi_get_manifest.cache_reply(key, self.dependencies, [], {}, '"1"',
+                                     'reply1')
+        self.assertEqual(cgi_get_manifest.get_cached_reply(key, {}),
+                         ('"1"', 'reply1'))
+        with open(self.profile, 'w') as pfp:
+            pfp.write('<profile/>')
+        self.assertEqual(cgi_get_manifest.get_cached_reply(key, {}), None)
+
+    def test_size(self):
+        '''verify the number of cached replies is bounded'''
+        cgi_get_manifest.RESPONSE_CACHE_SIZE = 2
+        for arch in ['i86pc', 'sun4u', 'sun4v']:
+            cgi_get_manifest.cache_reply(self.key({'arch': arch}),
+                                         self.dependencies, [], {}, arch,
+                                         arch)
+        self.assertEqual(cgi_get_manifest._RESPONSE_COUNT[0], 1)
+        self.assertEqual(cgi_get_manifest.get_cached_reply(
+            self.key({'arch': 'i86pc'}), {}), None)
+        self.assertEqual(cgi_get_manifest.get_cached_reply(
+            self.key({'arch': 'sun4v'}), {}), ('sun4v', 'sun4v'))
+
+
+class testSendReply(unittest.TestCase):
+    '''Tests for the entity tags of manifest replies'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.stdout_orig = sys.stdout
+        sys.stdout = RedirectedOutput()
+
+    def tearDown(self):
+        '''unit test tear down'''
+        sys.stdout = self.stdout_orig
+
+    @staticmethod
+    def mime(text):
+        '''return a MIME multipart message holding text'''
+        outermime = cgi_get_manifest.MIMEMultipart()
+        outermime.attach(cgi_get_manifest.MIMEText(text, 'plain'))
+        return outermime
+
+    def test_etag(self):
+        '''verify the same parts produce the same reply and entity tag'''
+        etag, reply = cgi_get_manifest.mime_reply(self.mime('text'))
+        self.assertEqual((etag, reply),
+                         cgi_get_manifest.mime_reply(self.mime('text')))
+        self.assertNotEqual(etag,
+                            cgi_get_manifest.mime_reply(self.mime('other'))[0])
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+
+    def test_etag_matches(self):
+        '''verify If-None-Match headers are matched'''
+        matches = cgi_get_manifest.etag_matches
+        self.assertTrue(matches('"a"', '"a"'))
+        self.assertTrue(matches('"a"', '"b", W/"a"'))
+        self.assertTrue(matches('"a"', '*'))
+        self.assertFalse(matches('"a"', '"b"'))
+        self.assertFalse(matches('"a"', None))
+
+    def test_send_reply(self):
+        '''verify a reply is sent unless the client already has it'''
+        etag, reply = cgi_get_manifest.mime_reply(self.mime('text'))
+        cgi_get_manifest.send_reply(etag, reply, '"other"')
+        self.assertTrue(sys.stdout.startswith('ETag: ' + etag + '\n'))
+        self.assertTrue(reply in str(sys.stdout))
+        sys.stdout.clear()
+        cgi_get_manifest.send_reply(etag, reply, etag)
+        self.assertEqual(str(sys.stdout), 'Status: 304 Not Modified\n'
+                         'ETag: ' + etag + '\n\n')
+
+
 if __name__ == '__main__':
     gettext.install("ai", "/usr/lib/locale")
     unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+To run these tests, see the instructions in usr/src/tools/tests/README.
+Remember that since the proto area is used for the PYTHONPATH, the gate
+must be rebuilt for these tests to pick up any changes in the tested code.
+'''
+import gettext
+import sys
+import threading
+import unittest
+
+from StringIO import StringIO
+
+import osol_install.auto_install.cgi_get_manifest as cgi_get_manifest
+import osol_install.auto_install.manifest_server as manifest_server
+
+gettext.install("ai-test")
+
+
+class MockProcessRequest(object):
+    '''Class for mock cgi_get_manifest.process_request'''
+    def __init__(self, output):
+        self.output = output
+        self.args = None
+
+    def __call__(self, form, method, port, default_port, if_none_match=None):
+        self.args = (form, method, port, default_port)
+        self.if_none_match = if_none_match
+        sys.stdout.write(self.output)
+
+
+class MockStartResponse(object):
+    '''Class for mock WSGI start_response'''
+    def __init__(self):
+        self.status = None
+        self.headers = None
+
+    def __call__(self, status, headers):
+        self.status = status
+        self.headers = dict(headers)
+
+
+class ParseCGIOutput(unittest.TestCase):
+    '''Tests for parse_cgi_output'''
+
+    def test_headers_and_body(self):
+        '''Verify headers are split from the body'''
+        status, headers, body = manifest_server.parse_cgi_output(
+            'Content-Length: 5\nContent-Type: text/xml\n\n<a/>\n')
+        self.assertEqual(status, manifest_server.DEFAULT_STATUS)
+        self.assertEqual(dict(headers)['Content-Type'], 'text/xml')
+        self.assertEqual(dict(headers)['Content-Length'], '5')
+        self.assertEqual(body, '<a/>\n')
+
+    def test_folded_header(self):
+        '''Verify folded MIME headers are joined'''
+        status, headers, body = manifest_server.parse_cgi_output(
+            'Content-Type: multipart/mixed;\n\tboundary="xyz"\n'
+            'MIME-Version: 1.0\n\n--xyz--\n')
+        self.assertEqual(dict(headers)['Content-Type'],
+                         'multipart/mixed; boundary="xyz"')
+        self.assertEqual(body, '--xyz--\n')
+
+    def test_status_header(self):
+        '''Verify a Status header sets the response status'''
+        status, headers, body = manifest_server.parse_cgi_output(
+            'Status: 404 Not Found\nContent-Type: text/html\n\n')
+        self.assertEqual(status, '404 Not Found')
+        self.assertFalse('Status' in dict(headers))
+
+    def test_no_headers(self):
+        '''Verify output without headers is returned as html'''
+        status, headers, body = manifest_server.parse_cgi_output('oops')
+        self.assertEqual(dict(headers)['Content-Type'], 'text/html')
+        self.assertEqual(body, 'oops')
+
+
+class RequestOutput(unittest.TestCase):
+    '''Tests for RequestOutput'''
+
+    def test_capture_per_thread(self):
+        '''Verify each thread only captures its own output'''
+        stream = StringIO()
+        output = manifest_server.RequestOutput(stream)
+        results = dict()
+
+        def worker(name):
+            output.start_capture()
+            output.write(name)
+            results[name] = output.stop_capture()
+
+        threads = [threading.Thread(target=worker, args=(str(i),))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        output.write('uncaptured')
+
+        for name in results:
+            self.assertEqual(results[name], name)
+        self.assertEqual(stream.getvalue(), 'uncaptured')
+
+
+class ManifestApplication(unittest.TestCase):
+    '''Tests for ManifestApplication'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.stdout_orig = sys.stdout
+        self.process_request_orig = cgi_get_manifest.process_request
+        self.mock = MockProcessRequest('Content-Type: text/xml\n\n<x/>\n')
+        cgi_get_manifest.process_request = self.mock
+        self.app = manifest_server.ManifestApplication(default_port=5555)
+
+    def tearDown(self):
+        '''unit test tear down'''
+        cgi_get_manifest.process_request = self.process_request_orig
+        sys.stdout = self.stdout_orig
+        manifest_server._OUTPUT = None
+
+    def test_request(self):
+        '''Verify a request is dispatched and its output returned'''
+        environ = {'PATH_INFO': '/cgi-bin/cgi_get_manifest.py',
+                   'REQUEST_METHOD': 'GET',
+                   'QUERY_STRING': 'version=2.0&service=aservice',
+                   'SERVER_PORT': '46501',
+                   'wsgi.input': StringIO()}
+        start_response = MockStartResponse()
+        body = self.app(environ, start_response)
+        self.assertEqual(start_response.status,
+                         manifest_server.DEFAULT_STATUS)
+        self.assertEqual(start_response.headers['Content-Type'], 'text/xml')
+        self.assertEqual(body, ['<x/>\n'])
+        form, method, port, default_port = self.mock.args
+        self.assertEqual(form['service'].value, 'aservice')
+        self.assertEqual(method, 'GET')
+        self.assertEqual(port, 46501)
+        self.assertEqual(default_port, 5555)
+
+    def test_unknown_path(self):
+        '''Verify requests for other paths are refused'''
+        environ = {'PATH_INFO': '/index.html',
+                   'wsgi.input': StringIO()}
+        start_response = MockStartResponse()
+        self.app(environ, start_response)
+        self.assertTrue(start_response.status.startswith('404'))
+        self.assertEqual(self.mock.args, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
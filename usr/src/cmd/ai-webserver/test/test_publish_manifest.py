@@ -131,6 +131,12 @@ class MockGetManifestCriteria(object):
         return self.criteria
 
 
+class MockCriteria(dict):
+    '''Class for mock Criteria, giving None for criteria not set '''
+    def __getitem__(self, key):
+        return self.get(key)
+
+
 class MockAIservice(object):
     '''Class for mock AIservice'''
     KEYERROR = False
@@ -405,5 +411,124 @@ class FindCollidingCriteria(unittest.TestCase):
                           criteria, self.files.database)
 
 
+class ManifestCriteria(unittest.TestCase):
+    '''Tests for ManifestCriteria and collision detection with it'''
+
+    COLUMNS = ['MINmem', 'MINipv4', 'MINmac', 'MAXmem', 'MAXipv4', 'MAXmac',
+               'arch']
+
+    def setUp(self):
+        '''unit test set up'''
+        self.aidb_getCriteria = AIdb.getCriteria
+        self.aidb_isRangeCriteria = AIdb.isRangeCriteria
+        AIdb.getCriteria = MockGetCriteria()
+        AIdb.isRangeCriteria = lambda queue, crit, table: \
+            crit in ('mem', 'ipv4', 'mac')
+        self.files = MockDataFiles()
+        rows = [('x86', None, None, None, None, None, None, u'i86pc sun4v'),
+                ('sparc', None, None, None, None, None, None, u'sun4u'),
+                ('bigmem', 2048, None, None, None, None, None, None),
+                ('lab', None, 10000000001, None, None, 10000000100, None,
+                 None),
+                ('lab2', None, 10000000100, None, None, 10000000200, None,
+                 None),
+                ('host', None, None, u'080027138669', None, None,
+                 u'080027138669', None),
+                ('amd64', None, None, None, None, None, None, u'I86PC')]
+        entries = list()
+        for row in rows:
+            entry = dict(zip(['name'] + self.COLUMNS, row))
+            entry['instance'] = 0
+            entries.append(entry)
+        self.manifests = publish_manifest.ManifestCriteria(entries,
+                                                           self.COLUMNS)
+
+    def tearDown(self):
+        '''unit test tear down
+        Functions originally saved in setUp are restored to their
+        original values.
+        '''
+        AIdb.getCriteria = self.aidb_getCriteria
+        AIdb.isRangeCriteria = self.aidb_isRangeCriteria
+
+    def test_find_values(self):
+        '''Ensure values are matched as is_in_list compares them'''
+        self.assertEqual(self.manifests.find_values('arch', ['I86pc']),
+                         [(u'x86', 0), (u'amd64', 0)])
+        self.assertEqual(self.manifests.find_values('arch',
+                                                    ['sun4u', 'sun4v']),
+                         [(u'sparc', 0), (u'x86', 0)])
+        self.assertEqual(self.manifests.find_values('arch', ['sparc']), [])
+
+    def test_find_range(self):
+        '''Ensure overlapping and adjacent ranges are found'''
+        self.assertEqual(sorted(self.manifests.find_range('ipv4',
+                                                          10000000050,
+                                                          10000000150)),
+                         [(u'lab', 0), (u'lab2', 0)])
+        self.assertEqual(self.manifests.find_range('ipv4', 10000000200,
+                                                   10000000300),
+                         [(u'lab2', 0)])
+        self.assertEqual(self.manifests.find_range('ipv4', 10000000201,
+                                                   10000000300), [])
+        # an unbounded maximum reaches every larger minimum
+        self.assertEqual(self.manifests.find_range('mem', 4096,
+                                                   long(publish_manifest.
+                                                        INFINITY)),
+                         [(u'bigmem', 0)])
+
+    def test_colliding_criteria(self):
+        '''Ensure the collisions are recorded per manifest'''
+        criteria = MockCriteria(arch=['i86pc'],
+                                ipv4=['10000000090', 'unbounded'])
+        collisions = publish_manifest.find_colliding_criteria(criteria,
+            self.files.database, manifests=self.manifests)
+        self.assertEqual(collisions, {(u'x86', 0): 'arch,',
+                                      (u'amd64', 0): 'arch,',
+                                      (u'lab', 0): 'MINipv4,MAXipv4,',
+                                      (u'lab2', 0): 'MINipv4,MAXipv4,'})
+
+    def test_colliding_criteria_excluded(self):
+        '''Ensure excluded manifests are not reported'''
+        criteria = MockCriteria(arch=['i86pc'])
+        collisions = publish_manifest.find_colliding_criteria(criteria,
+            self.files.database, exclude_manifests=['x86'],
+            manifests=self.manifests)
+        self.assertEqual(collisions, {(u'amd64', 0): 'arch,'})
+
+    def test_colliding_manifests(self):
+        '''Ensure same criteria and range collisions are caught'''
+        criteria = MockCriteria(arch=['sun4u'])
+        collisions = publish_manifest.find_colliding_criteria(criteria,
+            self.files.database, manifests=self.manifests)
+        self.assertRaises(SystemExit,
+                          publish_manifest.find_colliding_manifests,
+                          criteria, self.files.database, collisions,
+                          manifests=self.manifests)
+
+        criteria = MockCriteria(ipv4=['10000000150', '10000000160'])
+        collisions = publish_manifest.find_colliding_criteria(criteria,
+            self.files.database, manifests=self.manifests)
+        self.assertRaises(SystemExit,
+                          publish_manifest.find_colliding_manifests,
+                          criteria, self.files.database, collisions,
+                          manifests=self.manifests)
+
+    def test_diverging_manifests(self):
+        '''Ensure manifests sharing only some criteria are accepted'''
+        criteria = MockCriteria(arch=['sun4u'], mem=['1024', '1024'])
+        collisions = publish_manifest.find_colliding_criteria(criteria,
+            self.files.database, manifests=self.manifests)
+        self.assertEqual(collisions, {(u'sparc', 0): 'arch,'})
+        publish_manifest.find_colliding_manifests(criteria,
+            self.files.database, collisions, manifests=self.manifests)
+
+    def test_audit(self):
+        '''Ensure every colliding pair of manifests is reported'''
+        self.assertEqual(self.manifests.audit(),
+                         [((u'x86', 0), (u'amd64', 0), ''),
+                          ((u'lab', 0), (u'lab2', 0), 'ipv4')])
+
+
 if __name__ == '__main__':
     unittest.main()
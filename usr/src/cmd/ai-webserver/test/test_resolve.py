@@ -0,0 +1,112 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+
+'''
+To run these tests, see the instructions in usr/src/tools/tests/README.
+Remember that since the proto area is used for the PYTHONPATH, the gate
+must be rebuilt for these tests to pick up any changes in the tested code.
+
+'''
+
+import csv
+import gettext
+import json
+import unittest
+
+import osol_install.auto_install.resolve as resolve
+
+from StringIO import StringIO
+
+gettext.install("ai-test")
+
+
+class ParseOptions(unittest.TestCase):
+    '''Tests for parse_options. Some tests correctly output usage msg'''
+
+    def test_parse_no_options(self):
+        '''Ensure no options caught'''
+        self.assertRaises(SystemExit, resolve.parse_options, [])
+
+    def test_parse_no_file(self):
+        '''Ensure the client file is required'''
+        self.assertRaises(SystemExit, resolve.parse_options,
+                          ['-n', 'mysvc'])
+
+    def test_parse_invalid_format(self):
+        '''Ensure an unknown output format is flagged'''
+        self.assertRaises(SystemExit, resolve.parse_options,
+                          ['-n', 'mysvc', '-f', 'clients.csv', '-F', 'xml'])
+
+    def test_parse_valid(self):
+        '''Ensure valid options are accepted'''
+        options = resolve.parse_options(['-n', 'mysvc', '-f', '-',
+                                         '-F', 'csv'])
+        self.assertEqual(options.service_name, 'mysvc')
+        self.assertEqual(options.client_file, '-')
+        self.assertEqual(options.format, 'csv')
+
+
+class WriteResults(unittest.TestCase):
+    '''Tests for write_results'''
+
+    CLIENTS = [{'mac': '080027138669', 'arch': 'i86pc'},
+               {'ipv4': '010000002015'},
+               {'arch': 'sparc'}]
+    RESULTS = [('mac', ['bigmem', 'global']),
+               ('default', ['global']),
+               (None, [])]
+
+    def write(self, fmt):
+        '''return the output of write_results in format fmt'''
+        outfile = StringIO()
+        resolve.write_results(outfile, fmt, self.CLIENTS, self.RESULTS)
+        return outfile.getvalue()
+
+    def test_json(self):
+        '''Ensure the criteria, manifest and profiles of each client'''
+        reply = json.loads(self.write('json'))
+        self.assertEqual(len(reply), 3)
+        self.assertEqual(reply[0], {'criteria': self.CLIENTS[0],
+                                    'manifest': 'mac',
+                                    'profiles': ['bigmem', 'global']})
+        self.assertEqual(reply[2]['manifest'], None)
+
+    def test_csv(self):
+        '''Ensure one row per client, labelled by mac or address'''
+        rows = list(csv.reader(StringIO(self.write('csv'))))
+        self.assertEqual(rows, [['client', 'manifest', 'profiles'],
+                                ['08:00:27:13:86:69', 'mac',
+                                 'bigmem global'],
+                                ['10.0.2.15', 'default', 'global'],
+                                ['client 3', '-', '-']])
+
+    def test_text(self):
+        '''Ensure a header and one line per client'''
+        lines = self.write('text').splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[2].startswith('08:00:27:13:86:69  mac'))
+
+
+if __name__ == '__main__':
+    unittest.main()
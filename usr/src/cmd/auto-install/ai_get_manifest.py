@@ -52,6 +52,12 @@ SC_EXTENSION = '.xml'
 
 AI_MANIFEST_ATTACHMENT_NAME = 'manifest.xml'  # named as MIME attachment
 
+# last reply obtained from an AI service, offered to the service again by
+# its entity tag when the manifest is requested again (e.g. after the
+# manifest locator is restarted) and reused if the service reports it
+# unchanged
+AI_REPLY_CACHE = system_temp_path("ai_manifest_reply")
+
 
 class AILog:
     """
@@ -650,7 +656,7 @@ def get_image_version(fname):
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 def ai_get_http_file(address, service_name, file_path, method, nv_pairs,
-                     no_default=False):
+                     no_default=False, etag=None):
     """		Description: Downloads file from url using HTTP protocol
 
         Parameters:
@@ -662,12 +668,16 @@ def ai_get_http_file(address, service_name, file_path, method, nv_pairs,
                            to the server using 'POST' method
             no_default   - whether or not to request a default manifest if
                            criteria can't be used to match a manifest.
+            etag         - entity tag of a reply obtained earlier. If the
+                           reply is unchanged, the web server responds with
+                           status 304 (Not Modified) and no file.
 
         Returns:
             file
             return code: >= 100 - HTTP Response status code
                              -1 - Connection to web server failed
             HTTP content type header record
+            HTTP entity tag header record
     """
 
     # try to connect to the provided web server
@@ -687,7 +697,7 @@ def ai_get_http_file(address, service_name, file_path, method, nv_pairs,
             if service_name:
                 version = get_image_version(VERSION_FILE)
                 if not version:
-                    return None, -1, None
+                    return None, -1, None, None
 
                 params = urllib.urlencode({
                                       'version': version,
@@ -704,6 +714,8 @@ def ai_get_http_file(address, service_name, file_path, method, nv_pairs,
             http_headers = {
                 "Content-Type": "application/x-www-form-urlencoded",
                 "Accept": "text/plain,multipart/alternative"}
+            if etag:
+                http_headers["If-None-Match"] = etag
             http_conn.request("POST", file_path, params, http_headers)
         else:
             http_conn.request("GET", file_path)
@@ -711,19 +723,70 @@ def ai_get_http_file(address, service_name, file_path, method, nv_pairs,
     except httplib.InvalidURL:
         AIGM_LOG.post(AILog.AI_DBGLVL_ERR,
                       "%s is not valid URL", address)
-        return None, -1, None
+        return None, -1, None, None
     except StandardError, err:
         msg = "Connection to %s failed (%s)" % (address, err)
         AIGM_LOG.post(AILog.AI_DBGLVL_ERR,
                       "%s", msg)
-        return None, -1, None
+        return None, -1, None, None
 
     http_response = http_conn.getresponse()
     url_content = http_response.read()
     http_status = http_response.status
     http_conn.close()
 
-    return url_content, http_status, http_response.getheader("Content-Type")
+    return url_content, http_status, \
+        http_response.getheader("Content-Type"), http_response.getheader("ETag")
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def load_cached_reply(service, cache_file=AI_REPLY_CACHE):
+    """	Description: read the reply saved by save_cached_reply()
+
+        Parameters:
+            service    - AI service the reply is needed from, as listed in
+                         the service list file
+            cache_file - file the reply was saved to
+
+        Returns:
+            entity tag, content type and content of the reply,
+            or None, None, None if no reply of the service was saved
+    """
+    try:
+        with open(cache_file, 'r') as cache_fh:
+            cached_service = cache_fh.readline().rstrip('\n')
+            etag = cache_fh.readline().rstrip('\n')
+            content_type = cache_fh.readline().rstrip('\n')
+            content = cache_fh.read()
+    except IOError:
+        return None, None, None
+    if cached_service != service or not etag:
+        return None, None, None
+    return etag, content_type, content
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def save_cached_reply(service, etag, content_type, content,
+                      cache_file=AI_REPLY_CACHE):
+    """	Description: save the reply of an AI service, see load_cached_reply()
+
+        Parameters:
+            service      - AI service which sent the reply
+            etag         - entity tag of the reply
+            content_type - content type of the reply
+            content      - the reply
+
+        Returns:
+            None
+    """
+    try:
+        with open(cache_file, 'w') as cache_fh:
+            cache_fh.write("%s\n%s\n%s\n" % (service, etag, content_type))
+            cache_fh.write(content)
+    except IOError:
+        AIGM_LOG.post(AILog.AI_DBGLVL_WARN,
+                      "Could not save the reply of %s to %s", service,
+                      cache_file)
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -778,8 +841,9 @@ def ai_do_compatibility(service_name, known_criteria):
             the retrieved manifest
             return code: 0 - Success, -1 - Failure
     """
-    xml_criteria, ret, ctype = ai_get_http_file(service_name, None,
-                                                "/manifest.xml", "GET", None)
+    xml_criteria, ret, ctype, etag = ai_get_http_file(service_name, None,
+                                                      "/manifest.xml", "GET",
+                                                      None)
     if ret != httplib.OK:
         AIGM_LOG.post(AILog.AI_DBGLVL_ERR,
                       "Could not obtain criteria list from %s, ret=%d",
@@ -805,9 +869,9 @@ def ai_do_compatibility(service_name, known_criteria):
     AIGM_LOG.post(AILog.AI_DBGLVL_INFO,
                   " HTTP POST %s %s", ai_crit_response, service_name)
 
-    ai_manifest, ret, ctype = ai_get_http_file(service_name, None,
-                                               "/manifest.xml", 'POST',
-                                               ai_crit_response)
+    ai_manifest, ret, ctype, etag = ai_get_http_file(service_name, None,
+                                                     "/manifest.xml", 'POST',
+                                                     ai_crit_response)
 
     return ai_manifest, ret
 
@@ -957,12 +1021,22 @@ def parse_cli(cli_opts_args):
                       " HTTP POST cgi-bin/cgi_get_manifest.py?service=%s",
                       ai_service)
 
-        # invoke CGI script to get manifest, profiles
-        http_resp, ret, content_type = \
+        # invoke CGI script to get manifest, profiles, offering the reply
+        # obtained by an earlier run if any
+        cached_etag, cached_type, cached_resp = load_cached_reply(service)
+        http_resp, ret, content_type, etag = \
                 ai_get_http_file(ai_service, ai_name,
                                  "/cgi-bin/cgi_get_manifest.py",
                                  'POST', ai_criteria_known,
-                                 no_default=no_default)
+                                 no_default=no_default, etag=cached_etag)
+        if ret == httplib.NOT_MODIFIED and cached_etag is not None:
+            AIGM_LOG.post(AILog.AI_DBGLVL_INFO,
+                          "%s AI service reply unchanged, using the reply "
+                          "saved in %s", ai_service, AI_REPLY_CACHE)
+            http_resp, ret, content_type = \
+                cached_resp, httplib.OK, cached_type
+        elif ret == httplib.OK and etag:
+            save_cached_reply(service, etag, content_type, http_resp)
         #
         # If valid manifest was provided, it is not necessary
         # to connect next AI service,
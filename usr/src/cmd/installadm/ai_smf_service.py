@@ -323,3 +323,20 @@ def get_imagedir():
     except CalledProcessError:
         imagedir = com.IMAGE_DIR_PATH
     return imagedir
+
+
+def get_content_store():
+    ''' get the directory of the content store shared by images from AI
+    SMF service, or '' if there is none '''
+
+    getprop = [SVCPROP, '-p', com.CONTENT_STORE_PROP, com.SRVINST]
+    try:
+        svcprop_popen = Popen.check_call(getprop, stdout=Popen.STORE,
+                                         stderr=Popen.DEVNULL)
+        store = svcprop_popen.stdout.strip()
+    except CalledProcessError:
+        store = ''
+    # svcprop shows an empty string as ""
+    if store == '""':
+        store = ''
+    return store
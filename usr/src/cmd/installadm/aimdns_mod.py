@@ -28,6 +28,7 @@ import gettext
 import select
 import signal
 import sys
+import time
 
 import pybonjour as pyb
 
@@ -46,14 +47,54 @@ class AIMDNSError(Exception):
     pass
 
 
+class EventCounters(object):
+    ''' Class: EventCounters - counters of the work done by the AImDNS event
+                               loop, to tell whether it keeps up with the
+                               registered services.
+    '''
+    def __init__(self):
+        # services registered and unregistered
+        self.registrations = 0
+        self.unregistrations = 0
+        # refreshes of the registered services (SIGHUP) and the time the
+        # last one took
+        self.refreshes = 0
+        self.refresh_time = 0.0
+        # mDNS callbacks invoked
+        self.callbacks = 0
+        # event loop iterations with service references ready, and the
+        # time taken processing them
+        self.loops = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_loop(self, latency):
+        '''Method: record_loop
+        Description:
+            Count an event loop iteration which took latency seconds to
+            process the ready service references.
+        '''
+        self.loops += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def __str__(self):
+        mean = self.total_latency / self.loops if self.loops else 0.0
+        return _('registrations=%(reg)d unregistrations=%(unreg)d '
+                 'refreshes=%(refresh)d (last %(refresh_ms).1fms) '
+                 'callbacks=%(cb)d loops=%(loops)d latency '
+                 'mean=%(mean).1fms max=%(max).1fms') % \
+                 {'reg': self.registrations, 'unreg': self.unregistrations,
+                  'refresh': self.refreshes,
+                  'refresh_ms': self.refresh_time * 1000,
+                  'cb': self.callbacks, 'loops': self.loops,
+                  'mean': mean * 1000, 'max': self.max_latency * 1000}
+
+
 class AImDNS(object):
     ''' Class: AImDNS - base class for registering, browsing and looking up
                         AI and ad hoc mDNS records.
     '''
-    # a _handle_event() loop control variable, used to restart the loop
-    # after modification to the self.sdrefs variable, private
-    _restart_loop = False
-
     # find/browse mode variables, private
     _do_lookup = False
     _found = False
@@ -90,6 +131,16 @@ class AImDNS(object):
         self.count = 0
 
         self.sdrefs = dict()
+        # the service references of self.sdrefs by file descriptor, and
+        # the list of those file descriptors for select(), kept up to date
+        # as service references are added and removed
+        self._fdmap = dict()
+        self._fds = list()
+        # the text record of each registered AI service, to tell when the
+        # service changed, and whether a refresh was requested (SIGHUP)
+        self._registered = dict()
+        self._refresh = False
+        self.counters = EventCounters()
 
         self.interfaces = libaimdns.getifaddrs()
 
@@ -139,6 +190,7 @@ class AImDNS(object):
         Raises
             None
         '''
+        self.counters.callbacks += 1
         # handle errors from within the _browse_callback
         # after the select() call
         if errorcode == pyb.kDNSServiceErr_NoError:
@@ -184,6 +236,7 @@ class AImDNS(object):
         Raises
             None
         '''
+        self.counters.callbacks += 1
         if errorcode != pyb.kDNSServiceErr_NoError:
             return  # error handled in the _handle_event() method
 
@@ -239,69 +292,98 @@ class AImDNS(object):
                 None
         '''
         self.done = False
+        count = 0
         while not self.done:
-            # The self.sdrefs is a dictionary of the form:
-            #
-            #   for the find mode:
-            #       { 'find':[list of sdrefs] }
-            #
-            #   OR for the browse mode:
-            #       { 'browse':[list of sdrefs] }
-            #
-            #   OR for the register mode:
-            #       { <service-name>:[list of sdrefs] }
-            #
-            #   OR for the register all mode:
-            #       { <service-name1>:[list of sdrefs],
-            #         <service-name2>:[list of sdrefs],
-            #         ... }
-            #
-            # This must be converted to a simple list of sdrefs for the
-            # select() call.
-            therefs = list()
-            # iterate through the dictionary
-            for srv in self.sdrefs:
-                for refs in self.sdrefs.get(srv, list()):
-                    if refs is not None:
-                        therefs.append(refs)
-
-            # loop until done or we need to redo the service reference
-            # list mentioned above.  The service reference list will be
-            # updated when the SMF service is refreshed which sends a
-            # SIGHUP to the application in daemon mode.  This processing
-            # of the SIGHUP is done in the signal_hup() method below.
-            self._restart_loop = False
-            count = 0
-            while not self._restart_loop and not self.done:
-                try:
-                    # process the appropriate service reference
+            try:
+                # refresh the registered services when SIGHUP was received
+                # (see _signal_hup()), outside of the signal handler
+                if self._refresh:
+                    self._refresh = False
                     try:
-                        ready = select.select(therefs, list(), list(),
-                                              self.timeout)
-                    except select.error:
-                        continue
-
-                    # check to ensure that the __del__ method was not called
-                    # between the select and the DNS processing.
-                    if self.done:
-                        continue
-
-                    for sdref in therefs:
-                        if sdref in ready[0]:
+                        self.sync_services()
+                    except AIMDNSError, err:
+                        # not a catastrophic error, the services which
+                        # could be registered are
+                        sys.stderr.write(str(err) + '\n')
+
+                # self._fds holds the file descriptors of the service
+                # references in self.sdrefs, whatever the mode (find,
+                # browse, register or register all); it is updated as
+                # references are added and removed, rather than rebuilt
+                # on each iteration.
+                try:
+                    ready = select.select(self._fds, list(), list(),
+                                          self.timeout)[0]
+                except select.error:
+                    # interrupted, e.g. by SIGHUP
+                    continue
+
+                # check to ensure that the __del__ method was not called
+                # between the select and the DNS processing.
+                if self.done:
+                    continue
+
+                if ready:
+                    start = time.time()
+                    for fd in ready:
+                        sdref = self._fdmap.get(fd)
+                        if sdref is not None:
                             pyb.DNSServiceProcessResult(sdref)
+                    self.counters.record_loop(time.time() - start)
+
+                # if browse or find loop then loop only long enough to
+                # ensure that all the registered mDNS records are
+                # retrieved per interface configured
+                if self._do_lookup is True:
+                    count += 1
+                    if count >= self.count:
+                        self.done = True
+
+            # <CTL>-C will exit the loop, application
+            # needed for command line invocation
+            except KeyboardInterrupt:
+                self.done = True
+
+    def _add_sdrefs(self, key, sdrefs):
+        '''Method: _add_sdrefs, class private
+        Description:
+            Add service references to self.sdrefs and to the file
+            descriptors watched by the event loop.
 
-                    # if browse or find loop then loop only long enough to
-                    # ensure that all the registered mDNS records are
-                    # retrieved per interface configured
-                    if self._do_lookup is True:
-                        count += 1
-                        if count >= self.count:
-                            self.done = True
+        Args
+            key    - the self.sdrefs key: a service name, 'find' or 'browse'
+            sdrefs - list of service references
 
-                # <CTL>-C will exit the loop, application
-                # needed for command line invocation
-                except KeyboardInterrupt:
-                    self.done = True
+        Returns
+            None
+
+        Raises
+            None
+        '''
+        self.sdrefs.setdefault(key, list()).extend(sdrefs)
+        for sdref in sdrefs:
+            self._fdmap[sdref.fileno()] = sdref
+        self._fds = self._fdmap.keys()
+
+    def _remove_sdrefs(self, key):
+        '''Method: _remove_sdrefs, class private
+        Description:
+            Remove and close the service references of a self.sdrefs key.
+            Closing a registered service reference de-registers the record.
+
+        Args
+            key - the self.sdrefs key
+
+        Returns
+            None
+
+        Raises
+            None
+        '''
+        for sdref in self.sdrefs.pop(key, list()):
+            self._fdmap.pop(sdref.fileno(), None)
+            sdref.close()
+        self._fds = self._fdmap.keys()
 
     def _register_callback(self, sdref, flags, errorcode, name,
                            regtype, domain):
@@ -326,6 +408,7 @@ class AImDNS(object):
             Raises
                 None
         '''
+        self.counters.callbacks += 1
         # note: DNSService Errors are ignored here and handled elsewhere.
         if errorcode == pyb.kDNSServiceErr_NoError and \
            self.verbose:
@@ -506,7 +589,7 @@ class AImDNS(object):
                                           comments=comments)
 
         if sdrefs is not None:
-            self.sdrefs[servicename] = sdrefs
+            self._add_sdrefs(self.servicename, sdrefs)
             self._handle_events()
         else:
             raise AIMDNSError(cw(_('error: aiMDNSError: mDNS ad hoc '
@@ -516,7 +599,8 @@ class AImDNS(object):
     def _signal_hup(self, signum, frame):
         '''Method: _signal_hup, class private
         Description:
-            Callback invoked when SIGHUP is received
+            Callback invoked when SIGHUP is received, requests the event
+            loop to refresh the registered services.
 
         Args
             signum - standard argument for callback, not used
@@ -528,76 +612,100 @@ class AImDNS(object):
         Raises
             None
         '''
-        # get the new service keys and iterate over them
-        services = config.get_all_service_names()
-        for srv in services:
-            # is this service already registered
-            if srv not in self.instance_services or srv not in self.sdrefs:
-                # need to register the service
-                if self.verbose:
-                    print _('Registering %s') % srv
-
-                sdrefs = self._register_a_service(interfaces=self.interfaces,
-                                                  name=srv)
-
-                # save the service reference list in self.sdrefs
-                if sdrefs is not None:
-                    # self.sdrefs update, force restart of event loop
-                    self._restart_loop = True
-                    if srv in self.sdrefs:
-                        self.sdrefs[srv].extend(sdrefs)
-                    else:
-                        self.sdrefs[srv] = sdrefs
+        self._refresh = True
 
-        # check the old service keys for removed or disabled services
-        for srv in self.instance_services:
-            # get the service (srv) from the instance
-            try:
-                serv = config.get_service_props(srv)
-            except KeyError:
-                # not a catastrophic error for the class as additional
-                # services can still be processed.  This error will be
-                # caught in the service log file.
-                sys.stderr.write(_('warning: No such installation service, '
-                                   '%s\n') % srv)
-
-                # remove the service references for the now non-existent
-                # service that was just identified.  This can occur when
-                # a service is deleted.
-                if srv in self.sdrefs:
-                    self._restart_loop = True
-                    for sdref in self.sdrefs[srv]:
-                        sdref.close()
-                    del self.sdrefs[srv]
+    def _signal_usr1(self, signum, frame):
+        '''Method: _signal_usr1, class private
+        Description:
+            Callback invoked when SIGUSR1 is received, prints the event
+            counters.
 
-                continue
+        Args
+            signum - standard argument for callback, not used
+            frame  - standard argument for callback, not used
 
-            # was the service removed or disabled
-            if (srv not in services) or \
-               (srv in self.sdrefs and
-                serv[config.PROP_STATUS] == config.STATUS_OFF):
+        Returns
+            None
+
+        Raises
+            None
+        '''
+        print _('aimdns: %s') % self.counters
+        sys.stdout.flush()
 
-                if self.verbose:
-                    print _('Unregistering %s') % srv
+    def sync_services(self, interfaces=None):
+        '''Method: sync_services
+        Description:
+            Brings the registered AI services up to date with the
+            installation services: registers the enabled services which are
+            not registered yet, unregisters those which were deleted or
+            disabled, and registers again those whose text record (port)
+            changed.  The registrations of the other services are kept.
 
-                # remove the registered service
-                if srv in self.sdrefs:
-                    # self.sdrefs update, force restart of event loop
-                    self._restart_loop = True
-                    for sdref in self.sdrefs[srv]:
-                        sdref.close()
-                    del self.sdrefs[srv]
+        Args
+            interfaces  - the interfaces to register the AI services on
 
-        # save the new services list
-        self.instance_services = services
+        Returns
+            tuple of the lists of the service names registered and
+            unregistered
+
+        Raises
+            AIMDNSError  - if some services could not be registered, the
+                           others are registered
+        '''
+        start = time.time()
+        if interfaces is None:
+            interfaces = self.interfaces
+
+        # the text record of each enabled service
+        wanted = dict()
+        all_props = config.get_all_service_props()
+        for srv, serv in all_props.iteritems():
+            if serv and serv.get(config.PROP_STATUS) == config.STATUS_ON:
+                wanted[srv] = serv.get(config.PROP_TXT_RECORD)
+
+        removed = sorted(srv for srv in self._registered
+                         if srv not in wanted or
+                         wanted[srv] != self._registered[srv])
+        for srv in removed:
+            if self.verbose:
+                print _('Unregistering %s') % srv
+            self._remove_sdrefs(srv)
+            del self._registered[srv]
+            self.counters.unregistrations += 1
+
+        added = sorted(srv for srv in wanted if srv not in self._registered)
+        errors = list()
+        for srv in added:
+            try:
+                sdrefs = self._register_a_service(name=srv,
+                                                  interfaces=interfaces)
+            except AIMDNSError, err:
+                # try again on the next refresh
+                errors.append(str(err))
+                continue
+            self._registered[srv] = wanted[srv]
+            if sdrefs:
+                self._add_sdrefs(srv, sdrefs)
+                self.counters.registrations += 1
+
+        self.instance_services = sorted(all_props)
+        self.counters.refreshes += 1
+        self.counters.refresh_time = time.time() - start
+        if self.verbose:
+            print _('aimdns: %s') % self.counters
+        if errors:
+            raise AIMDNSError('\n'.join(errors))
+        return added, removed
 
     def register_all(self, interfaces=None):
         '''Method: register_all
            Description:
                 Registers all AI services.  This method will loop until the
                 the application is killed.  It responds to SIGHUP signals,
-                re-checking all registered services for additions and removals
-                of a service from the AI SMF service.
+                registering and unregistering the services added, removed,
+                enabled or disabled since (see sync_services()), and to
+                SIGUSR1 signals, printing the event counters.
 
             Args
                 interfaces  - the interfaces to register the AI services on
@@ -620,25 +728,11 @@ class AImDNS(object):
         except SystemError:
             raise SystemError(_("error: the system does not have the "
                                 "system/install/server SMF service"))
-        self.instance_services = config.get_all_service_names()
 
-        # use interfaces within the class if none are passed
-        if interfaces is None:
-            interfaces = self.interfaces
-
-        # iterate through each service and register it
-        for servicename in self.instance_services:
-            sdrefs = self._register_a_service(name=servicename,
-                                              interfaces=interfaces)
-
-            # save the service reference within the class
-            if sdrefs:
-                if servicename in self.sdrefs:
-                    self.sdrefs[servicename].extend(sdrefs)
-                else:
-                    self.sdrefs[servicename] = sdrefs
+        self.sync_services(interfaces)
 
         signal.signal(signal.SIGHUP, self._signal_hup)
+        signal.signal(signal.SIGUSR1, self._signal_usr1)
         self._handle_events()
 
     def browse(self):
@@ -657,7 +751,7 @@ class AImDNS(object):
         Raises
             AImDNSError - if there are no service references available
         '''
-        self.sdrefs = dict()
+        self.clear_sdrefs()
         self._found = False
         self._resolved = list()
 
@@ -680,7 +774,7 @@ class AImDNS(object):
 
         # save the service reference
         if sdref:
-            self.sdrefs['browse'] = [sdref]
+            self._add_sdrefs('browse', [sdref])
         else:
             raise AIMDNSError(_('error: aiMDNSError: mDNS browse failed'))
 
@@ -702,7 +796,7 @@ class AImDNS(object):
             Raises:
                 AImDNSError - if there are no service references available
         '''
-        self.sdrefs = dict()
+        self.clear_sdrefs()
         self._found = False
         self._lookup = True
         self.servicename = servicename if servicename else self.servicename
@@ -725,7 +819,7 @@ class AImDNS(object):
             list_sdrefs.append(sdref)
 
         if list_sdrefs:
-            self.sdrefs['find'] = list_sdrefs
+            self._add_sdrefs('find', list_sdrefs)
         else:
             raise AIMDNSError(_('error: aiMDNSError: mDNS find failed'))
 
@@ -846,3 +940,6 @@ class AImDNS(object):
             for sdref in self.sdrefs[srv]:
                 sdref.close()
         self.sdrefs = dict()
+        self._fdmap = dict()
+        self._fds = list()
+        self._registered = dict()
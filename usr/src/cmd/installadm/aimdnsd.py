@@ -180,6 +180,8 @@ def on_exit(signum=0, frame=None):
         None
     '''
     remove_pid()
+    if AIMDNS.verbose:
+        print _('aimdns: %s') % AIMDNS.counters
     AIMDNS.clear_sdrefs()
     if signum == signal.SIGTERM:
         sys.exit(0)
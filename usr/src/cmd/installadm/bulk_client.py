@@ -0,0 +1,318 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+AI create-clients / delete-clients
+
+Create or delete the clients listed in a CSV file in one pass: each
+service's configuration, the local DHCP configuration and the boot
+configuration are read and written once for all clients, rather than
+once per client as with create-client and delete-client.
+
+Each line of the file is:
+    <MAC address>,<service name>[,<property>=<value>,...]
+where the optional fields are the client's boot arguments, as given with
+create-client -b. delete-clients only uses the MAC address. Blank lines
+and lines starting with '#' are ignored.
+'''
+import csv
+import gettext
+import logging
+import os
+import sys
+
+import osol_install.auto_install.ai_smf_service as aismf
+import osol_install.auto_install.client_control as clientctrl
+import osol_install.auto_install.installadm_common as com
+import osol_install.auto_install.service as svc
+import osol_install.auto_install.service_config as config
+
+from optparse import OptionParser
+
+from osol_install.auto_install.installadm_common import _, cli_wrap as cw
+from solaris_install import Popen
+
+
+def get_create_usage():
+    ''' get usage for create-clients'''
+    return _('create-clients\t-f|--file <csvfile>')
+
+
+def get_delete_usage():
+    ''' get usage for delete-clients'''
+    return _('delete-clients\t-f|--file <csvfile>')
+
+
+def parse_options(cmd_options=None, usage=None):
+    '''Parse and validate options
+    Args: Optional cmd_options, used for unit testing. Otherwise, cmd line
+          options handled by OptionParser
+          usage - usage of the subcommand
+    Returns: command line options
+    Raises: SystemExit on invalid options
+    '''
+    parser = OptionParser(usage='\n' + (usage or get_create_usage()))
+    parser.add_option('-f', '--file', dest='csvfile', default=None,
+                      help=_("CSV file listing the clients, one per line: "
+                             "<macaddr>,<svcname>[,<property>=<value>,...]"))
+
+    (options, args) = parser.parse_args(cmd_options)
+
+    if args:
+        parser.error(_("Unexpected argument(s): %s" % args))
+    if not options.csvfile:
+        parser.error(_("A CSV file is required (-f|--file <csvfile>)."))
+
+    logging.debug("options = %s", options)
+    return options
+
+
+def read_csv(csvfile):
+    '''Read the rows of a CSV file of clients
+
+    Args: csvfile - file object to read
+    Returns: list of (line number, list of fields), for each line which
+             is neither blank nor a comment
+    Raises: csv.Error if the file is not valid CSV
+    '''
+    rows = list()
+    reader = csv.reader(csvfile, skipinitialspace=True)
+    for fields in reader:
+        fields = [field.strip() for field in fields]
+        if not any(fields) or fields[0].startswith('#'):
+            continue
+        rows.append((reader.line_num, fields))
+    return rows
+
+
+def parse_clients(rows, need_service=True):
+    '''Check the rows of a CSV file of clients
+
+    Args: rows - rows as returned by read_csv
+          need_service - whether a service name is required (create-clients)
+    Returns: tuple of
+             list of (line number, MAC address, service name, bootargs),
+             with the MAC address as formed by the MACAddress class and
+             bootargs formatted as by create-client ('' if none)
+             list of error messages, one per invalid row
+    '''
+    clients = list()
+    errors = list()
+    seen = dict()
+    for line, fields in rows:
+        try:
+            mac_address = str(com.MACAddress(fields[0]))
+        except com.MACAddress.MACAddressError as err:
+            errors.append(_row_error(line, err))
+            continue
+        if mac_address in seen:
+            errors.append(_row_error(line, _("client %(mac)s already listed "
+                                             "on line %(line)d") %
+                                     {'mac': fields[0],
+                                      'line': seen[mac_address]}))
+            continue
+        seen[mac_address] = line
+
+        service_name = None
+        bootargs = ''
+        if need_service:
+            if len(fields) < 2 or not fields[1]:
+                errors.append(_row_error(line, _("a service name is "
+                                                 "required")))
+                continue
+            service_name = fields[1]
+            try:
+                com.validate_service_name(service_name)
+            except ValueError as err:
+                errors.append(_row_error(line, err))
+                continue
+            bootargs = ",".join(field for field in fields[2:] if field)
+            if bootargs:
+                bootargs += ","
+        clients.append((line, mac_address, service_name, bootargs))
+    return clients, errors
+
+
+def check_services(clients):
+    '''Check the services of the clients to create exist and support them
+
+    Args: clients - clients as returned by parse_clients
+    Returns: tuple of
+             dict of AIService objects, key is the service name
+             list of error messages, one per invalid row
+    '''
+    services = dict()
+    invalid = dict()
+    errors = list()
+    for line, mac_address, service_name, bootargs in clients:
+        if service_name not in services and service_name not in invalid:
+            if not config.is_service(service_name):
+                invalid[service_name] = _("The specified service does not "
+                                          "exist: %s") % service_name
+            else:
+                service = svc.AIService(service_name)
+                try:
+                    service.image
+                except KeyError:
+                    invalid[service_name] = _("The specified service does "
+                                              "not have an image_path "
+                                              "property: %s") % service_name
+                else:
+                    services[service_name] = service
+        if service_name in invalid:
+            errors.append(_row_error(line, invalid[service_name]))
+        elif bootargs and services[service_name].arch == 'sparc':
+            errors.append(_row_error(line, _("Boot arguments not supported "
+                                             "for SPARC clients.")))
+    return services, errors
+
+
+def _row_error(line, error):
+    '''Format the error found on a line of the CSV file'''
+    return _("Error:\tline %(line)d: %(error)s") % {'line': line,
+                                                    'error': error}
+
+
+def _report(errors):
+    '''Print errors and exit if there are any'''
+    if errors:
+        for error in errors:
+            print >> sys.stderr, error
+        raise SystemExit(1)
+
+
+def _read_clients(options, need_service=True):
+    '''Read and check the CSV file of clients named in options'''
+    try:
+        with open(options.csvfile) as csvfile:
+            rows = read_csv(csvfile)
+    except (IOError, csv.Error) as err:
+        raise SystemExit(_("Error:\tunable to read %(file)s: %(error)s") %
+                         {'file': options.csvfile, 'error': err})
+    clients, errors = parse_clients(rows, need_service)
+    _report(errors)
+    return clients
+
+
+def do_create_clients(cmd_options=None):
+    '''Parse the user supplied arguments and create the clients listed
+    in the CSV file. Nothing is changed if any row of the file is invalid.
+    '''
+    # check that we are root
+    if os.geteuid() != 0:
+        raise SystemExit(_("Error: Root privileges are required for "
+                           "this command."))
+
+    options = parse_options(cmd_options, get_create_usage())
+
+    # Verify that the server settings are not obviously broken, as
+    # create-client does.
+    logging.debug("Calling %s", com.CHECK_SETUP_SCRIPT)
+    ret = Popen([com.CHECK_SETUP_SCRIPT]).wait()
+    if ret:
+        raise SystemExit(1)
+
+    clients = _read_clients(options)
+    services, errors = check_services(clients)
+    _report(errors)
+
+    lines = dict((mac_address, line) for line, mac_address, service_name,
+                 bootargs in clients)
+    try:
+        # replace any existing clients, as create-client does
+        removed = clientctrl.remove_clients(["01" + mac_address for
+                                             mac_address in lines])
+        failed = dict((client_id[2:].upper(), error) for client_id, error
+                      in removed)
+        failed.update(clientctrl.setup_clients([(services[service_name],
+                                                 mac_address, bootargs) for
+                                                line, mac_address,
+                                                service_name, bootargs in
+                                                clients if mac_address not
+                                                in failed]))
+    except OSError as err:
+        raise SystemExit(err)
+    except (aismf.ServicesError, config.ServiceCfgError,
+            svc.MountError) as err:
+        raise SystemExit(err)
+
+    print cw(_("Created %d of %d clients.") % (len(clients) - len(failed),
+                                                len(clients)))
+
+    # If the installation services these clients are created for are
+    # not enabled, print warning to the user.
+    for service_name in sorted(services):
+        if not config.is_enabled(service_name):
+            logging.debug("service is disabled: %s", service_name)
+            print cw(_("\nWarning: the installation service, %s, is "
+                       "disabled. To enable it, use 'installadm enable "
+                       "%s'.") % (service_name, service_name))
+
+    _report([_row_error(line, error) for line, error in
+             sorted((lines[mac_address], error) for mac_address, error in
+                    failed.iteritems())])
+    return 0
+
+
+def do_delete_clients(cmd_options=None):
+    '''Parse the user supplied arguments and delete the clients listed
+    in the CSV file. Nothing is changed if any row of the file is invalid
+    or is not a client.
+    '''
+    # check that we are root
+    if os.geteuid() != 0:
+        raise SystemExit(_("Error: Root privileges are required for "
+                           "this command."))
+
+    options = parse_options(cmd_options, get_delete_usage())
+    clients = _read_clients(options, need_service=False)
+
+    existing = set()
+    for service_name in config.get_all_service_names():
+        try:
+            existing.update(config.get_clients(service_name))
+        except config.ServiceCfgError:
+            continue
+    _report([_row_error(line, _("Client does not exist: %s") % mac_address)
+             for line, mac_address, service_name, bootargs in clients
+             if "01" + mac_address not in existing])
+
+    lines = dict(("01" + mac_address, line) for line, mac_address,
+                 service_name, bootargs in clients)
+    try:
+        failed = clientctrl.remove_clients(lines.keys())
+    except (OSError, config.ServiceCfgError) as err:
+        raise SystemExit(err)
+
+    print cw(_("Deleted %d of %d clients.") % (len(clients) - len(failed),
+                                                len(clients)))
+    _report([_row_error(line, error) for line, error in
+             sorted((lines[client_id.upper()], error) for client_id, error
+                    in failed)])
+    return 0
+
+
+if __name__ == "__main__":
+    # initialize gettext
+    gettext.install("ai", "/usr/lib/locale")
+    do_create_clients()
@@ -41,10 +41,12 @@ from osol_install.auto_install.service import AIService
 from solaris_install import force_delete
 
 
-def _cleanup_files(client_id, more_files=()):
+def _cleanup_files(client_id, more_files=(), subnet_dirs=None):
     '''
     Removes any files that might have been used by this client at
     some point. For simplicity's sake, we check both architectures.
+    subnet_dirs, if given, is the list of _subnet_dirs() to check, so
+    that many clients can be cleaned up with one scan of com.BOOT_DIR.
     '''
     # The following files may be vestiges from failed calls to delete-service,
     # old versions of installadm, etc.
@@ -59,12 +61,12 @@ def _cleanup_files(client_id, more_files=()):
 
     # Search for pre-multihomed, subnet-specific SPARC directories
     # (e.g., /etc/netboot/192.168.0.0/010011AABB/) and add those.
-    subnet = re.compile(dhcp.IP_PATTERN)
-    for f in os.listdir(com.BOOT_DIR):
-        if subnet.match(f):
-            d = os.path.join(com.BOOT_DIR, f, client_id)
-            if os.path.isdir(d):
-                cleanup.append(d)
+    if subnet_dirs is None:
+        subnet_dirs = _subnet_dirs()
+    for f in subnet_dirs:
+        d = os.path.join(f, client_id)
+        if os.path.isdir(d):
+            cleanup.append(d)
 
     # Finally, delete any files or directories from our list that
     # might exist on the system.
@@ -73,6 +75,13 @@ def _cleanup_files(client_id, more_files=()):
             force_delete(f)
 
 
+def _subnet_dirs():
+    '''Returns the subnet-specific SPARC directories of com.BOOT_DIR'''
+    subnet = re.compile(dhcp.IP_PATTERN)
+    return [os.path.join(com.BOOT_DIR, f) for f in os.listdir(com.BOOT_DIR)
+            if subnet.match(f)]
+
+
 def _menulst_path(client_id):
     return os.path.join(com.BOOT_DIR, grub.MENULST + "." + client_id)
 
@@ -254,3 +263,216 @@ def remove_client_dhcp_config(client_id):
         print cw(_("No local DHCP configuration found. Unless it will be "
                    "reused, the bootfile '%s' may be removed from the DHCP "
                    "configuration\n" % client_id))
+
+
+def setup_clients(clients):
+    ''' Set up many clients at once
+
+    Does what setup_x86_client and setup_sparc_client do for each client,
+    but writes each service's .config file once, reads each service's
+    menu.lst once, and changes the local DHCP configuration (and restarts
+    the DHCP server) once for all clients.
+
+    Arguments:
+              clients - list of (service, mac_address, bootargs) tuples:
+                        the AIService to attach the client to, the client
+                        MAC address (as formed by MACAddress class) and
+                        its bootargs (x86 only, '' to inherit the service's)
+    Returns: list of (mac_address, error message) for the clients which
+             could not be set up
+
+    '''
+    errors = list()
+    by_service = dict()
+    for service, mac_address, bootargs in clients:
+        by_service.setdefault(service.name, (service, list()))[1].append(
+            (mac_address, bootargs))
+
+    dhcp_hosts = list()
+    for service, svc_clients in by_service.itervalues():
+        logging.debug("creating %d clients for service %s, arch %s",
+                      len(svc_clients), service.name, service.arch)
+        menulst = None
+        if service.arch == 'i386':
+            menulst = os.path.join(service.config_dir, grub.MENULST)
+            try:
+                with open(menulst) as menulst_file:
+                    menulst_lines = menulst_file.readlines()
+            except IOError as err:
+                errors.extend((mac_address, _("Unable to read grub menu.lst "
+                                              "file: %s") % err.strerror)
+                              for mac_address, bootargs in svc_clients)
+                continue
+
+        clientinfo = dict()
+        for mac_address, bootargs in svc_clients:
+            client_id = "01" + mac_address
+            try:
+                if menulst is not None:
+                    info = _create_x86_client_files(service, client_id,
+                        menulst, menulst_lines, bootargs)
+                else:
+                    link_name = os.path.join(com.BOOT_DIR, client_id)
+                    os.symlink(service.mountpoint, link_name)
+                    info = {config.FILES: [link_name]}
+            except (IOError, OSError) as err:
+                errors.append((mac_address, str(err)))
+                continue
+            clientinfo[client_id] = info
+
+        try:
+            config.add_clients_info(service.name, clientinfo)
+        except (OSError, config.ServiceCfgError) as err:
+            errors.extend((client_id[2:], str(err)) for client_id in
+                          clientinfo)
+            continue
+        if menulst is not None:
+            dhcp_hosts.extend(client_id[2:] for client_id in clientinfo)
+
+    if dhcp_hosts:
+        errors.extend(_add_dhcp_hosts(dhcp_hosts))
+    return errors
+
+
+def _create_x86_client_files(service, client_id, menulst, menulst_lines,
+                             bootargs):
+    '''
+    Creates the menu.lst.<client_id> file and pxegrub symlink of an x86
+    client from the lines of its service's menu.lst, and returns its
+    client info.
+    '''
+    client_menulst = _menulst_path(client_id)
+    if bootargs:
+        lines = [grub.replace_bootargs(line, service.bootargs, bootargs)
+                 for line in menulst_lines]
+    else:
+        lines = menulst_lines
+    with open(client_menulst, 'w') as menulst_file:
+        menulst_file.writelines(lines)
+    shutil.copymode(menulst, client_menulst)
+
+    bootfile, pxegrub_path = _pxegrub_path(client_id)
+    os.symlink("./" + service.dhcp_bootfile, pxegrub_path)
+
+    clientinfo = {config.FILES: [client_menulst, pxegrub_path]}
+    if bootargs:
+        clientinfo[config.BOOTARGS] = bootargs
+    return clientinfo
+
+
+def _add_dhcp_hosts(mac_addresses):
+    '''
+    Add host entries for x86 clients to the local DHCP configuration in one
+    go, or suggest the configuration additions if there is none.
+    Returns a list of (mac_address, error message) for the hosts which
+    could not be added.
+    '''
+    errors = list()
+    server = dhcp.DHCPServer()
+    if not server.is_configured():
+        valid_nets = list(com.get_valid_networks())
+        server_ip = valid_nets[0] if valid_nets else ''
+        print _(_PXE_CLIENT_DHCP_CONFIG % (server_ip,
+                _("01 followed by the client's MAC address")))
+        return errors
+
+    print cw(_("Adding %d host entries to local DHCP configuration.") %
+               len(mac_addresses))
+    with server.batch():
+        for mac_address in mac_addresses:
+            full_mac = AIdb.formatValue('mac', mac_address)
+            try:
+                server.add_host(full_mac, "01" + mac_address)
+            except dhcp.DHCPServerError as err:
+                errors.append((mac_address, _("Unable to add host to DHCP "
+                                              "configuration: %s") % err))
+    if not _restart_dhcp_server(server):
+        print cw(_("\nLocal DHCP configuration complete, but the DHCP "
+                   "server SMF service is offline. To enable the "
+                   "changes made, enable: %s.\nPlease see svcadm(1M) "
+                   "for further information.\n") %
+                   dhcp.DHCP_SERVER_IPV4_SVC)
+    return errors
+
+
+def remove_clients(client_ids):
+    ''' Remove many clients' configuration at once
+
+    Does what remove_client does for each client, but writes each
+    service's .config file once and changes the local DHCP configuration
+    (and restarts the DHCP server) once for all clients.
+
+    Arguments:
+              client_ids - list of client IDs ('01' + MAC address)
+    Returns: list of (client_id, error message) for the clients which
+             could not be removed
+
+    '''
+    errors = list()
+    wanted = set(client_id.upper() for client_id in client_ids)
+    dhcp_hosts = list()
+    for service in config.get_all_service_names():
+        try:
+            clients = wanted.intersection(config.get_clients(service))
+        except config.ServiceCfgError:
+            continue
+        if not clients:
+            continue
+        logging.debug("removing %d clients of service %s", len(clients),
+                      service)
+        try:
+            config.remove_clients_from_config(service, clients)
+        except (OSError, config.ServiceCfgError) as err:
+            errors.extend((client_id, str(err)) for client_id in clients)
+            wanted.difference_update(clients)
+            continue
+        if AIService(service).arch == 'i386':
+            dhcp_hosts.extend(clients)
+
+    if dhcp_hosts:
+        _remove_dhcp_hosts(dhcp_hosts)
+
+    # remove client specific symlinks/files
+    subnet_dirs = _subnet_dirs()
+    for client_id in client_ids:
+        if client_id.upper() in wanted:
+            _cleanup_files(client_id, subnet_dirs=subnet_dirs)
+    return errors
+
+
+def _remove_dhcp_hosts(client_ids):
+    '''
+    Remove host entries for x86 clients from the local DHCP configuration in
+    one go, or tell the end-user they are no longer needed if there is none.
+    '''
+    server = dhcp.DHCPServer()
+    if not server.is_configured():
+        print cw(_("No local DHCP configuration found. Unless they will be "
+                   "reused, the bootfiles of the %d deleted x86 clients may "
+                   "be removed from the DHCP configuration\n") %
+                   len(client_ids))
+        return
+
+    removed = 0
+    with server.batch():
+        for client_id in client_ids:
+            mac_address = AIdb.formatValue('mac', client_id[2:])
+            if server.host_is_configured(mac_address):
+                server.remove_host(mac_address)
+                removed += 1
+    if removed:
+        print cw(_("Removed %d host entries from local DHCP "
+                   "configuration.") % removed)
+        _restart_dhcp_server(server)
+
+
+def _restart_dhcp_server(server):
+    '''Restart the DHCP server if online. Returns False if offline.'''
+    if not server.is_online():
+        return False
+    try:
+        server.control('restart')
+    except dhcp.DHCPServerError as err:
+        print >> sys.stderr, cw(_("\nUnable to restart the DHCP SMF "
+                                  "service: %s\n" % err))
+    return True
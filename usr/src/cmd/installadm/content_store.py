@@ -0,0 +1,389 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Content store shared by the images of installadm services
+
+Services created from different updates of the same release have most of
+their files in common. When the all_services/content_store property of
+the install server SMF service names a directory, the files of each new
+image are stored there by content and hard-linked into the image, so
+that identical files of all images share their disk blocks. pkg(5) based
+images also share one download cache in the store, so that content
+already downloaded for another image is not downloaded again.
+
+Hard links share the file mode and ownership, so files are stored by
+their content, mode, owner and group. Images are not changed in place
+once created (updates create a new image), so sharing files is safe; an
+image being deleted only drops its links, and prune() removes the
+content no image uses any more.
+
+Usage, to show how much is shared or to prune the store:
+    content_store.py report|prune
+'''
+import errno
+import fcntl
+import gettext
+import hashlib
+import json
+import logging
+import os
+import stat
+import sys
+import tempfile
+import time
+
+import osol_install.auto_install.ai_smf_service as aismf
+import osol_install.auto_install.installadm_common as com
+
+from osol_install.auto_install.installadm_common import _, cli_wrap as cw
+
+
+OBJECTS = 'objects'
+DOWNLOADS = 'downloads'
+IMAGES = 'images.json'
+LOCK = '.lock'
+
+# files smaller than this are not worth sharing
+MIN_SIZE = 1
+BLOCKSIZE = 1024 * 1024
+
+
+class ContentStoreError(StandardError):
+    '''Error raised if a content store can not be used'''
+    pass
+
+
+class ContentStore(object):
+    '''Files shared by the images of installadm services, stored by
+    content in the directory path
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def objects_dir(self):
+        '''directory holding the stored files'''
+        return os.path.join(self.path, OBJECTS)
+
+    @property
+    def download_dir(self):
+        '''pkg(5) download cache shared by the images'''
+        return os.path.join(self.path, DOWNLOADS)
+
+    def add_image(self, image_path, create_time=None, fetched=None):
+        '''Store the files of an image, replacing each file already stored
+        by a hard link to the stored one.
+
+        Args: image_path - path of the image
+              create_time - seconds it took to create the image, if known
+              fetched - bytes downloaded to create the image, if known
+        Returns: dict of the statistics recorded for the image:
+                 files - number of files
+                 bytes - total size of those files
+                 shared - bytes of files which were already stored
+                 dedup_time - seconds it took to store the files
+                 create_time, fetched - as passed in
+        Raises: ContentStoreError if the store is not on the file system
+                of the image, or can not be written
+        '''
+        logging.debug("content store %s: adding image %s", self.path,
+                      image_path)
+        start = time.time()
+        record = {'files': 0, 'bytes': 0, 'shared': 0,
+                  'create_time': create_time, 'fetched': fetched}
+        with self._lock():
+            for root, dirs, files in os.walk(image_path):
+                for name in files:
+                    path = os.path.join(root, name)
+                    size = self._add_file(path)
+                    if size is None:
+                        continue
+                    record['files'] += 1
+                    record['bytes'] += abs(size)
+                    if size < 0:
+                        record['shared'] += -size
+            record['dedup_time'] = time.time() - start
+            images = self._read_images()
+            images[image_path] = record
+            self._write_images(images)
+        logging.debug("content store %s: %s", self.path, record)
+        return record
+
+    def _add_file(self, path):
+        '''Store the file at path, or link it to the stored copy.
+        Returns its size, negated if it was already stored, or None if
+        it is not stored (not a regular file, or too small).
+        '''
+        st = os.lstat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_size < MIN_SIZE:
+            return None
+        obj = self._object_path(path, st)
+        try:
+            os.link(path, obj)
+            return st.st_size
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                try:
+                    os.makedirs(os.path.dirname(obj), 0755)
+                except OSError as err:
+                    if err.errno != errno.EEXIST:
+                        raise
+                return self._add_file(path)
+            if err.errno == errno.EXDEV:
+                raise ContentStoreError(_("The content store %(store)s is "
+                                          "not on the file system of "
+                                          "%(path)s") %
+                                        {'store': self.path, 'path': path})
+            if err.errno == errno.EMLINK:
+                logging.debug("too many links to %s, not sharing %s",
+                              obj, path)
+                return None
+            if err.errno != errno.EEXIST:
+                raise
+
+        stored = os.lstat(obj)
+        if (stored.st_dev, stored.st_ino) == (st.st_dev, st.st_ino):
+            # stored by an earlier add_image of this image
+            return st.st_size
+        # replace the file by a link to the stored one, in one step
+        tmp = os.path.join(os.path.dirname(path),
+                           '.%s.%d' % (os.path.basename(path), os.getpid()))
+        try:
+            os.link(obj, tmp)
+        except OSError as err:
+            if err.errno == errno.EMLINK:
+                return None
+            raise
+        os.rename(tmp, path)
+        return -st.st_size
+
+    def _object_path(self, path, st):
+        '''Path of the stored copy of the file at path, of stat st'''
+        digest = hashlib.sha1()
+        with open(path, 'rb') as fh:
+            for block in iter(lambda: fh.read(BLOCKSIZE), ''):
+                digest.update(block)
+        digest = digest.hexdigest()
+        return os.path.join(self.objects_dir, digest[:2], '%s.%o.%d.%d' %
+                            (digest, stat.S_IMODE(st.st_mode), st.st_uid,
+                             st.st_gid))
+
+    def prune(self):
+        '''Remove the stored files no image links to any more, and the
+        records of images which no longer exist.
+
+        Returns: tuple of the number of files and bytes removed
+        '''
+        removed = 0
+        freed = 0
+        with self._lock():
+            for root, dirs, files in os.walk(self.objects_dir):
+                for name in files:
+                    obj = os.path.join(root, name)
+                    st = os.lstat(obj)
+                    if st.st_nlink == 1:
+                        os.remove(obj)
+                        removed += 1
+                        freed += st.st_size
+            images = self._read_images()
+            for image_path in images.keys():
+                if not os.path.isdir(image_path):
+                    del images[image_path]
+            self._write_images(images)
+        logging.debug("content store %s: pruned %d files, %d bytes",
+                      self.path, removed, freed)
+        return removed, freed
+
+    def usage(self):
+        '''Returns a dict of how much of the images' content is shared:
+        stored - bytes in the store
+        linked - bytes of the images' files linked to the store
+        ratio - linked / stored
+        images - dict of the statistics recorded for each image still
+                 present, key is the image path (see add_image)
+        time_saved - estimated seconds saved creating the images, or None
+                     if unknown
+        '''
+        stored = 0
+        linked = 0
+        for root, dirs, files in os.walk(self.objects_dir):
+            for name in files:
+                st = os.lstat(os.path.join(root, name))
+                stored += st.st_size
+                linked += st.st_size * (st.st_nlink - 1)
+        images = dict((path, record) for path, record in
+                      self._read_images().iteritems()
+                      if os.path.isdir(path))
+        return {'stored': stored, 'linked': linked,
+                'ratio': float(linked) / stored if stored else None,
+                'images': images,
+                'time_saved': estimate_time_saved(images.values())}
+
+    def report(self, outfile=sys.stdout):
+        '''Write a report of how much of the images' content is shared'''
+        usage = self.usage()
+        print >> outfile, _("Content store: %s") % self.path
+        print >> outfile, "%-40s %10s %8s %10s %10s" % (_("Image"),
+            _("Size"), _("Shared"), _("Created"), _("Fetched"))
+        for path in sorted(usage['images']):
+            record = usage['images'][path]
+            shared = float(record['shared']) / record['bytes'] \
+                if record['bytes'] else 0.0
+            print >> outfile, "%-40s %10s %7.1f%% %10s %10s" % (path,
+                _size(record['bytes']), 100 * shared,
+                _seconds(record['create_time']), _size(record['fetched']))
+        print >> outfile, _("Stored: %(stored)s, linked from images: "
+                            "%(linked)s") % {'stored': _size(usage['stored']),
+                                             'linked': _size(usage['linked'])}
+        if usage['ratio'] is not None:
+            print >> outfile, _("Deduplication ratio: %.2f") % usage['ratio']
+        if usage['time_saved'] is not None:
+            print >> outfile, _("Estimated creation time saved: %s") % \
+                _seconds(usage['time_saved'])
+
+    def _lock(self):
+        '''Returns a file object holding the lock of the store, creating
+        the store as needed, to be used as a context manager
+        '''
+        try:
+            os.makedirs(self.objects_dir, 0755)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise ContentStoreError(_("Unable to create the content "
+                                          "store %(store)s: %(error)s") %
+                                        {'store': self.path, 'error': err})
+        lock = open(os.path.join(self.path, LOCK), 'a')
+        fcntl.lockf(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _read_images(self):
+        '''Returns the statistics recorded for each image'''
+        try:
+            with open(os.path.join(self.path, IMAGES)) as fh:
+                return json.load(fh)
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            logging.debug("content store %s: discarding invalid %s",
+                          self.path, IMAGES)
+        return dict()
+
+    def _write_images(self, images):
+        '''Write the statistics recorded for each image'''
+        (fd, tmp) = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(images, fh, indent=1)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, os.path.join(self.path, IMAGES))
+
+
+def estimate_time_saved(records):
+    '''Estimate how much time sharing content saved creating images.
+
+    Images which shared nothing show how fast an image is created from
+    scratch; shared content would have taken that long to download (pkg
+    images) or copy (ISO images).
+
+    Args: records - statistics recorded for images (see add_image)
+    Returns: estimated seconds, or None if no image was created from
+             scratch with its creation time known
+    '''
+    timed = [record for record in records
+             if record.get('create_time') and record['bytes']]
+    baseline = [record for record in timed if not record['shared']]
+    if not baseline:
+        return None
+    rate = float(sum(record['bytes'] for record in baseline)) / \
+        sum(record['create_time'] for record in baseline)
+    return sum(record['shared'] for record in timed) / rate
+
+
+def get_content_store():
+    '''Returns the ContentStore configured for the install server, or None
+    if images do not share content.
+    '''
+    path = aismf.get_content_store()
+    if not path:
+        return None
+    return ContentStore(path)
+
+
+def dir_size(path):
+    '''Returns the total size of the files under path'''
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _size(nbytes):
+    '''Format a number of bytes for the report'''
+    if nbytes is None:
+        return '-'
+    for unit in ('', 'K', 'M', 'G'):
+        if nbytes < 1024:
+            break
+        nbytes /= 1024.0
+    else:
+        unit = 'T'
+    if unit:
+        return "%.1f%s" % (nbytes, unit)
+    return "%d" % nbytes
+
+
+def _seconds(seconds):
+    '''Format a duration for the report'''
+    if seconds is None:
+        return '-'
+    return "%.1fs" % seconds
+
+
+def main(args):
+    '''Report on or prune the content store of the install server'''
+    if len(args) != 1 or args[0] not in ('report', 'prune'):
+        raise SystemExit(_("Usage: %s report|prune") % __file__)
+    store = get_content_store()
+    if store is None:
+        raise SystemExit(cw(_("No content store is configured. Set the "
+                              "%(prop)s property of %(svc)s to use one.") %
+                            {'prop': com.CONTENT_STORE_PROP,
+                             'svc': com.SRVINST}))
+    if args[0] == 'prune':
+        removed, freed = store.prune()
+        print _("Removed %(files)d files, %(size)s") % \
+            {'files': removed, 'size': _size(freed)}
+    else:
+        store.report()
+    return 0
+
+
+if __name__ == '__main__':
+    gettext.install("ai", "/usr/lib/locale")
+    sys.exit(main(sys.argv[1:]))
@@ -34,8 +34,10 @@ import shutil
 import stat
 import sys
 import tempfile
+import time
 
 import osol_install.auto_install.ai_smf_service as aismf
+import osol_install.auto_install.content_store as content_store
 import osol_install.auto_install.installadm_common as com
 import osol_install.auto_install.service_config as config
 import pkg.client.api_errors
@@ -124,6 +126,23 @@ def set_permissions(imagepath):
     os.close(fd)
 
 
+def share_image_content(store, imagepath, create_time, fetched):
+    ''' Link the files of the image at imagepath to the identical files
+        of the other images, through the content store.
+        Failing that, the image is left as is.
+    '''
+    try:
+        record = store.add_image(imagepath, create_time, fetched)
+    except (content_store.ContentStoreError, IOError, OSError) as err:
+        print >> sys.stderr, cw(_("\nWarning: the image does not share "
+                                  "content with other images: %s\n") % err)
+        return
+    print cw(_("Content shared with other images: %(shared)d%% of "
+               "%(files)d files\n") %
+             {'shared': 100 * record['shared'] / max(record['bytes'], 1),
+              'files': record['files']})
+
+
 def get_usage():
     ''' get usage for create-service'''
     return(_(
@@ -507,7 +526,11 @@ def do_create_baseservice(options):
             options.imagepath = tempdir
         logging.debug('Using default image path: %s', options.imagepath)
 
-    # create the image area
+    # create the image area, sharing content with the other images if
+    # the install server has a content store
+    store = content_store.get_content_store()
+    create_start = time.time()
+    fetched = None
     if have_iso:
         try:
             image = InstalladmIsoImage.unpack(options.srcimage,
@@ -520,11 +543,16 @@ def do_create_baseservice(options):
             raise SystemExit(cw(_('Please re-enter command and specify '
                              'a valid Automated Installer ISO file')))
     else:
+        cache_dir = None
+        if store is not None:
+            cache_dir = store.download_dir
+            cached = content_store.dir_size(cache_dir)
         try:
             image = InstalladmPkgImage.image_create(options.srcimage,
                 options.imagepath,
                 arch=options.arch,
-                publisher=options.publisher)
+                publisher=options.publisher,
+                cache_dir=cache_dir)
         except (ImageError,
                 pkg.client.api_errors.ApiException) as err:
             print >> sys.stderr, cw(_("The specified data source, %s, "
@@ -547,6 +575,9 @@ def do_create_baseservice(options):
                     print >> sys.stderr, err.errmessage
             shutil.rmtree(options.imagepath, ignore_errors=True)
             raise SystemExit(err)
+        if cache_dir is not None:
+            fetched = content_store.dir_size(cache_dir) - cached
+    create_time = time.time() - create_start
 
     # get default service name, if needed
     if not options.svcname:
@@ -577,6 +608,8 @@ def do_create_baseservice(options):
 
     set_permissions(options.imagepath)
     print _("Image path: %s\n") % options.imagepath
+    if store is not None:
+        share_image_content(store, options.imagepath, create_time, fetched)
     try:
         if options.dhcp_ip_start:
             service = AIService.create(options.svcname, image,
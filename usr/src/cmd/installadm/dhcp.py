@@ -34,6 +34,8 @@ import struct
 import sys
 import time
 
+from contextlib import contextmanager
+
 import osol_install.auto_install.installadm_common as com
 
 from osol_install.auto_install.installadm_common import _, cli_wrap as cw
@@ -79,6 +81,17 @@ IP_PATTERN = "\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}"
 X86_VCI_PATTERN = 'match if \(sub.*"PXEClient"\);'
 SPARC_VCI_PATTERN = 'match if not \(sub.*"PXEClient"\);'
 
+# Regular expressions used to parse the configuration file (see
+# _DHCPConfigBlock)
+_TOKEN_RE = re.compile('([{};])')
+_DECL_RE = re.compile('^(host|subnet|class)\s+(\S+)')
+_HARDWARE_RE = re.compile('^hardware ethernet\s+(\S+);')
+_RANGE_RE = re.compile('^range\s+(%s)\s+(%s)' % (IP_PATTERN, IP_PATTERN))
+_FILENAME_RE = re.compile('^filename\s+"(\S+)";')
+_BOOTFILE_RE = re.compile('filename\s+\S+;')
+_X86_VCI_RE = re.compile(X86_VCI_PATTERN)
+_SPARC_VCI_RE = re.compile(SPARC_VCI_PATTERN)
+
 # Set up some block-quoted strings for the ISC DHCP configuration file.
 # We have a set of base options we want for any new file, and also we can
 # set up each type of configuration stanza here.
@@ -290,6 +303,393 @@ class _DHCPConfigHost(_DHCPConfigStanza):
         self.bootfile = bootfile
 
 
+class _DHCPDeclaration(object):
+    '''
+    A host, subnet or class declaration found in the DHCP configuration.
+    Attributes:
+        kind - 'host', 'subnet' or 'class'
+        name - the host name, subnet address or (quoted) class name
+        start - index of the line (within its block) starting the declaration
+        end - index of the line ending it
+        macs - hardware ethernet addresses (hosts)
+        ranges - list of (low, high) address tuples (subnets)
+        arch - architecture matched by the class: 'i386', 'sparc' or None
+        vci_line - index of the line holding the class' match statement
+        bootfile - first bootfile set in the class, or None
+        filename_lines - indexes of the lines setting a bootfile (classes)
+    '''
+    def __init__(self, kind, name, start):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = None
+        self.macs = list()
+        self.ranges = list()
+        self.arch = None
+        self.vci_line = None
+        self.bootfile = None
+        self.filename_lines = list()
+
+
+class _DHCPConfigBlock(object):
+    '''
+    A top-level statement of the DHCP configuration (e.g. a host or subnet
+    stanza, an option, or a comment or blank line), holding the lines of
+    the configuration file exactly as read along with the declarations
+    found in them.
+    '''
+    def __init__(self, lines):
+        self.lines = lines
+        self.decls = list()
+        self.scan()
+
+    @property
+    def host(self):
+        '''The host declaration, if this block is a host stanza'''
+        if self.decls and self.decls[0].kind == 'host' and \
+            self.decls[0].end is not None and \
+            not ''.join(self.lines[:self.decls[0].start]).strip():
+            return self.decls[0]
+        return None
+
+    def scan(self):
+        '''
+        Find the host, subnet and class declarations in this block, and
+        the statements of interest within them. Comments are ignored.
+        '''
+        self.decls = list()
+        stack = list()
+        stmt = ''
+        stmt_start = 0
+        for index, line in enumerate(self.lines):
+            content = line.partition('#')[0]
+            for piece in _TOKEN_RE.split(content):
+                if piece == '{':
+                    m = _DECL_RE.match(stmt.strip())
+                    decl = None
+                    if m is not None:
+                        decl = _DHCPDeclaration(m.group(1), m.group(2),
+                                                stmt_start)
+                        self.decls.append(decl)
+                    stack.append(decl)
+                    stmt = ''
+                elif piece == '}':
+                    if stack:
+                        decl = stack.pop()
+                        if decl is not None:
+                            decl.end = index
+                    stmt = ''
+                elif piece == ';':
+                    self._statement(stmt.strip() + ';', index, stack)
+                    stmt = ''
+                elif piece.strip():
+                    if not stmt.strip():
+                        stmt_start = index
+                    stmt += ' ' + piece.strip()
+
+    def _statement(self, stmt, index, stack):
+        '''Record a statement of interest in the innermost declaration'''
+        def innermost(kind):
+            '''innermost open declaration of kind'''
+            for decl in reversed(stack):
+                if decl is not None and decl.kind == kind:
+                    return decl
+
+        m = _HARDWARE_RE.match(stmt)
+        if m is not None:
+            host = innermost('host')
+            if host is not None:
+                host.macs.append(m.group(1))
+            return
+        m = _RANGE_RE.match(stmt)
+        if m is not None:
+            subnet = innermost('subnet')
+            if subnet is not None:
+                subnet.ranges.append(m.groups())
+            return
+        dhcp_class = innermost('class')
+        if dhcp_class is None:
+            return
+        m = _FILENAME_RE.match(stmt)
+        if m is not None:
+            if dhcp_class.bootfile is None:
+                dhcp_class.bootfile = m.group(1)
+            dhcp_class.filename_lines.append(index)
+        elif _X86_VCI_RE.search(stmt):
+            dhcp_class.arch = 'i386'
+            dhcp_class.vci_line = index
+        elif _SPARC_VCI_RE.search(stmt):
+            dhcp_class.arch = 'sparc'
+            dhcp_class.vci_line = index
+
+
+class DHCPConfigFile(object):
+    '''
+    In-memory model of an ISC DHCP configuration file, parsed once and
+    indexed by host hardware address, host name and subnet. The file is
+    kept as a list of blocks holding its lines exactly as read, so that
+    whatever is not edited, including comments and unknown statements, is
+    written back unchanged.
+    Constructor arguments:
+        text - The configuration file contents
+    Attributes:
+        dirty - True if the configuration was changed since read or written
+        signature - (inode, size, mtime) of the file when read or written
+    '''
+    def __init__(self, text=''):
+        self.blocks = list()
+        self._by_mac = dict()
+        self._by_hostname = dict()
+        self._by_subnet = dict()
+        self.signature = None
+        self.append(text)
+        self.dirty = False
+
+    @classmethod
+    def read(cls, path):
+        '''
+        Return a DHCPConfigFile for the configuration file at path, which
+        is empty if there is no such file.
+        '''
+        signature = _file_signature(path)
+        if signature is None:
+            return cls()
+        with open(path, "r") as cfg:
+            config = cls(cfg.read())
+        config.signature = signature
+        return config
+
+    def write(self, path):
+        '''
+        Atomically replace the configuration file at path with this
+        configuration.
+        '''
+        tmp_cfgfile = "%s~" % path
+        # dhcpd server runs under dhcpserv user account and needs to be able
+        # to read its config file
+        orig_umask = os.umask(0022)
+        try:
+            with open(tmp_cfgfile, "w") as tmp_cfg:
+                for block in self.blocks:
+                    tmp_cfg.writelines(block.lines)
+        finally:
+            os.umask(orig_umask)
+        os.rename(tmp_cfgfile, path)
+        self.signature = _file_signature(path)
+        self.dirty = False
+
+    def text(self):
+        '''Return the configuration file contents'''
+        return ''.join([''.join(block.lines) for block in self.blocks])
+
+    def lines(self):
+        '''Generator of the lines of the configuration file'''
+        for block in self.blocks:
+            for line in block.lines:
+                yield line
+
+    def append(self, text):
+        '''Add text to the end of the configuration'''
+        lines = text.splitlines(True)
+        if self.blocks and lines and \
+            not self.blocks[-1].lines[-1].endswith('\n'):
+            # complete the last line; its block may continue in text
+            last = self.blocks.pop()
+            self._unindex(last)
+            lines = last.lines + lines
+        for block in _split_blocks(lines):
+            self.blocks.append(block)
+            self._index(block)
+        self.dirty = True
+
+    def _index(self, block):
+        '''Add the declarations of block to the indexes'''
+        for decl in block.decls:
+            if decl.kind == 'host':
+                self._by_hostname.setdefault(decl.name, list()).append(block)
+                for mac in decl.macs:
+                    self._by_mac.setdefault(mac.lower(), list()).append(block)
+            elif decl.kind == 'subnet':
+                self._by_subnet.setdefault(decl.name, list()).append(block)
+
+    def _unindex(self, block):
+        '''Remove the declarations of block from the indexes'''
+        def drop(index, key):
+            '''remove block from index[key]'''
+            blocks = index.get(key, list())
+            if block in blocks:
+                blocks.remove(block)
+            if not blocks:
+                index.pop(key, None)
+
+        for decl in block.decls:
+            if decl.kind == 'host':
+                drop(self._by_hostname, decl.name)
+                for mac in decl.macs:
+                    drop(self._by_mac, mac.lower())
+            elif decl.kind == 'subnet':
+                drop(self._by_subnet, decl.name)
+
+    def _rescan(self, block):
+        '''Re-index block after its lines were edited'''
+        self._unindex(block)
+        block.scan()
+        self._index(block)
+        self.dirty = True
+
+    def hosts(self):
+        '''Return the hardware addresses of all hosts, in file order'''
+        return [mac for block in self.blocks for decl in block.decls
+                if decl.kind == 'host' for mac in decl.macs]
+
+    def has_host(self, macaddr):
+        '''Return True if a host has hardware address macaddr'''
+        return macaddr.lower() in self._by_mac
+
+    def has_hostname(self, hostname):
+        '''Return True if a host is declared with this name'''
+        return hostname in self._by_hostname
+
+    def remove_host(self, macaddr):
+        '''
+        Remove the first host stanza for hardware address macaddr, along
+        with the blank line setting it apart. Host declarations nested in
+        other statements are left alone.
+        Returns True if a host stanza was removed.
+        '''
+        for block in self._by_mac.get(macaddr.lower(), list()):
+            if block.host is not None:
+                break
+        else:
+            return False
+
+        index = self.blocks.index(block)
+        self._unindex(block)
+        del self.blocks[index]
+        # a stanza is added with a leading newline; don't let those pile up
+        if index > 0 and self.blocks[index - 1].lines == ['\n'] and \
+            (index == len(self.blocks) or self.blocks[index].lines == ['\n']):
+            del self.blocks[index - 1]
+        self.dirty = True
+        return True
+
+    def subnets(self):
+        '''Return the addresses of all subnets, in file order'''
+        return [decl.name for block in self.blocks for decl in block.decls
+                if decl.kind == 'subnet']
+
+    def has_subnet(self, subnet_ip):
+        '''Return True if subnet subnet_ip is declared'''
+        return subnet_ip in self._by_subnet
+
+    def subnet_ranges(self, subnet_ip):
+        '''Return the (low, high) address ranges of subnet subnet_ip'''
+        return [rng for decl in self._subnet_decls(subnet_ip)
+                for rng in decl.ranges]
+
+    def add_range(self, subnet_ip, loaddr, hiaddr):
+        '''Add an address range to the declarations of subnet subnet_ip'''
+        new_range = CFGFILE_SUBNET_RANGE_STRING % {'loaddr': loaddr,
+                                                   'hiaddr': hiaddr}
+        for block in list(self._by_subnet.get(subnet_ip, list())):
+            # insert from the bottom up, keeping the line indexes valid
+            starts = sorted([decl.start for decl in block.decls
+                             if decl.kind == 'subnet' and
+                             decl.name == subnet_ip], reverse=True)
+            for start in starts:
+                block.lines.insert(start + 1, new_range)
+            self._rescan(block)
+
+    def _subnet_decls(self, subnet_ip):
+        '''Return the declarations of subnet subnet_ip'''
+        return [decl for block in self._by_subnet.get(subnet_ip, list())
+                for decl in block.decls
+                if decl.kind == 'subnet' and decl.name == subnet_ip]
+
+    def get_class(self, arch):
+        '''
+        Return the first class declaration matching architecture arch
+        ('i386' or 'sparc'), or None.
+        '''
+        block, decl = self._get_class(arch)
+        return decl
+
+    def _get_class(self, arch):
+        '''Return the block and declaration of get_class()'''
+        for block in self.blocks:
+            for decl in block.decls:
+                if decl.kind == 'class' and decl.arch == arch:
+                    return block, decl
+        return None, None
+
+    def edit_class_bootfile(self, arch, action, bootfile=None):
+        '''
+        Set or update the bootfile in the class for architecture arch.
+        Arguments:
+            arch - 'i386' or 'sparc'
+            action - 'set' adds the bootfile after the class' match
+                     statement, 'update' replaces the first bootfile set
+                     after it (or removes it if bootfile is None).
+            bootfile - the bootfile
+        Returns True if the class was edited.
+        '''
+        block, decl = self._get_class(arch)
+        if decl is None:
+            return False
+        new_line = CFGFILE_CLASS_BOOTFILE_STRING % {'bootfile': bootfile}
+        if action == 'set':
+            block.lines.insert(decl.vci_line + 1, new_line)
+        else:
+            lines = [index for index in decl.filename_lines
+                     if index > decl.vci_line and
+                     _BOOTFILE_RE.search(block.lines[index])]
+            if not lines:
+                return False
+            if bootfile is not None:
+                block.lines[lines[0]] = new_line
+            else:
+                del block.lines[lines[0]]
+        self._rescan(block)
+        return True
+
+
+def _split_blocks(lines):
+    '''
+    Split configuration file lines into _DHCPConfigBlocks, one per blank or
+    comment line and one per top-level statement, which ends with a ';' or
+    with the '}' closing its braces.
+    '''
+    blocks = list()
+    pending = list()
+    depth = 0
+    for line in lines:
+        content = line.partition('#')[0].strip()
+        if not pending and not content:
+            blocks.append(_DHCPConfigBlock([line]))
+            continue
+        pending.append(line)
+        depth += content.count('{') - content.count('}')
+        if depth <= 0 and content.endswith((';', '}')):
+            blocks.append(_DHCPConfigBlock(pending))
+            pending = list()
+            depth = 0
+    if pending:
+        blocks.append(_DHCPConfigBlock(pending))
+    return blocks
+
+
+def _file_signature(path):
+    '''
+    Return a value that changes whenever the file at path is modified or
+    replaced, or None if there is no such file.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
 class DHCPData(object):
     '''
     Parent class of all ISC DHCP configuration data classes. This and its
@@ -319,18 +719,9 @@ class DHCPSubnet(DHCPData):
             raise ValueError('object passed not a DHCPServer object')
 
         self.subnet_ip = subnet_ip
-        self.ranges = list()
-
-        # Set up a regular expression to extract the low and high addresses
-        # of a range from a 'range' string in the configuration data.
-        regexp = re.compile("^range\s+(%s)\s+(%s)" % (IP_PATTERN, IP_PATTERN))
 
-        # Populate the 'ranges' list of tuples by applying the regexp across
-        # the DHCP server's current config and checking for our subnet_ip.
-        matches = filter(bool, map(regexp.match, server._current_config()))
-        self.ranges = [m.groups()
-            for m in matches
-                if _get_subnet(m.group(1), _get_mask(m.group(1))) == subnet_ip]
+        # The ranges are those declared within the subnet's stanza(s).
+        self.ranges = server._config.subnet_ranges(subnet_ip)
 
 
 class DHCPArchClass(DHCPData):
@@ -361,49 +752,14 @@ class DHCPArchClass(DHCPData):
         # The x86 class is determined by the VCI "PXEClient". For SPARC, we
         # use "not x86", since we only support the two architectures, and
         # there is no simple way to determine a SPARC client explicitly.
-        if arch == 'i386':
-            regexp = re.compile(X86_VCI_PATTERN)
-        elif arch == 'sparc':
-            regexp = re.compile(SPARC_VCI_PATTERN)
-        else:
+        if arch not in ('i386', 'sparc'):
             raise DHCPServerError(_("unsupported architecture: %s") % arch)
 
-        # Search for 'class' stanzas in the config data. If one is found,
-        # initialize a new list to 'record' each line of the class stanza.  If
-        # we find that it's for the architecture in question, then we can break
-        # out of parsing once we're done reading it all in. If not, move on to
-        # the next class, if there are any.
-        found = False
-        bootfile = None
-        classlines = list()
-        for line in server._current_config():
-            if line.startswith("class"):
-                # New class stanza, init a new class list
-                classlines = list()
-                continue
-            if line.endswith("}") and found:
-                # We're at the end of the class we wanted. The classlines list
-                # now contains each line of the class stanza for this
-                # architecture.
-                break
-            m = regexp.search(line)
-            if m is not None:
-                # We've found the class stanza for this architecture.
-                found = True
-            classlines.append(line)
-
-        # If we found our class, snag the bootfile if set
-        if found:
-            regexp = re.compile('^filename\s+"(\S+)";')
-            matches = [m.group(1)
-                for m in filter(bool, map(regexp.match, classlines))]
-            if matches:
-                bootfile = matches[0]
-
-        # Finally, if we found the class, instantiate and return a
-        # DHCPArchClass object.
-        if found:
-            return cls(server, arch, bootfile)
+        # Look up the first class stanza for this architecture and, if
+        # found, instantiate and return a DHCPArchClass object for it.
+        decl = server._config.get_class(arch)
+        if decl is not None:
+            return cls(server, arch, decl.bootfile)
         else:
             return None
 
@@ -463,114 +819,20 @@ class DHCPArchClass(DHCPData):
             raise ValueError(_("action 'set' requires bootfile"))
 
         # This is the workhorse for both 'set_bootfile', 'unset_bootfile' and
-        # 'update_bootfile'. We need to walk through the config data and make a
-        # copy, watching for this architecture's class stanza as we traverse.
-        # When we find it, update the bootfile setting as requested and then
-        # finish the copy.
-
-        # The x86 class is determined by the VCI "PXEClient". For SPARC, we
-        # use "not x86", since we only support the two architectures, and
-        # there is no simple way to determine a SPARC client explicitly.
-        if self.arch == 'i386':
-            vci_re = re.compile(X86_VCI_PATTERN)
-        elif self.arch == 'sparc':
-            vci_re = re.compile(SPARC_VCI_PATTERN)
+        # 'update_bootfile'. The class stanza for this architecture is found
+        # in the server's configuration, which takes care of adding the new
+        # bootfile after its match statement ('set') or of swapping it for
+        # the existing one ('update').
+        if self.arch == 'sparc':
             bootfile = fixup_sparc_bootfile(bootfile, True)
-        else:
+        elif self.arch != 'i386':
             raise DHCPServerError(_("unsupported architecture: %s") % \
                 self.arch)
 
-        bootfile_re = re.compile('filename\s+\S+;')
-
-        # Create a dictionary for use in the format string below
-        bf = {'bootfile': bootfile}
+        edit_complete = self.server._config.edit_class_bootfile(self.arch,
+            action, bootfile)
 
-        current_cfgfile = self.server._properties['config_file']
-        tmp_cfgfile = "%s~" % current_cfgfile
-
-        # Get the full configuration file, not just this server's current
-        # config, as we'll be making a copy of the current file for editing.
-        current_lines = list()
-        with open(current_cfgfile, "r") as current:
-            current_lines = current.readlines()
-
-        # Now make the copy, adding or updating the bootfile when we get to
-        # this architecture's class stanza. This gets a little involved, but
-        # the alternative appears to be to duplicate this entire block of code
-        # for updating or adding a new entry, which is not ideal. So, excessive
-        # comments are provided intentionally.
-        in_class = False
-        seek_bootfile = False
-        edit_complete = False
-        # dhcpd server runs under dhcpserv user account and needs to be able
-        # to read its config file
-        orig_umask = os.umask(0022)
-        with open(tmp_cfgfile, "w") as tmp_cfg:
-            for line in current_lines:
-                if not edit_complete:
-                    # We have not yet updated or set a new bootfile, so keep
-                    # checking for class stanzas and for the lines to edit
-                    # inside the class stanza once found. For a 'set' action,
-                    # we'll just drop in the new line after the match line. For
-                    # an 'update', we'll go further and actually find the
-                    # existing bootfile setting and swap our new one for it.
-                    if line.startswith("class"):
-                        # We have found the beginning of a class stanza, so set
-                        # our flag. Now, moving through the next set of lines,
-                        # the rest of this routine will know we're inside a
-                        # class stanza and can perform accordingly.
-                        in_class = True
-                    if line.strip().endswith("}"):
-                        # We are out of this particular class, so unset our
-                        # flag and move on. Note we could assert that
-                        # seek_bootfile shouldn't be set here (see below), but
-                        # it could be possible to have more than one class
-                        # stanza for this architecture. So, just unset that
-                        # flag as well.
-                        in_class = False
-                        seek_bootfile = False
-                    if seek_bootfile:
-                        if bootfile_re.search(line) is not None:
-                            # We're at the bootfile line in the class for this
-                            # architecture, and we want to update it (i.e. the
-                            # action is 'update'). If the bootfile argument is
-                            # set, then we're updating to a new bootfile
-                            # setting. Create a new entry and drop it in,
-                            # leaving the old one behind. If a new bootfile
-                            # wasn't passed, then we're unsetting the bootfile
-                            # altogether - just leave this line behind.  Either
-                            # way,  set our 'done' flag. We'll then just copy
-                            # the rest of the file and return.
-                            if bootfile is not None:
-                                tmp_cfg.write(CFGFILE_CLASS_BOOTFILE_STRING % \
-                                    bf)
-                            edit_complete = True
-                            continue
-                    if in_class:
-                        if vci_re.search(line) is not None:
-                            # We've found the class for this architecture
-                            if action == 'set':
-                                # We're setting a new bootfile for the class we
-                                # just entered. We haven't yet written the VCI
-                                # line to the new file yet, so write it now,
-                                # then drop in the bootfile as well and set our
-                                # 'done' flag. We'll then just copy the rest of
-                                # the file and return.
-                                tmp_cfg.write(line)
-                                tmp_cfg.write(CFGFILE_CLASS_BOOTFILE_STRING % \
-                                    bf)
-                                edit_complete = True
-                                continue
-                            else:
-                                # We're updating an existing bootfile setting,
-                                # so start looking for it by setting the seek
-                                # flag, then move onto the next line.
-                                seek_bootfile = True
-                # Write each line from the old file to the new as we traverse
-                tmp_cfg.write(line)
-        os.umask(orig_umask)
-        # Ok, we're done writing lines from the old file to the new. Let's
-        # ensure we've made our edit. If not, for whatever reason, we should
+        # Ensure we've made our edit. If not, for whatever reason, we should
         # inform the enduser that manual DHCP configuration might be required.
         if edit_complete == False:
             print cw(_("\nFailed to update the DHCP configuration. An error "
@@ -579,20 +841,28 @@ class DHCPArchClass(DHCPData):
                        "file (%s). Please ensure the bootfile is properly set "
                        "before using this service. Please see dhcpd(8) for "
                        "further information.\n") %
-                       (bootfile, self.arch, current_cfgfile))
+                       (bootfile, self.arch,
+                        self.server._properties['config_file']))
 
-        # Finally, rename the new temporary file to the configfile and return.
-        os.rename(tmp_cfgfile, current_cfgfile)
+        self.server._save_config()
 
 
 class DHCPServer(object):
     '''
     DHCPServer is used to represent and interact with the ISC DHCP server on
     the host system. The server can be configured and monitored via this class.
+
+    The configuration file is parsed once into a DHCPConfigFile, which is
+    read again only if the file is changed by someone else. Each change is
+    written back to the file atomically, or once for all the changes made
+    within a batch() block.
     '''
     def __init__(self):
         self._version = VERSION
         self.ip_version = 'IPv4'
+        self._props = None
+        self._cfg = None
+        self._batch_depth = 0
 
     @property
     def _state(self):
@@ -617,14 +887,21 @@ class DHCPServer(object):
         '''
         Returns True if the DHCP server is configured.
         '''
+        if self._cfg is not None and self._cfg.dirty:
+            # configuration not written yet (see batch())
+            return True
         return os.path.exists(self._properties['config_file'])
 
     @property
     def _properties(self):
         '''
         Retrieve the current properties for the ISC DHCP server's SMF service
-        and return to the caller as a dict keyed by property name.
+        and return to the caller as a dict keyed by property name. They are
+        retrieved once per DHCPServer object.
         '''
+        if self._props is not None:
+            return self._props
+
         cmd = [SVCCFG, "-s", DHCP_SERVER_IPV4_SVC, "listprop", "config"]
         p = Popen.check_call(cmd, stdout=Popen.STORE,
                              stderr=Popen.STORE, logger='',
@@ -635,8 +912,51 @@ class DHCPServer(object):
 
         # Apply the regular expression across the svccfg output, then build up
         # the dict from it and return it.
-        return dict([m.groups()
+        self._props = dict([m.groups()
             for m in filter(bool, map(regexp.match, p.stdout.splitlines()))])
+        return self._props
+
+    @property
+    def _config(self):
+        '''
+        Return the DHCPConfigFile for the server's configuration file,
+        parsing the file if it is not yet loaded or was changed since.
+        '''
+        path = self._properties['config_file']
+        if self._cfg is None or \
+            (not self._cfg.dirty and
+             self._cfg.signature != _file_signature(path)):
+            self._cfg = DHCPConfigFile.read(path)
+        return self._cfg
+
+    def _save_config(self):
+        '''
+        Write the configuration file if it was changed, unless within a
+        batch() block.
+        '''
+        if self._batch_depth == 0 and self._cfg is not None and \
+            self._cfg.dirty:
+            self._cfg.write(self._properties['config_file'])
+
+    @contextmanager
+    def batch(self):
+        '''
+        Context manager deferring the writes of the configuration file
+        until the end of the block, so that a series of changes (e.g.
+        adding many hosts) rewrites the file only once. Changes are not
+        written if the block raises an exception.
+        '''
+        self._batch_depth += 1
+        try:
+            yield self
+        except:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                # drop the unwritten changes
+                self._cfg = None
+            raise
+        self._batch_depth -= 1
+        self._save_config()
 
     def _current_config(self):
         '''
@@ -645,7 +965,7 @@ class DHCPServer(object):
         removed to simplify searching returned data for keywords.
         '''
         if self.is_configured():
-            for line in open(self._properties['config_file']):
+            for line in self._config.lines():
                 line = line.partition('#')[0].strip()
                 if line.startswith("log") or line == '':
                     continue
@@ -660,12 +980,13 @@ class DHCPServer(object):
         if self.is_configured():
             raise DHCPServerError(_("init_config failed, file already exists"))
 
-        # Initialize a base configuration and create a new file with it
-        new_stanza = _DHCPConfigBase()
-        self._add_stanza_to_config_file(new_stanza)
+        with self.batch():
+            # Initialize a base configuration and create a new file with it
+            new_stanza = _DHCPConfigBase()
+            self._add_stanza_to_config_file(new_stanza)
 
-        # Add configured name services to the global configuration
-        self._add_name_services()
+            # Add configured name services to the global configuration
+            self._add_name_services()
 
     def _add_name_services(self):
         '''
@@ -700,8 +1021,8 @@ class DHCPServer(object):
             # is saved off with a header and print it to the config file.
             lines.insert(0, '\n# Global name services\n')
             lines.append('\n')
-            with open(self._properties['config_file'], 'a') as cfg:
-                cfg.writelines(lines)
+            self._config.append(''.join(lines))
+            self._save_config()
 
     def control(self, action):
         '''
@@ -743,8 +1064,8 @@ class DHCPServer(object):
         '''
         Add the stanza passed to the server's configuration file.
         '''
-        with open(self._properties['config_file'], 'a') as cfg:
-            cfg.write(new_stanza.format_stanza())
+        self._config.append(new_stanza.format_stanza())
+        self._save_config()
 
     @property
     def _subnets(self):
@@ -752,34 +1073,16 @@ class DHCPServer(object):
         Return a list of DHCPSubnet objects representing each of the subnets
         that are currently configured.
         '''
-        # Set up a utility to test for subnet strings
-        def _subnet_check(s):
-            if s is not None:
-                return s.startswith("subnet")
-
-        # Set up a regular expression to extract the subnet IP from a 'subnet'
-        # string in the configuration data.
-        regexp = re.compile("^subnet\s+(%s)" % IP_PATTERN)
-
-        # Build a list of all subnet IPs in the current config. Innermost scope
-        # filters for "subnet" lines, the map applies the regular expression,
-        # and the outer filter will iterate on the matches.
-        nets = list()
-        nets = [m.group(1)
-            for m in filter(bool, map(regexp.match,
-                filter(_subnet_check, self._current_config())))]
-
-        # Now build up and return a list of DHCPSubnet objects
-        return [DHCPSubnet(self, subnet_ip) for subnet_ip in nets]
+        return [DHCPSubnet(self, subnet_ip)
+                for subnet_ip in self._config.subnets()]
 
     def lookup_subnet(self, subnet_ip):
         '''
         Return a DHCPSubnet object representing the subnet defined by
         subnet_ip. Return None if not found.
         '''
-        for net in self._subnets:
-            if net.subnet_ip == subnet_ip:
-                return net
+        if self._config.has_subnet(subnet_ip):
+            return DHCPSubnet(self, subnet_ip)
 
     def add_address_range(self, ipaddr, count, bootserver):
         '''
@@ -862,33 +1165,8 @@ class DHCPServer(object):
         if not isinstance(subnet, DHCPSubnet):
             raise ValueError('object passed not a DHCPSubnet object')
 
-        # Create a dictionary for use in the format string below
-        new_range = dict()
-        new_range = {'loaddr': loaddr, 'hiaddr': hiaddr}
-
-        current_cfgfile = self._properties['config_file']
-        tmp_cfgfile = "%s~" % current_cfgfile
-
-        # Set up a regular expression to extract the subnet IP from a 'subnet'
-        # string in the configuration data.
-        regexp = re.compile("^subnet\s+(%s)" % IP_PATTERN)
-
-        # Get the full configuration file, not just this server's current
-        # config, as we'll be making a copy of the current file for editing.
-        current_lines = list()
-        with open(current_cfgfile, "r") as current:
-            current_lines = current.readlines()
-
-        # Make the copy, and when we hit our subnet, add our range to it
-        with open(tmp_cfgfile, "w") as tmp_cfg:
-            for line in current_lines:
-                tmp_cfg.write(line)
-                m = regexp.match(line)
-                if m is not None and m.group(1) == subnet.subnet_ip:
-                    tmp_cfg.write(CFGFILE_SUBNET_RANGE_STRING % new_range)
-
-        # Rename the temporary new file to the configfile
-        os.rename(tmp_cfgfile, current_cfgfile)
+        self._config.add_range(subnet.subnet_ip, loaddr, hiaddr)
+        self._save_config()
 
     @property
     def _hosts(self):
@@ -897,24 +1175,14 @@ class DHCPServer(object):
         the DHCP server. Since we're really only concerned with whether there
         is an entry or not, we can just work with hardware addresses.
         '''
-        # Set up a regular expression to extract the hardware address from an
-        # address string in the configuration data.
-        regexp = re.compile("^hardware ethernet\s+(\S+);")
-
-        # Now apply the regexp across the current config data, assembling all
-        # of the hardware addresses in a list, and return it.
-        return [m.group(1)
-            for m in filter(bool, map(regexp.match, self._current_config()))]
+        return self._config.hosts()
 
     def host_is_configured(self, address):
         '''
         Return True if this hardware address is already configured in the DHCP
         server.
         '''
-        for host in self._hosts:
-            if host.lower() == address.lower():
-                return True
-        return False
+        return self._config.has_host(address)
 
     def add_host(self, macaddr, bootfile, hostname=None):
         '''
@@ -943,85 +1211,8 @@ class DHCPServer(object):
         '''
         logging.debug("dhcp.remove_host: removing host [%s]", macaddr)
 
-        current_cfgfile = self._properties['config_file']
-        tmp_cfgfile = "%s~" % current_cfgfile
-
-        # Get the full configuration file, not just this server's current
-        # config, as we'll be making a copy of the current file for editing.
-        current_cfg = list()
-        with open(current_cfgfile, "r") as current:
-            current_cfg = current.readlines()
-
-        # Set up a regular expression to search for the proper host stanza
-        regexp = re.compile(macaddr)
-
-        found = False
-        in_host = False
-        remove_finished = False
-        new_cfg = list()
-        hostlines = list()
-        consec_newlines = 0
-        # Walk through the current configuration lines, adding them to a new
-        # list (which we will write out to the new copy of the configuration
-        # file). If we hit a host stanza, start saving the strings off in a
-        # separate list, since it might be the host stanza we are removing and
-        # we won't know until we hit the 'hardware ethernet' line. If it's not
-        # the stanza we want to remove, then we can just add it to the new list
-        # and move on.
-        for line in current_cfg:
-            # When removing stanzas, errant newlines can build up over time.
-            if line == '\n':
-                consec_newlines += 1
-                if consec_newlines > 1:
-                    continue
-            else:
-                consec_newlines = 0
-
-            if not remove_finished:
-                if line.startswith("host"):
-                    # We're in a host stanza, init a new list and start saving
-                    # this stanza to it.
-                    in_host = True
-                    hostlines = list()
-                    hostlines.append(line)
-                    continue
-                if in_host and line.strip().endswith("}"):
-                    # We're at the end of a host stanza, clear our flag.
-                    in_host = False
-
-                    # Add this final line to the hostlines list.
-                    hostlines.append(line)
-
-                    # If we've not found our host yet, then this host stanza
-                    # we've just hit the end of needs to be written out to the
-                    # new file; add these lines to 'new_cfg'.
-                    if not found:
-                        new_cfg.extend(hostlines)
-                        continue
-
-                    # If we have found the host we're removing, set our
-                    # finished flag and just move on, leaving this host
-                    # stanza behind.
-                    remove_finished = True
-                    continue
-                if in_host and regexp.search(line):
-                    # We've found the right host stanza
-                    found = True
-
-            # If we're in a host stanza, tuck this line away on the current
-            # hostlines list. Otherwise, add it to the new configuration file.
-            if in_host:
-                hostlines.append(line)
-            else:
-                new_cfg.append(line)
-
-        # Write out the configuration lines, sans our host stanza, to the
-        # tempfile, then move the tempfile over to the configuration file.
-        with open(tmp_cfgfile, "w") as tmp_cfg:
-            for line in new_cfg:
-                tmp_cfg.write(line)
-
-        os.rename(tmp_cfgfile, current_cfgfile)
+        self._config.remove_host(macaddr)
+        self._save_config()
 
     def _get_arch_class(self, arch):
         '''
@@ -48,20 +48,34 @@ def update_bootargs(menulstpath, oldbootargs, bootargs):
     logging.log(XDEBUG, 'in update_bootargs menu.lst=%s oldbootargs=%s '
                 'bootargs=%s', menulstpath, oldbootargs, bootargs)
 
-    bootargs = bootargs.strip()
     for line in fileinput.input(menulstpath, inplace=1):
-        newline = line
-        parts = line.partition(' -B')
-        if parts[1]:
-            ending = parts[2].lstrip()
-            # Need to check for oldbootargs because '' is
-            # a valid value
-            if oldbootargs and oldbootargs in ending:
-                ending = ending.replace(oldbootargs, bootargs)
-            else:
-                ending = bootargs + ending
-            newline = parts[0] + ' -B ' + ending
-        sys.stdout.write(newline)
+        sys.stdout.write(replace_bootargs(line, oldbootargs, bootargs))
+
+
+def replace_bootargs(line, oldbootargs, bootargs):
+    '''Replace bootargs in a line of menu.lst
+
+     Input:
+        line - line of menu.lst
+        oldbootargs - bootargs to replace
+        bootargs - replacement bootargs
+     Returns:
+        the line, with bootargs in place of oldbootargs if it has a
+        kernel -B option
+
+    '''
+    bootargs = bootargs.strip()
+    parts = line.partition(' -B')
+    if not parts[1]:
+        return line
+    ending = parts[2].lstrip()
+    # Need to check for oldbootargs because '' is
+    # a valid value
+    if oldbootargs and oldbootargs in ending:
+        ending = ending.replace(oldbootargs, bootargs)
+    else:
+        ending = bootargs + ending
+    return parts[0] + ' -B ' + ending
 
 
 def update_svcname(menulstpath, newsvcname, mountdir):
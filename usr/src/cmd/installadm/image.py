@@ -51,6 +51,7 @@ import errno
 import logging
 import os
 import shutil
+import sys
 
 import pkg.client.api
 import pkg.client.imageconfig
@@ -58,6 +59,7 @@ import pkg.client.imagetypes
 import pkg.client.progress
 
 import osol_install.auto_install.installadm_common as com
+import osol_install.auto_install.iso9660 as iso9660
 
 from osol_install.auto_install.installadm_common import _, cli_wrap as cw
 from solaris_install import Popen, PKG5_API_VERSION
@@ -65,6 +67,9 @@ from solaris_install import Popen, PKG5_API_VERSION
 
 _FILE = '/usr/bin/file'
 
+# environment variable naming the pkg(5) client download cache
+_PKG_CACHEDIR = 'PKG_CACHEDIR'
+
 
 class ImageError(StandardError):
     '''Base class for InstalladmImage-unique errors'''
@@ -229,8 +234,17 @@ class InstalladmPkgImage(InstalladmImage):
         self._pkgimg = pkg_image
     
     @classmethod
-    def image_create(cls, fmri_or_p5i, targetdir, arch=None, publisher=None):
-        logging.debug("image_create, install from=%s", fmri_or_p5i)
+    def image_create(cls, fmri_or_p5i, targetdir, arch=None, publisher=None,
+                     cache_dir=None):
+        '''Creates a pkg(5) image in targetdir holding fmri_or_p5i, and
+        returns an InstalladmPkgImage object representing it.
+
+        If cache_dir is given, pkg(5) content is downloaded to and reused
+        from that directory, and kept there to be shared by other images.
+
+        '''
+        logging.debug("image_create, install from=%s, cache=%s",
+                      fmri_or_p5i, cache_dir)
         tracker = pkg.client.progress.CommandLineProgressTracker()
         root_img = pkg.client.api.ImageInterface(
             "/", PKG5_API_VERSION, tracker, None, cls._PKG_CLIENT_NAME)
@@ -262,30 +276,41 @@ class InstalladmPkgImage(InstalladmImage):
             arch = root_img.img.get_variants()[cls.ARCH_VARIANT]
         variants = {cls.ARCH_VARIANT: arch}
         
-        props = {pkg.client.imageconfig.FLUSH_CONTENT_CACHE: True}
-        pkgimg = pkg.client.api.image_create(
-                        cls._PKG_CLIENT_NAME,
-                        PKG5_API_VERSION,
-                        targetdir,
-                        pkg.client.imagetypes.IMG_USER,
-                        is_zone=False,
-                        progtrack=tracker,
-                        props=props,
-                        variants=variants
-                        )
-
-        # Add publishers to the new image, preserving the original
-        # search order
-        search_after = None
-        for pub_prefix in order:
-            add_pub = publishers[pub_prefix]
-            pkgimg.add_publisher(add_pub, search_after=search_after)
-            logging.debug("adding publisher '%s' after '%s'",
-                          add_pub.prefix, search_after)
-            search_after = pub_prefix
-        
-        ai_img = cls(targetdir, pkg_image=pkgimg)
-        ai_img._install_package(fmri_or_p5i)
+        props = {pkg.client.imageconfig.FLUSH_CONTENT_CACHE:
+                 cache_dir is None}
+        orig_cache_dir = os.environ.get(_PKG_CACHEDIR)
+        if cache_dir is not None:
+            os.environ[_PKG_CACHEDIR] = cache_dir
+        try:
+            pkgimg = pkg.client.api.image_create(
+                            cls._PKG_CLIENT_NAME,
+                            PKG5_API_VERSION,
+                            targetdir,
+                            pkg.client.imagetypes.IMG_USER,
+                            is_zone=False,
+                            progtrack=tracker,
+                            props=props,
+                            variants=variants
+                            )
+
+            # Add publishers to the new image, preserving the original
+            # search order
+            search_after = None
+            for pub_prefix in order:
+                add_pub = publishers[pub_prefix]
+                pkgimg.add_publisher(add_pub, search_after=search_after)
+                logging.debug("adding publisher '%s' after '%s'",
+                              add_pub.prefix, search_after)
+                search_after = pub_prefix
+
+            ai_img = cls(targetdir, pkg_image=pkgimg)
+            ai_img._install_package(fmri_or_p5i)
+        finally:
+            if orig_cache_dir is None:
+                os.environ.pop(_PKG_CACHEDIR, None)
+            else:
+                os.environ[_PKG_CACHEDIR] = orig_cache_dir
+
         ai_img.verify()
         ai_img._prep_ai_webserver()
         
@@ -378,18 +403,103 @@ class InstalladmPkgImage(InstalladmImage):
 class InstalladmIsoImage(InstalladmImage):
     '''Handles creation of an InstalladmImage from an AI iso'''
     @classmethod
-    def unpack(cls, iso, targetdir):
+    def unpack(cls, iso, targetdir, progress=None):
         '''Unpacks an AI ISO into targetdir, and returns an InstalladmImage
         object representing the unpacked image.
-        
+
+        The ISO is read directly, without mounting it; an ISO which can not
+        be read that way is copied from a lofi mount by setup-image.
+        progress, if given, is called as progress(done, total) with the
+        bytes copied so far and in total.
+
         '''
-        cmd = [com.SETUP_IMAGE_SCRIPT, com.IMAGE_CREATE, iso, targetdir]
-        Popen.check_call(cmd, stderr=Popen.STORE)
+        try:
+            cls._extract(iso, targetdir, progress)
+        except iso9660.ISOError as err:
+            logging.debug("unable to read %s directly (%s), mounting it",
+                          iso, err)
+            cmd = [com.SETUP_IMAGE_SCRIPT, com.IMAGE_CREATE, iso, targetdir]
+            Popen.check_call(cmd, stderr=Popen.STORE)
+        else:
+            if not os.path.isdir(os.path.join(targetdir, 'auto_install')):
+                # copy it from the solaris.zlib archive
+                cmd = [com.SETUP_IMAGE_SCRIPT, com.IMAGE_AUTO_INSTALL,
+                       targetdir]
+                Popen.check_call(cmd, stderr=Popen.STORE)
         iso_img = cls(targetdir)
         iso_img.verify()
         iso_img._prep_ai_webserver()
         return iso_img
 
+    @staticmethod
+    def _extract(iso, targetdir, progress=None):
+        '''Extract the files of an AI ISO into targetdir, checking first
+        that it is a net image and that targetdir has space for it.
+        Raises: iso9660.ISOError if the ISO can not be read directly
+                ImageError if it is not a net image, or on failure to
+                extract it
+        '''
+        image = iso9660.ISOImage(iso)
+        try:
+            entries = image.entries()
+        finally:
+            image.close()
+        if not any(entry.path == 'solaris.zlib' for entry in entries):
+            raise ImageError(cw(_("\nError:\tThe source image is not an AI "
+                                  "net image: %s") % iso))
+
+        try:
+            if not os.path.isdir(targetdir):
+                os.makedirs(targetdir)
+            fs_stat = os.statvfs(targetdir)
+        except OSError as err:
+            raise ImageError(cw(_("\nError:\tUnable to create %(path)s: "
+                                  "%(error)s") % {'path': targetdir,
+                                                  'error': err.strerror}))
+        needed = sum(entry.size for entry in entries)
+        available = fs_stat.f_bavail * fs_stat.f_frsize
+        if needed > available:
+            raise ImageError(cw(_("\nError:\tInsufficient space to copy "
+                                  "the image: %(needed)d KB necessary, "
+                                  "%(available)d KB available") %
+                                {'needed': needed // 1024,
+                                 'available': available // 1024}))
+
+        print _("Setting up the image ...")
+        if progress is None and sys.stdout.isatty():
+            progress = _ProgressPrinter()
+        try:
+            iso9660.extract(iso, targetdir, progress)
+        except (IOError, OSError) as err:
+            raise ImageError(cw(_("\nError:\tSetting up AI image failed: "
+                                  "%s") % err))
+        finally:
+            if isinstance(progress, _ProgressPrinter):
+                progress.done()
+
+
+class _ProgressPrinter(object):
+    '''Print the progress of copying an image on one terminal line'''
+
+    def __init__(self, outfile=sys.stdout):
+        self.outfile = outfile
+        self.percent = None
+
+    def __call__(self, done, total):
+        percent = 100 * done // total if total else 100
+        if percent != self.percent:
+            self.percent = percent
+            self.outfile.write(_("\r%(done)d of %(total)d MB (%(pct)d%%)") %
+                               {'done': done // 1048576,
+                                'total': total // 1048576,
+                                'pct': percent})
+            self.outfile.flush()
+
+    def done(self):
+        '''End the progress line'''
+        if self.percent is not None:
+            self.outfile.write('\n')
+
 
 def is_iso(filepath):
     '''Check if the supplied file spec is an (hsfs) ISO file,
@@ -28,6 +28,7 @@ services, clients, and DHCP configuration created before installing S11 FCS.
 """
 import fileinput
 import glob
+import heapq
 import logging
 import optparse
 import os
@@ -37,9 +38,12 @@ import socket
 import struct
 import sys
 import tempfile
+import threading
 
 import osol_install.auto_install.AI_database as AIdb
 import osol_install.auto_install.ai_smf_service as aismf
+import osol_install.auto_install.client_control as clientctrl
+import osol_install.auto_install.content_store as content_store
 import osol_install.auto_install.dhcp as dhcp
 import osol_install.auto_install.grub as grub
 import osol_install.auto_install.installadm_common as com
@@ -75,6 +79,20 @@ SERVICE_DIR = '/var/ai/service'
 AI_SVC_FMRI = 'system/install/server:default'
 SOLARIS_DHCP_SVC_FMRI = 'network/dhcp-server:default'
 ISC_DHCP_CONFIG = '/var/ai/isc_dhcp.conf'
+
+# Rough costs of the conversion steps, for the dry run time estimate
+EST_COPY_RATE = 100 * 1024 * 1024   # bytes a second copying an image
+EST_SERVICE_TIME = 2.0              # seconds converting a service
+EST_MANIFEST_TIME = 5.0             # seconds upgrading a default manifest
+EST_CLIENT_TIME = 1.0               # seconds recreating a client alone
+EST_BULK_CLIENT_TIME = 0.05         # seconds a client recreating in bulk
+EST_JOBS = 4                        # jobs to estimate for when not given
+
+# Serializes the changes to what services share (/etc/vfstab, the AI SMF
+# service properties, /etc/netboot) when services are converted in
+# parallel (--jobs)
+_SHARED_LOCK = threading.RLock()
+
 NETBOOT_ERR = _("""
 Conversion continuing.  To manually complete this step:
    Move all required non Automated Install files from /tftpboot to /etc/netboot
@@ -96,6 +114,109 @@ class ServiceConversionError(Exception):
     pass
 
 
+class _TaskOutput(object):
+    """
+    Stand-in for sys.stdout or sys.stderr while conversions run in
+    parallel.  What a task writes is held and printed in one piece when the
+    task completes, so that the output of tasks does not interleave.
+    """
+    _local = threading.local()
+    _lock = threading.Lock()
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _get_softspace(self):
+        """the print statement's softspace flag, kept for each thread"""
+        return getattr(self._local, 'softspace', dict()).get(id(self), 0)
+
+    def _set_softspace(self, value):
+        """set the print statement's softspace flag for this thread"""
+        if not hasattr(self._local, 'softspace'):
+            self._local.softspace = dict()
+        self._local.softspace[id(self)] = value
+
+    softspace = property(_get_softspace, _set_softspace)
+
+    def write(self, text):
+        """hold text if written by a task, otherwise write it now"""
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            with self._lock:
+                self.stream.write(text)
+        else:
+            held.append((self.stream, text))
+
+    def flush(self):
+        """flush the underlying stream"""
+        self.stream.flush()
+
+    @classmethod
+    def start(cls):
+        """start holding the output of the current thread"""
+        cls._local.held = list()
+
+    @classmethod
+    def finish(cls):
+        """write the held output of the current thread"""
+        held = cls._local.held
+        cls._local.held = None
+        with cls._lock:
+            for stream, text in held:
+                stream.write(text)
+            for stream in set(stream for stream, text in held):
+                stream.flush()
+
+
+def _run_tasks(function, items, jobs, errors):
+    """
+    Call function on each of items, running up to jobs of them at once.
+    Returns a list holding a (result, error) tuple for each of items, the
+    error being None unless function raised one of the errors exception
+    classes.  Any other exception is raised, in parallel mode once all of
+    the items have been processed.
+    """
+    if jobs <= 1:
+        results = list()
+        for item in items:
+            try:
+                results.append((function(item), None))
+            except errors as err:
+                results.append((None, err))
+        return results
+
+    def task(item):
+        """run function, holding its output until it completes"""
+        _TaskOutput.start()
+        try:
+            return function(item)
+        finally:
+            _TaskOutput.finish()
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _TaskOutput(stdout), _TaskOutput(stderr)
+    try:
+        results = com.run_parallel(task, items, jobs, errors=BaseException)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+    for result, err in results:
+        if err is not None and not isinstance(err, errors):
+            raise err
+    return results
+
+
+def _makespan(costs, jobs):
+    """
+    Returns how long tasks taking costs seconds take when run on jobs
+    workers, each next longest task going to the first worker free
+    """
+    workers = [0.0] * max(1, min(jobs, len(costs)))
+    for cost in sorted(costs, reverse=True):
+        heapq.heapreplace(workers, workers[0] + cost)
+    return max(workers)
+
+
 class SUNDHCPData:
     """
     Class to query Solaris DHCP server configuration material
@@ -692,9 +813,10 @@ def del_prop_group(ai_service, dry_run):
         cmd = ['/usr/sbin/svccfg', '-s', AI_SVC_FMRI, 'delprop', pg_name]
 
         try:
-            Popen.check_call(cmd, stdout=Popen.STORE,
-                stderr=Popen.STORE, logger='',
-                stderr_loglevel=logging.DEBUG)
+            with _SHARED_LOCK:
+                Popen.check_call(cmd, stdout=Popen.STORE,
+                    stderr=Popen.STORE, logger='',
+                    stderr_loglevel=logging.DEBUG)
         except CalledProcessError as err:
             sys.stderr.write(cw(_('%s failed with: %s') % (cmd,
                              err.popen.stderr)))
@@ -1190,7 +1312,8 @@ def build_option_list():
     desc = _("Utility for converting Solaris 11 Express services and clients "
              "to Solaris 11 FCS format")
     usage = _("usage: %prog [-h][--version]\n"
-              "       %prog [-n][--dryrun] [-d][--debug] [-p][--dhcp]\n")
+              "       %prog [-n][--dryrun] [-d][--debug] [-p][--dhcp] "
+              "[-j|--jobs <jobs>]\n")
 
     parser = optparse.OptionParser(version=VERSION, description=desc,
         usage=usage)
@@ -1207,6 +1330,10 @@ def build_option_list():
                       help=_("DHCP mode.  Create an ISC DHCP configuration "
                              "from the current Solaris DHCP configuration"))
 
+    parser.add_option("-j", "--jobs", dest="jobs", default=1, type="int",
+                      help=_("convert up to JOBS services and images at "
+                             "once, and recreate all clients together"))
+
     return parser
 
 
@@ -1322,11 +1449,13 @@ def move_service_directory(services, dryrun, ai_service):
 
     sdpath = os.path.join('/var/ai', ai_service)
     new_service_path = os.path.join(SERVICE_DIR, ai_service)
-    if not dryrun and not os.path.exists(SERVICE_DIR):
-        os.mkdir(SERVICE_DIR)
-    elif not os.path.isdir(SERVICE_DIR):
-        raise ServiceConversionError(
-            cw(_("Error: %s exists and is not a directory" % SERVICE_DIR)))
+    with _SHARED_LOCK:
+        if not dryrun and not os.path.exists(SERVICE_DIR):
+            os.mkdir(SERVICE_DIR)
+        elif not os.path.isdir(SERVICE_DIR):
+            raise ServiceConversionError(
+                cw(_("Error: %s exists and is not a directory" %
+                     SERVICE_DIR)))
 
     if os.path.exists(sdpath) and os.path.isdir(sdpath):
         print _("    Move %s to %s") % (sdpath, new_service_path)
@@ -1362,7 +1491,8 @@ def move_service_directory(services, dryrun, ai_service):
         print _("    Remove vfstab entry for %s if it exists" % ai_service)
         if not dryrun:
             try:
-                remove_boot_archive_from_vfstab(ai_service, service)
+                with _SHARED_LOCK:
+                    remove_boot_archive_from_vfstab(ai_service, service)
             except OSError as err:
                 raise ServiceConversionError(str(err))
 
@@ -1413,14 +1543,15 @@ def move_service_directory(services, dryrun, ai_service):
             # if symlink from /etc/netboot/wanboot.conf to
             # /etc/netboot/<service>/wanboot.conf then delete it
             netboot_lnk = os.path.join(NETBOOT, 'wanboot.conf')
-            if os.path.islink(netboot_lnk):
-                print _("    Remove link %s") % netboot_lnk
-                if not dryrun:
-                    try:
-                        os.remove(netboot_lnk)
-                    # If error encountered continue with the conversion
-                    except OSError as err:
-                        sys.stderr.write(str(err) + "\n")
+            with _SHARED_LOCK:
+                if os.path.islink(netboot_lnk):
+                    print _("    Remove link %s") % netboot_lnk
+                    if not dryrun:
+                        try:
+                            os.remove(netboot_lnk)
+                        # If error encountered continue with the conversion
+                        except OSError as err:
+                            sys.stderr.write(str(err) + "\n")
         else:
             raise ServiceConversionError(cw(_("Warning: wanboot.conf file for "
                                               "service: %s was not found" %
@@ -1449,6 +1580,56 @@ def get_bootargs(menupath):
     return bootargs.rstrip(',')
 
 
+def remove_old_client(ai_service, client, dry_run):
+    """
+    Remove the specified client of the service, and list how it will be
+    recreated.
+    x86 - save the bootargs from menu.lst
+        Remove /tftpboot/<clientid> and /tfpboot/menu.lst.<clientid>
+    sparc - remove the /etc/netboot/<clientid> directory
+
+    Returns the bootargs of x86 clients, None for sparc clients
+    """
+    # Strip : from client
+    print _("    client: %s") % client['client']
+    clientid = '01' + client['client'].replace(':', '')
+    if client['arch'] == 'i386':
+        client_menu_lst = os.path.join(TFTPBOOT, 'menu.lst.' + clientid)
+        boot_args = get_bootargs(client_menu_lst)
+
+        # remove the client specific entries in tftpboot
+        print _("    Remove %s") % client_menu_lst
+        print _("    Remove %s/%s") % (TFTPBOOT, clientid)
+        if not dry_run:
+            try:
+                # /tftpboot/<clientid> is a symlink - remove it
+                os.remove(os.path.join(TFTPBOOT, clientid))
+                os.remove(client_menu_lst)
+            # If error encountered continue with the conversion
+            except OSError as err:
+                sys.stderr.write(str(err) + "\n")
+
+    else:
+        boot_args = None
+        # remove the /etc/netboot client directory
+        netboot_dir = os.path.join(NETBOOT, clientid)
+        print _("    Remove %s") % netboot_dir
+        if not dry_run:
+            try:
+                shutil.rmtree(netboot_dir)
+            # If error encountered continue with the conversion
+            except OSError as err:
+                sys.stderr.write(str(err) + "\n")
+
+    print _("    Recreate client with ")
+    print _("        arch: %s") % client['arch']
+    print _("        service: %s") % ai_service
+    print _("        client: %s") % client['client']
+    if client['arch'] == 'i386':
+        print _("        boot_args: %s") % boot_args
+    return boot_args
+
+
 def convert_client(clients, dry_run, ai_service):
     """
     Remove the clients from the specified server and then recreate them.
@@ -1462,43 +1643,7 @@ def convert_client(clients, dry_run, ai_service):
     print _("Client conversion:")
 
     for service in clients[ai_service]:
-        # Strip : from client
-        print _("    client: %s") % service['client']
-        clientid = '01' + service['client'].replace(':', '')
-        if service['arch'] == 'i386':
-            client_menu_lst = os.path.join(TFTPBOOT, 'menu.lst.' + clientid)
-            boot_args = get_bootargs(client_menu_lst)
-
-            # remove the client specific entries in tftpboot
-            print _("    Remove %s") % client_menu_lst
-            print _("    Remove %s/%s") % (TFTPBOOT, clientid)
-            if not dry_run:
-                try:
-                    # /tftpboot/<clientid> is a symlink - remove it
-                    os.remove(os.path.join(TFTPBOOT, clientid))
-                    os.remove(client_menu_lst)
-                # If error encountered continue with the conversion
-                except OSError as err:
-                    sys.stderr.write(str(err) + "\n")
-
-        else:
-            boot_args = None
-            # remove the /etc/netboot client directory
-            netboot_dir = os.path.join(NETBOOT, clientid)
-            print _("    Remove %s") % netboot_dir
-            if not dry_run:
-                try:
-                    shutil.rmtree(netboot_dir)
-                # If error encountered continue with the conversion
-                except OSError as err:
-                    sys.stderr.write(str(err) + "\n")
-
-        print _("    Recreate client with ")
-        print _("        arch: %s") % service['arch']
-        print _("        service: %s") % ai_service
-        print _("        client: %s") % service['client']
-        if service['arch'] == 'i386':
-            print _("        boot_args: %s") % boot_args
+        boot_args = remove_old_client(ai_service, service, dry_run)
         if not dry_run:
             mac_address = service['client'].replace(':', '')
 
@@ -1512,7 +1657,51 @@ def convert_client(clients, dry_run, ai_service):
                     svc.MountError) as err:
                 sys.stderr.write("Client conversion failed:\n")
                 sys.stderr.write(str(err) + "\n")
-                
+
+
+def convert_clients(clients, dry_run, unconverted_services, jobs=1):
+    """
+    Convert the clients of all of the services which were converted.
+    With more than one job, the old clients are removed up to jobs at once
+    and all of the clients are then recreated together, so that each
+    service configuration and the DHCP configuration change only once.
+    """
+    service_names = [service_name for service_name in clients
+                     if service_name not in unconverted_services]
+    if jobs <= 1:
+        for service_name in service_names:
+            convert_client(clients, dry_run, service_name)
+        return
+
+    logging.debug("convert_clients")
+    print _("Client conversion:")
+    work = [(service_name, client) for service_name in service_names
+            for client in clients[service_name]]
+    results = _run_tasks(lambda item: remove_old_client(item[0], item[1],
+                                                        dry_run),
+                         work, jobs, ())
+    if dry_run:
+        return
+
+    new_clients = list()
+    ai_services = dict()
+    for (service_name, client), (boot_args, err) in zip(work, results):
+        try:
+            if service_name not in ai_services:
+                ai_services[service_name] = AIService(service_name)
+            mac_address = str(com.MACAddress(client['client']))
+        except (OSError, aismf.ServicesError, config.ServiceCfgError,
+                svc.MountError, com.MACAddress.MACAddressError) as err:
+            sys.stderr.write("Client conversion failed:\n")
+            sys.stderr.write(str(err) + "\n")
+            continue
+        new_clients.append((ai_services[service_name], mac_address,
+                            boot_args or ''))
+
+    for mac_address, err in clientctrl.setup_clients(new_clients):
+        sys.stderr.write("Client conversion failed:\n")
+        sys.stderr.write("%s: %s\n" % (mac_address, err))
+
 
 def copy_netboot_files(dry_run):
     """
@@ -1653,18 +1842,109 @@ def upgrade_svc_vers_1_2(services, dry_run, ai_service):
     create_config(services, dry_run, ai_service)
 
 
-def copy_image_path(service_name, service_info, dry_run):
+def convert_service(services, dry_run, ai_service):
     """
-    Copy specified image to a unique location
+    Make all of the AI service conversions for the specified service.
+    Returns None if the service was converted, or the ServiceConversionError
+    giving why it was not
+    """
+    try:
+        # Upgrade the service from 1 to 2 (ISIM)
+        upgrade_svc_vers_1_2(services, dry_run, ai_service)
+
+        # Grab the attributes for the specified service. There
+        # is only one set of attributes associated so grab the first
+        # entry in the list.
+        service_attributes = services[ai_service][0]
+
+        # if is only necessary to upgrade when the default-manifest
+        # property isn't defined for the service and the service version
+        # is not 1 or greater
+        service_version = int(service_attributes.get('version', 0))
+        if service_version >= 1:
+            return None
+
+        if not 'default-manifest' in service_attributes:
+            # Upgrade the service version from 0 to 1
+            # It is necessary to call upgrade_svc_vers_0_1 after
+            # upgrade_svc_vers_1_2 because it is necessary to upgrade the
+            # service to ISIM before calling installadm to upgrade
+            # the manifests
+            upgrade_svc_vers_0_1(services, dry_run, ai_service)
+
+    except ServiceConversionError as err:
+        print str(err)
+        return err
+    return None
+
+
+def convert_services(services, dry_run, jobs=1):
+    """
+    Make all of the AI service conversions, up to jobs services at once.
+    Returns a dictionary of the services which were not converted, each
+    with the reason why
     """
+    service_names = list(services)
+    results = _run_tasks(lambda service_name: convert_service(services,
+                             dry_run, service_name),
+                         service_names, jobs, ())
+    unconverted_services = dict()
+    for service_name, (err, unused) in zip(service_names, results):
+        if err is not None:
+            unconverted_services[service_name] = err
+    return unconverted_services
 
-    new_image_path = service_info['path']
+
+def estimate_conversion_time(services, clients, jobs):
+    """
+    Roughly estimate how long converting the services and clients takes,
+    from the size of the images to copy and typical times for the other
+    steps.
+    Returns a (serial seconds, seconds with jobs parallel jobs) tuple
+    """
+    copies = [content_store.dir_size(service_info['path']) /
+              float(EST_COPY_RATE) for service_name, service_info, new_path
+              in plan_image_copies(services)]
+
+    conversions = list()
+    for service_name in services:
+        service_attributes = services[service_name][0]
+        cost = EST_SERVICE_TIME
+        if int(service_attributes.get('version', 0)) < 1 and \
+            not 'default-manifest' in service_attributes:
+            cost += EST_MANIFEST_TIME
+        conversions.append(cost)
+
+    nclients = sum(len(clients[service_name]) for service_name in clients)
+
+    serial = sum(copies) + sum(conversions) + nclients * EST_CLIENT_TIME
+    parallel = _makespan(copies, jobs) + _makespan(conversions, jobs) + \
+        nclients * EST_BULK_CLIENT_TIME
+    return serial, parallel
+
+
+def unique_image_path(image_path, reserved):
+    """
+    Returns the first path of the form <image_path>_<n> which neither
+    exists nor is in the reserved set, and adds it to the set
+    """
     iter = 1
     while True:
-        new_image_path = service_info['path'] + '_%s' % iter
-        if not os.path.exists(new_image_path):
+        new_image_path = image_path + '_%s' % iter
+        if not (os.path.exists(new_image_path) or new_image_path in reserved):
             break
         iter += 1
+    reserved.add(new_image_path)
+    return new_image_path
+
+
+def copy_image_path(service_name, service_info, dry_run, new_image_path=None):
+    """
+    Copy specified image to a unique location
+    """
+
+    if new_image_path is None:
+        new_image_path = unique_image_path(service_info['path'], set())
 
     print cw(_("Create a unique instance of image path for %s at %s") %
             (service_name, new_image_path))
@@ -1675,12 +1955,14 @@ def copy_image_path(service_name, service_info, dry_run):
         service_info['path'] = new_image_path
 
 
-def convert_image_paths(services, dry_run):
+def plan_image_copies(services):
     """
-    If multiple services use the same image path make copies for each
+    Find the services which share an image path with another service.
+    Returns a list of (service name, service information, new image path)
+    tuples, one for each image copy to make
     """
-
-    print 'Ensure that all image paths are unique'
+    copies = list()
+    reserved = set()
     image = dict()
     for service_name in services:
         for service in services[service_name]:
@@ -1691,9 +1973,23 @@ def convert_image_paths(services, dry_run):
                 # don't throw an exception - this will get caught later
                 if not (os.path.exists(ipath) and os.path.isdir(ipath)):
                     continue
-                copy_image_path(service_name, service, dry_run)
+                copies.append((service_name, service,
+                               unique_image_path(ipath, reserved)))
 
-            image[service['path']] = service_name
+            image[ipath] = service_name
+    return copies
+
+
+def convert_image_paths(services, dry_run, jobs=1):
+    """
+    If multiple services use the same image path make copies for each,
+    up to jobs copies at once
+    """
+
+    print 'Ensure that all image paths are unique'
+    _run_tasks(lambda copy: copy_image_path(copy[0], copy[1], dry_run,
+                                            copy[2]),
+               plan_image_copies(services), jobs, ())
 
 
 def is_solaris_dhcp_host():
@@ -1835,6 +2131,7 @@ def main():
         -n, --dryrun - List but do not apply changes
         -p, --dhcp - Only generate the ISC configuration file
                      for this AI server
+        -j, --jobs - Number of services and images to convert at once
 
     """
 
@@ -1869,6 +2166,9 @@ def main():
     logging.debug("installadm conversion options: verbosity = %s",
                   options.log_level)
 
+    if options.jobs < 1:
+        parser.error(_("the number of jobs must be at least 1"))
+
     # Create an ISC DHCP configuration from the existing Solaris DHCP if
     # the AI server has been setup as the DHCP server
     # If the --dhcp option was specified then exit after creating the config
@@ -1892,6 +2192,13 @@ def main():
 
     if options.dryrun:
         print _("Dry run mode - no changes will be made to the system")
+        est_jobs = options.jobs
+        if est_jobs == 1:
+            est_jobs = EST_JOBS
+        serial, parallel = estimate_conversion_time(services,
+            get_clients(service_names) or dict(), est_jobs)
+        print cw(_("Estimated conversion time: %d seconds, or %d seconds "
+                   "with --jobs %d") % (serial, parallel, est_jobs))
     else:
         _warning = """
         WARNING: The conversion process will make changes to the file system.
@@ -1915,41 +2222,11 @@ def main():
 
     # If multiple services use the same image path then convert them so that
     # they each have their own copy
-    convert_image_paths(services, options.dryrun)
+    convert_image_paths(services, options.dryrun, options.jobs)
 
     # Make all of the AI service conversions
-    unconverted_services = dict()
-    for service_name in services:
-        try:
-            # Upgrade the service from 1 to 2 (ISIM)
-            upgrade_svc_vers_1_2(services, options.dryrun, service_name)
-
-            # Grab the attributes for the specified service. There
-            # is only one set of attributes associated so grab the first
-            # entry in the list.
-            service_attributes = services[service_name][0]
-
-            # if is only necessary to upgrade when the default-manifest
-            # property isn't defined for the service and the service version
-            # is not 1 or greater
-            service_version = int(service_attributes.get('version', 0))
-            if service_version >= 1:
-                continue
-
-            if not 'default-manifest' in service_attributes:
-                # Upgrade the service version from 0 to 1
-                # It is necessary to call upgrade_svc_vers_0_1 after
-                # upgrade_svc_vers_1_2 because it is necessary to upgrade the
-                # service to ISIM before calling installadm to upgrade
-                # the manifests
-                upgrade_svc_vers_0_1(services, options.dryrun, service_name)
-
-        except ServiceConversionError as err:
-            print str(err)
-            # Add the service to the list of services that were not converted
-            # and keep the reason so that this list can be presented to the
-            # user at the end of the conversion
-            unconverted_services[service_name] = err
+    unconverted_services = convert_services(services, options.dryrun,
+                                            options.jobs)
 
     # Make all of the client conversions
     clients = get_clients(service_names)
@@ -1957,10 +2234,9 @@ def main():
         output = _('There are no clients configured on this server.\n')
         sys.stdout.write(output)
     else:
-        for service_name in clients:
-            # Only convert the client if the service was converted successfully
-            if not service_name in unconverted_services:
-                convert_client(clients, options.dryrun, service_name)
+        # Only convert the clients of services converted successfully
+        convert_clients(clients, options.dryrun, unconverted_services,
+                        options.jobs)
 
     copy_netboot_files(options.dryrun)
 
@@ -34,6 +34,8 @@ import osol_install.auto_install.service_config as config
 
 from optparse import OptionParser, SUPPRESS_HELP
 
+from osol_install.auto_install import bulk_client
+from osol_install.auto_install import bulk_import
 from osol_install.auto_install import create_client
 from osol_install.auto_install import create_profile
 from osol_install.auto_install import create_service
@@ -45,6 +47,7 @@ from osol_install.auto_install import export
 from osol_install.auto_install import list as ai_list
 from osol_install.auto_install import publish_manifest
 from osol_install.auto_install import rename_service
+from osol_install.auto_install import resolve
 from osol_install.auto_install import set_criteria
 from osol_install.auto_install import set_service
 from osol_install.auto_install import validate_profile
@@ -240,6 +243,10 @@ def main():
                               create_profile.get_update_usage()),
         'delete-client':     (delete_client.do_delete_client,
                               delete_client.get_usage()),
+        'create-clients':    (bulk_client.do_create_clients,
+                              bulk_client.get_create_usage()),
+        'delete-clients':    (bulk_client.do_delete_clients,
+                              bulk_client.get_delete_usage()),
         'create-manifest':   (publish_manifest.do_publish_manifest,
                               publish_manifest.get_create_usage()),
         'add-manifest':      (publish_manifest.do_publish_manifest,  # alias
@@ -252,6 +259,10 @@ def main():
                               delete_profile.get_usage()),
         'export':            (export.do_export,
                               export.get_usage()),
+        'import':            (bulk_import.do_import,
+                              bulk_import.get_usage()),
+        'resolve':           (resolve.do_resolve,
+                              resolve.get_usage()),
         'remove':            (delete_manifest.do_delete_manifest,  # alias
                               delete_manifest.get_usage()),
         'set-criteria':      (set_criteria.do_set_criteria,
@@ -272,6 +283,8 @@ def main():
             "disable",
             "create-client",
             "delete-client",
+            "create-clients",
+            "delete-clients",
             "create-manifest",
             "update-manifest",
             "delete-manifest",
@@ -279,6 +292,8 @@ def main():
             "update-profile",
             "delete-profile",
             "export",
+            "import",
+            "resolve",
             "validate",
             "set-criteria",
             "help",
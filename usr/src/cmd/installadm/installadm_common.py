@@ -27,10 +27,12 @@ Common Python Objects for Installadm Commands
 import gettext
 import logging
 import os
+import Queue
 import re
 import stat
 import StringIO
 import sys
+import threading
 import time
 
 from textwrap import fill, dedent
@@ -65,6 +67,7 @@ EXCLPROP = 'all_services/exclude_networks'
 NETSPROP = 'all_services/networks'
 PORTPROP = 'all_services/port'
 BASEDIR_PROP = 'all_services/default_imagepath_basedir'
+CONTENT_STORE_PROP = 'all_services/content_store'
 
 # File used to verify that image is ai netimage
 AI_NETIMAGE_REQUIRED_FILE = "solaris.zlib"
@@ -86,6 +89,7 @@ BOOT_DIR = '/etc/netboot'
 # Script paths and arguments
 AIWEBSERVER = "aiwebserver"
 CHECK_SETUP_SCRIPT = "/usr/lib/installadm/check-server-setup"
+IMAGE_AUTO_INSTALL = "auto_install"
 IMAGE_CREATE = "create"
 SERVICE_DISABLE = "disable"
 SERVICE_LIST = "list"
@@ -192,6 +196,42 @@ def cli_wrap(text):
     return ("\n".join(map(_text_wrap, text.splitlines())) + "\n")
 
 
+def run_parallel(function, items, jobs, errors=(SystemExit, StandardError)):
+    '''Call function on each of items from up to jobs threads.
+    Input: function - function to call with each item
+           items - list of items
+           jobs - maximum number of threads
+           errors - exception classes to catch and return
+    Returns: a list holding, for each of items in order, a (result, None)
+             tuple or a (None, error) tuple if function raised one of errors
+
+    '''
+    results = [None] * len(items)
+    work = Queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+
+    def worker():
+        '''process items until there are none left'''
+        while True:
+            try:
+                index, item = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = (function(item), None)
+            except errors as err:
+                results[index] = (None, err)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(jobs, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
 #
 # General classes below
 #
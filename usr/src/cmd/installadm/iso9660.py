@@ -0,0 +1,567 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Extract an ISO 9660 image without mounting it
+
+The directory records of the image are read directly from the file, with
+the Rock Ridge extensions (names, modes, ownership, times and symbolic
+links) when present. Files are then read in the order they are laid out
+in the image, in large sequential reads, by a thread feeding the thread
+writing them out, so that reading the image and writing the files
+overlap.
+'''
+import calendar
+import errno
+import logging
+import os
+import Queue
+import stat
+import struct
+import threading
+
+from osol_install.auto_install.installadm_common import _, XDEBUG
+
+
+SECTOR_SIZE = 2048
+# first volume descriptor
+VD_START = 16
+VD_PRIMARY = 1
+VD_TERMINATOR = 255
+VD_ID = 'CD001'
+
+# file flags of a directory record
+FLAG_DIRECTORY = 0x02
+FLAG_MULTI_EXTENT = 0x80
+
+# size of the reads of file content, and number of reads queued ahead
+CHUNK_SIZE = 1024 * 1024
+QUEUE_DEPTH = 8
+
+# modes of files without Rock Ridge attributes, as given by hsfs(7FS)
+_DEFAULT_DIR_MODE = stat.S_IFDIR | 0555
+_DEFAULT_FILE_MODE = stat.S_IFREG | 0555
+
+
+class ISOError(StandardError):
+    '''Error raised if a file is not a readable ISO 9660 image'''
+    pass
+
+
+class ISOEntry(object):
+    '''A file, directory or symbolic link of an ISO 9660 image'''
+
+    def __init__(self, path, mode, extents=None, size=0, uid=None, gid=None,
+                 mtime=None, target=None):
+        self.path = path
+        self.mode = mode
+        self.extents = extents or list()
+        self.size = size
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.target = target
+
+    def __repr__(self):
+        return "ISOEntry(%r, %o, %d)" % (self.path, self.mode, self.size)
+
+    @property
+    def is_dir(self):
+        '''True if this is a directory'''
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_link(self):
+        '''True if this is a symbolic link'''
+        return stat.S_ISLNK(self.mode)
+
+
+class ISOImage(object):
+    '''An ISO 9660 image file, read without mounting it'''
+
+    def __init__(self, path):
+        '''Open the image at path and read its primary volume descriptor.
+        Raises: ISOError if the file is not an ISO 9660 image
+                IOError if the file can not be read
+        '''
+        self.path = path
+        self._file = open(path, 'rb')
+        self._susp_skip = None
+        try:
+            self._root = self._read_volume_descriptors()
+        except:
+            self._file.close()
+            raise
+
+    def close(self):
+        '''Close the image file'''
+        self._file.close()
+
+    def _read(self, sector, length):
+        '''Read length bytes from sector'''
+        self._file.seek(sector * SECTOR_SIZE)
+        data = self._file.read(length)
+        if len(data) != length:
+            raise ISOError(_("%(path)s: truncated at sector %(sector)d") %
+                           {'path': self.path, 'sector': sector})
+        return data
+
+    def _read_volume_descriptors(self):
+        '''Returns the root directory record of the primary volume'''
+        sector = VD_START
+        while True:
+            vd = self._read(sector, SECTOR_SIZE)
+            if vd[1:6] != VD_ID:
+                raise ISOError(_("%s is not an ISO 9660 image") % self.path)
+            vd_type = ord(vd[0])
+            if vd_type == VD_PRIMARY:
+                block_size = struct.unpack('<H', vd[128:130])[0]
+                if block_size != SECTOR_SIZE:
+                    raise ISOError(_("%(path)s: unsupported block size "
+                                     "%(size)d") % {'path': self.path,
+                                                    'size': block_size})
+                return vd[156:190]
+            if vd_type == VD_TERMINATOR:
+                raise ISOError(_("%s has no primary volume descriptor") %
+                               self.path)
+            sector += 1
+
+    def entries(self):
+        '''Returns the list of ISOEntry objects of the image, each
+        directory before its content.
+        Raises: ISOError if the image is corrupt
+        '''
+        root = _parse_record(self._root)
+        entries = list()
+        self._walk(root['extent'], root['size'], '', entries, set())
+
+        # two entries of a path, e.g. a symbolic link and a directory,
+        # would let the content of one be written through the other
+        paths = set()
+        for entry in entries:
+            if entry.path in paths:
+                raise ISOError(_("%(path)s: duplicate entry %(entry)s") %
+                               {'path': self.path, 'entry': entry.path})
+            paths.add(entry.path)
+        return entries
+
+    def _walk(self, extent, size, parent, entries, seen):
+        '''Add the entries of the directory at extent to entries'''
+        if extent in seen:
+            raise ISOError(_("%s: directory loop") % self.path)
+        seen.add(extent)
+
+        data = self._read(extent, size)
+        records = list(_records(data))
+        if not records:
+            raise ISOError(_("%(path)s: empty directory at sector "
+                             "%(sector)d") % {'path': self.path,
+                                              'sector': extent})
+        if self._susp_skip is None:
+            # the '.' record of the root tells whether SUSP is used
+            self._susp_skip = _susp_skip(records[0]['system_use'])
+
+        pending = None
+        for record in records[2:]:
+            rrip = self._rock_ridge(record)
+            if 'relocated' in rrip:
+                # found through the CL entry of its original parent
+                continue
+            name = rrip.get('name') or _iso_name(record['name'],
+                                                 record['flags'])
+            if name in ('', '.', '..') or '/' in name or '\0' in name:
+                raise ISOError(_("%(path)s: invalid file name %(name)r in "
+                                 "%(parent)s") %
+                               {'path': self.path, 'name': name,
+                                'parent': parent or '/'})
+            path = os.path.join(parent, name)
+
+            if pending is not None and pending.path == path:
+                # next extent of a multi-extent file
+                pending.extents.append((record['extent'], record['size']))
+                pending.size += record['size']
+            else:
+                mode = rrip.get('mode')
+                if 'child' in rrip:
+                    mode = mode or _DEFAULT_DIR_MODE
+                elif mode is None:
+                    mode = _DEFAULT_DIR_MODE if record['flags'] & \
+                        FLAG_DIRECTORY else _DEFAULT_FILE_MODE
+                pending = ISOEntry(path, mode,
+                                   [(record['extent'], record['size'])],
+                                   record['size'], rrip.get('uid'),
+                                   rrip.get('gid'),
+                                   rrip.get('mtime', record['mtime']),
+                                   rrip.get('target'))
+                entries.append(pending)
+                if 'child' in rrip:
+                    child = self._read(rrip['child'], SECTOR_SIZE)
+                    dot = _parse_record(child[:ord(child[0])])
+                    self._walk(dot['extent'], dot['size'], path, entries,
+                               seen)
+                elif record['flags'] & FLAG_DIRECTORY:
+                    pending.size = 0
+                    self._walk(record['extent'], record['size'], path,
+                               entries, seen)
+            if not record['flags'] & FLAG_MULTI_EXTENT:
+                pending = None
+
+    def _rock_ridge(self, record):
+        '''Returns a dict of the Rock Ridge attributes of a directory
+        record: name, mode, uid, gid, mtime, target (of a symbolic link),
+        child (sector of a relocated directory), relocated
+        '''
+        attrs = dict()
+        if self._susp_skip is None:
+            return attrs
+        name = ''
+        target = list()
+        area = record['system_use'][self._susp_skip:]
+        areas_read = 0
+        while area:
+            continuation = None
+            for sig, data in _susp_entries(area):
+                if sig == 'CE':
+                    continuation = (_both32(data, 0), _both32(data, 8),
+                                    _both32(data, 16))
+                elif sig == 'PX':
+                    attrs['mode'] = _both32(data, 0)
+                    attrs['uid'] = _both32(data, 16)
+                    attrs['gid'] = _both32(data, 24)
+                elif sig == 'NM':
+                    flags = ord(data[0])
+                    if not flags & 0x06:
+                        name += data[1:]
+                elif sig == 'SL':
+                    target.extend(_sl_components(data[1:]))
+                elif sig == 'TF':
+                    mtime = _tf_mtime(data)
+                    if mtime is not None:
+                        attrs['mtime'] = mtime
+                elif sig == 'CL':
+                    attrs['child'] = _both32(data, 0)
+                elif sig == 'RE':
+                    attrs['relocated'] = True
+                elif sig == 'ST':
+                    break
+            area = ''
+            if continuation is not None and areas_read < 16:
+                sector, offset, length = continuation
+                area = self._read(sector, offset + length)[offset:]
+                areas_read += 1
+        if name:
+            attrs['name'] = name
+        if target:
+            attrs['target'] = _sl_path(target)
+        return attrs
+
+
+def extract(iso, targetdir, progress=None):
+    '''Extract the ISO 9660 image iso into targetdir
+
+    Args: iso - path of the image
+          targetdir - directory to extract to, created if needed
+          progress - if given, called as progress(done, total) with the
+                     number of bytes of file content written so far and
+                     to write in total
+    Returns: the list of ISOEntry objects extracted
+    Raises: ISOError if iso is not a readable ISO 9660 image
+            IOError, OSError on failure to read iso or write the files
+    '''
+    image = ISOImage(iso)
+    try:
+        entries = image.entries()
+        total = sum(entry.size for entry in entries
+                    if stat.S_ISREG(entry.mode))
+        logging.debug("extracting %d entries, %d bytes, of %s to %s",
+                      len(entries), total, iso, targetdir)
+
+        if not os.path.isdir(targetdir):
+            os.makedirs(targetdir)
+        # directories are checked with lstat, so that no file is written
+        # through a symbolic link left in targetdir
+        for entry in entries:
+            if entry.is_dir:
+                path = _target_path(targetdir, entry)
+                if not stat.S_ISDIR(_lmode(path)):
+                    _remove(path)
+                    os.mkdir(path, 0700)
+
+        _copy_files(image, targetdir,
+                    [entry for entry in entries if stat.S_ISREG(entry.mode)],
+                    total, progress)
+    finally:
+        image.close()
+
+    # symbolic links last, once nothing else is written to the image
+    for entry in entries:
+        if entry.is_link:
+            path = _target_path(targetdir, entry)
+            _remove(path)
+            os.symlink(entry.target, path)
+
+    # set attributes last, deepest first, so that read-only directories
+    # can be filled and their times are not changed by their content
+    is_root = os.geteuid() == 0
+    for entry in reversed(entries):
+        path = _target_path(targetdir, entry)
+        if is_root and entry.uid is not None:
+            os.lchown(path, entry.uid, entry.gid)
+        if entry.is_link:
+            continue
+        os.chmod(path, stat.S_IMODE(entry.mode))
+        if entry.mtime is not None:
+            os.utime(path, (entry.mtime, entry.mtime))
+    return entries
+
+
+def _copy_files(image, targetdir, files, total, progress):
+    '''Copy the content of files from image to targetdir: a thread reads
+    the files in the order of their extents, while this one writes them.
+    '''
+    # read the image sequentially, as far as its layout allows
+    files = sorted(files, key=lambda entry: entry.extents and
+                   entry.extents[0][0])
+    chunks = Queue.Queue(QUEUE_DEPTH)
+    stop = threading.Event()
+    failure = list()
+
+    def put(item):
+        '''queue item unless the writer stopped'''
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def reader():
+        '''read the content of files into chunks'''
+        try:
+            with open(image.path, 'rb') as isofile:
+                for index, entry in enumerate(files):
+                    if not put((index, None)):
+                        return
+                    for extent, size in entry.extents:
+                        isofile.seek(extent * SECTOR_SIZE)
+                        while size > 0:
+                            data = isofile.read(min(size, CHUNK_SIZE))
+                            if not data:
+                                raise ISOError(_("%(path)s: truncated in "
+                                                 "%(file)s") %
+                                               {'path': image.path,
+                                                'file': entry.path})
+                            size -= len(data)
+                            if not put((index, data)):
+                                return
+        except Exception as err:
+            failure.append(err)
+        put(None)
+
+    thread = threading.Thread(target=reader, name="iso9660-reader")
+    thread.daemon = True
+    thread.start()
+
+    done = 0
+    outfile = None
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            index, data = item
+            if data is None:
+                if outfile is not None:
+                    outfile.close()
+                path = _target_path(targetdir, files[index])
+                _remove(path)
+                outfile = open(path, 'wb')
+                logging.log(XDEBUG, "extracting %s", path)
+                continue
+            outfile.write(data)
+            done += len(data)
+            if progress is not None:
+                progress(done, total)
+    finally:
+        if outfile is not None:
+            outfile.close()
+        stop.set()
+        thread.join()
+    if failure:
+        raise failure[0]
+    if progress is not None and done == 0:
+        progress(done, total)
+
+
+def _target_path(targetdir, entry):
+    '''Returns the path of entry in targetdir.
+    Raises: ISOError if the path of entry is not in targetdir
+    '''
+    path = os.path.normpath(os.path.join(targetdir, entry.path))
+    if not path.startswith(os.path.join(os.path.normpath(targetdir), '')):
+        raise ISOError(_("%s is outside the image directory") % entry.path)
+    return path
+
+
+def _lmode(path):
+    '''Returns the mode of path, not following a symbolic link, or 0 if
+    there is no such file'''
+    try:
+        return os.lstat(path).st_mode
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return 0
+
+
+def _remove(path):
+    '''Remove the file at path, if any, as cpio -u does'''
+    try:
+        os.unlink(path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def _records(data):
+    '''Generate the directory records of the directory data'''
+    offset = 0
+    while offset < len(data):
+        length = ord(data[offset])
+        if length == 0:
+            # records do not cross sectors; skip to the next one
+            offset = (offset // SECTOR_SIZE + 1) * SECTOR_SIZE
+            continue
+        if length < 34 or offset + length > len(data):
+            raise ISOError(_("invalid directory record"))
+        yield _parse_record(data[offset:offset + length])
+        offset += length
+
+
+def _parse_record(record):
+    '''Returns a dict of the fields of a directory record'''
+    name_len = ord(record[32])
+    system_use = 33 + name_len + (1 - name_len % 2)
+    return {'extent': _both32(record, 2),
+            'size': _both32(record, 10),
+            'mtime': _record_time(record[18:25]),
+            'flags': ord(record[25]),
+            'name': record[33:33 + name_len],
+            'system_use': record[system_use:]}
+
+
+def _both32(data, offset):
+    '''Returns the both-endian 32-bit number at offset of data'''
+    return struct.unpack('<I', data[offset:offset + 4])[0]
+
+
+def _record_time(data):
+    '''Returns the time, in seconds since the epoch, of a 7-byte date'''
+    year, month, day, hour, minute, second, gmtoff = \
+        struct.unpack('6Bb', data)
+    if month == 0 or day == 0:
+        return None
+    try:
+        return calendar.timegm((1900 + year, month, day, hour, minute,
+                                second)) - gmtoff * 15 * 60
+    except (ValueError, OverflowError):
+        return None
+
+
+def _iso_name(name, flags):
+    '''Map a plain ISO 9660 file identifier to a file name, as hsfs does:
+    drop the version and a trailing dot, and use lower case'''
+    if not flags & FLAG_DIRECTORY:
+        name = name.split(';')[0]
+        if name.endswith('.'):
+            name = name[:-1]
+    return name.lower()
+
+
+def _susp_skip(system_use):
+    '''Returns the number of bytes to skip in the system use area of
+    each directory record if the image uses the System Use Sharing
+    Protocol (Rock Ridge), or None if it does not'''
+    if system_use[:2] == 'SP' and system_use[4:6] == '\xbe\xef':
+        return ord(system_use[6])
+    return None
+
+
+def _susp_entries(area):
+    '''Generate the (signature, data) of the SUSP entries of area'''
+    offset = 0
+    while offset + 4 <= len(area):
+        sig = area[offset:offset + 2]
+        length = ord(area[offset + 2])
+        if length < 4:
+            break
+        yield sig, area[offset + 4:offset + length]
+        offset += length
+
+
+def _sl_components(data):
+    '''Returns the components of the symbolic link data of an SL entry,
+    as (flags, text) tuples'''
+    components = list()
+    offset = 0
+    while offset + 2 <= len(data):
+        flags = ord(data[offset])
+        length = ord(data[offset + 1])
+        components.append((flags, data[offset + 2:offset + 2 + length]))
+        offset += 2 + length
+    return components
+
+
+def _sl_path(components):
+    '''Returns the target of a symbolic link from its SL components'''
+    parts = list()
+    text = ''
+    for flags, content in components:
+        if flags & 0x02:
+            text += '.'
+        elif flags & 0x04:
+            text += '..'
+        elif flags & 0x08:
+            text += '/'
+        else:
+            text += content
+        if not flags & 0x01:
+            parts.append(text)
+            text = ''
+    if text:
+        parts.append(text)
+    if parts and parts[0] == '/':
+        return '/' + '/'.join(parts[1:])
+    return '/'.join(parts)
+
+
+def _tf_mtime(data):
+    '''Returns the modification time of the data of a TF entry'''
+    flags = ord(data[0])
+    size = 17 if flags & 0x80 else 7
+    if not flags & 0x02 or size != 7:
+        return None
+    # the modification time follows the creation time, if any
+    offset = 1 + (size if flags & 0x01 else 0)
+    return _record_time(data[offset:offset + size])
@@ -25,15 +25,19 @@
 AI List Services
 """
 import gettext
+import json
+import logging
 import os
 import sys
+import tempfile
 
 import osol_install.auto_install.AI_database as AIdb
 import osol_install.auto_install.service_config as config
 
 from optparse import OptionParser
 
-from osol_install.auto_install.installadm_common import _, cli_wrap as cw
+from osol_install.auto_install.installadm_common import _, run_parallel, \
+    cli_wrap as cw
 from osol_install.auto_install.service import AIService, VersionError
 
 # FDICT contains the width of each field that gets printed
@@ -53,6 +57,15 @@ _WARNED_ABOUT = set()
 ARCH_UNKNOWN = _('* - Architecture unknown, service image does '
                  'not exist or is inaccessible.\n')
 
+# maximum number of services whose information is gathered concurrently
+JOBS = 8
+
+# file in a service's directory caching the criteria read from its database
+SUMMARY_CACHE = '.list-cache'
+
+# summaries of the service databases read by this invocation
+_SUMMARIES = dict()
+
 
 def warn_version(version_err):
     '''Prints a short warning about version incompatibility to stderr
@@ -141,6 +154,177 @@ def which_arch(service):
     return service.arch
 
 
+def get_db_summaries(snames):
+    """
+    Reads the manifest and profile criteria from the databases of the
+    named services, up to JOBS services at once. Each database is read
+    only once per invocation (see read_db_summary).
+
+    Args
+        snames = list of service names
+
+    Returns
+        a list holding, for each service name in order, a tuple of the
+        summary of its database (see read_db_summary) and None, or of
+        None and the error raised while reading it
+
+    Raises
+        None
+    """
+    unread = [sname for sname in snames if sname not in _SUMMARIES]
+    for sname, result in zip(unread,
+                             run_parallel(read_db_summary, unread, JOBS)):
+        _SUMMARIES[sname] = result
+    return [_SUMMARIES[sname] for sname in snames]
+
+
+def read_db_summary(sname):
+    """
+    Reads the criteria of all manifests and profiles of a service,
+    through a single database connection. The result is cached in
+    the service's SUMMARY_CACHE file, and reused for as long as the
+    database file is unchanged.
+
+    Args
+        sname = service name
+
+    Returns
+        None if the service database does not exist, otherwise a
+        dictionary holding, for AIdb.MANIFESTS_TABLE and
+        AIdb.PROFILES_TABLE, None if the database has no such table or
+        the criteria columns of the table and its rows:
+
+            {
+                'manifests': [['MINmem', 'MAXmem', 'arch', ...],
+                              [{'name': name1, 'instance': 0,
+                                'MINmem': None, 'MAXmem': None,
+                                'arch': 'i86pc', ... },
+                               ...
+                              ]],
+                'profiles': None
+            }
+
+    Raises
+        VersionError if the service version is not supported
+        SystemExit if the database structure is not valid
+        StandardError if the database can not be read
+    """
+    path = AIService(sname).database_path
+    if not os.path.exists(path):
+        return None
+
+    cache = os.path.join(os.path.dirname(path), SUMMARY_CACHE)
+    signature = repr(AIdb.dbSignature(path))
+    summary = _load_summary(cache, signature)
+    if summary is not None:
+        return summary
+
+    maisql = AIdb.DB(path, readers=1)
+    try:
+        maisql.verifyDBStructure()
+        aiqueue = maisql.getQueue()
+        summary = dict()
+        for dbtable in (AIdb.MANIFESTS_TABLE, AIdb.PROFILES_TABLE):
+            if not AIdb.tableExists(aiqueue, dbtable):
+                summary[dbtable] = None
+                continue
+            fields = 'name'
+            if dbtable == AIdb.MANIFESTS_TABLE:
+                fields += ', instance'
+            columns = AIdb.getCriteria(aiqueue, table=dbtable,
+                                       onlyUsed=False, strip=False)
+            summary[dbtable] = [columns, AIdb.getCriteriaRows(aiqueue,
+                                dbtable, fields, columns)]
+    finally:
+        maisql.close()
+
+    _save_summary(cache, signature, summary)
+    return summary
+
+
+def _load_summary(cache, signature):
+    """
+    Returns the summary in the cache file if it was read from the
+    database with the given signature, None otherwise
+    """
+    try:
+        with open(cache) as cache_file:
+            cached = json.load(cache_file)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('signature') != signature:
+        return None
+    return cached.get('summary')
+
+
+def _save_summary(cache, signature, summary):
+    """
+    Writes a summary to the cache file, if possible (e.g. only root
+    may write to the service directory)
+    """
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache),
+                                   prefix=SUMMARY_CACHE)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump({'signature': signature, 'summary': summary},
+                      cache_file)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, cache)
+    except (IOError, OSError, TypeError) as err:
+        logging.debug('unable to write %s: %s', cache, err)
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def table_criteria(summary, dbtable):
+    """
+    Iterates over the names in a table of a database summary.
+
+    Args
+        summary = database summary (see read_db_summary)
+        dbtable = database table, distinguishing manifests from profiles
+
+    Returns
+        a generator of (name, criteria) tuples, in the order the names
+        were added to the database. criteria is a list holding, for each
+        instance of a manifest or for a profile, either None if no
+        criteria are in use in the table, or a dictionary of the values
+        of the criteria in use, as returned by AIdb.getTableCriteria()
+        with humanOutput and onlyUsed set.
+
+    Raises
+        None
+    """
+    columns, rows = summary[dbtable]
+    used = [col for col in columns
+            if any(row[col] is not None for row in rows)]
+    names = list()
+    name_rows = dict()
+    for row in rows:
+        if row['name'] not in name_rows:
+            names.append(row['name'])
+            name_rows[row['name']] = list()
+        name_rows[row['name']].append(row)
+
+    for name in names:
+        if dbtable == AIdb.MANIFESTS_TABLE:
+            instances = dict()
+            for row in name_rows[name]:
+                instances.setdefault(int(row['instance']), row)
+            selected = [instances.get(instance)
+                        for instance in range(len(name_rows[name]))]
+        else:
+            selected = name_rows[name][:1]
+        criteria = list()
+        for row in selected:
+            if row is None or not used:
+                criteria.append(None)
+            else:
+                criteria.append(dict((col, row[col]) for col in used))
+        yield name, criteria
+
+
 def print_local_services(sdict, width, awidth):
     """
     Iterates over the local service dictionary and prints out
@@ -224,18 +408,23 @@ def find_clients(lservices, sname=None):
         None
 
     """
+    def service_clients(servicename):
+        """Returns the arch, image path and clients of a service"""
+        service = AIService(servicename)
+        return (which_arch(service), [service.image.path],
+                config.get_clients(servicename))
+
     sdict = dict()
-    for servicename in lservices.keys():
-        if sname and sname != servicename:
-            continue
-        try:
-            service = AIService(servicename)
-        except VersionError as version_err:
-            warn_version(version_err)
+    snames = [servicename for servicename in lservices.keys()
+              if not sname or sname == servicename]
+    results = run_parallel(service_clients, snames, JOBS)
+    for servicename, (info, err) in zip(snames, results):
+        if isinstance(err, VersionError):
+            warn_version(err)
             continue
-        arch = which_arch(service)
-        image_path = [service.image.path]
-        client_info = config.get_clients(servicename)
+        elif err is not None:
+            raise err
+        arch, image_path, client_info = info
         for clientkey in client_info:
             # strip off the leading '01' and reinsert ':'s
             client = AIdb.formatValue('mac', clientkey[2:])
@@ -550,73 +739,46 @@ def get_manifest_or_profile_names(services, dbtable):
     mwidth = 0
     cwidth = 0
     sdict = dict()
-    for sname in sorted(services.keys()):
-        try:
-            service = AIService(sname)
-        except VersionError as err:
+    snames = sorted(services.keys())
+    for sname, (summary, err) in zip(snames, get_db_summaries(snames)):
+        if isinstance(err, VersionError):
             warn_version(err)
             continue
-        
-        path = service.database_path
-        
-        if os.path.exists(path):
-            try:
-                maisql = AIdb.DB(path)
-                maisql.verifyDBStructure()
-                aiqueue = maisql.getQueue()
-                swidth = max(len(sname), swidth)
-                if not AIdb.tableExists(aiqueue, dbtable):
-                    continue
-                for name in AIdb.getNames(aiqueue, dbtable):
-                    mwidth = max(len(name), mwidth)
-                    tdict = dict()
-                    if dbtable == 'manifests':
-                        instances = AIdb.numInstances(name, aiqueue)
-                        for instance in range(0, instances):
-                            criteria = AIdb.getTableCriteria(name,
-                                            instance, aiqueue, dbtable,
-                                            humanOutput=False,
-                                            onlyUsed=True)
-                            has_criteria = False
-                            if criteria is not None:
-                                for key in criteria.keys():
-                                    if criteria[key] is not None:
-                                        has_criteria = True
-                                        break
-                                if has_criteria:
-                                    # We need criteria in human readable form
-                                    hrcrit = AIdb.getTableCriteria(name,
-                                                  instance, aiqueue, dbtable,
-                                                  humanOutput=True,
-                                                  onlyUsed=True)
-                                    tdict, twidth = get_criteria_info(hrcrit)
-                                    cwidth = max(twidth, cwidth)
-                    else:
-                        criteria = AIdb.getTableCriteria(name,
-                                        None, aiqueue, dbtable,
-                                        humanOutput=False,
-                                        onlyUsed=True)
-                        has_criteria = False
-                        if criteria is not None:
-                            for key in criteria.keys():
-                                if criteria[key] is not None:
-                                    has_criteria = True
-                                    break
-                    if sname in sdict:
-                        slist = sdict[sname]
-                        slist.append([name, has_criteria, tdict])
-                        sdict[sname] = slist
-                    else:
-                        sdict[sname] = [[name, has_criteria, tdict]]
-            except StandardError as err:
-                sys.stderr.write(_('Error: AI database access error\n%s\n')
-                                   % err)
-                continue
-        else:
+        elif isinstance(err, SystemExit):
+            raise err
+        elif err is not None:
+            sys.stderr.write(_('Error: AI database access error\n%s\n')
+                               % err)
+            continue
+        elif summary is None:
             sys.stderr.write(_('Error: unable to locate AI database for "%s" '
                                'on server\n') % sname)
             continue
 
+        swidth = max(len(sname), swidth)
+        if summary[dbtable] is None:
+            continue
+        for name, criteria in table_criteria(summary, dbtable):
+            mwidth = max(len(name), mwidth)
+            tdict = dict()
+            has_criteria = False
+            for instance_criteria in criteria:
+                has_criteria = False
+                if instance_criteria is not None:
+                    for key in instance_criteria.keys():
+                        if instance_criteria[key] is not None:
+                            has_criteria = True
+                            break
+                if has_criteria and dbtable == AIdb.MANIFESTS_TABLE:
+                    tdict, twidth = get_criteria_info(instance_criteria)
+                    cwidth = max(twidth, cwidth)
+            if sname in sdict:
+                slist = sdict[sname]
+                slist.append([name, has_criteria, tdict])
+                sdict[sname] = slist
+            else:
+                sdict[sname] = [[name, has_criteria, tdict]]
+
     return sdict, swidth, mwidth, cwidth
 
 
@@ -741,58 +903,42 @@ def get_mfest_or_profile_criteria(sname, services, dbtable):
     sdict = dict()
     width = 0
     cwidth = 0
+    if dbtable not in (AIdb.MANIFESTS_TABLE, AIdb.PROFILES_TABLE):
+        raise ValueError("Invalid value for dbtable: %s" % dbtable)
     # ensure the named service is in our service dictionary.
     lservices = services.keys()
     if sname in lservices:
-        try:
-            path = AIService(sname).database_path
-        except VersionError as version_err:
-            warn_version(version_err)
+        summary, err = get_db_summaries([sname])[0]
+        if isinstance(err, VersionError):
+            warn_version(err)
             return sdict, width, cwidth
-
-        if os.path.exists(path):
-            try:
-                maisql = AIdb.DB(path)
-                maisql.verifyDBStructure()
-                aiqueue = maisql.getQueue()
-                if dbtable == AIdb.MANIFESTS_TABLE:
-                    for name in AIdb.getNames(aiqueue, dbtable):
-                        sdict[name] = list()
-                        instances = AIdb.numInstances(name, aiqueue)
-                        for instance in range(0, instances):
-                            width = max(len(name), width)
-                            criteria = AIdb.getManifestCriteria(name,
-                                            instance, aiqueue,
-                                            humanOutput=True,
-                                            onlyUsed=True)
-                            if criteria:
-                                tdict, twidth = get_criteria_info(criteria)
-                                cwidth = max(twidth, cwidth)
-                                sdict[name].append(tdict)
-                elif dbtable == AIdb.PROFILES_TABLE:
-                    for name in AIdb.getNames(aiqueue, dbtable):
-                        sdict[name] = list()
-                        criteria = AIdb.getProfileCriteria(name,
-                                        aiqueue,
-                                        humanOutput=True,
-                                        onlyUsed=True)
-                        width = max(len(name), width)
-                        tdict, twidth = get_criteria_info(criteria)
-                        cwidth = max(twidth, cwidth)
-
-                        sdict[name].append(tdict)
-                else:
-                    raise ValueError("Invalid value for dbtable: %s" % dbtable)
-
-            except StandardError as err:
-                sys.stderr.write(_('Error: AI database access error\n%s\n')
-                                   % err)
-                sys.exit(1)
-        else:
+        elif isinstance(err, SystemExit):
+            raise err
+        elif err is not None:
+            sys.stderr.write(_('Error: AI database access error\n%s\n')
+                               % err)
+            sys.exit(1)
+        elif summary is None:
             sys.stderr.write(_('Error: unable to locate AI database on server '
                                'for %s\n') % sname)
             sys.exit(1)
 
+        if summary[dbtable] is None:
+            return sdict, width, cwidth
+        for name, criteria in table_criteria(summary, dbtable):
+            sdict[name] = list()
+            width = max(len(name), width)
+            if dbtable == AIdb.MANIFESTS_TABLE:
+                for instance_criteria in criteria:
+                    if instance_criteria:
+                        tdict, twidth = get_criteria_info(instance_criteria)
+                        cwidth = max(twidth, cwidth)
+                        sdict[name].append(tdict)
+            else:
+                tdict, twidth = get_criteria_info(criteria[0])
+                cwidth = max(twidth, cwidth)
+                sdict[name].append(tdict)
+
     return sdict, width, cwidth
 
 
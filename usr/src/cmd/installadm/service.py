@@ -46,6 +46,7 @@ import socket
 import sys
 
 import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.content_store as content_store
 import osol_install.auto_install.dhcp as dhcp
 import osol_install.auto_install.grub as grub
 import osol_install.auto_install.installadm_common as com
@@ -422,9 +423,20 @@ class AIService(object):
         self.disable(arch_safe=True, force=True)
 
         self.remove_profiles()
+        alias = self.is_alias()
         for path in self.get_files_to_remove():
             force_delete(path)
 
+        # drop the content only this service's image used
+        if not alias:
+            store = content_store.get_content_store()
+            if store is not None:
+                try:
+                    store.prune()
+                except (content_store.ContentStoreError, IOError,
+                        OSError) as err:
+                    logging.debug("unable to prune content store: %s", err)
+
     def version(self):
         '''Look up and return the version of this service. See module
         docstring for info on what each service version supports
@@ -30,8 +30,10 @@ import ConfigParser
 import errno
 import logging
 import os
+import sqlite3
 import sys
 import tempfile
+import threading
 
 import osol_install.auto_install.ai_smf_service as aismf
 import osol_install.auto_install.installadm_common as com
@@ -64,6 +66,7 @@ BOOTARGS = 'bootargs'
 
 AI_SERVICE_DIR_PATH = com.AI_SERVICE_DIR_PATH
 CFGFILE = '.config'
+CLIENT_INDEX = '.clients.db'
 
 AI_HTTPD_CONF = '/var/installadm/ai-webserver/ai-httpd.conf'
 COMPATIBILITY_PORTS = ('/var/installadm/ai-webserver/'
@@ -151,6 +154,7 @@ def delete_service_props(service_name):
 
     logging.log(com.XDEBUG, "deleting props for service %s", service_name)
     cfgpath = _get_configfile_path(service_name)
+    _SERVICES.invalidate(service_name)
     os.remove(cfgpath)
 
 
@@ -169,7 +173,12 @@ def get_service_props(service_name):
 
     '''
     logging.log(com.XDEBUG, '**** START service_config.get_service_props ****')
-    
+    return _SERVICES.get(service_name)
+
+
+def _read_service_props(service_name):
+    '''Read the properties of a service from its .config file, or return
+    None if it does not exist'''
     cfgp = _read_config_file(service_name)
     if cfgp is None:
         return None
@@ -211,16 +220,7 @@ def get_all_service_names():
     '''
     logging.log(com.XDEBUG,
                 '**** START service_config.get_all_service_names ****')
-    names = list()
-    dirlist = os.listdir(AI_SERVICE_DIR_PATH)
-    for subdir in dirlist:
-        fullpath = os.path.join(AI_SERVICE_DIR_PATH, subdir)
-        # if not a true directory, skip
-        if not os.path.isdir(fullpath) or os.path.islink(fullpath):
-            continue
-        cfgfile = os.path.join(AI_SERVICE_DIR_PATH, subdir, CFGFILE)
-        if os.path.isfile(cfgfile):
-            names.append(subdir)
+    names = _SERVICES.names()
     logging.log(com.XDEBUG, 'services are: %s', names)
     return names
 
@@ -240,16 +240,44 @@ def get_all_service_props():
     logging.log(com.XDEBUG,
                 '**** START service_config.get_all_service_props ****')
 
-    all_properties = dict()
-    all_svc_names = get_all_service_names()
-    for service in all_svc_names:
-        service_props = get_service_props(service)
-        all_properties[service] = service_props
+    all_properties = _SERVICES.all_props()
 
     logging.log(com.XDEBUG, 'all service properties are: %s', all_properties)
     return all_properties
 
 
+def find_service_by_port(port):
+    '''
+    Find the service whose txt_record names port, as get_service_port
+    returns it
+
+    Input:
+        port - port number, as a string or integer
+    Return:
+        The name of the first such service (in the order of
+        get_all_service_names), or None if there is none
+
+    '''
+    services = _SERVICES.by_port().get(str(port))
+    if not services:
+        return None
+    return services[0]
+
+
+def get_services_by_image_path(image_path):
+    '''
+    Get the services (not aliases) using the image at image_path
+
+    Input:
+        image_path - path of an image
+    Return:
+        list of service names, empty if there are none
+
+    '''
+    return list(_SERVICES.by_image_path().get(os.path.normpath(image_path),
+                                              list()))
+
+
 def verify_key_properties(svcname, props):
     '''Verify key properties are present for a service
 
@@ -306,12 +334,7 @@ def get_aliased_services(service_name, recurse=False):
     '''
     logging.log(com.XDEBUG, "get_aliased_services: %s, recurse %s",
                 service_name, recurse)
-    aliases = list()
-    all_svc_data = get_all_service_props()
-    for svc_data in all_svc_data.values():
-        if (PROP_ALIAS_OF in svc_data and
-            svc_data[PROP_ALIAS_OF] == service_name):
-            aliases.append(svc_data[PROP_SERVICE_NAME])
+    aliases = list(_SERVICES.aliases().get(service_name, list()))
     if recurse:
         taliases = list()
         for alias in aliases:
@@ -337,6 +360,23 @@ def add_client_info(service_name, clientid, clientdata):
     logging.log(com.XDEBUG, '**** START service_config.add_client_info ****')
     logging.log(com.XDEBUG, '  service=%s, clientid=%s, clientdata=%s',
                 service_name, clientid, clientdata)
+    add_clients_info(service_name, {clientid: clientdata})
+
+
+def add_clients_info(service_name, clients):
+    '''add info on many clients to the service configuration file,
+    writing it only once
+
+    Input:
+        service_name - service name
+        clients - dict of client data (see find_client), key is
+                  clientid (01aabbccaabbcc)
+
+    Raises:
+        ServiceCfgError if service missing .config file
+
+    '''
+    logging.log(com.XDEBUG, '**** START service_config.add_clients_info ****')
     cfg = _read_config_file(service_name)
     if cfg is None:
         raise ServiceCfgError(_("\nMissing configuration file for service: "
@@ -345,10 +385,13 @@ def add_client_info(service_name, clientid, clientdata):
     if CLIENTS not in cfg.sections():
         cfg.add_section(CLIENTS)
 
-    # add the client
-    cfg.set(CLIENTS, clientid, clientdata)
+    # add the clients
+    changes = dict()
+    for clientid, clientdata in clients.iteritems():
+        cfg.set(CLIENTS, clientid, clientdata)
+        changes[clientid] = str(clientdata)
 
-    _write_config_file(service_name, cfg)
+    _write_client_config(service_name, cfg, changes)
 
 
 def get_clients(service_name):
@@ -363,19 +406,26 @@ def get_clients(service_name):
     '''
     logging.log(com.XDEBUG, "**** START service_config.get_clients: %s ****",
                 service_name)
-    cfg = _read_config_file(service_name)
-    if cfg is None:
-        raise ServiceCfgError(_("\nMissing configuration file for service: "
-                                "%s\n" % service_name))
+    index = _client_index()
+    try:
+        indexed = index.execute('SELECT 1 FROM services WHERE name = ?',
+                                (service_name,)).fetchone()
+        rows = index.execute('SELECT client_id, data FROM clients '
+                             'WHERE service = ?', (service_name,)).fetchall()
+    finally:
+        index.close()
+
+    if not indexed:
+        # not a service directory known to the index (e.g. a port link)
+        cfg = _read_config_file(service_name)
+        if cfg is None:
+            raise ServiceCfgError(_("\nMissing configuration file for "
+                                    "service: %s\n" % service_name))
+        rows = _config_clients(cfg)
 
     clients = dict()
-    if CLIENTS not in cfg.sections():
-        return clients
-    rawclients = dict(cfg.items(CLIENTS))
-    for client in rawclients:
-        data = rawclients[client]
-        value = ast.literal_eval(data)
-        clients[client.upper()] = value
+    for client, data in rows:
+        clients[client.upper()] = ast.literal_eval(data)
     logging.log(com.XDEBUG, 'clients are %s', clients)
     return clients
 
@@ -398,20 +448,16 @@ def find_client(client_id):
                 client_id)
     service = None
     files = None
-    for svc in get_all_service_names():
-        cfg = _read_config_file(svc)
-        if cfg is None:
-            raise ServiceCfgError(_("\nMissing configuration file for "
-                                    "service: %s\n" % svc))
-        if CLIENTS not in cfg.sections():
-            continue
-        clients = dict(cfg.items(CLIENTS))
-        # cfgparser changes client_id to lower
-        if client_id.lower() in clients:
-            data = clients[client_id.lower()]
-            files = ast.literal_eval(data)
-            service = svc
-            break
+    index = _client_index()
+    try:
+        row = index.execute('SELECT service, data FROM clients '
+                            'WHERE client_id = ?',
+                            (client_id.upper(),)).fetchone()
+    finally:
+        index.close()
+    if row is not None:
+        service = row[0]
+        files = ast.literal_eval(row[1])
     logging.log(com.XDEBUG, 'service is %s, files are %s', service, files)
     return (service, files)
 
@@ -428,19 +474,12 @@ def is_client(client_id):
     '''
     logging.log(com.XDEBUG, "**** START service_config.is_client: %s ****",
                 client_id)
-    exists = False
-    all_svc_names = get_all_service_names()
-    for svc in all_svc_names:
-        cfg = _read_config_file(svc)
-        if cfg is None:
-            raise ServiceCfgError(_("\nMissing configuration file for "
-                                    "service: %s\n" % svc))
-        if CLIENTS not in cfg.sections():
-            continue
-        clients = dict(cfg.items(CLIENTS))
-        # cfgparser changes client_id to lower
-        if client_id.lower() in clients:
-            exists = True
+    index = _client_index()
+    try:
+        exists = index.execute('SELECT 1 FROM clients WHERE client_id = ?',
+                               (client_id.upper(),)).fetchone() is not None
+    finally:
+        index.close()
     logging.log(com.XDEBUG, 'client exists: %s', exists)
     return exists
 
@@ -457,19 +496,78 @@ def remove_client_from_config(service_name, client_id):
     logging.log(com.XDEBUG,
                 "**** START service_config.remove_client_from_config: %s "
                 "%s ****", service_name, client_id)
+    remove_clients_from_config(service_name, [client_id])
+
+
+def remove_clients_from_config(service_name, client_ids):
+    '''
+    Remove many client entries from .config file, writing it only once
+    Input: service name
+          client_ids of entries to remove
+    Raises:
+        ServiceCfgError if service missing .config file
+
+    '''
+    logging.log(com.XDEBUG,
+                "**** START service_config.remove_clients_from_config: %s "
+                "****", service_name)
     cfg = _read_config_file(service_name)
     if cfg is None:
         raise ServiceCfgError(_("\nMissing configuration file for "
                                 "service: %s\n" % service_name))
     if CLIENTS not in cfg.sections():
         return
-    clients = cfg.options(CLIENTS)
-    if client_id.lower() in clients:
-        cfg.remove_option(CLIENTS, client_id.lower())
+    clients = set(cfg.options(CLIENTS))
+    for client_id in client_ids:
+        if client_id.lower() in clients:
+            cfg.remove_option(CLIENTS, client_id.lower())
     # if last client deleted, remove section
     if not cfg.options(CLIENTS):
         cfg.remove_section(CLIENTS)
-    _write_config_file(service_name, cfg)
+    _write_client_config(service_name, cfg,
+                         dict.fromkeys(client_ids, None))
+
+
+def verify_client_index():
+    '''
+    Rebuild the client index from the service configuration files
+
+    The index is normally kept up to date by add_client_info and
+    remove_client_from_config, and services whose .config file changed
+    behind its back are re-read the next time it is used. This throws
+    away everything indexed and reads every .config file again.
+
+    Returns: list of (service, clientid) entries that were wrong in the
+             index, i.e. missing, stale or left over
+    Raises:
+        sqlite3.Error if the index cannot be written
+
+    '''
+    logging.log(com.XDEBUG,
+                "**** START service_config.verify_client_index ****")
+    index = _open_client_index(os.path.join(AI_SERVICE_DIR_PATH,
+                                            CLIENT_INDEX))
+    try:
+        before = set(index.execute('SELECT service, client_id, data '
+                                   'FROM clients'))
+        index.execute('BEGIN IMMEDIATE')
+        try:
+            index.execute('DELETE FROM clients')
+            index.execute('DELETE FROM services')
+            for svc in get_all_service_names():
+                _index_service(index, svc)
+            index.execute('COMMIT')
+        except:
+            _rollback(index)
+            raise
+        after = set(index.execute('SELECT service, client_id, data '
+                                  'FROM clients'))
+    finally:
+        index.close()
+    wrong = sorted(set((svc, client) for svc, client, data in
+                       before.symmetric_difference(after)))
+    logging.log(com.XDEBUG, 'wrongly indexed clients: %s', wrong)
+    return wrong
 
 
 def get_service_port(svcname):
@@ -760,6 +858,7 @@ def _write_config_file(service_name, cfg):
 
     cfgpath = os.path.join(svcdir, CFGFILE)
     logging.log(com.XDEBUG, 'writing config file:  %s', cfgpath)
+    _SERVICES.invalidate(service_name)
 
     # .config file should be created with right permissions
     orig_umask = os.umask(0022)
@@ -770,6 +869,323 @@ def _write_config_file(service_name, cfg):
     os.umask(orig_umask)
 
 
+def _open_client_index(path):
+    '''Open the client index at path, creating its tables if needed.
+    Transactions are managed explicitly by the callers.
+    '''
+    orig_umask = os.umask(0022)
+    try:
+        index = sqlite3.connect(path, isolation_level=None)
+    finally:
+        os.umask(orig_umask)
+    try:
+        index.execute('CREATE TABLE IF NOT EXISTS services '
+                      '(name TEXT PRIMARY KEY, mtime REAL, size INTEGER)')
+        index.execute('CREATE TABLE IF NOT EXISTS clients '
+                      '(service TEXT, client_id TEXT, data TEXT, '
+                      'PRIMARY KEY (service, client_id))')
+        index.execute('CREATE INDEX IF NOT EXISTS clients_by_id '
+                      'ON clients (client_id)')
+    except sqlite3.Error:
+        index.close()
+        raise
+    return index
+
+
+def _client_index():
+    ''' Get the client index, up to date with the service config files
+
+    The index maps clients to services (and back) without reading every
+    service's .config file. It records the modification time and size of
+    each .config file it was built from, and any service whose file
+    changed (or appeared or went away) since is re-read before use.
+
+    If the index file can't be used (e.g. no write access), a temporary
+    in-memory index is built from the config files instead.
+
+    Return:
+        An open sqlite3 connection, to be closed by the caller
+
+    '''
+    path = os.path.join(AI_SERVICE_DIR_PATH, CLIENT_INDEX)
+    try:
+        index = _open_client_index(path)
+        try:
+            _sync_client_index(index)
+        except sqlite3.Error:
+            index.close()
+            raise
+    except sqlite3.Error as err:
+        logging.debug('client index %s unusable, reading config files: %s',
+                      path, err)
+        index = _open_client_index(':memory:')
+        _sync_client_index(index)
+    return index
+
+
+def _sync_client_index(index):
+    '''Re-index the services whose .config file changed since indexed'''
+    indexed = dict((name, (mtime, size)) for name, mtime, size in
+                   index.execute('SELECT name, mtime, size FROM services'))
+    stale = list()
+    for svc in get_all_service_names():
+        if indexed.pop(svc, None) != _config_signature(svc):
+            stale.append(svc)
+    # whatever is left in indexed no longer has a config file
+    if not stale and not indexed:
+        return
+
+    logging.log(com.XDEBUG, 're-indexing clients of %s, dropping %s',
+                stale, indexed.keys())
+    index.execute('BEGIN IMMEDIATE')
+    try:
+        for svc in indexed:
+            index.execute('DELETE FROM clients WHERE service = ?', (svc,))
+            index.execute('DELETE FROM services WHERE name = ?', (svc,))
+        for svc in stale:
+            _index_service(index, svc)
+        index.execute('COMMIT')
+    except:
+        _rollback(index)
+        raise
+
+
+def _index_service(index, service_name):
+    '''Replace the indexed clients of service_name with those in its
+    .config file. Must be called within a transaction.
+    '''
+    # take the signature first: should the file change while it is being
+    # read, the next sync sees a mismatch and reads it again
+    signature = _config_signature(service_name)
+    cfg = _read_config_file(service_name)
+    index.execute('DELETE FROM clients WHERE service = ?', (service_name,))
+    if cfg is None or signature is None:
+        index.execute('DELETE FROM services WHERE name = ?', (service_name,))
+        return
+    index.executemany('INSERT OR REPLACE INTO clients VALUES (?, ?, ?)',
+                      [(service_name, client.upper(), data) for client, data
+                       in _config_clients(cfg)])
+    index.execute('INSERT OR REPLACE INTO services VALUES (?, ?, ?)',
+                  (service_name,) + signature)
+
+
+def _write_client_config(service_name, cfg, clients):
+    ''' Write out cfg for a service after adding or removing clients,
+    updating the client index in the same transaction.
+
+    Input:
+        service_name - An AI service name
+        cfg - A ConfigParser object with the updated config
+        clients - dict of the clients added or removed, value is the
+                  client data as written to cfg, or None if removed
+    Raises:
+        OSError if problem creating service dir
+
+    '''
+    index = _client_index()
+    try:
+        # lock the index before writing, so that no other process can
+        # index the new file ahead of us
+        index.execute('BEGIN IMMEDIATE')
+    except sqlite3.Error as err:
+        # the next lookup will notice the changed file and re-read it
+        logging.debug('unable to update client index: %s', err)
+        index.close()
+        _write_config_file(service_name, cfg)
+        return
+
+    try:
+        try:
+            _write_config_file(service_name, cfg)
+        except:
+            _rollback(index)
+            raise
+        try:
+            index.executemany('DELETE FROM clients WHERE service = ? AND '
+                              'client_id = ?', [(service_name, client.upper())
+                                                for client in clients])
+            index.executemany('INSERT INTO clients VALUES (?, ?, ?)',
+                              [(service_name, client.upper(), data)
+                               for client, data in clients.iteritems()
+                               if data is not None])
+            signature = _config_signature(service_name)
+            index.execute('INSERT OR REPLACE INTO services VALUES (?, ?, ?)',
+                          (service_name,) + signature)
+            index.execute('COMMIT')
+        except sqlite3.Error as err:
+            # the old signature stays, so the service gets re-read
+            logging.debug('unable to update client index: %s', err)
+            _rollback(index)
+    finally:
+        index.close()
+
+
+def _rollback(index):
+    '''Roll back the current transaction on index, if any'''
+    try:
+        index.execute('ROLLBACK')
+    except sqlite3.Error:
+        pass
+
+
+def _config_signature(service_name):
+    '''Return the (mtime, size) of a service's .config file, or None'''
+    try:
+        stat = os.stat(_get_configfile_path(service_name))
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def _config_clients(cfg):
+    '''Return the (clientid, data) pairs of a ConfigParser object'''
+    if CLIENTS not in cfg.sections():
+        return list()
+    return cfg.items(CLIENTS)
+
+
+class _ServiceRegistry(object):
+    ''' The properties of all installation services, with indexes by port,
+    alias and image path.
+
+    A service's properties are read again only when its .config file
+    changed (modification time or size, as for the client index), and the
+    service directory is listed again only when its modification time
+    changed, so that a command or request reads each .config file once
+    however many lookups it makes. Changes written by this process are
+    seen at once (see invalidate()).
+
+    The registry is shared by the threads of the manifest server, so the
+    public methods hold self._lock while they use or update the cache.
+    '''
+
+    def __init__(self):
+        # reentrant, as _refresh() invalidates services
+        self._lock = threading.RLock()
+        self._reset(None)
+
+    def _reset(self, path):
+        '''Forget all services, cached from the service directory path'''
+        self._path = path
+        self._dir_mtime = None
+        # service directories, in listing order
+        self._subdirs = list()
+        # name -> (.config signature, properties)
+        self._services = dict()
+        self._indexes = None
+
+    def invalidate(self, service_name):
+        '''Forget the properties of service_name'''
+        with self._lock:
+            if self._services.pop(service_name, None) is not None:
+                self._indexes = None
+
+    def get(self, service_name):
+        '''Return a copy of the properties of service_name, or None if it
+        has no .config file'''
+        with self._lock:
+            if self._path != AI_SERVICE_DIR_PATH:
+                self._reset(AI_SERVICE_DIR_PATH)
+            entry = self._entry(service_name)
+            if entry is None:
+                return None
+            return dict(entry[1])
+
+    def _entry(self, service_name):
+        '''Return the (signature, properties) of service_name, reading its
+        .config file if it changed, or None if it has none. Called with
+        self._lock held.'''
+        signature = _config_signature(service_name)
+        entry = self._services.get(service_name)
+        if entry is not None and entry[0] == signature:
+            return entry
+        self._indexes = None
+        props = None
+        if signature is not None:
+            props = _read_service_props(service_name)
+        if props is None:
+            self._services.pop(service_name, None)
+            return None
+        entry = (signature, props)
+        self._services[service_name] = entry
+        return entry
+
+    def _refresh(self):
+        '''Bring all services up to date with the service directory.
+        Called with self._lock held.'''
+        if self._path != AI_SERVICE_DIR_PATH:
+            self._reset(AI_SERVICE_DIR_PATH)
+        # a directory removed and created again is a different inode
+        dir_stat = os.stat(self._path)
+        dir_mtime = (dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime)
+        if dir_mtime != self._dir_mtime:
+            subdirs = list()
+            for subdir in os.listdir(self._path):
+                fullpath = os.path.join(self._path, subdir)
+                # if not a true directory, skip
+                if os.path.isdir(fullpath) and not os.path.islink(fullpath):
+                    subdirs.append(subdir)
+            self._subdirs = subdirs
+            self._dir_mtime = dir_mtime
+            for name in self._services.keys():
+                if name not in self._subdirs:
+                    self.invalidate(name)
+        for subdir in self._subdirs:
+            self._entry(subdir)
+
+    def names(self):
+        '''Return the names of all services'''
+        with self._lock:
+            self._refresh()
+            return [name for name in self._subdirs if name in self._services]
+
+    def all_props(self):
+        '''Return a copy of the properties of all services, by name'''
+        with self._lock:
+            self._refresh()
+            return dict((name, dict(entry[1])) for name, entry in
+                        self._services.iteritems())
+
+    def _index(self):
+        '''Return the indexes of the services, built again if needed'''
+        with self._lock:
+            self._refresh()
+            if self._indexes is None:
+                by_port = dict()
+                aliases = dict()
+                by_image_path = dict()
+                for name in self._subdirs:
+                    if name not in self._services:
+                        continue
+                    props = self._services[name][1]
+                    if PROP_TXT_RECORD in props:
+                        port = props[PROP_TXT_RECORD].rsplit(':')[-1]
+                        by_port.setdefault(port, list()).append(name)
+                    if PROP_ALIAS_OF in props:
+                        aliases.setdefault(props[PROP_ALIAS_OF],
+                            list()).append(props[PROP_SERVICE_NAME])
+                    elif PROP_IMAGE_PATH in props:
+                        by_image_path.setdefault(os.path.normpath(
+                            props[PROP_IMAGE_PATH]), list()).append(name)
+                self._indexes = (by_port, aliases, by_image_path)
+            return self._indexes
+
+    def by_port(self):
+        '''Return the names of the services by port'''
+        return self._index()[0]
+
+    def aliases(self):
+        '''Return the names of the aliases of each service'''
+        return self._index()[1]
+
+    def by_image_path(self):
+        '''Return the names of the services by image path'''
+        return self._index()[2]
+
+
+_SERVICES = _ServiceRegistry()
+
+
 def _write_service_config(service_name, props):
     '''Writes out the service related info to the .config file
        for service_name, leaving other sections intact.
@@ -817,5 +1233,8 @@ if __name__ == '__main__':
         sys.exit(create_main_ports_file(sys.argv[2]))
     elif sys.argv[1] == "listprop":
         print str(get_service_props(sys.argv[2])[sys.argv[3]])
+    elif sys.argv[1] == "verify-client-index":
+        for entry in verify_client_index():
+            print "%s %s" % entry
     else:
         sys.exit("Invalid arguments")
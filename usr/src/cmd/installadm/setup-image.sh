@@ -113,6 +113,7 @@ cleanup_and_exit()
 usage()
 {
 	print "setup_image create <source> <destination>"
+	print "setup_image auto_install <destination>"
 	cleanup_and_exit 1
 }
 
@@ -423,6 +424,13 @@ if [ "$action" = "create" ]; then
 	dest=$3
 	create_image $src $dest
 	status=$?
+elif [ "$action" = "auto_install" ]; then
+	# Need 2 args for auto_install including action=auto_install
+	if [ $# -ne 2 ]; then
+		usage
+	fi
+	check_auto_install_dir $2
+	status=0
 else 
 	print " $1 - unsupported image action"
 	exit 1
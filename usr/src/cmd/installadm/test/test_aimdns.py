@@ -28,6 +28,7 @@ Remember that since the proto area is used for the PYTHONPATH, the gate
 must be rebuilt for these tests to pick up any changes in the tested code.
 '''
 import gettext
+import os
 import sys
 import unittest
 
@@ -35,6 +36,7 @@ import pybonjour as pyb
 
 import osol_install.auto_install.aimdns_mod as aimdns
 import osol_install.auto_install.installadm_common as common
+import osol_install.auto_install.service_config as config
 
 from nose.plugins.skip import SkipTest
 
@@ -212,6 +214,129 @@ class TestCompareIPv4(unittest.TestCase):
                 "_convert_cidr_mask failed for 8 cidr mask"
 
 
+class FakeSDRef(object):
+    '''Class FakeSDRef - service reference on a pipe, readable once
+       written to
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.rfd, self.wfd = os.pipe()
+        self.closed = False
+
+    def fileno(self):
+        '''the file descriptor select() watches
+        '''
+        return self.rfd
+
+    def close(self):
+        '''close the pipe
+        '''
+        os.close(self.rfd)
+        os.close(self.wfd)
+        self.closed = True
+
+
+class TestSyncServices(unittest.TestCase):
+    '''Class TestSyncServices - class to test incremental registration of
+       the AI services and the event loop
+    '''
+    def setUp(self):
+        '''unit test set up
+        '''
+        gettext.install("ai", "/usr/lib/locale")
+        self.get_all_service_props = config.get_all_service_props
+        self.process_result = pyb.DNSServiceProcessResult
+        self.props = dict()
+        config.get_all_service_props = lambda: self.props
+        self.registered = list()
+        self.mdns = aimdns.AImDNS()
+        self.mdns._register_a_service = self.register
+
+    def tearDown(self):
+        '''unit test tear down
+        '''
+        config.get_all_service_props = self.get_all_service_props
+        pyb.DNSServiceProcessResult = self.process_result
+        self.mdns.clear_sdrefs()
+
+    def register(self, name, interfaces=None):
+        '''replacement for _register_a_service, registering on two
+           interfaces
+        '''
+        self.registered.append(name)
+        return [FakeSDRef(name), FakeSDRef(name)]
+
+    def add_service(self, name, status=config.STATUS_ON, port=5555):
+        '''add an installation service
+        '''
+        self.props[name] = {config.PROP_STATUS: status,
+                            config.PROP_TXT_RECORD:
+                                'aiwebserver=server:%d' % port}
+
+    def test_sync_services(self):
+        '''test only added, removed and changed services are registered
+        '''
+        for num in range(100):
+            self.add_service('svc%02d' % num)
+        self.add_service('disabled', status=config.STATUS_OFF)
+        added, removed = self.mdns.sync_services()
+        self.assertEqual(len(added), 100)
+        self.assertEqual(removed, [])
+        self.assertEqual(len(self.mdns._fds), 200)
+        self.assertEqual(self.mdns.counters.registrations, 100)
+
+        old_refs = self.mdns.sdrefs['svc01']
+        del self.props['svc00']
+        self.add_service('svc01', port=5556)
+        self.add_service('disabled')
+        self.add_service('svc02', status=config.STATUS_OFF)
+        self.add_service('new')
+        self.registered = list()
+        added, removed = self.mdns.sync_services()
+        self.assertEqual(added, ['disabled', 'new', 'svc01'])
+        self.assertEqual(removed, ['svc00', 'svc01', 'svc02'])
+        self.assertEqual(sorted(self.registered), added)
+        self.assertTrue(all(sdref.closed for sdref in old_refs))
+        self.assertEqual(sorted(self.mdns._fds),
+                         sorted(sdref.fileno() for refs in
+                                self.mdns.sdrefs.values() for sdref in refs))
+        self.assertEqual(self.mdns.counters.unregistrations, 3)
+
+        # nothing changed, nothing to do
+        self.assertEqual(self.mdns.sync_services(), ([], []))
+        self.assertEqual(self.mdns.counters.refreshes, 3)
+
+    def test_handle_events(self):
+        '''test the event loop processes the ready service references
+        '''
+        self.add_service('svc')
+        self.mdns.sync_services()
+
+        def process_result(sdref):
+            '''read the event and invoke the callback'''
+            os.read(sdref.rfd, 1)
+            self.mdns._register_callback(sdref, 0, pyb.kDNSServiceErr_NoError,
+                                         sdref.name, common.REGTYPE,
+                                         common.DOMAIN)
+
+        pyb.DNSServiceProcessResult = process_result
+        for sdref in self.mdns.sdrefs['svc']:
+            os.write(sdref.wfd, 'x')
+        self.mdns._do_lookup = True
+        self.mdns.count = 1
+        self.mdns.timeout = 0
+        self.mdns._handle_events()
+        self.assertEqual(self.mdns.counters.callbacks, 2)
+        self.assertEqual(self.mdns.counters.loops, 1)
+
+        # a refresh requested by SIGHUP is done by the event loop
+        self.add_service('other')
+        self.mdns._signal_hup(None, None)
+        self.mdns._handle_events()
+        self.assertTrue('other' in self.mdns.sdrefs)
+        self.assertEqual(self.mdns.counters.refreshes, 2)
+
+
 def check_install_SMF():
     ''' Check if install/server SMF services is available.
         returning True if available and False if not.
@@ -0,0 +1,208 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+
+'''
+To run these tests, see the instructions in usr/src/tools/tests/README.
+Remember that since the proto area is used for the PYTHONPATH, the gate
+must be rebuilt for these tests to pick up any changes in the tested code.
+
+'''
+
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+import osol_install.auto_install.bulk_client as bulk_client
+import osol_install.auto_install.client_control as clientctrl
+import osol_install.auto_install.dhcp as dhcp
+import osol_install.auto_install.installadm_common as com
+import osol_install.auto_install.service_config as config
+
+from StringIO import StringIO
+
+gettext.install("ai-test")
+
+
+class MockService(object):
+    '''Class for mock AIService'''
+    def __init__(self, name, arch, basedir):
+        self.name = name
+        self.arch = arch
+        self.config_dir = os.path.join(basedir, name)
+        self.mountpoint = os.path.join(basedir, 'mnt', name)
+        self.dhcp_bootfile = name + '/boot/grub/pxegrub2'
+        self.bootargs = 'console=ttya,'
+
+
+class MockDHCPServer(dhcp.DHCPServer):
+    '''Class for mock DHCPServer, with an offline server'''
+    config_file = None
+
+    def __init__(self):
+        super(MockDHCPServer, self).__init__()
+        self._props = {'config_file': self.config_file}
+
+    def is_online(self):
+        '''the server is never online'''
+        return False
+
+
+class ParseOptions(unittest.TestCase):
+    '''Tests for parse_options'''
+
+    def test_parse_no_file(self):
+        '''Ensure the CSV file is required'''
+        self.assertRaises(SystemExit, bulk_client.parse_options, [])
+
+    def test_parse_invalid_args(self):
+        '''Ensure extra arguments are caught'''
+        self.assertRaises(SystemExit, bulk_client.parse_options,
+                          ['-f', 'clients.csv', 'extra'])
+
+    def test_parse_valid(self):
+        '''Ensure valid options are accepted'''
+        options = bulk_client.parse_options(['-f', 'clients.csv'])
+        self.assertEqual(options.csvfile, 'clients.csv')
+
+
+class ParseClients(unittest.TestCase):
+    '''Tests for read_csv and parse_clients'''
+
+    CSV = ("# mac,service,bootargs\n"
+           "\n"
+           "00:14:4f:01:02:03, x86svc\n"
+           "00:14:4f:01:02:04,x86svc,console=ttya,livemode=text\n"
+           "00:14:4f:01:02:05,x86svc,\"console=ttyb,livemode=text\"\n"
+           "00:14:4f:01:02\n"
+           "0:14:4f:1:2:3,sparcsvc\n"
+           "00:14:4f:01:02:06\n"
+           "00:14:4f:01:02:07,bad/name\n")
+
+    def test_read_csv(self):
+        '''Ensure comments and blank lines are skipped'''
+        rows = bulk_client.read_csv(StringIO(self.CSV))
+        self.assertEqual([line for line, fields in rows], range(3, 10))
+        self.assertEqual(rows[0][1], ['00:14:4f:01:02:03', 'x86svc'])
+
+    def test_parse_clients(self):
+        '''Ensure valid rows are parsed and invalid ones reported'''
+        rows = bulk_client.read_csv(StringIO(self.CSV))
+        clients, errors = bulk_client.parse_clients(rows)
+        self.assertEqual(clients,
+            [(3, '00144F010203', 'x86svc', ''),
+             (4, '00144F010204', 'x86svc', 'console=ttya,livemode=text,'),
+             (5, '00144F010205', 'x86svc', 'console=ttyb,livemode=text,')])
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(errors[0].startswith("Error:\tline 6: "))
+        self.assertTrue("already listed on line 3" in errors[1])
+        self.assertTrue("service name is required" in errors[2])
+        self.assertTrue(errors[3].startswith("Error:\tline 9: "))
+
+    def test_parse_clients_no_service(self):
+        '''Ensure only MAC addresses are needed to delete clients'''
+        rows = bulk_client.read_csv(StringIO(self.CSV))
+        clients, errors = bulk_client.parse_clients(rows, need_service=False)
+        self.assertEqual([client[1] for client in clients],
+                         ['00144F010203', '00144F010204', '00144F010205',
+                          '00144F010206', '00144F010207'])
+        self.assertEqual(len(errors), 2)
+
+
+class SetupClients(unittest.TestCase):
+    '''Tests for client_control.setup_clients and remove_clients'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp")
+        self.boot_dir = com.BOOT_DIR
+        self.svcdir = config.AI_SERVICE_DIR_PATH
+        self.dhcpserver = dhcp.DHCPServer
+        self.aiservice = clientctrl.AIService
+        com.BOOT_DIR = os.path.join(self.tmpdir, 'netboot')
+        config.AI_SERVICE_DIR_PATH = os.path.join(self.tmpdir, 'services')
+        os.mkdir(com.BOOT_DIR)
+        os.mkdir(config.AI_SERVICE_DIR_PATH)
+
+        self.services = dict()
+        for name, arch in (('x86svc', 'i386'), ('sparcsvc', 'sparc')):
+            service = MockService(name, arch, config.AI_SERVICE_DIR_PATH)
+            config._write_service_config(name, {config.PROP_SERVICE_NAME:
+                                                name})
+            self.services[name] = service
+        with open(os.path.join(self.services['x86svc'].config_dir,
+                               'menu.lst'), 'w') as menulst:
+            menulst.write("title x86svc\n"
+                          "\tkernel$ /x86svc/unix -B console=ttya,"
+                          "install=true\n")
+        clientctrl.AIService = self.services.get
+
+        MockDHCPServer.config_file = os.path.join(self.tmpdir, 'dhcpd4.conf')
+        with open(MockDHCPServer.config_file, 'w') as dhcpconf:
+            dhcpconf.write("default-lease-time 900;\n")
+        dhcp.DHCPServer = MockDHCPServer
+
+    def tearDown(self):
+        '''unit test tear down'''
+        com.BOOT_DIR = self.boot_dir
+        config.AI_SERVICE_DIR_PATH = self.svcdir
+        dhcp.DHCPServer = self.dhcpserver
+        clientctrl.AIService = self.aiservice
+        shutil.rmtree(self.tmpdir)
+
+    def test_setup_and_remove(self):
+        '''Ensure many clients are set up and removed'''
+        x86 = self.services['x86svc']
+        sparc = self.services['sparcsvc']
+        clients = [(x86, '00144F%06X' % num, '') for num in range(50)]
+        clients.append((x86, '00144FAAAAAA', 'console=ttyb,'))
+        clients.append((sparc, '00144FBBBBBB', ''))
+        self.assertEqual(clientctrl.setup_clients(clients), [])
+
+        self.assertEqual(len(config.get_clients('x86svc')), 51)
+        self.assertEqual(config.find_client('0100144FBBBBBB')[0], 'sparcsvc')
+        with open(os.path.join(com.BOOT_DIR,
+                               'menu.lst.0100144FAAAAAA')) as menulst:
+            self.assertTrue("-B console=ttyb,install=true" in menulst.read())
+        self.assertEqual(os.readlink(os.path.join(com.BOOT_DIR,
+                                                  '0100144FBBBBBB')),
+                         sparc.mountpoint)
+        server = MockDHCPServer()
+        self.assertTrue(server.host_is_configured('00:14:4F:AA:AA:AA'))
+        self.assertFalse(server.host_is_configured('00:14:4F:BB:BB:BB'))
+
+        # a client which already exists is reported
+        self.assertEqual(len(clientctrl.setup_clients(clients[:1])), 1)
+
+        client_ids = ['01' + mac for service, mac, bootargs in clients]
+        self.assertEqual(clientctrl.remove_clients(client_ids), [])
+        self.assertEqual(config.get_clients('x86svc'), {})
+        self.assertEqual(config.get_clients('sparcsvc'), {})
+        self.assertEqual(os.listdir(com.BOOT_DIR), [])
+        self.assertEqual(MockDHCPServer()._config.hosts(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
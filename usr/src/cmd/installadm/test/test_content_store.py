@@ -0,0 +1,137 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+
+'''
+To run these tests, see the instructions in usr/src/tools/tests/README.
+Remember that since the proto area is used for the PYTHONPATH, the gate
+must be rebuilt for these tests to pick up any changes in the tested code.
+
+'''
+
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+import osol_install.auto_install.content_store as content_store
+
+from StringIO import StringIO
+
+gettext.install("ai-test")
+
+
+class ContentStore(unittest.TestCase):
+    '''Tests for ContentStore'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp")
+        self.store = content_store.ContentStore(os.path.join(self.tmpdir,
+                                                             'store'))
+        self.images = list()
+        for image in ('image1', 'image2'):
+            path = os.path.join(self.tmpdir, image)
+            os.makedirs(os.path.join(path, 'platform'))
+            self.write(path, 'solaris.zlib', 'zlib ' * 1000)
+            self.write(path, 'platform/unix', 'unix ' * 100)
+            self.write(path, '.image_info', 'IMAGE_VERSION=3.0\n')
+            self.write(path, 'empty', '')
+            os.symlink('unix', os.path.join(path, 'platform', 'link'))
+            self.images.append(path)
+        # different content
+        self.write(self.images[1], '.image_info', 'IMAGE_VERSION=3.1\n')
+        # same content, different mode
+        os.chmod(os.path.join(self.images[1], 'platform/unix'), 0600)
+
+    def tearDown(self):
+        '''unit test tear down'''
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, image, name, text):
+        '''Write text to the file name of image'''
+        with open(os.path.join(image, name), 'w') as fh:
+            fh.write(text)
+
+    def inode(self, image, name):
+        '''Returns the inode of the file name of image'''
+        return os.lstat(os.path.join(image, name)).st_ino
+
+    def test_add_image(self):
+        '''Ensure identical files of images are linked'''
+        record = self.store.add_image(self.images[0], create_time=10.0)
+        self.assertEqual((record['files'], record['shared']), (3, 0))
+        record = self.store.add_image(self.images[1], create_time=1.0,
+                                      fetched=0)
+        self.assertEqual((record['files'], record['shared']), (3, 5000))
+
+        image1, image2 = self.images
+        self.assertEqual(self.inode(image1, 'solaris.zlib'),
+                         self.inode(image2, 'solaris.zlib'))
+        self.assertNotEqual(self.inode(image1, '.image_info'),
+                            self.inode(image2, '.image_info'))
+        self.assertNotEqual(self.inode(image1, 'platform/unix'),
+                            self.inode(image2, 'platform/unix'))
+        self.assertEqual(os.readlink(os.path.join(image2, 'platform/link')),
+                         'unix')
+        with open(os.path.join(image2, 'solaris.zlib')) as fh:
+            self.assertEqual(fh.read(), 'zlib ' * 1000)
+        self.assertEqual(os.stat(os.path.join(image2,
+                                              'platform/unix')).st_mode &
+                         0777, 0600)
+
+        # adding an image again shares nothing more
+        record = self.store.add_image(self.images[0], create_time=10.0)
+        self.assertEqual(record['shared'], 0)
+
+        usage = self.store.usage()
+        self.assertEqual(usage['stored'], 5000 + 500 * 2 + 18 * 2)
+        self.assertEqual(usage['linked'], 5000 * 2 + 500 * 2 + 18 * 2)
+        self.assertEqual(sorted(usage['images']), self.images)
+        # image1, sharing nothing, was created at 551.8 bytes a second
+        self.assertAlmostEqual(usage['time_saved'], 5000 / 551.8)
+
+        outfile = StringIO()
+        self.store.report(outfile)
+        self.assertTrue("Deduplication ratio: 1.83" in outfile.getvalue())
+
+    def test_prune(self):
+        '''Ensure content no image uses is removed'''
+        for image in self.images:
+            self.store.add_image(image)
+        shutil.rmtree(self.images[1])
+        self.assertEqual(self.store.prune(), (2, 518))
+        self.assertEqual(self.store.prune(), (0, 0))
+        usage = self.store.usage()
+        self.assertEqual(sorted(usage['images']), self.images[:1])
+        self.assertEqual(usage['stored'], usage['linked'])
+
+    def test_estimate_time_saved(self):
+        '''Ensure no estimate without an image created from scratch'''
+        self.assertEqual(content_store.estimate_time_saved([{'bytes': 100,
+            'shared': 50, 'create_time': 1.0}]), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
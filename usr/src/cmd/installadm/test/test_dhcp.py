@@ -109,5 +109,167 @@ class DHCPServerTest(unittest.TestCase):
         # return umask to the original value
         os.umask(orig_umask)
 
+
+SAMPLE_CONFIG = """# dhcpd.conf
+default-lease-time 900;   # seconds
+log-facility local7;
+
+# lab network
+subnet 10.0.0.0 netmask 255.255.255.0 {
+  range 10.0.0.10 10.0.0.19;
+  option routers 10.0.0.1;
+  host nested { hardware ethernet 00:00:00:00:00:01; }
+}
+
+class "PXEBoot" {
+  match if (substring(option vendor-class-identifier, 0, 9) = "PXEClient");
+  filename "default-i386/boot/grub/pxegrub2";
+}
+
+host myhost
+{
+  hardware ethernet 08:00:27:AA:BB:CC;  # lab box
+  filename "0108002700AABBCC";
+}
+
+failover peer "dhcp" { primary; }
+"""
+
+
+class DHCPConfigFileTest(unittest.TestCase):
+    '''Tests for the parsed DHCP configuration'''
+
+    def setUp(self):
+        '''Parse a sample configuration'''
+        self.config = dhcp.DHCPConfigFile(SAMPLE_CONFIG)
+
+    def test_unchanged(self):
+        '''Test the configuration is kept byte for byte'''
+        self.assertEqual(self.config.text(), SAMPLE_CONFIG)
+        self.assertFalse(self.config.dirty)
+
+    def test_indexes(self):
+        '''Test hosts, subnets and classes are found'''
+        self.assertEqual(self.config.hosts(),
+                         ['00:00:00:00:00:01', '08:00:27:AA:BB:CC'])
+        self.assertTrue(self.config.has_host('08:00:27:aa:bb:cc'))
+        self.assertTrue(self.config.has_hostname('myhost'))
+        self.assertEqual(self.config.subnets(), ['10.0.0.0'])
+        self.assertEqual(self.config.subnet_ranges('10.0.0.0'),
+                         [('10.0.0.10', '10.0.0.19')])
+        self.assertEqual(self.config.get_class('i386').bootfile,
+                         'default-i386/boot/grub/pxegrub2')
+        self.assertEqual(self.config.get_class('sparc'), None)
+
+    def test_hosts(self):
+        '''Test adding and removing hosts'''
+        stanza = dhcp._DHCPConfigHost('newhost', '08:00:27:00:00:01', 'boot')
+        self.config.append(stanza.format_stanza())
+        self.assertTrue(self.config.has_host('08:00:27:00:00:01'))
+        self.assertTrue(self.config.dirty)
+
+        self.assertTrue(self.config.remove_host('08:00:27:00:00:01'))
+        self.assertEqual(self.config.text(), SAMPLE_CONFIG)
+        self.assertTrue(self.config.remove_host('08:00:27:aa:bb:cc'))
+        self.assertFalse(self.config.has_hostname('myhost'))
+        self.assertTrue("failover" in self.config.text())
+        self.assertFalse("lab box" in self.config.text())
+        # nested host stanzas are not removed
+        self.assertFalse(self.config.remove_host('00:00:00:00:00:01'))
+
+    def test_range(self):
+        '''Test adding a range to a subnet'''
+        self.config.add_range('10.0.0.0', '10.0.0.30', '10.0.0.39')
+        self.assertEqual(self.config.subnet_ranges('10.0.0.0'),
+                         [('10.0.0.30', '10.0.0.39'),
+                          ('10.0.0.10', '10.0.0.19')])
+        self.assertTrue(self.config.has_host('00:00:00:00:00:01'))
+
+    def test_class_bootfile(self):
+        '''Test updating and unsetting a class bootfile'''
+        self.assertTrue(self.config.edit_class_bootfile('i386', 'update',
+                                                        'new/pxegrub2'))
+        self.assertEqual(self.config.get_class('i386').bootfile,
+                         'new/pxegrub2')
+        self.assertTrue(self.config.edit_class_bootfile('i386', 'update'))
+        self.assertEqual(self.config.get_class('i386').bootfile, None)
+        self.assertFalse(self.config.edit_class_bootfile('i386', 'update'))
+        self.assertTrue(self.config.edit_class_bootfile('i386', 'set',
+                                                        'pxegrub2'))
+        self.assertEqual(self.config.get_class('i386').bootfile, 'pxegrub2')
+        self.assertFalse(self.config.edit_class_bootfile('sparc', 'set',
+                                                         'wanboot'))
+
+
+class DHCPServerConfigTest(unittest.TestCase):
+    '''Tests for DHCPServer changes to its configuration file'''
+
+    def setUp(self):
+        '''Set up a DHCPServer with a sample configuration file'''
+        self.dhcp_dir = tempfile.mkdtemp(dir="/tmp")
+        self.path = os.path.join(self.dhcp_dir, 'dhcpd4.conf')
+        with open(self.path, 'w') as cfg:
+            cfg.write(SAMPLE_CONFIG)
+        self.server = dhcp.DHCPServer()
+        self.server._props = {'config_file': self.path}
+
+    def tearDown(self):
+        '''Remove the configuration file'''
+        shutil.rmtree(self.dhcp_dir)
+
+    def read(self):
+        '''Return the contents of the configuration file'''
+        with open(self.path) as cfg:
+            return cfg.read()
+
+    def test_hosts(self):
+        '''Test hosts are written to the file'''
+        self.server.add_host('08:00:27:00:00:01', 'boot')
+        self.assertTrue("08:00:27:00:00:01" in self.read())
+        self.assertRaises(dhcp.DHCPServerError, self.server.add_host,
+                          '08:00:27:00:00:01', 'boot')
+        self.server.remove_host('08:00:27:00:00:01')
+        self.assertEqual(self.read(), SAMPLE_CONFIG)
+
+    def test_batch(self):
+        '''Test changes within a batch are written once'''
+        with self.server.batch():
+            for host in range(10):
+                self.server.add_host('08:00:27:00:00:%02x' % host, 'boot')
+            self.assertEqual(self.read(), SAMPLE_CONFIG)
+        self.assertEqual(dhcp.DHCPConfigFile(self.read()).hosts()[-1],
+                         '08:00:27:00:00:09')
+
+        try:
+            with self.server.batch():
+                self.server.remove_host('08:00:27:00:00:00')
+                raise DummyError()
+        except DummyError:
+            pass
+        self.assertTrue(self.server.host_is_configured('08:00:27:00:00:00'))
+
+    def test_external_change(self):
+        '''Test the file is read again if changed by someone else'''
+        self.assertFalse(self.server.host_is_configured('08:00:27:00:00:01'))
+        stanza = dhcp._DHCPConfigHost('newhost', '08:00:27:00:00:01', 'boot')
+        with open(self.path, 'a') as cfg:
+            cfg.write(stanza.format_stanza())
+        self.assertTrue(self.server.host_is_configured('08:00:27:00:00:01'))
+
+    def test_arch_class(self):
+        '''Test arch class bootfile changes'''
+        self.assertEqual(self.server.get_bootfile_for_arch('i386'),
+                         'default-i386/boot/grub/pxegrub2')
+        self.server.unset_bootfile_for_arch('i386')
+        self.assertEqual(dhcp.DHCPConfigFile(self.read()).get_class(
+                         'i386').bootfile, None)
+        self.assertEqual(os.stat(self.path).st_mode, 0100644)
+
+
+class DummyError(Exception):
+    '''Exception raised to abort a batch'''
+    pass
+
+
 if __name__ == '__main__':
     unittest.main()
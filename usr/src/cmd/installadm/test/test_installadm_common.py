@@ -75,5 +75,32 @@ class TestValidateServiceName(unittest.TestCase):
             self.fail("validate_service_name failed")
 
 
+class TestRunParallel(unittest.TestCase):
+    '''Tests for run_parallel'''
+
+    def test_results(self):
+        '''Ensure results are kept in order and errors reported'''
+        def check(value):
+            '''fail on odd values'''
+            if value % 2:
+                raise SystemExit("odd %d" % value)
+            return value * 10
+
+        results = com.run_parallel(check, range(20), 3)
+        self.assertEqual([result for result, error in results[::2]],
+                         range(0, 200, 20))
+        self.assertEqual(str(results[3][1]), "odd 3")
+        self.assertEqual(com.run_parallel(check, [], 3), [])
+
+    def test_errors(self):
+        '''Ensure only the given errors are caught'''
+        def check(value):
+            '''fail with a KeyError'''
+            raise KeyError(value)
+
+        results = com.run_parallel(check, [1], 1, errors=(KeyError,))
+        self.assertTrue(isinstance(results[0][1], KeyError))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+
+'''
+To run these tests, see the instructions in usr/src/tools/tests/README.
+Remember that since the proto area is used for the PYTHONPATH, the gate
+must be rebuilt for these tests to pick up any changes in the tested code.
+
+installadm-convert is a script rather than a module, so it is loaded from
+the source tree.
+
+'''
+
+import gettext
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from StringIO import StringIO
+
+gettext.install("ai-test")
+
+convert = imp.load_source('installadm_convert',
+                          os.path.join(os.path.dirname(__file__), '..',
+                                       'installadm-convert.py'))
+
+
+class Makespan(unittest.TestCase):
+    '''Tests for _makespan'''
+
+    def test_makespan(self):
+        '''Ensure tasks are scheduled longest first on the free worker'''
+        self.assertEqual(convert._makespan([3, 2, 2], 2), 4.0)
+        self.assertEqual(convert._makespan([1, 1, 1, 1], 1), 4.0)
+        # longest first is not always the best schedule: 5 + 4 would do
+        self.assertEqual(convert._makespan([5, 4, 3, 3, 3], 2), 10.0)
+        self.assertEqual(convert._makespan([5, 1], 4), 5.0)
+        self.assertEqual(convert._makespan([], 4), 0.0)
+
+
+class ImagePaths(unittest.TestCase):
+    '''Tests for unique_image_path and plan_image_copies'''
+
+    def setUp(self):
+        '''Create an image directory'''
+        self.tmp_dir = tempfile.mkdtemp(dir="/tmp")
+        self.image = os.path.join(self.tmp_dir, 'image')
+        os.mkdir(self.image)
+
+    def tearDown(self):
+        '''Remove the image directory'''
+        shutil.rmtree(self.tmp_dir)
+
+    def test_unique_image_path(self):
+        '''Ensure neither existing nor reserved paths are used'''
+        os.mkdir(self.image + '_1')
+        reserved = set([self.image + '_2'])
+        new_path = convert.unique_image_path(self.image, reserved)
+        self.assertEqual(new_path, self.image + '_3')
+        self.assertTrue(new_path in reserved)
+        self.assertEqual(convert.unique_image_path(self.image, reserved),
+                         self.image + '_4')
+
+    def test_plan_shared_image(self):
+        '''Ensure three services sharing an image get two distinct copies'''
+        services = dict()
+        for service_name in ('svc_a', 'svc_b', 'svc_c'):
+            services[service_name] = [{'path': self.image}]
+        services['svc_d'] = [{'path': os.path.join(self.tmp_dir, 'other')}]
+
+        copies = convert.plan_image_copies(services)
+        self.assertEqual(len(copies), 2)
+        new_paths = [new_path for service_name, service_info, new_path
+                     in copies]
+        self.assertEqual(sorted(new_paths),
+                         [self.image + '_1', self.image + '_2'])
+        copied = set(service_name for service_name, service_info, new_path
+                     in copies)
+        self.assertEqual(len(copied), 2)
+        self.assertFalse('svc_d' in copied)
+        for service_name, service_info, new_path in copies:
+            self.assertTrue(service_info is services[service_name][0])
+
+        # nothing is copied yet
+        self.assertFalse(os.path.exists(self.image + '_1'))
+
+    def test_plan_missing_image(self):
+        '''Ensure a shared image which does not exist is not copied'''
+        missing = os.path.join(self.tmp_dir, 'missing')
+        services = {'svc_a': [{'path': missing}],
+                    'svc_b': [{'path': missing}]}
+        self.assertEqual(convert.plan_image_copies(services), [])
+
+
+class RunTasks(unittest.TestCase):
+    '''Tests for _run_tasks'''
+
+    def setUp(self):
+        '''Capture the output'''
+        self.stdout = sys.stdout
+        self.stderr = sys.stderr
+        sys.stdout = StringIO()
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        '''Restore the output'''
+        sys.stdout = self.stdout
+        sys.stderr = self.stderr
+
+    @staticmethod
+    def chatty(item):
+        '''print a few lines, giving other tasks time to run in between'''
+        print 'task', item,
+        time.sleep(0.01)
+        print 'started'
+        sys.stderr.write('task %s warning\n' % item)
+        time.sleep(0.01)
+        print 'task', item, 'done'
+        return item * 2
+
+    def test_output_in_one_piece(self):
+        '''Ensure the output of each task is printed in one piece'''
+        out, err = sys.stdout, sys.stderr
+        results = convert._run_tasks(self.chatty, range(6), 3, ())
+        self.assertTrue(sys.stdout is out and sys.stderr is err)
+        self.assertEqual(results, [(item * 2, None) for item in range(6)])
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 12)
+        for first, second in zip(lines[::2], lines[1::2]):
+            item = first.split()[1]
+            self.assertEqual(first, 'task %s started' % item)
+            self.assertEqual(second, 'task %s done' % item)
+        self.assertEqual(sorted(err.getvalue().splitlines()),
+                         ['task %d warning' % item for item in range(6)])
+
+    def test_serial_output(self):
+        '''Ensure one job runs the tasks in order, printing directly'''
+        out = sys.stdout
+        results = convert._run_tasks(self.chatty, range(2), 1, ())
+        self.assertEqual(results, [(0, None), (2, None)])
+        self.assertEqual(out.getvalue(), 'task 0 started\ntask 0 done\n'
+                                         'task 1 started\ntask 1 done\n')
+
+    def test_errors(self):
+        '''Ensure expected errors are returned and others raised once all
+        of the items are processed
+        '''
+        processed = list()
+        lock = threading.Lock()
+
+        def failing(item):
+            '''raise ValueError or KeyError for some items'''
+            with lock:
+                processed.append(item)
+            if item == 1:
+                raise ValueError('expected')
+            if item == 2:
+                raise KeyError('unexpected')
+            return item
+
+        for jobs in (1, 3):
+            del processed[:]
+            self.assertRaises(KeyError, convert._run_tasks, failing,
+                              range(3), jobs, (ValueError,))
+            self.assertEqual(sorted(processed), range(3))
+
+            results = convert._run_tasks(failing, [0, 1], jobs,
+                                         (ValueError,))
+            self.assertEqual(results[0], (0, None))
+            self.assertEqual(results[1][0], None)
+            self.assertTrue(isinstance(results[1][1], ValueError))
+
+        # SystemExit is not swallowed by parallel tasks either
+        def exiting(item):
+            '''exit'''
+            raise SystemExit(1)
+
+        self.assertRaises(SystemExit, convert._run_tasks, exiting,
+                          range(2), 2, (ValueError,))
+        self.assertTrue(isinstance(sys.stdout, StringIO))
+
+
+class EstimateConversionTime(unittest.TestCase):
+    '''Tests for the dry run time estimate'''
+
+    def setUp(self):
+        '''Create a shared image of known size'''
+        self.tmp_dir = tempfile.mkdtemp(dir="/tmp")
+        self.image = os.path.join(self.tmp_dir, 'image')
+        os.mkdir(self.image)
+        with open(os.path.join(self.image, 'file'), 'w') as image_file:
+            image_file.write('x' * 2000)
+        self.copy_rate = convert.EST_COPY_RATE
+        convert.EST_COPY_RATE = 1000
+
+    def tearDown(self):
+        '''Remove the image'''
+        convert.EST_COPY_RATE = self.copy_rate
+        shutil.rmtree(self.tmp_dir)
+
+    def test_estimate(self):
+        '''Ensure the estimate adds up the costs of the steps'''
+        services = {'svc_a': [{'path': self.image, 'version': '0'}],
+                    'svc_b': [{'path': self.image, 'version': '2'}],
+                    'svc_c': [{'path': self.image, 'version': '0',
+                               'default-manifest': 'orig_default'}]}
+        clients = {'svc_a': [{'client': '01:02:03:04:05:06'}] * 3}
+
+        serial, parallel = convert.estimate_conversion_time(services,
+                                                            clients, 2)
+        # two 2 second copies, one manifest upgrade, three clients
+        self.assertAlmostEqual(serial,
+            2 * 2.0 + 3 * convert.EST_SERVICE_TIME +
+            convert.EST_MANIFEST_TIME + 3 * convert.EST_CLIENT_TIME)
+        self.assertAlmostEqual(parallel,
+            2.0 + convert.EST_SERVICE_TIME + convert.EST_MANIFEST_TIME +
+            3 * convert.EST_BULK_CLIENT_TIME)
+
+        # no image is copied when estimating
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['image'])
+
+    def test_estimate_nothing(self):
+        '''Ensure converting nothing is estimated to take no time'''
+        self.assertEqual(convert.estimate_conversion_time(dict(), dict(), 4),
+                         (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,417 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+
+'''
+To run these tests, see the instructions in usr/src/tools/tests/README.
+Remember that since the proto area is used for the PYTHONPATH, the gate
+must be rebuilt for these tests to pick up any changes in the tested code.
+
+'''
+
+import calendar
+import gettext
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import unittest
+
+import osol_install.auto_install.image as image
+import osol_install.auto_install.iso9660 as iso9660
+
+gettext.install("ai-test")
+
+SECTOR = iso9660.SECTOR_SIZE
+# 2012-01-02 03:04:05 UTC
+DATE = struct.pack('6Bb', 112, 1, 2, 3, 4, 5, 0)
+MTIME = calendar.timegm((2012, 1, 2, 3, 4, 5))
+
+
+def both16(num):
+    '''both-endian 16-bit number'''
+    return struct.pack('<H', num) + struct.pack('>H', num)
+
+
+def both32(num):
+    '''both-endian 32-bit number'''
+    return struct.pack('<I', num) + struct.pack('>I', num)
+
+
+def sectors(size):
+    '''number of sectors holding size bytes'''
+    return (size + SECTOR - 1) // SECTOR
+
+
+class ISOBuilder(object):
+    '''Write a small ISO 9660 image, optionally with Rock Ridge entries.
+
+    tree is a list of (path, mode, content): content is the data of a
+    file, or the target of a symbolic link; directories have no content.
+    Parent directories are listed before their content. Files are split
+    into extents of at most max_extent bytes (multi-extent files). names
+    maps paths of tree to the names written for them, by default their
+    base names.
+    '''
+
+    def __init__(self, tree, rock_ridge=True, max_extent=None, names=None):
+        self.tree = tree
+        self.rock_ridge = rock_ridge
+        self.max_extent = max_extent
+        self.names = names or dict()
+
+    def write(self, path):
+        '''Write the image to path'''
+        dirs = ['']
+        children = {'': []}
+        for name, mode, content in self.tree:
+            children[os.path.dirname(name)].append(name)
+            if stat.S_ISDIR(mode):
+                dirs.append(name)
+                children[name] = []
+        modes = dict((name, mode) for name, mode, content in self.tree)
+        contents = dict((name, content) for name, mode, content in self.tree)
+        modes[''] = stat.S_IFDIR | 0755
+
+        # directory records do not depend on the extents' values, so build
+        # them once to size the directories, then again to write them
+        extents = dict((name, (0, 0)) for name in dirs)
+        files = dict((name, [(0, 0)] * len(self._splits(len(content))))
+                     for name, mode, content in self.tree
+                     if stat.S_ISREG(mode))
+        data = dict((name, self._directory(name, children, modes, contents,
+                                           extents, files)) for name in dirs)
+        sector = 18
+        for name in dirs:
+            extents[name] = (sector, len(data[name]))
+            sector += sectors(len(data[name]))
+        for name, mode, content in self.tree:
+            if stat.S_ISREG(mode):
+                files[name] = list()
+                for start in self._splits(len(content)):
+                    chunk = content[start:start + self._extent_size()]
+                    files[name].append((sector if chunk else 0, len(chunk)))
+                    sector += sectors(len(chunk))
+        data = dict((name, self._directory(name, children, modes, contents,
+                                           extents, files)) for name in dirs)
+
+        with open(path, 'wb') as isofile:
+            isofile.write('\0' * 16 * SECTOR)
+            isofile.write(self._pvd(sector, extents['']).ljust(SECTOR, '\0'))
+            isofile.write(('\xff' + 'CD001\1').ljust(SECTOR, '\0'))
+            for name in dirs:
+                isofile.write(data[name])
+            for name, mode, content in self.tree:
+                if stat.S_ISREG(mode):
+                    for extent, size in files[name]:
+                        if extent:
+                            isofile.seek(extent * SECTOR)
+                            isofile.write(content[:size].ljust(
+                                sectors(size) * SECTOR, '\0'))
+                            content = content[size:]
+            isofile.truncate(sector * SECTOR)
+
+    def _extent_size(self):
+        '''largest extent of a file'''
+        return self.max_extent or 0xffffffff
+
+    def _splits(self, size):
+        '''offsets of the extents of a file of size bytes'''
+        return range(0, size, self._extent_size()) or [0]
+
+    def _pvd(self, size, root):
+        '''the primary volume descriptor'''
+        pvd = '\1CD001\1'.ljust(80, '\0') + both32(size)
+        pvd = pvd.ljust(120, '\0') + both16(1) + both16(1) + both16(SECTOR)
+        pvd = pvd.ljust(156, '\0')
+        return pvd + self._record(root[0], root[1], 0x02, '\0', '')
+
+    def _directory(self, name, children, modes, contents, extents, files):
+        '''the data of directory name'''
+        parent = os.path.dirname(name)
+        susp = ''
+        if self.rock_ridge and name == '':
+            susp = 'SP\7\1\xbe\xef\0'
+        records = [self._record(extents[name][0], extents[name][1], 0x02,
+                                '\0', susp + self._px(modes[name])),
+                   self._record(extents[parent][0], extents[parent][1], 0x02,
+                                '\1', self._px(modes[parent]))]
+        for child in sorted(children[name]):
+            mode = modes[child]
+            base = self.names.get(child, os.path.basename(child))
+            susp = self._px(mode)
+            if self.rock_ridge:
+                susp += 'NM%c\1\0%s' % (5 + len(base), base)
+                susp += 'TF\14\1\2' + DATE
+            if stat.S_ISDIR(mode):
+                records.append(self._record(extents[child][0],
+                                            extents[child][1], 0x02,
+                                            base.upper(), susp))
+            elif stat.S_ISLNK(mode):
+                records.append(self._record(0, 0, 0, base.upper() + ';1',
+                                            susp + self._sl(contents[child])))
+            else:
+                parts = files[child]
+                for index, (extent, size) in enumerate(parts):
+                    flags = 0x80 if index < len(parts) - 1 else 0
+                    records.append(self._record(extent, size, flags,
+                                                base.upper() + ';1', susp))
+
+        data = ''
+        for record in records:
+            if len(data) % SECTOR + len(record) > SECTOR:
+                data = data.ljust(sectors(len(data)) * SECTOR, '\0')
+            data += record
+        return data.ljust(sectors(len(data)) * SECTOR, '\0')
+
+    def _px(self, mode):
+        '''Rock Ridge PX entry'''
+        if not self.rock_ridge:
+            return ''
+        return 'PX\54\1' + both32(mode) + both32(1) + both32(0) + \
+            both32(0) + both32(0)
+
+    def _sl(self, target):
+        '''Rock Ridge SL entry'''
+        components = ''
+        if target.startswith('/'):
+            components += '\10\0'
+        for part in target.strip('/').split('/'):
+            if part == '..':
+                components += '\4\0'
+            else:
+                components += '\0%c%s' % (len(part), part)
+        return 'SL%c\1\0%s' % (5 + len(components), components)
+
+    @staticmethod
+    def _record(extent, size, flags, ident, susp):
+        '''a directory record'''
+        pad = '' if len(ident) % 2 else '\0'
+        record = chr(0) + both32(extent) + both32(size) + DATE + \
+            chr(flags) + '\0\0' + both16(1) + chr(len(ident)) + ident + pad + \
+            susp
+        if len(record) % 2 == 0:
+            record += '\0'
+        return chr(len(record) + 1) + record
+
+
+class Extract(unittest.TestCase):
+    '''Tests for iso9660.extract'''
+
+    TREE = [('boot', stat.S_IFDIR | 0755, None),
+            ('boot/grub', stat.S_IFDIR | 0700, None),
+            ('boot/grub/menu.lst', stat.S_IFREG | 0644, 'title AI\n'),
+            ('boot/unix', stat.S_IFLNK | 0777, '../platform/unix'),
+            ('boot/abs', stat.S_IFLNK | 0777, '/usr/bin'),
+            ('empty', stat.S_IFREG | 0600, ''),
+            ('platform', stat.S_IFDIR | 0555, None),
+            ('platform/unix', stat.S_IFREG | 0755, 'unix' * 3000),
+            ('solaris.zlib', stat.S_IFREG | 0444, 'zlib' * 1000)]
+
+    def setUp(self):
+        '''unit test set up'''
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp")
+        self.iso = os.path.join(self.tmpdir, 'ai.iso')
+        self.target = os.path.join(self.tmpdir, 'image')
+        self.chunk_size = iso9660.CHUNK_SIZE
+        iso9660.CHUNK_SIZE = 1000
+
+    def tearDown(self):
+        '''unit test tear down'''
+        iso9660.CHUNK_SIZE = self.chunk_size
+        for root, dirs, files in os.walk(self.tmpdir):
+            for name in dirs:
+                os.chmod(os.path.join(root, name), 0755)
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, name):
+        '''Returns the content of the extracted file name'''
+        with open(os.path.join(self.target, name)) as fh:
+            return fh.read()
+
+    def test_rock_ridge(self):
+        '''Ensure names, modes, links and times are extracted'''
+        ISOBuilder(self.TREE).write(self.iso)
+        calls = list()
+        entries = iso9660.extract(self.iso, self.target,
+                                  lambda done, total: calls.append(done))
+        self.assertEqual([entry.path for entry in entries],
+                         ['boot', 'boot/abs', 'boot/grub',
+                          'boot/grub/menu.lst', 'boot/unix', 'empty',
+                          'platform', 'platform/unix', 'solaris.zlib'])
+        for name, mode, content in self.TREE:
+            path = os.path.join(self.target, name)
+            st = os.lstat(path)
+            self.assertEqual(st.st_mode, mode, name)
+            if stat.S_ISREG(mode):
+                self.assertEqual(self.read(name), content)
+                self.assertEqual(st.st_mtime, MTIME)
+            elif stat.S_ISLNK(mode):
+                self.assertEqual(os.readlink(path), content)
+
+        total = 9 + 12000 + 4000
+        self.assertEqual(calls[-1], total)
+        self.assertEqual(calls, sorted(calls))
+        self.assertTrue(len(calls) > 16)
+
+    def test_plain(self):
+        '''Ensure names and modes are mapped as hsfs does without Rock
+        Ridge'''
+        tree = [entry for entry in self.TREE
+                if not stat.S_ISLNK(entry[1])]
+        ISOBuilder(tree, rock_ridge=False).write(self.iso)
+        iso9660.extract(self.iso, self.target)
+        self.assertEqual(sorted(os.listdir(self.target)),
+                         ['boot', 'empty', 'platform', 'solaris.zlib'])
+        self.assertEqual(self.read('boot/grub/menu.lst'), 'title AI\n')
+        self.assertEqual(os.stat(os.path.join(self.target,
+                                              'solaris.zlib')).st_mode,
+                         stat.S_IFREG | 0555)
+
+    def test_multi_extent(self):
+        '''Ensure files of several extents are extracted whole'''
+        ISOBuilder(self.TREE, max_extent=2 * SECTOR).write(self.iso)
+        entries = iso9660.extract(self.iso, self.target)
+        unix = [entry for entry in entries if entry.path == 'platform/unix']
+        self.assertEqual(len(unix), 1)
+        self.assertEqual(len(unix[0].extents), 3)
+        self.assertEqual(self.read('platform/unix'), 'unix' * 3000)
+
+    def test_large_directory(self):
+        '''Ensure directories of several sectors are read'''
+        tree = [('dir', stat.S_IFDIR | 0755, None)]
+        tree.extend(('dir/file%03d' % num, stat.S_IFREG | 0644, str(num))
+                    for num in range(100))
+        ISOBuilder(tree).write(self.iso)
+        iso9660.extract(self.iso, self.target)
+        self.assertEqual(len(os.listdir(os.path.join(self.target, 'dir'))),
+                         100)
+        self.assertEqual(self.read('dir/file099'), '99')
+
+    def test_replace(self):
+        '''Ensure existing files are replaced'''
+        ISOBuilder(self.TREE).write(self.iso)
+        iso9660.extract(self.iso, self.target)
+        os.chmod(os.path.join(self.target, 'platform'), 0755)
+        with open(os.path.join(self.target, 'platform/unix'), 'w') as fh:
+            fh.write('old')
+        iso9660.extract(self.iso, self.target)
+        self.assertEqual(self.read('platform/unix'), 'unix' * 3000)
+
+    def test_not_iso(self):
+        '''Ensure a file which is not an ISO 9660 image is rejected'''
+        with open(self.iso, 'w') as fh:
+            fh.write('\0' * 20 * SECTOR)
+        self.assertRaises(iso9660.ISOError, iso9660.extract, self.iso,
+                          self.target)
+        with open(self.iso, 'w') as fh:
+            fh.write('short')
+        self.assertRaises(iso9660.ISOError, iso9660.ISOImage, self.iso)
+
+    def test_truncated(self):
+        '''Ensure a truncated image is reported'''
+        ISOBuilder(self.TREE).write(self.iso)
+        with open(self.iso, 'r+') as fh:
+            fh.truncate(os.path.getsize(self.iso) - SECTOR)
+        self.assertRaises(iso9660.ISOError, iso9660.extract, self.iso,
+                          self.target)
+
+    def test_not_net_image(self):
+        '''Ensure an ISO without solaris.zlib is not unpacked'''
+        ISOBuilder(self.TREE[:-1]).write(self.iso)
+        self.assertRaises(image.ImageError,
+                          image.InstalladmIsoImage._extract, self.iso,
+                          self.target)
+        self.assertFalse(os.path.exists(self.target))
+
+
+class Hostile(unittest.TestCase):
+    '''Tests for images trying to write outside the target directory'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp")
+        self.iso = os.path.join(self.tmpdir, 'ai.iso')
+        self.outside = os.path.join(self.tmpdir, 'outside')
+        os.mkdir(self.outside)
+        self.target = os.path.join(self.tmpdir, 'out', 'image')
+
+    def tearDown(self):
+        '''unit test tear down'''
+        shutil.rmtree(self.tmpdir)
+
+    def assert_rejected(self, tree, names):
+        '''Ensure the image of tree is rejected and nothing is written'''
+        ISOBuilder(tree, names=names).write(self.iso)
+        self.assertRaises(iso9660.ISOError, iso9660.extract, self.iso,
+                          self.target)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual(os.listdir(self.outside), [])
+        self.assertEqual(os.listdir(self.tmpdir), ['ai.iso', 'outside'])
+
+    def test_dot_dot(self):
+        '''Ensure a directory named .. is rejected'''
+        tree = [('up', stat.S_IFDIR | 0755, None),
+                ('up/pwned', stat.S_IFREG | 0644, 'pwned')]
+        self.assert_rejected(tree, {'up': '..'})
+        self.assert_rejected(tree, {'up': '.'})
+
+    def test_invalid_names(self):
+        '''Ensure names with / or NUL are rejected'''
+        tree = [('pwned', stat.S_IFREG | 0644, 'pwned')]
+        for name in ('../outside/pwned', '/tmp/pwned', 'a\0b'):
+            self.assert_rejected(tree, {'pwned': name})
+
+    def test_link_then_directory(self):
+        '''Ensure a symbolic link and a directory of the same name are
+        rejected'''
+        tree = [('link', stat.S_IFLNK | 0777, self.outside),
+                ('dir', stat.S_IFDIR | 0755, None),
+                ('dir/pwned', stat.S_IFREG | 0644, 'pwned')]
+        self.assert_rejected(tree, {'dir': 'link'})
+
+    def test_existing_link(self):
+        '''Ensure files are not written through a symbolic link already
+        in the target directory'''
+        tree = [('dir', stat.S_IFDIR | 0755, None),
+                ('dir/file', stat.S_IFREG | 0644, 'file'),
+                ('link', stat.S_IFLNK | 0777, 'dir')]
+        ISOBuilder(tree).write(self.iso)
+        os.makedirs(self.target)
+        os.symlink(self.outside, os.path.join(self.target, 'dir'))
+        iso9660.extract(self.iso, self.target)
+        self.assertEqual(os.listdir(self.outside), [])
+        self.assertFalse(os.path.islink(os.path.join(self.target, 'dir')))
+        with open(os.path.join(self.target, 'link', 'file')) as fh:
+            self.assertEqual(fh.read(), 'file')
+
+        # extracting again replaces the files, not through the link
+        iso9660.extract(self.iso, self.target)
+        self.assertEqual(os.readlink(os.path.join(self.target, 'link')),
+                         'dir')
+        self.assertEqual(os.listdir(self.outside), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,7 +29,12 @@ must be rebuilt for these tests to pick up any changes in the tested code.
 
 '''
 
+import os
+import shutil
+import sqlite3
+import tempfile
 import unittest
+import osol_install.auto_install.AI_database as AIdb
 import osol_install.auto_install.list as list
 
 
@@ -127,5 +132,79 @@ class ParseOptions(unittest.TestCase):
         self.assertEqual(options.service, "mysvc") 
 
 
+class MockService(object):
+    '''Class for mock AIService'''
+    root = None
+
+    def __init__(self, name):
+        self.database_path = os.path.join(self.root, name, 'AI.db')
+
+
+class DBSummary(unittest.TestCase):
+    '''Tests for read_db_summary and table_criteria'''
+
+    def setUp(self):
+        '''unit test set up'''
+        self.root = tempfile.mkdtemp(dir="/tmp")
+        os.mkdir(os.path.join(self.root, 'mysvc'))
+        self.path = os.path.join(self.root, 'mysvc', 'AI.db')
+        con = sqlite3.connect(self.path)
+        con.execute("CREATE TABLE manifests (name TEXT, instance INTEGER, "
+                    "arch TEXT, MINmem INTEGER, MAXmem INTEGER, "
+                    "MINmac INTEGER, MAXmac INTEGER)")
+        con.execute("INSERT INTO manifests (name, instance, arch) VALUES "
+                    "('default', 0, NULL)")
+        con.execute("INSERT INTO manifests (name, instance, arch, MINmem, "
+                    "MINmac, MAXmac) VALUES ('x86', 0, 'i86pc', 1024, "
+                    "x'0800270000AB', x'0800270000AB')")
+        con.commit()
+        con.close()
+        self.aiservice = list.AIService
+        MockService.root = self.root
+        list.AIService = MockService
+
+    def tearDown(self):
+        '''unit test tear down'''
+        list.AIService = self.aiservice
+        list._SUMMARIES.clear()
+        shutil.rmtree(self.root)
+
+    def test_summary(self):
+        '''Ensure criteria in use are read from the database'''
+        summary = list.read_db_summary('mysvc')
+        self.assertEqual(summary[AIdb.PROFILES_TABLE], None)
+        criteria = dict(list.table_criteria(summary, AIdb.MANIFESTS_TABLE))
+        self.assertEqual(criteria['default'],
+                         [{'arch': None, 'MINmem': None, 'MINmac': None,
+                           'MAXmac': None}])
+        tdict = list.get_criteria_info(criteria['x86'][0])[0]
+        self.assertEqual(tdict, {'arch': 'i86pc', 'mem': '1024 MB - unbounded',
+                                 'mac': '08:00:27:00:00:AB'})
+
+    def test_no_database(self):
+        '''Ensure a missing database gives no summary'''
+        os.remove(self.path)
+        self.assertEqual(list.get_db_summaries(['mysvc']), [(None, None)])
+
+    def test_cache(self):
+        '''Ensure the summary is cached until the database changes'''
+        summary = list.read_db_summary('mysvc')
+        cache = os.path.join(self.root, 'mysvc', list.SUMMARY_CACHE)
+        self.assertTrue(os.path.exists(cache))
+        self.assertEqual(list.read_db_summary('mysvc'), summary)
+
+        con = sqlite3.connect(self.path)
+        con.execute("INSERT INTO manifests (name, instance, arch) VALUES "
+                    "('sparc', 0, 'sun4v')")
+        con.commit()
+        con.close()
+        # make sure the change is noticed even within the same second
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 1))
+        names = [name for name, criteria in list.table_criteria(
+                 list.read_db_summary('mysvc'), AIdb.MANIFESTS_TABLE)]
+        self.assertEqual(names, ['default', 'x86', 'sparc'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -33,6 +33,8 @@ import unittest
 import os
 import shutil
 import tempfile
+import threading
+import time
 import osol_install.auto_install.service_config as config
 
 
@@ -208,6 +210,117 @@ class ServiceConfig(unittest.TestCase):
         aliased = config.get_aliased_services('base1', recurse=True)
         self.assertTrue(aliased == ['alias1', 'alias2'])
 
+    def test_service_lookups(self):
+        '''test lookups by port and image path'''
+
+        for num, (port, image) in enumerate((('46501', '/export/img1'),
+                                             ('46502', '/export/img1/'),
+                                             ('46503', '/export/img2'))):
+            svc = 's%d' % num
+            props = {config.PROP_SERVICE_NAME: svc,
+                     config.PROP_TXT_RECORD: 'aiwebserver=ais:' + port,
+                     config.PROP_IMAGE_PATH: image}
+            config._write_service_config(svc, props)
+        config._write_service_config('alias', {
+            config.PROP_SERVICE_NAME: 'alias',
+            config.PROP_TXT_RECORD: 'aiwebserver=ais:46504',
+            config.PROP_ALIAS_OF: 's2'})
+        self.assertEqual(config.find_service_by_port(46502), 's1')
+        self.assertEqual(config.find_service_by_port('46504'), 'alias')
+        self.assertEqual(config.find_service_by_port('5555'), None)
+        self.assertEqual(sorted(config.get_services_by_image_path(
+            '/export/img1')), ['s0', 's1'])
+        self.assertEqual(config.get_services_by_image_path('/export/img2'),
+                         ['s2'])
+
+        config.set_service_props('s1', {config.PROP_TXT_RECORD:
+                                        'aiwebserver=ais:46505'})
+        self.assertEqual(config.find_service_by_port(46502), None)
+        self.assertEqual(config.find_service_by_port(46505), 's1')
+        config.delete_service_props('s0')
+        self.assertEqual(config.get_services_by_image_path('/export/img1'),
+                         ['s1'])
+
+    def test_service_cache(self):
+        '''test service properties are read again only when changed'''
+
+        config._write_service_config('s1', {'hot': 'fudge'})
+        config._write_service_config('s2', {'ice': 'cream'})
+        self.assertEqual(sorted(config.get_all_service_names()),
+                         ['s1', 's2'])
+
+        reads = list()
+        read_service_props = config._read_service_props
+        def counting_read(service_name):
+            '''count the reads of .config files'''
+            reads.append(service_name)
+            return read_service_props(service_name)
+        config._read_service_props = counting_read
+        try:
+            for count in range(10):
+                config.get_all_service_props()
+                config.get_service_props('s1')
+                config.get_aliased_services('s1')
+            self.assertEqual(reads, [])
+
+            # changed by another process
+            path = config._get_configfile_path('s2')
+            with open(path, 'a') as cfgfile:
+                cfgfile.write('apple = pie\n')
+            self.assertEqual(config.get_all_service_props()['s2']['apple'],
+                             'pie')
+            self.assertEqual(reads, ['s2'])
+
+            # returned properties are copies
+            config.get_service_props('s1')['hot'] = 'chocolate'
+            self.assertEqual(config.get_service_props('s1')['hot'], 'fudge')
+
+            # removed and added by another process
+            shutil.rmtree(os.path.join(config.AI_SERVICE_DIR_PATH, 's1'))
+            os.mkdir(os.path.join(config.AI_SERVICE_DIR_PATH, 's3'))
+            self.assertEqual(config.get_all_service_names(), ['s2'])
+            with open(config._get_configfile_path('s3'), 'w') as cfgfile:
+                cfgfile.write('[service]\nbanana = split\n')
+            self.assertEqual(sorted(config.get_all_service_names()),
+                             ['s2', 's3'])
+        finally:
+            config._read_service_props = read_service_props
+
+    def test_service_cache_threads(self):
+        '''test concurrent lookups see each service once'''
+        names = ['s%02d' % num for num in range(20)]
+        for name in names:
+            config._write_service_config(name, {'hot': 'fudge'})
+
+        isdir = os.path.isdir
+        def slow_isdir(path):
+            '''give other threads time to list the directory too'''
+            time.sleep(0.001)
+            return isdir(path)
+
+        results = list()
+        def lookup(start):
+            '''look the services up once all threads are started'''
+            start.wait()
+            results.append(sorted(config.get_all_service_names()))
+
+        os.path.isdir = slow_isdir
+        try:
+            for attempt in range(3):
+                config._SERVICES._reset(None)
+                start = threading.Event()
+                threads = [threading.Thread(target=lookup, args=(start,))
+                           for count in range(4)]
+                for thread in threads:
+                    thread.start()
+                start.set()
+                for thread in threads:
+                    thread.join()
+        finally:
+            os.path.isdir = isdir
+        self.assertEqual(results, [names] * 12)
+        self.assertEqual(sorted(config.get_all_service_names()), names)
+
     def test_clients(self):
         '''test clients'''
 
@@ -235,6 +348,57 @@ class ServiceConfig(unittest.TestCase):
         clientdict = config.get_clients('s1')
         self.assertTrue('01AABBCCDDAABB' not in clientdict)
 
+    def test_client_index(self):
+        '''test client index follows the config files'''
+
+        for svc in ('s1', 's2'):
+            config._write_service_config(svc, {config.PROP_SERVICE_NAME: svc})
+        config.add_client_info('s1', '01AABBCCDDAABB',
+                               {config.FILES: ['/tmp/foo']})
+        self.assertTrue(os.path.exists(os.path.join(
+            config.AI_SERVICE_DIR_PATH, config.CLIENT_INDEX)))
+
+        # client moved to another service by editing the config files
+        cfg = config._read_config_file('s1')
+        config._write_config_file('s2', cfg)
+        os.remove(config._get_configfile_path('s1'))
+        self.assertEqual(config.find_client('01aabbccddaabb'),
+                         ('s2', {config.FILES: ['/tmp/foo']}))
+        self.assertRaises(config.ServiceCfgError, config.get_clients, 's1')
+
+        config.remove_client_from_config('s2', '01AABBCCDDAABB')
+        self.assertFalse(config.is_client('01AABBCCDDAABB'))
+        self.assertEqual(config.get_clients('s2'), {})
+
+    def test_verify_client_index(self):
+        '''test verify_client_index rebuilds a wrong index'''
+
+        config._write_service_config('s1', {config.PROP_SERVICE_NAME: 's1'})
+        config.add_client_info('s1', '01AABBCCDDAABB',
+                               {config.FILES: ['/tmp/foo']})
+        self.assertEqual(config.verify_client_index(), [])
+
+        index = config._open_client_index(os.path.join(
+            config.AI_SERVICE_DIR_PATH, config.CLIENT_INDEX))
+        index.execute("INSERT INTO clients VALUES ('s1', '01AAAAAAAAAAAA', "
+                      "'{}')")
+        index.close()
+        self.assertTrue(config.is_client('01AAAAAAAAAAAA'))
+        self.assertEqual(config.verify_client_index(),
+                         [('s1', '01AAAAAAAAAAAA')])
+        self.assertFalse(config.is_client('01AAAAAAAAAAAA'))
+        self.assertTrue(config.is_client('01AABBCCDDAABB'))
+
+    def test_unusable_client_index(self):
+        '''test clients are found without a usable client index'''
+
+        config._write_service_config('s1', {config.PROP_SERVICE_NAME: 's1'})
+        os.mkdir(os.path.join(config.AI_SERVICE_DIR_PATH,
+                              config.CLIENT_INDEX))
+        config.add_client_info('s1', '01AABBCCDDAABB',
+                               {config.FILES: ['/tmp/foo']})
+        self.assertEqual(config.find_client('01AABBCCDDAABB')[0], 's1')
+
     def test_configfile_permissions(self):
         '''test permissions of .config file'''
 
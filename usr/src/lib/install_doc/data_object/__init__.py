@@ -26,9 +26,10 @@
 '''Provides definition of base classes for storage in Data Object Cache.
 '''
 
-__all__ = ["cache", "data_dict", "simple"]
+__all__ = ["cache", "data_dict", "simple", "snapshot"]
 
 import copy
+import itertools
 import logging
 import re
 import sys
@@ -62,6 +63,53 @@ class PathError(DataObjectError):
     pass
 
 
+class SnapshotError(DataObjectError):
+    '''Exception to be raised when a snapshot can't be loaded.'''
+    pass
+
+
+# Every change of an attribute of a DataObject is numbered from this counter,
+# and the object keeps the number of its last change under _CHANGE_STAMP.
+# Snapshots use this to find the objects changed since the previous snapshot.
+_CHANGE_COUNTER = itertools.count(1)
+_CHANGE_STAMP = "_DataObjectBase__change_stamp"
+
+# An object with descendants keeps an index of them under _INDEX, counting
+# them by class and by name, so that searches only go down the branches of
+# the tree which hold matching objects. The index is built on first use and
+# then kept up to date as objects are inserted, deleted and renamed.
+_INDEX = "_DataObjectBase__index"
+# The index of an object with no descendants, which is never kept
+_EMPTY_INDEX = (dict(), dict())
+# The name the index counts an object under if its class overrides the
+# 'name' property, and so its name isn't known to the index.
+_ANY_NAME = object()
+# Set on an object removed from the tree by delete(), which leaves it its
+# reference to its parent; the indexes of its former ancestors aren't
+# updated for changes under it.
+_DETACHED = "_DataObjectBase__detached"
+# Whether a class counted in an index is a sub-class of a class searched for,
+# kept as issubclass() is slow with ABCMeta classes.
+_SUBCLASSES = dict()
+
+# Paths given to find_path() are broken down into steps once, and the steps
+# kept here, keyed by path, as the same few paths are used over and over
+# again. At most PATH_CACHE_SIZE paths are kept.
+PATH_CACHE_SIZE = 256
+_PATH_CACHE = dict()
+
+
+def _add_counts(counts, items, delta):
+    '''Adds delta times the counts of items, a list of (key, count), to the
+    dictionary counts, dropping the keys whose count falls to 0.'''
+    for key, count in items:
+        total = counts.get(key, 0) + delta * count
+        if total > 0:
+            counts[key] = total
+        else:
+            counts.pop(key, None)
+
+
 class DataObjectBase(object):
     '''Core abstract base class for the Data Object Cache contents.
 
@@ -362,6 +410,10 @@ class DataObjectBase(object):
 
                         A B D E C F G
 
+        Branches of the tree which, according to the index each object keeps
+        of its descendants, hold no match are skipped, so the time taken
+        depends on the number of matches rather than on the size of the tree.
+
         You may specify one, or both, of the following to narrow the list of
         children returned:
 
@@ -394,6 +446,31 @@ class DataObjectBase(object):
 
         '''
 
+        class_type, classes = self._search_criteria(name, class_type,
+                                                    max_depth, max_count)
+
+        new_list = list()
+        if self._may_hold(name, classes):
+            self._find_descendants(name, class_type, classes, max_depth,
+                                   max_count, new_list)
+
+        if len(new_list) == 0 and not_found_is_err:
+            raise ObjectNotFoundError(\
+                "No matching objects found: name = '%s' "
+                "and class_type = %s" %
+                (str(name), str(class_type)))
+
+        return new_list
+
+    def _search_criteria(self, name, class_type, max_depth, max_count):
+        '''THIS IS A PRIVATE METHOD
+
+        Checks the criteria of a search of the descendants of this object,
+        as given to get_descendants(), returning the class_type to match and
+        the classes of the descendants matching it, which are the ones to
+        look for in the indexes of the branches of the tree.
+        '''
+
         if max_depth is not None and max_depth < 0:
             raise ValueError(
                 "max_depth should be greater than or equal to 0, got %d" %
@@ -413,52 +490,48 @@ class DataObjectBase(object):
         if class_type is None:
             class_type = DataObjectBase
 
-        new_list = list()
-        new_max_count = None
-        for child in self._children:
-            if max_count is not None:
-                new_max_count = max_count - len(new_list)
-                if new_max_count < 1:
-                    # Reached limit, stop now.
-                    break
+        classes = list()
+        for cls in self._get_index()[0]:
+            is_subclass = _SUBCLASSES.get((cls, class_type))
+            if is_subclass is None:
+                is_subclass = issubclass(cls, class_type)
+                _SUBCLASSES[(cls, class_type)] = is_subclass
+            if is_subclass:
+                classes.append(cls)
+        return class_type, classes
+
+    def _find_descendants(self, name, class_type, classes, max_depth,
+                          max_count, found):
+        '''THIS IS A PRIVATE METHOD
 
+        Appends the descendants matching the criteria of get_descendants()
+        to found, only searching the children which may hold some according
+        to their index.
+
+        Returns True once max_count objects have been found.
+        '''
+        for child in self._children:
             # Look for matches to criteria
             if isinstance(child, class_type):
                 if name is None or name == child.name:
-                    new_list.append(child)
-                    # Double check max_count after adding to the list.
-                    if max_count is not None:
-                        if len(new_list) >= max_count:
-                            break
-                        else:
-                            new_max_count -= 1
+                    found.append(child)
+                    if max_count is not None and len(found) >= max_count:
+                        # Reached limit, stop now.
+                        return True
+
+            if max_depth == 1:
+                # Don't go any deeper than current child level.
+                continue
 
             # Now search children's children, using recursion...
-            if child.has_children:
+            if child._children and child._may_hold(name, classes):
                 new_max_depth = None
-                if max_depth is not None:
-                    if max_depth > 1:
-                        new_max_depth = max_depth - 1
-                    elif max_depth == 1:
-                        # Don't go any deeper than current child level.
-                        continue
-
-                try:
-                    children_list = child.get_descendants(name=name,
-                        class_type=class_type, max_depth=new_max_depth,
-                        max_count=new_max_count)
-                    new_list.extend(children_list)
-                except ObjectNotFoundError:
-                    # Don't throw here, will throw later if still none found.
-                    pass
-
-        if len(new_list) == 0 and not_found_is_err:
-            raise ObjectNotFoundError(\
-                "No matching objects found: name = '%s' "
-                "and class_type = %s" %
-                (str(name), str(class_type)))
-
-        return new_list
+                if max_depth is not None and max_depth > 1:
+                    new_max_depth = max_depth - 1
+                if child._find_descendants(name, class_type, classes,
+                                           new_max_depth, max_count, found):
+                    return True
+        return False
 
     @staticmethod
     def _check_object_type(obj):
@@ -476,6 +549,161 @@ class DataObjectBase(object):
             DataObjectBase.get_logger().error(msg)
             raise TypeError(msg)
 
+    def __setattr__(self, name, value):
+        '''Sets an attribute, recording when the object was last changed.
+
+        The change stamp lets snapshots of the cache skip objects which
+        haven't changed since the previous snapshot.
+
+        Changes of the attributes the search indexes depend on are passed
+        on to them.
+        '''
+        self._attribute_changing(name, value)
+        object.__setattr__(self, name, value)
+        self.__dict__[_CHANGE_STAMP] = _CHANGE_COUNTER.next()
+
+    def __delattr__(self, name):
+        '''Deletes an attribute, recording when the object was last changed
+        as __setattr__ does, so that snapshots don't keep the attribute.
+        '''
+        self._attribute_changing(name, None)
+        object.__delattr__(self, name)
+        self.__dict__[_CHANGE_STAMP] = _CHANGE_COUNTER.next()
+
+    def _attribute_changing(self, name, value):
+        '''THIS IS A PRIVATE METHOD
+
+        Passes on to the search indexes the change of attribute name to
+        value, None if the attribute is deleted.
+        '''
+        if name == "_name":
+            self._rename_in_index(value)
+        elif name == "_children":
+            # The list of children is replaced, so the indexes holding them
+            # will have to be rebuilt.
+            self._drop_index()
+        elif name == "_parent":
+            self.__dict__.pop(_DETACHED, None)
+
+    # Methods maintaining the search indexes
+    def _get_index(self):
+        '''THIS IS A PRIVATE METHOD
+
+        Returns the index of the descendants of this object, a tuple of
+        two dictionaries counting them by class and by name, building it
+        if needed.
+        '''
+        index = self.__dict__.get(_INDEX)
+        if index is not None:
+            return index
+        if not self._children:
+            return _EMPTY_INDEX
+
+        classes = dict()
+        names = dict()
+        for child in self._children:
+            child_classes, child_names = child._get_index()
+            for key, count in child_classes.iteritems():
+                classes[key] = classes.get(key, 0) + count
+            for key, count in child_names.iteritems():
+                names[key] = names.get(key, 0) + count
+            key = child.__class__
+            classes[key] = classes.get(key, 0) + 1
+            key = child._index_name()
+            names[key] = names.get(key, 0) + 1
+        index = self.__dict__[_INDEX] = (classes, names)
+        return index
+
+    def _index_name(self):
+        '''THIS IS A PRIVATE METHOD
+
+        Returns the name this object is counted under in the index of its
+        ancestors.
+        '''
+        if self.__class__.name is DataObjectBase.name:
+            return self.__dict__.get("_name")
+        return _ANY_NAME
+
+    def _ancestor_indexes(self):
+        '''THIS IS A PRIVATE METHOD
+
+        Returns the indexes kept by this object and its ancestors.
+        '''
+        indexes = list()
+        node = self
+        while node is not None:
+            index = node.__dict__.get(_INDEX)
+            if index is not None:
+                indexes.append(index)
+            if _DETACHED in node.__dict__:
+                break
+            node = node.__dict__.get("_parent")
+        return indexes
+
+    def _update_index(self, child, delta):
+        '''THIS IS A PRIVATE METHOD
+
+        Updates the indexes of this object and its ancestors once child
+        has been inserted (delta 1) or removed (delta -1) as a child of
+        this object.
+        '''
+        indexes = self._ancestor_indexes()
+        if not indexes:
+            return
+
+        classes, names = child._get_index()
+        classes = classes.items()
+        classes.append((child.__class__, 1))
+        names = names.items()
+        names.append((child._index_name(), 1))
+        for index_classes, index_names in indexes:
+            _add_counts(index_classes, classes, delta)
+            _add_counts(index_names, names, delta)
+
+    def _rename_in_index(self, name):
+        '''THIS IS A PRIVATE METHOD
+
+        Updates the indexes of the ancestors of this object, before it's
+        given a new name.
+        '''
+        parent = self.__dict__.get("_parent")
+        if parent is None or _DETACHED in self.__dict__:
+            return
+        old_name = self._index_name()
+        if old_name is _ANY_NAME:
+            return
+        for index_classes, index_names in parent._ancestor_indexes():
+            _add_counts(index_names, [(old_name, 1)], -1)
+            _add_counts(index_names, [(name, 1)], 1)
+
+    def _drop_index(self):
+        '''THIS IS A PRIVATE METHOD
+
+        Drops the indexes of this object and its ancestors, which will be
+        rebuilt when next needed.
+        '''
+        node = self
+        while node is not None:
+            node.__dict__.pop(_INDEX, None)
+            if _DETACHED in node.__dict__:
+                break
+            node = node.__dict__.get("_parent")
+
+    def _may_hold(self, name, classes):
+        '''THIS IS A PRIVATE METHOD
+
+        Returns False if none of the descendants of this object can have
+        the given name (if not None) and be of one of the given classes.
+        '''
+        index_classes, index_names = self._get_index()
+        if name is not None and name not in index_names and \
+            _ANY_NAME not in index_names:
+            return False
+        for cls in classes:
+            if cls in index_classes:
+                return True
+        return False
+
     # Methods for cloning / duplication objects
     def __getstate__(self):
         '''Provide a copy of the internal dictionary to be used in deepcopy'''
@@ -483,6 +711,10 @@ class DataObjectBase(object):
         state = dict(self.__dict__)
         # Ensure that copy doesn't have a parent to avoid recusion up tree.
         state['_parent'] = None
+        # The change stamp and the index only have a meaning for this object.
+        state.pop(_CHANGE_STAMP, None)
+        state.pop(_INDEX, None)
+        state.pop(_DETACHED, None)
         return state
 
     def __setstate__(self, state):
@@ -677,6 +909,9 @@ class DataObjectBase(object):
         The '/' root node is the 'self' reference, so it's name is not
         included in a path, since it's releative to this object.
 
+        A path is broken down the first time it's used, and kept for later
+        uses, so that only the search itself is repeated.
+
         Exceptions:
 
             PathError       - Raised if invalid path is provided.
@@ -691,71 +926,65 @@ class DataObjectBase(object):
 
         '''
 
-        # Used to enforce a max_depth if only one '/' specified.
-        max_depth = None
-        # Tokenize string specific to this level, will call recursively.
-        matched = list()
-        remaining_path = None
-        if (path_string.startswith("//")):
-            # Use descendants
-            tokens = path_string.split("/", 3)
-            to_eval = tokens[2]
-            if (len(tokens) > 3 and tokens[3] != ""):
-                remaining_path = "/" + tokens[3]
-        elif (path_string.startswith("/")):
-            # Use get_children OR max_depth = 1
-            tokens = path_string.split("/", 2)
-            to_eval = tokens[1]
-            if (len(tokens) > 2 and tokens[2] != ""):
-                remaining_path = "/" + tokens[2]
-            max_depth = 1
-        else:
-            # Raise error
-            raise PathError("Invalid path: '%s'" % (path_string))
-
-        kwargs = self.__convert_to_kwargs(to_eval)
-
-        # Remove attribute if found since it's not a valid parameter
-        # to get_descendants
-        attribute = None
-        if "attribute" in kwargs:
-            attribute = kwargs["attribute"]
-            del kwargs["attribute"]
-
-            if attribute.startswith("_"):
-                raise AttributeError("Invalid attribute: '%s'" % (attribute))
+        steps = _PATH_CACHE.get(path_string)
+        if steps is None:
+            steps = DataObjectBase.__compile_path(path_string)
+            if len(_PATH_CACHE) >= PATH_CACHE_SIZE:
+                # start over rather than track the use of each path
+                _PATH_CACHE.clear()
+            _PATH_CACHE[path_string] = steps
 
-        # Enforce a max_depth is we set one ourselves.
-        if max_depth is not None:
-            kwargs["max_depth"] = max_depth
-
-        children = self.get_descendants(**kwargs)
-        if remaining_path is not None:
-             # Keep descending, don't include intermediate matches.
-            child_matched = list()
-            for child in children:
-                try:
-                    child_list = child.find_path(remaining_path)
-                    child_matched.extend(child_list)
-                except ObjectNotFoundError:
-                    pass
-            matched.extend(child_matched)
-        else:
-            # As deep as possible, return these children.:
-            matched.extend(children)
+        matched = self.__match_path(steps)
 
         if len(matched) == 0 and not_found_is_err:
             raise ObjectNotFoundError("No children found matching : '%s'" %
                 (path_string))
 
-        if attribute is not None:
-            attr_values = list()
+        return matched
+
+    def __match_path(self, steps):
+        '''Returns the matches of steps, a path compiled by __compile_path(),
+        below this object.'''
+        matched = [self]
+        for name, class_name, max_depth, max_count, attribute in steps:
+            class_type = None
+            if class_name is not None:
+                # Located on each use, as the module holding the class may
+                # not be loaded yet when the path is first used.
+                class_type = DataObjectBase.__locate_class_by_name(class_name)
+            elif name is None:
+                # If neither specified assume DataObjectBase
+                class_type = DataObjectBase
+
+            if attribute is not None and attribute.startswith("_"):
+                raise AttributeError("Invalid attribute: '%s'" % (attribute))
+
+            # The objects searched are all below this one, so the classes
+            # to look for are found once, in the index of this object.
+            class_type, classes = self._search_criteria(name, class_type,
+                                                        max_depth, max_count)
+
+            # Keep descending, don't include intermediate matches.
+            children = list()
             for match in matched:
-                # getattr() will generate AttributeErrors if invalid attribute.
-                attr_values.append(getattr(match, attribute))
-            return attr_values
-        else:
-            return matched
+                found = list()
+                if match._may_hold(name, classes):
+                    match._find_descendants(name, class_type, classes,
+                                            max_depth, max_count, found)
+                children.extend(found)
+            matched = children
+            if not matched:
+                break
+
+        # The attribute of an element is got from what the rest of the path
+        # matched, so the last element's attribute is got first.
+        for name, class_name, max_depth, max_count, attribute in \
+            reversed(steps):
+            if attribute is not None:
+                # getattr() will generate AttributeErrors if invalid
+                # attribute.
+                matched = [getattr(match, attribute) for match in matched]
+        return matched
 
     def str_replace_paths_refs(self, orig_string, value_separator=",",
                                quote=False):
@@ -861,21 +1090,59 @@ class DataObjectBase(object):
 
         return(class_obj)
 
+    @staticmethod
+    def __compile_path(path_string):
+        '''Breaks a path down into a tuple of steps, one for each of its
+        elements, as (name, class name, max_depth, max_count, attribute).
+        '''
+        steps = list()
+        remaining_path = path_string
+        while remaining_path is not None:
+            # Used to enforce a max_depth if only one '/' specified.
+            max_depth = None
+            if (remaining_path.startswith("//")):
+                # Use descendants
+                tokens = remaining_path.split("/", 3)
+                to_eval = tokens[2]
+                remaining_path = None
+                if (len(tokens) > 3 and tokens[3] != ""):
+                    remaining_path = "/" + tokens[3]
+            elif (remaining_path.startswith("/")):
+                # Use get_children OR max_depth = 1
+                tokens = remaining_path.split("/", 2)
+                to_eval = tokens[1]
+                remaining_path = None
+                if (len(tokens) > 2 and tokens[2] != ""):
+                    remaining_path = "/" + tokens[2]
+                max_depth = 1
+            else:
+                # Raise error
+                raise PathError("Invalid path: '%s'" % (path_string))
+
+            kwargs = DataObjectBase.__convert_to_kwargs(to_eval)
+
+            # A max_depth we set ourselves overrides the one in the path.
+            if max_depth is None:
+                max_depth = kwargs.get("max_depth")
+
+            steps.append((kwargs.get("name"), kwargs.get("class_name"),
+                          max_depth, kwargs.get("max_count"),
+                          kwargs.get("attribute")))
+
+        return tuple(steps)
+
     @staticmethod
     def __convert_to_kwargs(value_string):
-        '''Convert a path element to a series of kwargs for get_descendants'''
+        '''Convert a path element to a series of kwargs for get_descendants.
+        A class is returned by name, as class_name, to be located on use;
+        with neither a name nor a class, all objects are matched.'''
         args = dict()
         match = DataObjectBase.__NAME_RE.match(value_string)
         if match:
             args["name"] = unquote(match.group(1))
         match = DataObjectBase.__TYPE_RE.match(value_string)
         if match:
-            args["class_type"] = \
-                DataObjectBase.__locate_class_by_name(unquote(match.group(1)))
-
-        # If neither specified assume DataObjectBase for the class_type
-        if "name" not in args and "class_type" not in args:
-            args["class_type"] = DataObjectBase
+            args["class_name"] = unquote(match.group(1))
 
         match = DataObjectBase.__COUNT_RE.match(value_string)
         if match:
@@ -962,9 +1229,13 @@ class DataObject(DataObjectBase):
         offset = 0
         for child in new_children:
             self._check_object_type(child)
+            count = len(self._children)
             self._children.insert(insert_at + offset, child)
             child._parent = self
             offset += 1
+            # Some lists of children may refuse to take new children
+            if len(self._children) > count:
+                self._update_index(child, 1)
 
     def __delete_child(self, child, not_found_is_err=False):
         '''THIS IS A PRIVATE CLASS METHOD
@@ -979,6 +1250,7 @@ class DataObject(DataObjectBase):
         try:
             self._children.remove(child)
             child._parent = None
+            self._update_index(child, -1)
         except ValueError:
             if not_found_is_err:
                 raise ObjectNotFoundError(
@@ -1074,3 +1346,7 @@ class DataObject(DataObjectBase):
 
         if self._parent is not None:
             self._parent._children.remove(self)
+            self._parent._update_index(self, -1)
+            # The reference to the parent is left in place, but changes
+            # under this object no longer concern the parent's index.
+            self.__dict__[_DETACHED] = True
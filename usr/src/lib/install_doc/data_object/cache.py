@@ -27,12 +27,12 @@
 """
 
 import inspect
-import pickle
 
 from lxml import etree
 
 from solaris_install.data_object import \
     DataObjectBase, DataObject
+from solaris_install.data_object.snapshot import SnapshotJournal
 
 # Registry of all classes that use the cache (ie all sub-classes of DataObject)
 # Uses a dictionary, with keys being priorities, and values being a list of
@@ -99,6 +99,10 @@ class DataObjectCache(DataObjectBase):
       - It is possible to roll-back the 'persistent' sub-tree to the contents
         of a provided file or file-like object.
 
+      - Snapshots written to a file path after the first are incremental,
+        holding only the objects which changed since the previous snapshot
+        taken or loaded (see the snapshot module).
+
     - XML Manifest Import and Generation
 
       - Drives the import of an XML manifest into a DataObject based tree
@@ -132,6 +136,9 @@ class DataObjectCache(DataObjectBase):
         self._persistent_tree._parent = self
         self._volatile_tree._parent = self
 
+        # Tracks the 'persistent' sub-tree between snapshots
+        self._journal = SnapshotJournal()
+
     @property
     def persistent(self):
         '''Returns the persistent tree child_node'''
@@ -168,7 +175,7 @@ class DataObjectCache(DataObjectBase):
         return not self._persistent_tree.has_children and \
                 not self._volatile_tree.has_children
 
-    def take_snapshot(self, file_obj):
+    def take_snapshot(self, file_obj, compress=False):
         '''Takes a snapshot of the 'persistent' sub-tree.
 
         This method writes the contents of the 'persistent' sub-tree to the
@@ -183,6 +190,15 @@ class DataObjectCache(DataObjectBase):
                       be  an open file object, a StringIO object, or any
                       other custom object that meets this interface.
 
+        A snapshot written to a file path, in the same directory as the
+        previous snapshot taken or loaded, only holds the objects which
+        changed since then, and needs the previous snapshot to be loaded.
+        Every so often, or when written to an object, a full snapshot is
+        written instead.
+
+        If 'compress' is True, the snapshot is compressed as it's written,
+        trading the time taken to take and load it for its size.
+
         Exceptions:
 
         ValueError  - This will be thrown if wrong type is passed for
@@ -205,10 +221,15 @@ class DataObjectCache(DataObjectBase):
             raise ValueError("'file_obj' should be either a file path string \
                                or object with write(string) method")
 
-        pickle.dump(self._persistent_tree, outfile)
-
+        path = None
         if close_at_end:
-            outfile.close()
+            path = file_obj
+        try:
+            self._journal.write(self._persistent_tree, outfile, path,
+                                compress)
+        finally:
+            if close_at_end:
+                outfile.close()
 
     def load_from_snapshot(self, file_obj):
         '''Load a snapshot in to the 'persistent' sub-tree.
@@ -230,13 +251,21 @@ class DataObjectCache(DataObjectBase):
                       object opened for reading, a StringIO object, or any
                       other custom object that meets this interface.
 
+        Loading an incremental snapshot also reads the snapshots it was
+        taken on top of, from the same directory.
+
         Exceptions:
 
         ValueError  - This will be thrown if wrong type is passed for
                       'file_obj'
 
         IOError     - This will be thrown if there is a problem opening the
-                      specified file_obj path string.
+                      specified file_obj path string, or a snapshot it was
+                      taken on top of.
+
+        SnapshotError
+                    - This will be thrown if the snapshot isn't valid, or a
+                      snapshot it was taken on top of has been replaced.
 
         '''
 
@@ -253,14 +282,19 @@ class DataObjectCache(DataObjectBase):
             raise ValueError("'file_obj' should be either a file path string \
                                or object with read and readline methods")
 
-        new_cache_peristent_tree = pickle.load(infile)
-
+        path = None
         if close_at_end:
-            infile.close()
+            path = file_obj
+        try:
+            new_cache_peristent_tree = self._journal.load(infile, path)
+        finally:
+            if close_at_end:
+                infile.close()
 
         self._persistent_tree.delete_children()
         self._persistent_tree.insert_children(
             new_cache_peristent_tree.children)
+        self._journal.rebase(self._persistent_tree)
 
     @classmethod
     def register_class(cls, new_class_obj, priority=50):
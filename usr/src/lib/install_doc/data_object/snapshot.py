@@ -0,0 +1,583 @@
+#!/usr/bin/python
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''Incremental snapshots of a tree of DataObjects.
+
+A snapshot file starts with a preamble:
+
+    SNAPSHOT_MAGIC, format version (1 byte), flags (1 byte)
+
+followed by two binary pickles: a header, and a list of records, one for
+each object written:
+
+    (snapshot id, class, pickled state of the object)
+
+The state of an object, normally a dictionary, is pickled as the tuple
+
+    (shape id, value, value, ...)
+
+where the shape, found in the 'shapes' of the header, is the sorted tuple of
+the keys of the dictionary, so that the names of the attributes of objects
+aren't repeated in every record.
+
+If the COMPRESSED flag is set, the list of records is compressed with zlib;
+the header never is, so that the chain of snapshots can be checked cheaply.
+
+References from the state of an object to other objects of the tree (its
+children, a container referring back to it, etc.) are pickled as the
+snapshot ids of those objects.
+
+A full snapshot has a record for every object in the tree. An incremental
+snapshot only has records for the objects which were added or changed since
+the previous snapshot taken or loaded, and names that snapshot, in the same
+directory, as its parent. A tree is rebuilt from the newest record of each
+object found along the chain of snapshots leading back to a full snapshot.
+
+Version 1 snapshots, which had no preamble and were written with pickle
+protocol 0, and full trees pickled by earlier versions of the cache can
+still be loaded.
+'''
+
+import binascii
+import cPickle
+import gc
+import hashlib
+import os
+import struct
+import zlib
+
+from contextlib import contextmanager
+from cStringIO import StringIO
+
+from solaris_install.data_object import DataObjectBase, SnapshotError, \
+    _CHANGE_COUNTER, _CHANGE_STAMP, _DETACHED, _INDEX
+
+SNAPSHOT_FORMAT = "DataObjectCache-snapshot"
+SNAPSHOT_MAGIC = "\x89DOCSNAP"
+SNAPSHOT_VERSION = 2
+
+# Flags of the preamble
+COMPRESSED = 0x01
+
+_PREAMBLE = struct.Struct(">%dsBB" % len(SNAPSHOT_MAGIC))
+_PROTOCOL = cPickle.HIGHEST_PROTOCOL
+# Size of the chunks compressed data is read in
+_CHUNK_SIZE = 64 * 1024
+
+# Values of these types can't be changed in place, so an object holding only
+# such values (and references to other objects of the tree) can only change
+# by having its attributes set, which is recorded by its change stamp.
+_IMMUTABLE_TYPES = (type(None), bool, int, long, float, complex, str,
+                    unicode)
+
+# Indexes of the journal entry kept for each object of the tree
+_SID, _NODE, _CHILDREN, _DIGEST = range(4)
+
+
+class _StateEncoder(object):
+    '''Pickles the state of objects, referring to other objects of the tree
+    by their snapshot ids, and to the keys of their state by shape ids.'''
+
+    def __init__(self, nodes, shapes, shape_ids):
+        self._nodes = nodes
+        self._shapes = shapes
+        self._shape_ids = shape_ids
+        self._buffer = StringIO()
+        self._pickler = cPickle.Pickler(self._buffer, _PROTOCOL)
+        # Unlike persistent_id, this is only called for objects which
+        # aren't of a built-in type, which is far cheaper.
+        self._pickler.inst_persistent_id = self._persistent_id
+
+    def _persistent_id(self, obj):
+        '''Returns the snapshot id of obj if it's an object of the tree'''
+        entry = self._nodes.get(id(obj))
+        if entry is not None and entry[_NODE] is obj:
+            return entry[_SID]
+        return None
+
+    def encode(self, node):
+        '''Returns the pickled state of node'''
+        state = node.__getstate__()
+        if type(state) is dict:
+            keys = tuple(sorted(state))
+            shape = self._shape_ids.get(keys)
+            if shape is None:
+                shape = self._shape_ids[keys] = len(self._shapes)
+                self._shapes.append(keys)
+            state = (shape,) + tuple([state[key] for key in keys])
+        else:
+            state = (None, state)
+
+        # Reuse the pickler, but not its memo, as each state is unpickled
+        # on its own.
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._pickler.clear_memo()
+        self._pickler.dump(state)
+        return self._buffer.getvalue()
+
+
+@contextmanager
+def _gc_paused():
+    '''Suspend cyclic garbage collection, which would otherwise run over
+    and over while the many objects of a large tree are created'''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _decode(data, resolve, shapes):
+    '''Returns the state pickled in data, resolving references to other
+    objects of the tree with resolve(). shapes is None for the records of
+    version 1 snapshots, which pickled the state itself.'''
+    unpickler = cPickle.Unpickler(StringIO(data))
+    if shapes is None:
+        # Version 1 snapshots pickled snapshot ids as strings
+        unpickler.persistent_load = lambda pid: resolve(int(pid))
+        return unpickler.load()
+
+    unpickler.persistent_load = resolve
+    state = unpickler.load()
+    if state[0] is None:
+        return state[1]
+    return dict(zip(shapes[state[0]], state[1:]))
+
+
+class _CompressedWriter(object):
+    '''File-like object compressing what's written to it to outfile'''
+
+    def __init__(self, outfile):
+        self._outfile = outfile
+        self._compressor = zlib.compressobj()
+
+    def write(self, data):
+        '''Compress data to the underlying file'''
+        self._outfile.write(self._compressor.compress(data))
+
+    def flush(self):
+        '''Write what's left of the compressed stream'''
+        self._outfile.write(self._compressor.flush())
+
+
+def _read_preamble(infile):
+    '''Read the preamble of a snapshot from infile.
+
+    Returns (version, flags, infile), where infile is the file to read the
+    rest of the snapshot from, as files with no preamble have to be read
+    again from the start.
+    '''
+    preamble = infile.read(_PREAMBLE.size)
+    if len(preamble) == _PREAMBLE.size:
+        magic, version, flags = _PREAMBLE.unpack(preamble)
+        if magic == SNAPSHOT_MAGIC:
+            return version, flags, infile
+    return None, 0, StringIO(preamble + infile.read())
+
+
+def _read_records(infile, flags):
+    '''Returns the list of records read from infile'''
+    if not flags & COMPRESSED:
+        return cPickle.load(infile)
+    decompressor = zlib.decompressobj()
+    chunks = list()
+    while True:
+        chunk = infile.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(decompressor.decompress(chunk))
+    chunks.append(decompressor.flush())
+    return cPickle.loads("".join(chunks))
+
+
+class SnapshotJournal(object):
+    '''Tracks the objects of a tree between its snapshots.
+
+    The journal keeps an entry for each object of the tree written to or
+    loaded from the last snapshot:
+
+        [snapshot id, object, snapshot ids of its children, state digest]
+
+    and uses it to write only the objects which changed since then.
+
+    A full snapshot is written rather than an incremental one when:
+    - there's no previous snapshot, or it was written to or read from a
+      file-like object rather than a path
+    - the previous snapshot is in another directory
+    - the new snapshot would overwrite one of the chain it would be part of,
+      or any snapshot of that chain was replaced or removed
+    - the chain already has FULL_INTERVAL incremental snapshots
+    - more than half the objects of the tree changed
+    '''
+
+    FULL_INTERVAL = 8
+
+    def __init__(self):
+        self._nodes = dict()
+        self._next_sid = 1
+        self._seq = 0
+        self._directory = None
+        self._chain = None
+        self._loaded = None
+        # Shapes of the states written, which are only ever added to, so
+        # that records of earlier snapshots of a chain stay valid.
+        self._shapes = list()
+        self._shape_ids = dict()
+
+    def reset(self):
+        '''Forget about the objects and snapshots seen so far, so that the
+        next snapshot will be a full one.'''
+        self.__init__()
+
+    @property
+    def chain_length(self):
+        '''Returns the number of snapshots in the chain of the last snapshot
+        written or loaded, or 0 if it can't have incremental snapshots.'''
+        if self._chain is None:
+            return 0
+        return len(self._chain)
+
+    def write(self, tree, outfile, path=None, compress=False):
+        '''Write a snapshot of tree to outfile.
+
+        'path' is the path outfile was opened for, if any; incremental
+        snapshots are only written to, and on top of, files named by path.
+
+        If 'compress' is True, the records of the snapshot are compressed.
+        '''
+        with _gc_paused():
+            self._write(tree, outfile, path, compress)
+
+    def _write(self, tree, outfile, path, compress):
+        '''Write a snapshot, see write()'''
+        seq = _CHANGE_COUNTER.next()
+
+        nodes = dict()
+        order = list()
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            entry = self._nodes.get(id(node))
+            if entry is None or entry[_NODE] is not node:
+                entry = [self._next_sid, node, None, None]
+                self._next_sid += 1
+            nodes[id(node)] = entry
+            order.append(entry)
+            stack.extend(node._children)
+
+        full = not self._can_append(path)
+        encoder = _StateEncoder(nodes, self._shapes, self._shape_ids)
+        encoded = dict()
+        updates = list()
+        for entry in order:
+            node = entry[_NODE]
+            children = tuple([nodes[id(child)][_SID]
+                              for child in node._children])
+            digest = entry[_DIGEST]
+            if full or self._may_have_changed(entry, children, nodes):
+                data = encoder.encode(node)
+                digest = hashlib.md5(data).digest()
+                if full or digest != entry[_DIGEST]:
+                    encoded[entry[_SID]] = data
+            updates.append((entry, children, digest))
+
+        if not full and len(encoded) * 2 > len(order):
+            # Changes are widespread; start a new chain instead
+            full = True
+            for entry in order:
+                if entry[_SID] not in encoded:
+                    encoded[entry[_SID]] = encoder.encode(entry[_NODE])
+
+        token = binascii.hexlify(os.urandom(8))
+        parent = None
+        if not full:
+            parent = self._chain[0]
+        header = {"format": SNAPSHOT_FORMAT,
+                  "version": SNAPSHOT_VERSION,
+                  "token": token,
+                  "parent": parent,
+                  "root": nodes[id(tree)][_SID],
+                  "shapes": self._shapes}
+        records = [(entry[_SID], entry[_NODE].__class__,
+                    encoded[entry[_SID]])
+                   for entry in order if entry[_SID] in encoded]
+
+        flags = 0
+        if compress:
+            flags |= COMPRESSED
+        outfile.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, flags))
+        cPickle.dump(header, outfile, _PROTOCOL)
+        if compress:
+            writer = _CompressedWriter(outfile)
+            cPickle.dump(records, writer, _PROTOCOL)
+            writer.flush()
+        else:
+            cPickle.dump(records, outfile, _PROTOCOL)
+
+        # Only now that the snapshot is written, remember what it holds
+        for entry, children, digest in updates:
+            entry[_CHILDREN] = children
+            entry[_DIGEST] = digest
+        self._nodes = nodes
+        self._seq = seq
+        self._loaded = None
+        if path is None:
+            self._directory = self._chain = None
+        else:
+            link = (os.path.basename(path), token)
+            if full:
+                self._directory = os.path.dirname(os.path.abspath(path))
+                self._chain = [link]
+            else:
+                self._chain.insert(0, link)
+
+    def load(self, infile, path=None):
+        '''Load a snapshot from infile, returning the root of its tree.
+
+        'path' is the path infile was opened for, if any, which is used to
+        find the snapshots an incremental snapshot was taken on top of.
+
+        Once the objects of the tree have been put in place, rebase() should
+        be called so that the next snapshot can be taken on top of this one.
+        '''
+        with _gc_paused():
+            return self._load(infile, path)
+
+    def _load(self, infile, path):
+        '''Load a snapshot, see load()'''
+        self._loaded = None
+        version, flags, infile = _read_preamble(infile)
+        header = cPickle.load(infile)
+        if version is None and isinstance(header, DataObjectBase):
+            # A full tree pickled by earlier versions of the cache
+            self.reset()
+            return header
+
+        if path is None:
+            path = getattr(infile, "name", None)
+        directory = None
+        if path is not None:
+            directory = os.path.dirname(os.path.abspath(path))
+
+        self._check_header(header, path, version)
+        records = dict()
+        for sid, cls, data in _read_records(infile, flags):
+            records[sid] = (cls, data)
+
+        chain = [(None, header["token"])]
+        if path is not None:
+            chain = [(os.path.basename(path), header["token"])]
+        parent = header["parent"]
+        while parent is not None:
+            if directory is None:
+                raise SnapshotError("Incremental snapshot needs the path of "
+                                    "its parent snapshot '%s'" % parent[0])
+            name, token = parent
+            parent_path = os.path.join(directory, name)
+            with open(parent_path, "rb") as parent_file:
+                parent_version, flags, parent_file = \
+                    _read_preamble(parent_file)
+                parent_header = cPickle.load(parent_file)
+                self._check_header(parent_header, parent_path,
+                                   parent_version, token)
+                if parent_version != version:
+                    raise SnapshotError("Snapshot %s isn't of the version "
+                                        "of the snapshots taken on top of "
+                                        "it" % parent_path)
+                for sid, cls, data in _read_records(parent_file, flags):
+                    records.setdefault(sid, (cls, data))
+            chain.append(parent)
+            parent = parent_header["parent"]
+
+        shells = dict()
+        pending = list()
+
+        def resolve(sid):
+            '''Return the (new) object with snapshot id sid'''
+            obj = shells.get(sid)
+            if obj is None:
+                try:
+                    cls = records[sid][0]
+                except KeyError:
+                    raise SnapshotError("Snapshot has no record of object "
+                                        "%d" % sid)
+                obj = cls.__new__(cls)
+                shells[sid] = obj
+                pending.append(sid)
+            return obj
+
+        shapes = header.get("shapes")
+        root = resolve(header["root"])
+        states = list()
+        while pending:
+            sid = pending.pop()
+            states.append((shells[sid],
+                           _decode(records[sid][1], resolve, shapes)))
+
+        # Like pickle would, set the state of children before their parents,
+        # as setting the state of a parent sets the parent of its children.
+        for obj, state in reversed(states):
+            obj.__setstate__(state)
+        # An object may have been referred to before its parent was loaded,
+        # so make sure every parent reference is in place.
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for child in node._children:
+                if child._parent is not node:
+                    child._parent = node
+                stack.append(child)
+
+        digests = dict((sid, hashlib.md5(records[sid][1]).digest())
+                       for sid in shells)
+        if directory is None or chain[0][0] is None or \
+            header["version"] != SNAPSHOT_VERSION:
+            # Don't take snapshots on top of snapshots of an earlier version
+            chain = directory = None
+        self._loaded = (header["root"], shells, digests, directory, chain,
+                        shapes)
+        return root
+
+    def rebase(self, tree):
+        '''Make the tree just loaded, now under tree (which takes the place
+        of the root of the snapshot), the base for the next snapshot.'''
+        with _gc_paused():
+            self._rebase(tree)
+
+    def _rebase(self, tree):
+        '''Make tree the base for the next snapshot, see rebase()'''
+        if self._loaded is None:
+            self.reset()
+            return
+
+        root_sid, shells, digests, directory, chain, shapes = self._loaded
+        self._loaded = None
+
+        sids = dict((id(obj), sid) for sid, obj in shells.iteritems())
+        sids[id(tree)] = root_sid
+        nodes = dict()
+        for sid, obj in shells.iteritems():
+            if sid != root_sid:
+                nodes[id(obj)] = [sid, obj, None, digests[sid]]
+        # The state of the root itself wasn't loaded, so always write it.
+        nodes[id(tree)] = [root_sid, tree, None, None]
+
+        for entry in nodes.itervalues():
+            try:
+                entry[_CHILDREN] = tuple([sids[id(child)]
+                                          for child in entry[_NODE]._children])
+            except KeyError:
+                entry[_DIGEST] = None
+
+        self._nodes = nodes
+        self._next_sid = max(shells) + 1
+        self._seq = _CHANGE_COUNTER.next()
+        self._directory = directory
+        self._chain = chain
+        self._shapes = list(shapes or ())
+        self._shape_ids = dict((keys, shape)
+                               for shape, keys in enumerate(self._shapes))
+
+    def _may_have_changed(self, entry, children, nodes):
+        '''Returns False if the object of entry is known to be unchanged
+        since the last snapshot.'''
+        if entry[_DIGEST] is None or children != entry[_CHILDREN]:
+            return True
+
+        node = entry[_NODE]
+        if node.__dict__.get(_CHANGE_STAMP, 0) > self._seq:
+            return True
+
+        # The stamp doesn't show values changed in place (e.g. a list
+        # appended to), so objects holding such values must be compared
+        if type(node._children) is not list:
+            return True
+        for name, value in node.__dict__.iteritems():
+            if name in ("_children", "_parent", _INDEX, _DETACHED):
+                continue
+            if not self._is_immutable(value, nodes):
+                return True
+        return False
+
+    def _is_immutable(self, value, nodes):
+        '''Returns True if value can't be changed without setting the
+        attribute holding it'''
+        if isinstance(value, _IMMUTABLE_TYPES):
+            return True
+        entry = nodes.get(id(value))
+        if entry is not None and entry[_NODE] is value:
+            return True
+        if type(value) in (tuple, frozenset):
+            for item in value:
+                if not self._is_immutable(item, nodes):
+                    return False
+            return True
+        return False
+
+    def _can_append(self, path):
+        '''Returns True if an incremental snapshot can be written to path'''
+        if path is None or self._chain is None:
+            return False
+        if len(self._chain) > self.FULL_INTERVAL:
+            return False
+        if os.path.dirname(os.path.abspath(path)) != self._directory:
+            return False
+        name = os.path.basename(path)
+        for link_name, token in self._chain:
+            if link_name == name:
+                return False
+            # Make sure the chain is still there, unchanged.
+            link_path = os.path.join(self._directory, link_name)
+            try:
+                with open(link_path, "rb") as link_file:
+                    version, flags, link_file = _read_preamble(link_file)
+                    self._check_header(cPickle.load(link_file), link_path,
+                                       version, token)
+            except (IOError, EOFError, SnapshotError, cPickle.PickleError):
+                return False
+        return True
+
+    @staticmethod
+    def _check_header(header, path, version, token=None):
+        '''Raise SnapshotError unless header is the header of a snapshot
+        with the given token, and the version of its preamble (None if it
+        has none) can be read'''
+        if not isinstance(header, dict) or \
+            header.get("format") != SNAPSHOT_FORMAT:
+            raise SnapshotError("Not a DataObjectCache snapshot: %s" % path)
+        if version is None:
+            # Only version 1 snapshots had no preamble
+            version = 1
+        if version not in (1, SNAPSHOT_VERSION) or \
+            header.get("version") != version:
+            raise SnapshotError("Unsupported snapshot version %s: %s" %
+                                (header.get("version"), path))
+        if token is not None and header.get("token") != token:
+            raise SnapshotError("Snapshot %s has been replaced since an "
+                                "incremental snapshot was taken on top of it"
+                                % path)
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''Tests to validate incremental DOC snapshots'''
+
+import pickle
+import unittest
+from StringIO import StringIO
+from tempfile import mkdtemp
+from os import path, stat
+from shutil import rmtree
+
+from solaris_install.data_object import SnapshotError
+from solaris_install.data_object.cache import DataObjectCache
+from solaris_install.data_object.snapshot import SNAPSHOT_FORMAT, \
+    SNAPSHOT_MAGIC
+from simple_data_object import SimpleDataObject, \
+    SimpleDataObject2, SimpleDataObject3
+
+
+def tree_state(doc):
+    '''Returns a description of everything in the 'persistent' sub-tree'''
+    state = list()
+    stack = [doc.persistent]
+    while stack:
+        node = stack.pop()
+        attrs = node.__getstate__()
+        del attrs["_children"]
+        state.append((node.object_path, node.__class__.__name__,
+                      sorted((key, repr(value))
+                             for key, value in attrs.iteritems()),
+                      [child.name for child in node.children],
+                      node.parent is not None))
+        stack.extend(node.children)
+    return state
+
+
+class TestDataObjectCacheJournal(unittest.TestCase):
+    '''Tests to validate incremental DOC snapshots'''
+
+    def setUp(self):
+        '''Create a DOC with a few hundred objects, and a temp dir'''
+        self.temp_dir = mkdtemp(prefix="doc_test-")
+        self.doc = DataObjectCache()
+        self.disks = SimpleDataObject("disks")
+        self.doc.persistent.insert_children(self.disks)
+        for disk_num in range(50):
+            disk = SimpleDataObject2("disk%d" % disk_num)
+            disk.ctds = list()
+            disk.size = disk_num * 1024
+            for slice_num in range(4):
+                disk.insert_children(SimpleDataObject3("s%d" % slice_num))
+            self.disks.insert_children(disk)
+
+    def tearDown(self):
+        '''Remove the temp dir'''
+        rmtree(self.temp_dir)
+        self.doc = None
+        self.disks = None
+
+    def snap(self, name, compress=False):
+        '''Take a snapshot, returning its path'''
+        snap_path = path.join(self.temp_dir, name)
+        self.doc.take_snapshot(snap_path, compress)
+        return snap_path
+
+    def test_rebuild_each_state(self):
+        '''Validate every snapshot of a chain loads its own state'''
+        snaps = list()
+        snaps.append((self.snap("base"), tree_state(self.doc)))
+
+        disk = self.disks.get_first_child(name="disk3")
+        disk.size = 1
+        snaps.append((self.snap("attr"), tree_state(self.doc)))
+
+        disk.ctds.append("c0t0d0")
+        snaps.append((self.snap("in_place"), tree_state(self.doc)))
+
+        disk.delete_children(name="s2")
+        new_disk = SimpleDataObject2("new_disk")
+        new_disk.ctds = ("c1t0d0",)
+        self.disks.insert_children(new_disk, before=disk)
+        snaps.append((self.snap("structure"), tree_state(self.doc)))
+
+        moved = self.disks.get_first_child(name="disk7")
+        moved.delete()
+        new_disk.insert_children(moved)
+        new_disk.partner = disk
+        snaps.append((self.snap("moved"), tree_state(self.doc)))
+
+        self.assertEqual(self.doc._journal.chain_length, len(snaps))
+        self.assertTrue(stat(snaps[1][0]).st_size * 10 <
+                        stat(snaps[0][0]).st_size)
+
+        for snap_path, state in reversed(snaps + snaps):
+            self.doc.load_from_snapshot(snap_path)
+            self.assertEqual(tree_state(self.doc), state)
+
+        # An object referred to by another is the one in the tree
+        self.doc.load_from_snapshot(snaps[-1][0])
+        new_disk = self.doc.persistent.get_descendants(name="new_disk")[0]
+        self.assertTrue(new_disk.partner is
+                        self.doc.persistent.get_descendants(name="disk3")[0])
+
+    def test_deleted_attribute(self):
+        '''Validate an attribute deleted between snapshots stays deleted'''
+        # an object with only immutable attributes
+        slc = self.disks.get_first_child(name="disk3").get_first_child()
+        slc.extra = "extra"
+        snaps = [(self.snap("base"), tree_state(self.doc))]
+
+        del slc.extra
+        snaps.append((self.snap("deleted"), tree_state(self.doc)))
+        self.assertEqual(self.doc._journal.chain_length, 2)
+
+        for snap_path, state in reversed(snaps + snaps):
+            self.doc.load_from_snapshot(snap_path)
+            self.assertEqual(tree_state(self.doc), state)
+        self.doc.load_from_snapshot(snaps[1][0])
+        disk = self.doc.persistent.get_descendants(name="disk3")[0]
+        slc = disk.get_first_child()
+        self.assertFalse(hasattr(slc, "extra"))
+
+    def test_load_into_new_cache(self):
+        '''Validate an incremental snapshot loads in a new DOC'''
+        self.snap("base")
+        self.disks.get_first_child(name="disk3").size = 1
+        snap_path = self.snap("next")
+        state = tree_state(self.doc)
+
+        doc = DataObjectCache()
+        doc.load_from_snapshot(snap_path)
+        self.assertEqual(tree_state(doc), state)
+
+        # and new snapshots build on the snapshot loaded
+        doc.persistent.get_first_child().delete_children(name="disk4")
+        snap_path = path.join(self.temp_dir, "after_load")
+        doc.take_snapshot(snap_path)
+        self.assertEqual(doc._journal.chain_length, 3)
+        state = tree_state(doc)
+        self.doc.load_from_snapshot(snap_path)
+        self.assertEqual(tree_state(self.doc), state)
+
+    def test_full_snapshots(self):
+        '''Validate when full snapshots are written'''
+        self.snap("base")
+        for num in range(DataObjectCache()._journal.FULL_INTERVAL):
+            self.disks.get_first_child().size = num
+            self.snap("delta%d" % num)
+        self.assertEqual(self.doc._journal.chain_length,
+                         self.doc._journal.FULL_INTERVAL + 1)
+        self.snap("full")
+        self.assertEqual(self.doc._journal.chain_length, 1)
+
+        # overwriting a snapshot of the chain
+        self.snap("delta")
+        self.snap("full")
+        self.assertEqual(self.doc._journal.chain_length, 1)
+
+        # widespread changes
+        for node in self.disks.get_descendants(class_type=SimpleDataObject):
+            node.size = 0
+        self.snap("changed")
+        self.assertEqual(self.doc._journal.chain_length, 1)
+
+        # snapshot to an object
+        self.doc.take_snapshot(StringIO())
+        self.snap("after_object")
+        self.assertEqual(self.doc._journal.chain_length, 1)
+
+    def test_replaced_parent(self):
+        '''Validate loading fails if a parent snapshot was replaced'''
+        base = self.snap("base")
+        self.disks.get_first_child().size = 1
+        delta = self.snap("delta")
+
+        other = DataObjectCache()
+        other.take_snapshot(base)
+        self.assertRaises(SnapshotError, self.doc.load_from_snapshot, delta)
+
+        # and the next snapshot doesn't build on the replaced snapshot
+        self.snap("next")
+        self.assertEqual(self.doc._journal.chain_length, 1)
+
+    def test_compressed(self):
+        '''Validate compressed snapshots, in and out of chains'''
+        base = self.snap("base", compress=True)
+        plain = StringIO()
+        self.doc.take_snapshot(plain)
+        self.assertTrue(stat(base).st_size * 2 < len(plain.getvalue()))
+        self.snap("base", compress=True)
+        snaps = [(base, tree_state(self.doc))]
+
+        self.disks.get_first_child(name="disk3").size = 1
+        snaps.append((self.snap("plain_delta"), tree_state(self.doc)))
+        self.disks.delete_children(name="disk4")
+        snaps.append((self.snap("delta", compress=True),
+                      tree_state(self.doc)))
+        self.assertEqual(self.doc._journal.chain_length, 3)
+
+        for snap_path, state in reversed(snaps):
+            doc = DataObjectCache()
+            doc.load_from_snapshot(snap_path)
+            self.assertEqual(tree_state(doc), state)
+
+        buf = StringIO()
+        self.doc.take_snapshot(buf, compress=True)
+        buf.seek(0)
+        self.doc.persistent.delete_children()
+        self.doc.load_from_snapshot(buf)
+        self.assertEqual(tree_state(self.doc), snaps[-1][1])
+
+    def test_format(self):
+        '''Validate snapshots are versioned binary files'''
+        with open(self.snap("base"), "rb") as snap_file:
+            data = snap_file.read()
+        self.assertTrue(data.startswith(SNAPSHOT_MAGIC + "\x02\x00\x80"))
+
+        # Versions this code doesn't know about are refused
+        buf = StringIO(SNAPSHOT_MAGIC + "\x03" +
+                       data[len(SNAPSHOT_MAGIC) + 1:])
+        self.assertRaises(SnapshotError, self.doc.load_from_snapshot, buf)
+
+    def test_legacy_snapshot(self):
+        '''Validate snapshots of earlier versions still load'''
+        state = tree_state(self.doc)
+        buf = StringIO(pickle.dumps(self.doc.persistent))
+        self.doc.persistent.delete_children()
+        self.doc.load_from_snapshot(buf)
+        self.assertEqual(tree_state(self.doc), state)
+
+    def test_version1_snapshot(self):
+        '''Validate version 1 snapshots, pickled with protocol 0, load'''
+        sids = dict()
+        stack = [self.doc.persistent]
+        while stack:
+            node = stack.pop()
+            sids[id(node)] = len(sids) + 1
+            stack.extend(node.children)
+
+        def persistent_id(obj):
+            '''Version 1 snapshot ids were pickled as strings'''
+            if id(obj) in sids:
+                return str(sids[id(obj)])
+            return None
+
+        records = list()
+        stack = [self.doc.persistent]
+        while stack:
+            node = stack.pop()
+            data = StringIO()
+            pickler = pickle.Pickler(data)
+            pickler.persistent_id = persistent_id
+            pickler.dump(node.__getstate__())
+            records.append((sids[id(node)], node.__class__,
+                            data.getvalue()))
+            stack.extend(node.children)
+
+        state = tree_state(self.doc)
+        snap_path = path.join(self.temp_dir, "version1")
+        with open(snap_path, "wb") as snap_file:
+            pickle.dump({"format": SNAPSHOT_FORMAT, "version": 1,
+                         "token": "0", "parent": None, "root": 1},
+                        snap_file)
+            pickle.dump(records, snap_file)
+        self.doc.persistent.delete_children()
+        self.doc.load_from_snapshot(snap_path)
+        self.assertEqual(tree_state(self.doc), state)
+
+        # and the next snapshot is a full one, in the current format
+        self.disks = self.doc.persistent.get_first_child()
+        self.disks.get_first_child().size = 1
+        self.snap("next")
+        self.assertEqual(self.doc._journal.chain_length, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
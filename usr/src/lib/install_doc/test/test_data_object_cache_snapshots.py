@@ -218,7 +218,7 @@ class TestDataObjectCacheSnapshots(unittest.TestCase):
 
         try:
             stat_info = stat(self.temp_file)
-            self.assertFalse(stat_info.st_size < 2048,
+            self.assertFalse(stat_info.st_size < 1024,
                 "Snapshot file size is too small: %d" % (stat_info.st_size))
         except Exception, e:
             self.fail("Got unexpected error stat-ing snapshot file: " + str(e))
@@ -231,7 +231,7 @@ class TestDataObjectCacheSnapshots(unittest.TestCase):
             self.fail("Got unexpected error writing snapshot: " + str(e))
 
         try:
-            self.assertFalse(self.buffer.len < 2048,
+            self.assertFalse(self.buffer.len < 1024,
                 "Snapshot buffer size is too small: %d" % (self.buffer.len))
         except Exception, e:
             self.fail("Got unexpected error stat-ing snapshot file: " + str(e))
@@ -287,7 +287,7 @@ class TestDataObjectCacheSnapshots(unittest.TestCase):
         except Exception, e:
             self.fail("Got unexpected error writing snapshot: " + str(e))
 
-        self.assertTrue(self.buffer.len > 2048,
+        self.assertTrue(self.buffer.len > 1024,
             "Buffer size is wrong: %d" % (self.buffer.len))
 
         # Remove some persistent children to be sure it's empty so won't
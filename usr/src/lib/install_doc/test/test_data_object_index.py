@@ -0,0 +1,236 @@
+#!/usr/bin/python
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''Tests for the indexes used by the DataObject fetching methods'''
+
+import copy
+import unittest
+
+from simple_data_object import create_simple_data_obj_tree, SimpleDataObject, \
+    SimpleDataObject2, SimpleDataObject3, SimpleDataObject4, SimpleDataObject5
+
+
+class RenamedDataObject(SimpleDataObject):
+    '''A DataObject whose name isn't the one it was created with'''
+
+    def __init__(self, name):
+        super(RenamedDataObject, self).__init__("created")
+        self.real_name = name
+
+    @property
+    def name(self):
+        '''Returns the real name of the object'''
+        return self.real_name
+
+
+class CountingList(list):
+    '''A list of children counting how often it's searched'''
+
+    def __init__(self, *args):
+        super(CountingList, self).__init__(*args)
+        self.searched = 0
+
+    def __iter__(self):
+        self.searched += 1
+        return super(CountingList, self).__iter__()
+
+
+def walk(node, name=None, class_type=None, max_depth=None):
+    '''Returns the descendants of node matching the criteria, found by
+    walking the whole tree'''
+    if class_type is None:
+        class_type = SimpleDataObject
+    found = list()
+    for child in list.__iter__(node._children):
+        if isinstance(child, class_type) and \
+            (name is None or name == child.name):
+            found.append(child)
+        if max_depth != 1:
+            found.extend(walk(child, name, class_type,
+                              max_depth and max_depth - 1 or None))
+    return found
+
+
+class TestDataObjectIndex(unittest.TestCase):
+    '''Tests for the indexes used by the DataObject fetching methods'''
+
+    QUERIES = [dict(class_type=SimpleDataObject),
+               dict(class_type=SimpleDataObject2),
+               dict(class_type=SimpleDataObject3),
+               dict(class_type=(SimpleDataObject4, SimpleDataObject5)),
+               dict(name="child_5"),
+               dict(name="child_3_1_2"),
+               dict(name="child_5_2_3_3", class_type=SimpleDataObject),
+               dict(name="child_2_1", class_type=SimpleDataObject3),
+               dict(name="new"),
+               dict(class_type=SimpleDataObject, max_depth=2),
+               dict(name="child_5_2_3_1", max_depth=3)]
+
+    def setUp(self):
+        '''Create tree of data objects to test on'''
+        self.data_objs = create_simple_data_obj_tree()
+        self.root = self.data_objs["data_obj"]
+
+    def tearDown(self):
+        '''Clean up references to objects'''
+        self.data_objs = None
+        self.root = None
+
+    def check_queries(self, node=None):
+        '''Validate searches of node find what walking the tree finds'''
+        if node is None:
+            node = self.root
+        for query in self.QUERIES:
+            self.assertEqual(node.get_descendants(**query),
+                             walk(node, **query), "Query %s" % query)
+
+    def test_index_searches(self):
+        '''Validate searches using the index find the same objects'''
+        self.check_queries()
+        # a second time, with the index in place
+        self.check_queries()
+        self.check_queries(self.data_objs["child_5"])
+
+        found = self.root.get_descendants(class_type=SimpleDataObject,
+                                          max_count=4)
+        self.assertEqual(found, walk(self.root)[:4])
+        found = self.data_objs["child_5"].get_children(name="child_5_2")
+        self.assertEqual(found, [self.data_objs["child_5_2"]])
+        self.assertEqual(self.data_objs["child_1_1"].get_descendants(
+            class_type=SimpleDataObject), [])
+
+    def test_index_insert_delete(self):
+        '''Validate the index follows objects inserted and deleted'''
+        self.check_queries()
+
+        new = SimpleDataObject4("new")
+        new.insert_children([SimpleDataObject5("new"),
+                             SimpleDataObject2("child_5")])
+        self.data_objs["child_2_1_1"].insert_children(new)
+        self.check_queries()
+
+        self.data_objs["child_2_1_1"].insert_children(SimpleDataObject3("new"),
+            before=new)
+        self.check_queries()
+
+        self.data_objs["child_5_2"].delete_children(class_type=
+                                                    SimpleDataObject3)
+        self.check_queries()
+
+        self.data_objs["child_3"].delete_children(
+            self.data_objs["child_3_1"])
+        self.check_queries()
+
+        self.data_objs["child_2"].delete()
+        self.check_queries()
+
+        self.root.delete_children()
+        self.check_queries()
+        self.assertEqual(self.root.get_descendants(class_type=
+                                                   SimpleDataObject), [])
+
+    def test_index_deleted_object(self):
+        '''Validate changes under a deleted object don't reach its parent'''
+        self.check_queries()
+        child = self.data_objs["child_5_2"]
+        child.delete()
+        # The deleted object still refers to its parent
+        self.assertTrue(child.parent is self.data_objs["child_5"])
+
+        child.insert_children(SimpleDataObject4("new"))
+        child.delete_children(name="child_5_2_1")
+        self.data_objs["child_5_2_3_1"]._name = "new"
+        self.check_queries()
+        self.check_queries(child)
+
+        # and once inserted again, the indexes follow it again
+        self.data_objs["child_4"].insert_children(child)
+        self.check_queries()
+        self.data_objs["child_5_2_3_2"]._name = "new"
+        self.check_queries()
+
+    def test_index_rename(self):
+        '''Validate the index follows renamed objects'''
+        self.check_queries()
+        self.data_objs["child_5_2_3"]._name = "new"
+        self.data_objs["child_1"]._name = "child_5"
+        self.check_queries()
+
+    def test_index_name_property(self):
+        '''Validate objects whose class overrides name are found'''
+        self.check_queries()
+        renamed = RenamedDataObject("new")
+        self.data_objs["child_3_1"].insert_children(renamed)
+        self.check_queries()
+        renamed.real_name = "child_5"
+        self.check_queries()
+
+    def test_index_replaced_children(self):
+        '''Validate the index follows lists of children being replaced'''
+        self.check_queries()
+        child = self.data_objs["child_5_2"]
+        new = SimpleDataObject4("new")
+        new._parent = child
+        child._children = [new]
+        self.check_queries()
+
+    def test_index_copies(self):
+        '''Validate copies of objects have indexes of their own'''
+        self.check_queries()
+        deep = copy.deepcopy(self.data_objs["child_5"])
+        deep.insert_children(SimpleDataObject4("new"))
+        self.check_queries()
+        self.check_queries(deep)
+
+        shallow = copy.copy(self.data_objs["child_5"])
+        shallow.insert_children(SimpleDataObject4("new"))
+        self.check_queries()
+        self.check_queries(shallow)
+
+    def test_index_prunes_search(self):
+        '''Validate searches don't look into branches with no matches'''
+        for key, node in self.data_objs.iteritems():
+            node._children = CountingList(node._children)
+        # The index is built by the first search
+        self.root.get_descendants(name="child_1")
+        for node in self.data_objs.itervalues():
+            node._children.searched = 0
+
+        found = self.root.get_descendants(class_type=SimpleDataObject4)
+        self.assertEqual(found, [self.data_objs["child_5_2_3"]])
+        searched = set(key for key, node in self.data_objs.iteritems()
+                       if node._children.searched)
+        self.assertEqual(searched, set(["data_obj", "child_5", "child_5_2"]))
+
+        self.root.get_descendants(name="child_2_1_1_2")
+        searched = set(key for key, node in self.data_objs.iteritems()
+                       if node._children.searched)
+        self.assertEqual(searched, set(["data_obj", "child_5", "child_5_2",
+                                        "child_2", "child_2_1",
+                                        "child_2_1_1"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
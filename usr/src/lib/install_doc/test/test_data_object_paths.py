@@ -25,8 +25,11 @@
 #
 '''Tests to validate DataObject paths functionality'''
 
+import sys
+import types
 import unittest
 
+from solaris_install import data_object
 from solaris_install.data_object import ObjectNotFoundError, PathError, \
     DataObjectBase
 import simple_data_object
@@ -642,6 +645,54 @@ class  TestDataObjectPaths(unittest.TestCase):
             " value2=%{//child_5_2_1.name}"),
             "value1=child_3_1_1 value2=child_5_2_1")
 
+    def test_dobj_path_compiled_paths_kept(self):
+        '''Validate paths are kept once compiled, and still follow the tree'''
+        path = "//child_5_2/[@simple_data_object.SimpleDataObject].name"
+        root = self.data_objs["data_obj"]
+        found = root.find_path(path)
+        self.assertTrue(path in data_object._PATH_CACHE)
+        self.assertEquals(found, ["child_5_2_1", "child_5_2_2",
+                                  "child_5_2_3"])
+
+        self.data_objs["child_5_2"].delete_children(name="child_5_2_2")
+        self.data_objs["child_5_2_3"]._name = "renamed"
+        self.assertEquals(root.find_path(path), ["child_5_2_1", "renamed"])
+
+        # The same compiled path is used below any object
+        self.assertEquals(self.data_objs["child_5"].find_path(path),
+                          ["child_5_2_1", "renamed"])
+
+    def test_dobj_path_compiled_paths_bounded(self):
+        '''Validate only a bounded number of compiled paths are kept'''
+        root = self.data_objs["data_obj"]
+        for num in range(data_object.PATH_CACHE_SIZE * 2 + 1):
+            root.find_path("//child_%d" % num)
+            self.assertTrue(len(data_object._PATH_CACHE) <=
+                            data_object.PATH_CACHE_SIZE)
+        self.assertEquals(root.find_path("//child_5_2"),
+                          [self.data_objs["child_5_2"]])
+
+    def test_dobj_path_compiled_path_class_loaded_later(self):
+        '''Validate classes of a compiled path are located on each use'''
+        path = "//[@late_data_object_mod.LateDataObject]"
+        root = self.data_objs["data_obj"]
+        self.assertRaises(PathError, root.find_path, path)
+
+        module = types.ModuleType("late_data_object_mod")
+
+        class LateDataObject(simple_data_object.SimpleDataObject):
+            '''A class of a module loaded after the path is used'''
+            pass
+
+        module.LateDataObject = LateDataObject
+        sys.modules["late_data_object_mod"] = module
+        try:
+            late = LateDataObject("late")
+            self.data_objs["child_3_1"].insert_children(late)
+            self.assertEquals(root.find_path(path), [late])
+        finally:
+            del sys.modules["late_data_object_mod"]
+
 
 if __name__ == '__main__':
     unittest.main()
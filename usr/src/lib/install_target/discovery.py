@@ -49,7 +49,7 @@ from solaris_install.target.libdiskmgt import const, diskmgt
 from solaris_install.target.libdiskmgt.attributes import DMMediaAttr
 from solaris_install.target.logical import BE, Filesystem, Logical, Zpool, Zvol
 from solaris_install.target.physical import Disk, DiskProp, DiskGeometry, \
-    DiskKeyword, Iscsi, Partition, Slice
+    DiskKeyword, Iscsi, Partition, Slice, intern_string
 from solaris_install.target.size import Size
 
 
@@ -209,11 +209,14 @@ class TargetDiscovery(Checkpoint):
             if self.is_bootdisk(new_disk.ctd):
                 new_disk.disk_keyword = DiskKeyword()
 
-        # set vendor information for the drive
+        # set vendor information for the drive.  The same few types and
+        # vendors are shared by all the disks, so keep a single copy of each.
         new_disk.disk_prop = DiskProp()
         if drive.controllers:
-            new_disk.disk_prop.dev_type = drive.controllers[0].attributes.type
-        new_disk.disk_prop.dev_vendor = drive_attributes.vendor_id
+            new_disk.disk_prop.dev_type = \
+                intern_string(drive.controllers[0].attributes.type)
+        new_disk.disk_prop.dev_vendor = \
+            intern_string(drive_attributes.vendor_id)
 
         # walk the media node to extract partitions and slices
         if drive_media is None:
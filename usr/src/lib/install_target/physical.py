@@ -65,6 +65,16 @@ def partition_sort(a, b):
     return cmp(int(a.name), int(b.name))
 
 
+def intern_string(value):
+    """ intern_string() - function to return the interned copy of a string, so
+    that a value repeated across thousands of objects is only kept once.
+    Values which are not plain strings (None, unicode) are returned as is.
+    """
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
 def fill_right(obj, desired_size, right_gap):
     """ fill_right() - function to calculate how much space in the next gap is
     needed to fulfil a change in size of an object (Slice or Partition)
@@ -688,46 +698,51 @@ class Disk(DataObject):
     """class for modifying disk layout
     """
 
+    # The attributes most disks keep at their default value are class
+    # attributes, only set on the disks they differ for.  Large systems have
+    # thousands of Disk objects, and the dictionary holding the attributes of
+    # an object grows threefold past 21 entries.
+    disk_keyword = None
+    volid = None
+
+    # is the Disk a cdrom drive?
+    iscdrom = False
+
+    if platform.processor() == "i386":
+        kernel_arch = "x86"
+    else:
+        kernel_arch = "sparc"
+
+    # zpool and vdev references
+    in_zpool = None
+    in_vdev = None
+
+    # whole disk attribute
+    whole_disk = False
+
+    # write cache
+    write_cache = False
+
     def __init__(self, name, validate_children=True):
         """ constructor for the class
         """
         super(Disk, self).__init__(name)
         self.validate_children = validate_children
         self.disk_prop = None
-        self.disk_keyword = None
 
         # store valid representations of the disk
         self.ctd = None
-        self.volid = None
         self.devpath = None
         self.devid = None
         self.opath = None
         self.wwn = None
 
-        # is the Disk a cdrom drive?
-        self.iscdrom = False
-
         # Geometry object for this disk
         self.geometry = DiskGeometry()
 
-        if platform.processor() == "i386":
-            self.kernel_arch = "x86"
-        else:
-            self.kernel_arch = "sparc"
-
-        # zpool and vdev references
-        self.in_zpool = None
-        self.in_vdev = None
-
-        # whole disk attribute
-        self.whole_disk = False
-
         # disk label
         self.label = None
 
-        # write cache
-        self.write_cache = False
-
         # active and passive aliases
         self.active_ctds = list()
         self.passive_ctds = list()
@@ -826,8 +841,8 @@ class Disk(DataObject):
         disk_prop = element.find("disk_prop")
         if disk_prop is not None:
             dp = DiskProp()
-            dp.dev_type = disk_prop.get("dev_type")
-            dp.dev_vendor = disk_prop.get("dev_vendor")
+            dp.dev_type = intern_string(disk_prop.get("dev_type"))
+            dp.dev_vendor = intern_string(disk_prop.get("dev_vendor"))
             dp.dev_size = Size(disk_prop.get("dev_size"))
             disk.disk_prop = dp
 
@@ -1646,9 +1661,34 @@ class Disk(DataObject):
             sum([c.size.sectors for c in self._children])) + Size.sector_units)
 
 
-class DiskGeometry(object):
+class SlottedObject(object):
+    """ base class for the small objects held by the attributes of each Disk.
+    There are thousands of these on large systems, so their attributes are
+    kept in __slots__ rather than in a dictionary of their own.  Their state
+    is still pickled as a dictionary, so DOC snapshots taken before they had
+    __slots__ can be loaded.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        """ return the attributes of the object as a dictionary, for pickle
+        and copy
+        """
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__
+                    if hasattr(self, slot))
+
+    def __setstate__(self, state):
+        """ restore the attributes of the object from a dictionary
+        """
+        for slot in self.__slots__:
+            if slot in state:
+                setattr(self, slot, state[slot])
+
+
+class DiskGeometry(SlottedObject):
     """ class definition for DiskGeometry objects
     """
+    __slots__ = ("blocksize", "cylsize", "efi", "ncyl", "nheads", "nsectors")
 
     def __init__(self, blocksize=512, cylsize=512):
         self.blocksize = blocksize
@@ -1659,9 +1699,10 @@ class DiskGeometry(object):
         self.nsectors = 0
 
 
-class DiskProp(object):
+class DiskProp(SlottedObject):
     """ class definition for DiskProp objects
     """
+    __slots__ = ("dev_type", "dev_vendor", "dev_size")
 
     def __init__(self):
         self.dev_type = None
@@ -1675,7 +1716,7 @@ class DiskProp(object):
         For comparrisons of dev_size, a match is found if the size of other's
         dev_size is smaller than this dev_size
         """
-        for k in self.__dict__:
+        for k in self.__slots__:
             if getattr(self, k) is not None and getattr(other, k) is not None:
                 # special case for dev_size.  other.dev_size must be smaller
                 # than self.dev_size
@@ -1689,9 +1730,10 @@ class DiskProp(object):
         return True
 
 
-class DiskKeyword(object):
+class DiskKeyword(SlottedObject):
     """ class definition for DiskKeyword objects
     """
+    __slots__ = ("key",)
 
     def __init__(self):
         # this is the only key word so far. If others need to be added, this
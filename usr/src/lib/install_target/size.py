@@ -35,7 +35,13 @@ size_re = re.compile("([\d+\.]+)(\w+)?")
 class Size(object):
     """ Translation mapping class for converting number of sectors to/from
     human readable values.
+
+    A Size only keeps its value in bytes, as an integer, and its blocksize.
+    There is a Size for every Disk, Partition and Slice in the DOC, so they
+    are kept in __slots__ rather than in a dictionary of their own.
     """
+    __slots__ = ("byte_value", "blocksize")
+
     byte_units = "b"
     s_units = "s"
     sector_units = "secs"
@@ -83,11 +89,10 @@ class Size(object):
     valid_units.extend([byte_units, sector_units, s_units])
 
     def __init__(self, humanreadable, blocksize=512):
-        self.humanreadable = humanreadable
         self.blocksize = blocksize
 
         # attempt to split the humanreadable string into a value and suffix
-        size_test = size_re.match(self.humanreadable)
+        size_test = size_re.match(humanreadable)
         if size_test is not None:
             # First try to cast the string to an int.  If the int cast fails,
             # switch to casting to a float.  If the cast to a float fails,
@@ -101,23 +106,44 @@ class Size(object):
             # exception
             if size_test.group(2) is None:
                 raise ValueError("no units specified for a size value " \
-                                  "of '%s'" % self.humanreadable)
+                                  "of '%s'" % humanreadable)
             else:
                 suffix = size_test.group(2)
         else:
             raise ValueError("unable to process a size value of '%s'" % \
-                             self.humanreadable)
+                             humanreadable)
 
         if suffix.lower() not in Size.valid_units:
             raise ValueError("invalid suffix for a size value of '%s'" % \
-                             self.humanreadable)
+                             humanreadable)
 
+        # int() only returns a long for values which don't fit in an int
         if suffix == Size.byte_units:
-            self.byte_value = long(value)
+            self.byte_value = int(value)
         elif suffix in [Size.sector_units, Size.s_units]:
-            self.byte_value = long(value * self.blocksize)
+            self.byte_value = int(value * self.blocksize)
         else:
-            self.byte_value = long(value * Size.units[suffix.lower()])
+            self.byte_value = int(value * Size.units[suffix.lower()])
+
+    def __getstate__(self):
+        """ return the state of the object as a dictionary, as it was before
+        Size had __slots__, for pickle and copy
+        """
+        return {"byte_value": self.byte_value, "blocksize": self.blocksize}
+
+    def __setstate__(self, state):
+        """ restore the state of the object.  Sizes pickled before Size had
+        __slots__ also hold the humanreadable string they were created from.
+        """
+        self.byte_value = state["byte_value"]
+        self.blocksize = state["blocksize"]
+
+    @property
+    def humanreadable(self):
+        """ class property returning a humanreadable value which can be used
+        to recreate the object
+        """
+        return str(self.byte_value) + Size.byte_units
 
     @property
     def sectors(self):
@@ -299,7 +299,6 @@ class TestZvol(unittest.TestCase):
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(
             str(GBSECTOR * 250) + Size.sector_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
 
         self.logical = Logical("logical")
         self.zpool = Zpool("zpool")
@@ -409,7 +408,6 @@ class TestPartition(unittest.TestCase):
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(
             str(GBSECTOR * 100) + Size.sector_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
 
         # reset the errsvc
         errsvc.clear_error_list()
@@ -1023,7 +1021,6 @@ class TestSliceInDisk(unittest.TestCase):
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(
             str(GBSECTOR * 100) + Size.sector_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
 
         # reset the errsvc
         errsvc.clear_error_list()
@@ -1301,7 +1298,6 @@ class TestSliceInPartition(unittest.TestCase):
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(
             str(GBSECTOR * 100) + Size.sector_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
 
         # create a single 50 GB partition inside the disk
         self.partition = self.disk.add_partition(1, CYLSIZE, 50, Size.gb_units)
@@ -1699,7 +1695,6 @@ class TestLogicalPartition(unittest.TestCase):
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(
             str(GBSECTOR * 100) + Size.sector_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
 
         # reset the errsvc
         errsvc.clear_error_list()
@@ -1991,7 +1986,6 @@ class TestFinalValidation(unittest.TestCase):
         self.disk1.disk_prop = DiskProp()
         self.disk1.disk_prop.dev_size = Size(
             str(GBSECTOR * 100) + Size.sector_units)
-        self.disk1.disk_prop.blocksize = BLOCKSIZE
 
         # reset the errsvc
         errsvc.clear_error_list()
@@ -2163,7 +2157,6 @@ class TestInUse(unittest.TestCase):
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(
             str(GBSECTOR * 100) + Size.sector_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
 
     def tearDown(self):
         self.disk.delete_children()
@@ -2237,7 +2230,6 @@ class Test4KBlocksize(unittest.TestCase):
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(
             str(GBSECTOR * 100) + Size.sector_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE_4K
 
         # reset the errsvc
         errsvc.clear_error_list()
@@ -53,8 +53,6 @@ class TestDiskPartition(unittest.TestCase):
         self.disk.ctd = "c8t1d0"
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(str(200) + Size.gb_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
-        self.disk.disk_prop.cylsize = CYLSIZE
         self.disk.disk_geometry = DiskGeometry()
         self.target.insert_children(self.disk)
 
@@ -137,8 +135,6 @@ class TestDiskSlice(unittest.TestCase):
         self.disk.ctd = "c8t1d0"
         self.disk.disk_prop = DiskProp()
         self.disk.disk_prop.dev_size = Size(str(200) + Size.gb_units)
-        self.disk.disk_prop.blocksize = BLOCKSIZE
-        self.disk.disk_prop.cylsize = CYLSIZE
         self.disk.disk_geometry = DiskGeometry()
         self.target.insert_children(self.disk)
 
@@ -270,8 +266,6 @@ class TestDiskLabeling(unittest.TestCase):
         self.disk = Disk("disk")
         self.disk.ctd = "c8t1d0"
         self.disk.disk_prop = DiskProp()
-        self.disk.disk_prop.blocksize = BLOCKSIZE
-        self.disk.disk_prop.cylsize = CYLSIZE
         self.disk.disk_geometry = DiskGeometry()
         self.disk.disk_prop.dev_size = Size("500gb")
         self.target.insert_children(self.disk)
@@ -466,12 +460,10 @@ class TestZpool(unittest.TestCase):
         self.disk1 = Disk("disk")
         self.disk1.ctd = "c8t1d0"
         self.disk1.disk_prop = DiskProp()
-        self.disk1.disk_prop.blocksize = 512
 
         self.disk2 = Disk("disk2")
         self.disk2.ctd = "c8t2d0"
         self.disk2.disk_prop = DiskProp()
-        self.disk2.disk_prop.blocksize = 512
 
     def tearDown(self):
         self.target.delete_children()
@@ -0,0 +1,487 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Load generation benchmark of the AI manifest server.
+
+Creates a throw-away install service (service configuration, AI database,
+manifest and profile files, and an image directory holding a
+service_bundle DTD) under a temporary directory, starts manifest_server
+on a local port and sends it concurrent manifest requests as
+ai_get_manifest does, for clients drawn from a fixed population.
+
+Manifests and profiles are given the criteria distributions of a typical
+service: most target single mac addresses or small IPv4 ranges of the
+client population, fewer cover memory ranges, networks or architecture
+lists, so that a client matches a manifest and a handful of profiles.
+
+Reports the throughput, the latency seen by the clients, and the time
+spent by the server in each request, broken down into:
+
+    db          opening the database, finding the manifest and running
+                the profile query
+    templating  reading profile templates and substituting client values
+    validation  validating profiles (see the -r option)
+    mime        building the MIME reply
+    other       the rest: request parsing, file reads, reply caching
+
+Run with the proto area on the PYTHONPATH, as for the unit tests:
+
+    python2.6 ai_manifest_load.py -m 1000 -p 2000 -t 8 -n 5000
+'''
+import gettext
+import httplib
+import logging
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib
+
+from sqlite3 import dbapi2 as sqlite
+
+import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.cgi_get_manifest as cgi_get_manifest
+import osol_install.auto_install.common_profile as sc
+import osol_install.auto_install.installadm_common as com
+import osol_install.auto_install.manifest_server as manifest_server
+import osol_install.auto_install.service as service
+import osol_install.auto_install.service_config as config
+
+from wsgiref.simple_server import make_server
+
+from ai_query import ARCHS, CPUS, CRITERIA_COLUMNS, MANIFESTS, PLATFORMS, \
+    PROFILES, random_ipv4, random_mac
+
+SERVICE_NAME = 'loadtest'
+DEFAULT_MANIFEST = 'default.xml'
+PHASES = ('db', 'templating', 'validation', 'mime')
+# debug level sent by ai_get_manifest unless told otherwise (AI_DBGLVL_WARN)
+CLIENT_DEBUG_LEVEL = 3
+
+MANIFEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE auto_install SYSTEM "file:///usr/share/install/ai.dtd.1">
+<auto_install>
+  <ai_instance name="%(name)s">
+    <target>
+      <logical>
+        <zpool name="rpool" is_root="true">
+          <filesystem name="export" mountpoint="/export"/>
+          <filesystem name="export/home"/>
+          <be name="solaris"/>
+        </zpool>
+      </logical>
+    </target>
+    <software type="IPS">
+      <source>
+        <publisher name="solaris">
+          <origin name="http://pkg.oracle.com/solaris/release"/>
+        </publisher>
+      </source>
+      <software_data action="install">
+        <name>pkg:/entire@latest</name>
+        <name>pkg:/group/system/solaris-large-server</name>
+      </software_data>
+    </software>
+  </ai_instance>
+</auto_install>
+'''
+
+PROFILE = '''<?xml version="1.0"?>
+<!DOCTYPE service_bundle SYSTEM "/usr/share/lib/xml/dtd/service_bundle.dtd.1">
+<service_bundle type="profile" name="%(name)s">
+  <service version="1" type="service" name="system/identity">
+    <instance enabled="true" name="node">
+      <property_group type="application" name="config">
+        <propval type="astring" name="nodename" value="host-{{AI_MAC}}"/>
+      </property_group>
+    </instance>
+  </service>
+  <service version="1" type="service" name="network/install">
+    <instance enabled="true" name="default">
+      <property_group type="application" name="install_ipv4_interface">
+        <propval type="astring" name="name" value="net0/v4"/>
+        <propval type="astring" name="static_address"
+                 value="{{AI_IPV4}}/24"/>
+      </property_group>
+    </instance>
+  </service>
+</service_bundle>
+'''
+
+# The part of service_bundle(4) used by the profiles above
+SERVICE_BUNDLE_DTD = '''<!ELEMENT service_bundle (service*)>
+<!ATTLIST service_bundle type CDATA #REQUIRED name CDATA #REQUIRED>
+<!ELEMENT service (instance*)>
+<!ATTLIST service name CDATA #REQUIRED type CDATA #REQUIRED
+                  version CDATA #REQUIRED>
+<!ELEMENT instance (property_group*)>
+<!ATTLIST instance name CDATA #REQUIRED enabled CDATA #REQUIRED>
+<!ELEMENT property_group (propval*)>
+<!ATTLIST property_group name CDATA #REQUIRED type CDATA #REQUIRED>
+<!ELEMENT propval EMPTY>
+<!ATTLIST propval name CDATA #REQUIRED type CDATA #REQUIRED
+                  value CDATA #REQUIRED>
+'''
+
+
+def make_clients(count, rand):
+    '''Return the criteria of count clients, with distinct mac addresses'''
+    clients = list()
+    for i in range(count):
+        ipv4 = random_ipv4(rand)
+        clients.append({'arch': rand.choice(ARCHS),
+                        'cpu': rand.choice(CPUS),
+                        'platform': rand.choice(PLATFORMS),
+                        'mac': random_mac(rand),
+                        'ipv4': ipv4,
+                        'network': ipv4[:9] + '000',
+                        'mem': str(rand.choice([1024, 2048, 4096, 16384]))})
+    return clients
+
+
+def criteria_row(rand, clients, targeted):
+    '''Return the criteria values of a manifest or profile. A fraction
+    targeted of them target a client of the population, by mac address or
+    a small IPv4 range, the others select by memory size, network or
+    architecture.
+    '''
+    row = [None] * 13
+    client = rand.choice(clients)
+    if rand.random() < targeted:
+        if rand.random() < 0.7:
+            row[2] = row[3] = sqlite.Binary(client['mac'].decode('hex'))
+        else:
+            low = long(client['ipv4']) - rand.randint(0, 16)
+            row[4] = low
+            row[5] = low + rand.randint(16, 64)
+        return row
+    choice = rand.randint(0, 3)
+    if choice == 0:
+        row[10] = rand.choice([512, 1024, 2048])
+        row[11] = rand.choice([None, 4096, 8192])
+    elif choice == 1:
+        row[8] = row[9] = long(client['network'])
+    elif choice == 2:
+        row[0] = ' '.join(rand.sample(ARCHS, rand.randint(1, 2)))
+    else:
+        row[6] = rand.choice(CPUS)
+        row[7] = rand.choice(PLATFORMS)
+    return row
+
+
+def create_service(root, manifests, profiles, clients):
+    '''Create the install service SERVICE_NAME under root, with the given
+    numbers of manifests and profiles for the client population clients.
+    The installadm modules are pointed at root for the service's
+    configuration.
+    '''
+    rand = random.Random(0)
+    svcdir = os.path.join(root, 'service')
+    imagedir = os.path.join(root, 'image')
+    os.makedirs(os.path.join(imagedir, 'auto_install'))
+    with open(os.path.join(imagedir, 'auto_install',
+                           'service_bundle.dtd.1'), 'w') as dtd:
+        dtd.write(SERVICE_BUNDLE_DTD)
+
+    com.AI_SERVICE_DIR_PATH = svcdir
+    config.AI_SERVICE_DIR_PATH = svcdir
+    service.AI_SERVICE_DIR_PATH = svcdir
+    config.create_service_props(SERVICE_NAME, {
+        config.PROP_SERVICE_NAME: SERVICE_NAME,
+        config.PROP_STATUS: config.STATUS_ON,
+        config.PROP_TXT_RECORD: 'aiwebserver=localhost:5555',
+        config.PROP_IMAGE_PATH: imagedir,
+        config.PROP_VERSION: config.CURRENT_VERSION,
+        config.PROP_DEFAULT_MANIFEST: DEFAULT_MANIFEST})
+    aisvc = service.AIService(SERVICE_NAME)
+
+    os.makedirs(aisvc.manifest_dir)
+    profiledir = os.path.join(aisvc.config_dir, 'profiles')
+    os.makedirs(profiledir)
+
+    con = sqlite.connect(aisvc.database_path)
+    con.execute(MANIFESTS % CRITERIA_COLUMNS)
+    con.execute(PROFILES % CRITERIA_COLUMNS)
+    placeholders = ', '.join(['?'] * 15)
+    names = [DEFAULT_MANIFEST]
+    for i in range(manifests):
+        name = 'manifest%d.xml' % i
+        names.append(name)
+        con.execute("INSERT INTO manifests VALUES (%s)" % placeholders,
+                    [name, 0] + criteria_row(rand, clients, 0.8))
+    for i in range(profiles):
+        name = 'profile%d' % i
+        path = os.path.join(profiledir, name + '.xml')
+        with open(path, 'w') as profile:
+            profile.write(PROFILE % {'name': name})
+        con.execute("INSERT INTO profiles VALUES (%s)" % placeholders,
+                    [name, path] + criteria_row(rand, clients, 0.99))
+    con.commit()
+    con.close()
+
+    for name in names:
+        with open(os.path.join(aisvc.manifest_dir, name), 'w') as manifest:
+            manifest.write(MANIFEST % {'name': name})
+
+
+class PhaseTimer(object):
+    '''Accumulates, for the request handled by the calling thread, the time
+    spent in the functions wrapped by wrap(). Time spent in a wrapped
+    function called by another is only counted in the inner one's phase.
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.requests = list()
+
+    def wrap(self, phase, func):
+        '''Return func, timed as part of phase'''
+        def timed(*args, **kwargs):
+            '''func, timed'''
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                return func(*args, **kwargs)
+            stack.append(0.0)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                nested = stack.pop()
+                self._local.times[phase] += elapsed - nested
+                if stack:
+                    stack[-1] += elapsed
+        return timed
+
+    def wrap_request(self, func):
+        '''Return func, recording the phase times of each call'''
+        def timed(*args, **kwargs):
+            '''func, recorded as a request'''
+            self._local.stack = list()
+            self._local.times = dict.fromkeys(PHASES, 0.0)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times = self._local.times
+                times['total'] = time.time() - start
+                times['other'] = times['total'] - sum([times[phase] for
+                                                       phase in PHASES])
+                self._local.stack = None
+                with self._lock:
+                    self.requests.append(times)
+        return timed
+
+
+def instrument(timer):
+    '''Wrap the functions making up each phase of a manifest request'''
+    cgi_get_manifest.process_request = \
+        timer.wrap_request(cgi_get_manifest.process_request)
+    for name in ('get_service_db', 'response_key', 'build_profile_query'):
+        setattr(cgi_get_manifest, name,
+                timer.wrap('db', getattr(cgi_get_manifest, name)))
+    AIdb.findManifest = timer.wrap('db', AIdb.findManifest)
+    AIdb.DBrequest.waitAns = timer.wrap('db', AIdb.DBrequest.waitAns)
+    cgi_get_manifest.get_profile_template = \
+        timer.wrap('templating', cgi_get_manifest.get_profile_template)
+    sc.ProfileTemplate.substitute = \
+        timer.wrap('templating', sc.ProfileTemplate.substitute)
+    sc.validate_profile_string = \
+        timer.wrap('validation', sc.validate_profile_string)
+    for name in ('MIMEText', 'MIMEMultipart', 'mime_reply'):
+        setattr(cgi_get_manifest, name,
+                timer.wrap('mime', getattr(cgi_get_manifest, name)))
+
+
+def start_server():
+    '''Start manifest_server on a free local port, returning the server'''
+    server = make_server('127.0.0.1', 0, None,
+                         server_class=manifest_server.ThreadingWSGIServer,
+                         handler_class=manifest_server.QuietRequestHandler)
+    server.set_app(manifest_server.ManifestApplication(
+        default_port=server.server_port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+def request_manifest(address, criteria):
+    '''Request the manifest of a client as ai_get_manifest does, returning
+    True if a MIME reply was received
+    '''
+    post_data = ';'.join(['%s=%s' % item for item in criteria.iteritems()])
+    params = urllib.urlencode({'version': cgi_get_manifest.VERSION,
+                               'service': SERVICE_NAME,
+                               'logging': CLIENT_DEBUG_LEVEL,
+                               'no_default': False,
+                               'postData': post_data})
+    conn = httplib.HTTPConnection(address)
+    try:
+        conn.request("POST", manifest_server.SCRIPT_PATHS[0], params,
+                     {"Content-Type": "application/x-www-form-urlencoded",
+                      "Accept": "text/plain,multipart/alternative"})
+        response = conn.getresponse()
+        response.read()
+        return response.status == 200 and 'multipart' in \
+            (response.getheader('Content-Type') or '')
+    finally:
+        conn.close()
+
+
+def load(address, clients, count, threads):
+    '''Send count requests for random clients from threads threads,
+    returning the elapsed time, the latencies and the number of errors
+    '''
+    latencies = list()
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [count]
+
+    def worker(rand):
+        '''send requests until count were sent'''
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            criteria = rand.choice(clients)
+            start = time.time()
+            try:
+                received = request_manifest(address, criteria)
+            except (httplib.HTTPException, EnvironmentError):
+                received = False
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+                if not received:
+                    errors[0] += 1
+
+    workers = [threading.Thread(target=worker,
+                                args=(random.Random(index),))
+               for index in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.time() - start, latencies, errors[0])
+
+
+def percentile(values, pct):
+    '''Return the pct percentile of the sorted list values'''
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def report(seconds, latencies, errors, requests):
+    '''Print the throughput, latency and per phase server times'''
+    print "%d requests in %.2f sec: %.1f requests/sec, %d errors" % \
+        (len(latencies), seconds, len(latencies) / seconds, errors)
+    print
+    print "%-12s %9s %9s %9s %9s" % ('msec', 'mean', 'p50', 'p95', 'p99')
+    rows = [('client', latencies)]
+    for phase in PHASES + ('other', 'total'):
+        rows.append(('  ' + phase, [times[phase] for times in requests]))
+    for name, values in rows:
+        values = sorted(values)
+        mean = sum(values) / max(len(values), 1)
+        print "%-12s %9.2f %9.2f %9.2f %9.2f" % \
+            (name, mean * 1e3, percentile(values, 50) * 1e3,
+             percentile(values, 95) * 1e3, percentile(values, 99) * 1e3)
+
+
+def main():
+    '''Parse the options, create the service and run the benchmark'''
+    gettext.install("ai", "/usr/lib/locale")
+    logging.getLogger().setLevel(logging.ERROR)
+    parser = optparse.OptionParser(usage="%prog [-m manifests] "
+                                   "[-p profiles] [-c clients] [-n requests] "
+                                   "[-t threads] [-w warmup] [-r rate] "
+                                   "[-k] [-d dir]")
+    parser.add_option("-m", "--manifests", type="int", default=1000,
+                      help="number of manifests (default: %default)")
+    parser.add_option("-p", "--profiles", type="int", default=2000,
+                      help="number of profiles (default: %default)")
+    parser.add_option("-c", "--clients", type="int", default=1000,
+                      help="size of the client population "
+                           "(default: %default)")
+    parser.add_option("-n", "--requests", type="int", default=2000,
+                      help="number of requests timed (default: %default)")
+    parser.add_option("-t", "--threads", type="int", default=8,
+                      help="number of concurrent clients "
+                           "(default: %default)")
+    parser.add_option("-w", "--warmup", type="int", default=200,
+                      help="untimed requests sent first "
+                           "(default: %default)")
+    parser.add_option("-r", "--validation-rate", type="float", default=0.0,
+                      help="fraction of the profiles validated after "
+                           "substitution (default: %default)")
+    parser.add_option("-k", "--keep-replies", default=False,
+                      action="store_true",
+                      help="leave the reply cache on, so that repeated "
+                           "clients are answered from it")
+    parser.add_option("-d", "--dir", default=None,
+                      help="create the service in this (new) directory "
+                           "and leave it in place")
+    options, args = parser.parse_args()
+
+    rand = random.Random(1)
+    clients = make_clients(options.clients, rand)
+    root = options.dir
+    if root is None:
+        root = tempfile.mkdtemp(prefix='ai_manifest_load')
+    else:
+        os.makedirs(root)
+    try:
+        create_service(root, options.manifests, options.profiles, clients)
+        cgi_get_manifest.PROFILE_VALIDATION_RATE = options.validation_rate
+        if not options.keep_replies:
+            cgi_get_manifest.RESPONSE_CACHE_SIZE = 0
+        timer = PhaseTimer()
+        instrument(timer)
+        server = start_server()
+        address = '127.0.0.1:%d' % server.server_port
+
+        if options.warmup:
+            load(address, clients, options.warmup, options.threads)
+        del timer.requests[:]
+        seconds, latencies, errors = load(address, clients,
+                                          options.requests, options.threads)
+        server.shutdown()
+        report(seconds, latencies, errors, timer.requests)
+    finally:
+        if options.dir is None:
+            shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
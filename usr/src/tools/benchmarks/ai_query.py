@@ -0,0 +1,228 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Benchmark of the AI manifest and profile matching queries.
+
+Creates an AI database with the given number of manifests and profiles
+and times the lookups of randomly generated clients, comparing the
+queries with client values inlined in the SQL text (as built by
+AI_database.build_query_str()) with the parameterized queries built by
+AI_database.build_query() and cgi_get_manifest.build_profile_query().
+
+Run with the proto area on the PYTHONPATH, as for the unit tests:
+
+    python2.6 ai_query.py -m 5000 -p 5000 -n 2000
+'''
+import gettext
+import logging
+import optparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlite3 import dbapi2 as sqlite
+
+import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.cgi_get_manifest as cgi_get_manifest
+
+# Table definitions, as created by the ai-webserver Makefile
+CRITERIA_COLUMNS = ("arch TEXT, hostname TEXT, MINmac INTEGER, "
+                    "MAXmac INTEGER, MINipv4 INTEGER, MAXipv4 INTEGER, "
+                    "cpu TEXT, platform TEXT, MINnetwork INTEGER, "
+                    "MAXnetwork INTEGER, MINmem INTEGER, MAXmem INTEGER, "
+                    "zonename TEXT")
+MANIFESTS = "CREATE TABLE manifests (name TEXT, instance INTEGER, %s)"
+PROFILES = "CREATE TABLE profiles (name TEXT, file TEXT, %s)"
+
+ARCHS = ['i86pc', 'sun4u', 'sun4v']
+CPUS = ['i386', 'sparc']
+PLATFORMS = ['i86pc', 'SUNW,Sun-Fire-T200', 'SUNW,SPARC-Enterprise-T5120']
+
+
+def random_mac(rand=random):
+    '''Return a random mac address as 12 hex digits'''
+    return '%012x' % rand.getrandbits(48)
+
+
+def random_ipv4(rand=random):
+    '''Return a random ipv4 address in its 12 digit database form'''
+    return '%03d%03d%03d%03d' % (10, rand.randint(0, 255),
+                                 rand.randint(0, 255), rand.randint(1, 254))
+
+
+def criteria_row(rand):
+    '''Return the criteria values of a random manifest or profile'''
+    row = [None] * 13
+    choice = rand.randint(0, 5)
+    if choice == 0:
+        mac = random_mac(rand)
+        row[2] = row[3] = sqlite.Binary(mac.decode('hex'))
+    elif choice == 1:
+        low = random_ipv4(rand)
+        row[4] = long(low)
+        row[5] = long(low) + rand.randint(0, 255)
+    elif choice == 2:
+        row[0] = ' '.join(rand.sample(ARCHS, rand.randint(1, 2)))
+    elif choice == 3:
+        row[6] = rand.choice(CPUS)
+        row[7] = rand.choice(PLATFORMS)
+    elif choice == 4:
+        row[8] = row[9] = long(random_ipv4(rand)[:9] + '000')
+    else:
+        row[10] = rand.choice([512, 1024, 2048])
+        row[11] = rand.choice([None, 4096, 8192])
+    return row
+
+
+def create_db(path, manifests, profiles):
+    '''Create an AI database with random manifests and profiles'''
+    rand = random.Random(0)
+    con = sqlite.connect(path)
+    con.execute(MANIFESTS % CRITERIA_COLUMNS)
+    con.execute(PROFILES % CRITERIA_COLUMNS)
+    placeholders = ', '.join(['?'] * 15)
+    for i in range(manifests):
+        con.execute("INSERT INTO manifests VALUES (%s)" % placeholders,
+                    ['manifest%d' % i, 0] + criteria_row(rand))
+    for i in range(profiles):
+        con.execute("INSERT INTO profiles VALUES (%s)" % placeholders,
+                    ['profile%d' % i, '/tmp/profile%d' % i] +
+                    criteria_row(rand))
+    con.commit()
+    con.close()
+
+
+def random_client():
+    '''Return the criteria of a random client'''
+    return {'arch': random.choice(ARCHS),
+            'cpu': random.choice(CPUS),
+            'platform': random.choice(PLATFORMS),
+            'mac': random_mac(),
+            'ipv4': random_ipv4(),
+            'network': random_ipv4()[:9] + '000',
+            'mem': str(random.choice([1024, 2048, 4096, 16384])),
+            'hostname': 'client%d' % random.randint(0, 9999),
+            'zonename': 'zone%d' % random.randint(0, 9)}
+
+
+def inline(q_str, params):
+    '''Return q_str with each "?" replaced by the literal for its parameter,
+    producing a statement unique to the client as before the queries were
+    parameterized.
+    '''
+    parts = q_str.split('?')
+    result = [parts[0]]
+    for param, part in zip(params, parts[1:]):
+        if isinstance(param, basestring):
+            result.append("'" + param + "'")
+        else:
+            result.append(str(param))
+        result.append(part)
+    return ''.join(result)
+
+
+def time_queries(con, queries):
+    '''Run each (q_str, params) query on con, returning seconds per query'''
+    start = time.time()
+    for q_str, params in queries:
+        con.execute(q_str, params).fetchall()
+    return (time.time() - start) / len(queries)
+
+
+def run(path, lookups):
+    '''Time the matching queries for lookups random clients'''
+    aidb = AIdb.DB(path)
+    queue = aidb.getQueue()
+    set_in_db = AIdb.getCriteria(queue, strip=False)
+    all_in_db = AIdb.getCriteria(queue, strip=False, onlyUsed=False)
+
+    clients = [random_client() for i in range(lookups)]
+    literal_manifest = list()
+    bound_manifest = list()
+    literal_profile = list()
+    bound_profile = list()
+    for criteria in clients:
+        literal_manifest.append((AIdb.build_query_str(criteria, set_in_db,
+                                                      all_in_db), ()))
+        bound_manifest.append(AIdb.build_query(criteria, set_in_db,
+                                               all_in_db))
+        q_str, params, messages = cgi_get_manifest.build_profile_query(
+            criteria, queue)
+        literal_profile.append((inline(q_str, params), ()))
+        bound_profile.append((q_str, params))
+    aidb.close()
+
+    con = sqlite.connect(path, cached_statements=AIdb.STATEMENT_CACHE)
+    con.create_function("is_in_list", 4, AIdb.is_in_list)
+    # warm the page cache so both variants run against the same state
+    time_queries(con, bound_manifest[:10] + bound_profile[:10])
+
+    results = [('manifest, literal', time_queries(con, literal_manifest)),
+               ('manifest, parameterized', time_queries(con, bound_manifest)),
+               ('profile, literal', time_queries(con, literal_profile)),
+               ('profile, parameterized', time_queries(con, bound_profile))]
+    con.close()
+
+    for name, seconds in results:
+        print "%-26s %10.1f usec/lookup" % (name, seconds * 1e6)
+
+
+def main():
+    '''Parse the options, create the database and run the benchmark'''
+    gettext.install("ai", "/usr/lib/locale")
+    logging.getLogger().setLevel(logging.ERROR)
+    parser = optparse.OptionParser(usage="%prog [-m manifests] "
+                                   "[-p profiles] [-n lookups] [-d db]")
+    parser.add_option("-m", "--manifests", type="int", default=5000,
+                      help="number of manifests (default: %default)")
+    parser.add_option("-p", "--profiles", type="int", default=5000,
+                      help="number of profiles (default: %default)")
+    parser.add_option("-n", "--lookups", type="int", default=2000,
+                      help="number of client lookups (default: %default)")
+    parser.add_option("-d", "--db", default=None,
+                      help="use (or create) this database file")
+    options, args = parser.parse_args()
+
+    random.seed(1)
+    path = options.db
+    remove = False
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        os.remove(path)
+        remove = True
+    try:
+        if not os.path.exists(path):
+            create_db(path, options.manifests, options.profiles)
+        run(path, options.lookups)
+    finally:
+        if remove:
+            os.remove(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
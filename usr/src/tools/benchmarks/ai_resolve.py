@@ -0,0 +1,125 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Benchmark of the bulk client resolution behind "installadm resolve".
+
+Creates an AI database as ai_query.py does and resolves a list of randomly
+generated clients with cgi_get_manifest.resolve_database_clients(),
+reporting the number of clients resolved per second. With -s, the same
+clients are also resolved one at a time with the SQL queries used for
+each client request, for comparison.
+
+Run with the proto area on the PYTHONPATH, as for the unit tests:
+
+    python2.6 ai_resolve.py -m 5000 -p 5000 -n 50000
+'''
+import gettext
+import logging
+import optparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import osol_install.auto_install.AI_database as AIdb
+import osol_install.auto_install.cgi_get_manifest as cgi_get_manifest
+
+from ai_query import create_db, random_client
+
+
+def resolve_sql(aisql, clients):
+    '''Resolve each client with the per request SQL queries'''
+    for criteria in clients:
+        AIdb.findManifestSQL(criteria, aisql)
+        q_str, params, messages = cgi_get_manifest.build_profile_query(
+            criteria, aisql.getQueue())
+        if q_str is not None:
+            aisql.submit(q_str, params=params).result()
+
+
+def run(path, lookups, sql):
+    '''Time the resolution of lookups random clients'''
+    clients = [random_client() for i in range(lookups)]
+    aisql = AIdb.DB(path)
+
+    # the indexes are built once for each version of the database
+    start = time.time()
+    cgi_get_manifest.resolution_indexes(aisql)
+    print "%-22s %10.3f sec" % ('index build', time.time() - start)
+
+    start = time.time()
+    results = cgi_get_manifest.resolve_database_clients(aisql, clients)
+    seconds = time.time() - start
+    matched = len([result for result in results if result[0] is not None])
+    print "%-22s %10.0f clients/sec (%d of %d matched a manifest)" % \
+        ('bulk, indexed', lookups / seconds, matched, lookups)
+
+    if sql:
+        start = time.time()
+        resolve_sql(aisql, clients)
+        seconds = time.time() - start
+        print "%-22s %10.0f clients/sec" % ('per client, SQL',
+                                           lookups / seconds)
+    aisql.close()
+
+
+def main():
+    '''Parse the options, create the database and run the benchmark'''
+    gettext.install("ai", "/usr/lib/locale")
+    logging.getLogger().setLevel(logging.ERROR)
+    parser = optparse.OptionParser(usage="%prog [-m manifests] "
+                                   "[-p profiles] [-n clients] [-d db] [-s]")
+    parser.add_option("-m", "--manifests", type="int", default=5000,
+                      help="number of manifests (default: %default)")
+    parser.add_option("-p", "--profiles", type="int", default=5000,
+                      help="number of profiles (default: %default)")
+    parser.add_option("-n", "--clients", type="int", default=50000,
+                      help="number of clients (default: %default)")
+    parser.add_option("-d", "--db", default=None,
+                      help="use (or create) this database file")
+    parser.add_option("-s", "--sql", default=False, action="store_true",
+                      help="also time resolving each client with SQL")
+    options, args = parser.parse_args()
+
+    random.seed(1)
+    path = options.db
+    remove = False
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        os.remove(path)
+        remove = True
+    try:
+        if not os.path.exists(path):
+            create_db(path, options.manifests, options.profiles)
+        run(path, options.clients, options.sql)
+    finally:
+        if remove:
+            os.remove(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
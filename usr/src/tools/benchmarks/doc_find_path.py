@@ -0,0 +1,269 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Benchmark of DataObject.find_path().
+
+Builds a DOC shaped like the one of an automated install: the targets found
+by target discovery in the persistent tree (disks holding partitions holding
+slices), and in the volatile tree the AI instance read from the manifest,
+with its target, logical and software sections. For each number of disks,
+reports the time taken by the path expressions the install checkpoints
+evaluate:
+
+    before      as find_path() did before paths were compiled: the rest of
+                the path broken down again below each object matched, and
+                each object searched with get_descendants()
+    parsed      with the path compiled again on every call
+    cached      with the compiled path kept from the previous call
+
+Run with the proto area on the PYTHONPATH, as for the unit tests:
+
+    python2.6 doc_find_path.py -d 4,16,64 -n 2000
+'''
+import optparse
+import sys
+import time
+
+from solaris_install import data_object
+from solaris_install.data_object import DataObject, DataObjectBase
+from solaris_install.data_object.cache import DataObjectCache
+
+# Partitions of a disk, and slices of a partition
+PARTITIONS = 4
+SLICES = 8
+
+EXPRESSIONS = (
+    # from target_selection, auto_install and target_selection_zone
+    "//[@__main__.AIInstance?2]//[@__main__.Target?2]",
+    "/persistent/discovered/[@__main__.Disk]",
+    "//[@__main__.Disk]/[@__main__.Partition].size",
+    "//disk2/p1/s0.size",
+    "//[@__main__.Zpool#1].name",
+    "//software/[@__main__.Software]/source",
+    "//[@__main__.Slice]",
+)
+
+
+class BenchObject(DataObject):
+    '''A DataObject with a couple of attributes of a target object'''
+
+    def __init__(self, name, size=0):
+        super(BenchObject, self).__init__(name)
+        self.action = "preserve"
+        self.size = size
+
+    def to_xml(self):
+        return None
+
+    @classmethod
+    def can_handle(cls, element):
+        return False
+
+    @classmethod
+    def from_xml(cls, element):
+        return None
+
+
+class AIInstance(BenchObject):
+    '''Stands in for ai_instance.AIInstance'''
+
+
+class Target(BenchObject):
+    '''Stands in for target.Target'''
+
+
+class Disk(BenchObject):
+    '''Stands in for target.physical.Disk'''
+
+
+class Partition(BenchObject):
+    '''Stands in for target.physical.Partition'''
+
+
+class Slice(BenchObject):
+    '''Stands in for target.physical.Slice'''
+
+
+class Zpool(BenchObject):
+    '''Stands in for target.logical.Zpool'''
+
+
+class Software(BenchObject):
+    '''Stands in for transfer.info.Software'''
+
+
+def build_disks(parent, disks):
+    '''Insert disks disks, with their partitions and slices, in parent'''
+    for disk_num in range(disks):
+        disk = Disk("disk%d" % disk_num, disk_num << 30)
+        for part_num in range(PARTITIONS):
+            part = Partition("p%d" % part_num, part_num << 28)
+            for slice_num in range(SLICES):
+                part.insert_children(Slice("s%d" % slice_num, slice_num))
+            disk.insert_children(part)
+        parent.insert_children(disk)
+
+
+def build_doc(disks):
+    '''Returns a DOC like the one of an install to disks disks'''
+    doc = DataObjectCache()
+    discovered = Target("discovered")
+    build_disks(discovered, disks)
+    doc.persistent.insert_children(discovered)
+
+    instance = AIInstance("default")
+    desired = Target("desired")
+    build_disks(desired, 1)
+    logical = BenchObject("logical")
+    zpool = Zpool("rpool")
+    for name in ("ROOT", "export", "export/home", "swap", "dump"):
+        zpool.insert_children(BenchObject(name))
+    logical.insert_children(zpool)
+    desired.insert_children(logical)
+    software = BenchObject("software")
+    for name in ("ips", "cpio", "p5i"):
+        transfer = Software(name)
+        transfer.insert_children([BenchObject("source"),
+                                  BenchObject("destination")])
+        software.insert_children(transfer)
+    instance.insert_children([desired, software])
+    doc.volatile.insert_children(instance)
+    return doc
+
+
+def find_path_before(obj, path_string):
+    '''find_path() as it was before paths were compiled'''
+    convert = DataObjectBase._DataObjectBase__convert_to_kwargs
+    locate = DataObjectBase._DataObjectBase__locate_class_by_name
+    remaining_path = None
+    if path_string.startswith("//"):
+        tokens = path_string.split("/", 3)
+        kwargs = convert(tokens[2])
+        if len(tokens) > 3 and tokens[3] != "":
+            remaining_path = "/" + tokens[3]
+    else:
+        tokens = path_string.split("/", 2)
+        kwargs = convert(tokens[1])
+        if len(tokens) > 2 and tokens[2] != "":
+            remaining_path = "/" + tokens[2]
+        kwargs["max_depth"] = 1
+    if "class_name" in kwargs:
+        kwargs["class_type"] = locate(kwargs.pop("class_name"))
+    elif "name" not in kwargs:
+        kwargs["class_type"] = DataObjectBase
+    attribute = kwargs.pop("attribute", None)
+
+    matched = obj.get_descendants(**kwargs)
+    if remaining_path is not None:
+        child_matched = list()
+        for child in matched:
+            child_matched.extend(find_path_before(child, remaining_path))
+        matched = child_matched
+    if attribute is not None:
+        return [getattr(match, attribute) for match in matched]
+    return matched
+
+
+def call_before(doc, path):
+    '''Evaluate path on doc as before paths were compiled'''
+    return find_path_before(doc, path)
+
+
+def call_parsed(doc, path):
+    '''Evaluate path on doc, compiling it again'''
+    data_object._PATH_CACHE.clear()
+    return doc.find_path(path)
+
+
+def call_cached(doc, path):
+    '''Evaluate path on doc, using the compiled path kept'''
+    return doc.find_path(path)
+
+
+METHODS = (call_before, call_parsed, call_cached)
+
+
+def timed(doc, path, calls, method):
+    '''Return the time taken by calls evaluations of path on doc with
+    method'''
+    method(doc, path)
+    start = time.time()
+    for call in xrange(calls):
+        method(doc, path)
+    return time.time() - start
+
+
+def run(disks, calls, repeat):
+    '''Time each expression on a DOC with disks disks, returning a list of
+    (expression, matches, [seconds taken by each of METHODS])'''
+    doc = build_doc(disks)
+    results = list()
+    for path in EXPRESSIONS:
+        matches = doc.find_path(path)
+        assert find_path_before(doc, path) == matches
+        results.append((path, len(matches),
+                        [min(timed(doc, path, calls, method)
+                             for attempt in range(repeat))
+                         for method in METHODS]))
+    return results
+
+
+def report(disks, count, calls, results):
+    '''Print the time per call of each expression, and how many times
+    faster than before it is once compiled'''
+    print "%d disks, %d objects" % (disks, count)
+    print "%-50s %7s %9s %9s %9s %6s" % ('expression', 'matches',
+                                         'before us', 'parsed us',
+                                         'cached us', 'x')
+    for path, matches, (before, parsed, cached) in results:
+        print "%-50s %7d %9.1f %9.1f %9.1f %6.2f" % \
+            (path, matches, before * 1e6 / calls, parsed * 1e6 / calls,
+             cached * 1e6 / calls, before / cached)
+    print
+
+
+def main():
+    '''Parse the options and run the benchmark'''
+    parser = optparse.OptionParser(usage="%prog [-d disks] [-n calls] "
+                                   "[-r repeat]")
+    parser.add_option("-d", "--disks", default="4,16,64",
+                      help="comma separated numbers of disks found by "
+                           "target discovery (default: %default)")
+    parser.add_option("-n", "--calls", type="int", default=2000,
+                      help="calls timed for each expression "
+                           "(default: %default)")
+    parser.add_option("-r", "--repeat", type="int", default=3,
+                      help="times the calls are timed; the best time is "
+                           "reported (default: %default)")
+    options, args = parser.parse_args()
+
+    for disks in [int(disks) for disks in options.disks.split(',')]:
+        results = run(disks, options.calls, options.repeat)
+        count = len(build_doc(disks).get_descendants(class_type=DataObject))
+        report(disks, count, options.calls, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Memory used by the objects of a DataObjectCache, by class.
+
+Walks every object reachable from a DOC and reports, for each class, the
+number of objects and the bytes they take, as given by sys.getsizeof(). The
+dictionary holding the attributes of an object is counted with the object.
+Objects shared by several others, such as interned strings, are only counted
+once, and classes, modules and functions aren't counted.
+
+The DOC is either loaded from a snapshot, e.g. one the engine wrote during
+an install:
+
+    python2.6 doc_memory.py -s /var/run/install_engine/<snapshot>
+
+or, by default, built with the targets discovery would find on a system with
+many disks, half of them with a VTOC label in a Solaris partition and half
+with a GPT label:
+
+    python2.6 doc_memory.py -d 1000
+
+Run with the proto area on the PYTHONPATH, as for the unit tests, so that the
+classes of the objects in the DOC can be imported.
+'''
+import gc
+import optparse
+import sys
+import types
+
+from solaris_install.data_object import DataObject
+from solaris_install.data_object.cache import DataObjectCache
+
+# Objects which belong to the code rather than to the DOC
+SHARED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType,
+                types.BuiltinFunctionType, types.MethodType)
+
+GBSECTOR = 2 * 1024 * 1024
+
+
+def measure(root):
+    '''Returns {class: [objects, bytes]} for the objects reachable from
+    root, each counted once'''
+    sizes = dict()
+    seen = set()
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        referents = gc.get_referents(obj)
+
+        # count the dictionary of attributes of an object with the object
+        attrs = getattr(obj, "__dict__", None)
+        if type(attrs) is dict and id(attrs) not in seen and \
+            [ref for ref in referents if ref is attrs]:
+            seen.add(id(attrs))
+            size += sys.getsizeof(attrs)
+            referents.extend(gc.get_referents(attrs))
+
+        counts = sizes.setdefault(type(obj), [0, 0])
+        counts[0] += 1
+        counts[1] += size
+        stack.extend(referents)
+    return sizes
+
+
+def build_doc(disks):
+    '''Returns a DOC holding the targets discovery would find with disks
+    disks, set as TargetDiscovery sets them'''
+    from solaris_install.target import Target
+    from solaris_install.target.physical import Disk, DiskGeometry, \
+        DiskProp, Partition, Slice, intern_string
+    from solaris_install.target.size import Size
+
+    def new_slice(index, start, sectors):
+        '''Returns a discovered Slice'''
+        slc = Slice(str(index))
+        slc.action = "preserve"
+        slc.tag = index
+        slc.size = Size(str(sectors) + Size.sector_units)
+        slc.start_sector = long(start)
+        return slc
+
+    doc = DataObjectCache()
+    discovered = Target(Target.DISCOVERED)
+    for disk_num in range(disks):
+        disk = Disk("disk", validate_children=False)
+        disk.wwn = "%016X" % (0x5000CCA000000000 + disk_num)
+        disk.ctd = "c0t%sd0" % disk.wwn
+        disk.active_ctds.append(disk.ctd)
+        disk.devid = "id1,sd@n%s" % disk.wwn.lower()
+        disk.iscdrom = False
+        disk.opath = "/dev/rdsk/%sp0" % disk.ctd
+        disk.devpath = "/scsi_vhci/disk@g%s" % disk.wwn.lower()
+
+        # strings read from libdiskmgt are new objects for each disk
+        disk.disk_prop = DiskProp()
+        disk.disk_prop.dev_type = intern_string("".join("SCSI"))
+        disk.disk_prop.dev_vendor = intern_string("".join("HITACHI"))
+
+        sectors = 600 * GBSECTOR
+        disk.disk_prop.dev_size = Size(str(sectors) + Size.sector_units)
+        if disk_num % 2:
+            disk.label = "GPT"
+            disk.geometry = DiskGeometry(512, None)
+            disk.geometry.efi = True
+            disk.insert_children([new_slice(0, 256, sectors - 16640),
+                                  new_slice(8, sectors - 16384, 16384)])
+        else:
+            disk.label = "VTOC"
+            disk.volid = "%s cyl 65533 alt 2 hd 255 sec 63" % disk.ctd
+            disk.geometry = DiskGeometry(512, 16065)
+            disk.geometry.ncyl = sectors / 16065
+            disk.geometry.nheads = 255
+            disk.geometry.nsectors = 63
+            part = Partition("1", validate_children=False)
+            part.action = "preserve"
+            part.part_type = Partition.name_to_num("Solaris2")
+            part.size = Size(str(sectors - 16065) + Size.sector_units)
+            part.start_sector = 16065L
+            part.insert_children([new_slice(0, 16065, sectors - 48195),
+                                  new_slice(1, sectors - 32130, 16065),
+                                  new_slice(2, 0, sectors - 16065),
+                                  new_slice(8, 0, 16065)])
+            disk.insert_children(part)
+        discovered.insert_children(disk)
+    doc.persistent.insert_children(discovered)
+    return doc
+
+
+def report(sizes, top):
+    '''Print the objects and bytes of the top classes, by bytes, and the
+    totals'''
+    total_objects = sum(objects for objects, size in sizes.itervalues())
+    total_bytes = sum(size for objects, size in sizes.itervalues())
+    data_objects = sum(objects for cls, (objects, size) in sizes.iteritems()
+                       if issubclass(cls, DataObject))
+
+    print "%-24s %9s %12s %9s %6s" % ('class', 'objects', 'bytes',
+                                      'per obj', '%')
+    ranked = sorted(sizes.iteritems(), key=lambda item: item[1][1],
+                    reverse=True)
+    for cls, (objects, size) in ranked[:top]:
+        print "%-24s %9d %12d %9.1f %6.1f" % \
+            (cls.__name__, objects, size, float(size) / objects,
+             size * 100.0 / total_bytes)
+    print "%-24s %9d %12d %9.1f" % ('total', total_objects, total_bytes,
+                                    float(total_bytes) / total_objects)
+    if data_objects:
+        print "%d DataObjects, %.1f bytes each with what they hold" % \
+            (data_objects, float(total_bytes) / data_objects)
+
+
+def main():
+    '''Parse the options and report on the DOC'''
+    parser = optparse.OptionParser(usage="%prog [-s snapshot | -d disks] "
+                                   "[-n top]")
+    parser.add_option("-s", "--snapshot", default=None,
+                      help="load the DOC from this snapshot")
+    parser.add_option("-d", "--disks", type="int", default=1000,
+                      help="disks found by discovery, when no snapshot is "
+                           "given (default: %default)")
+    parser.add_option("-n", "--top", type="int", default=20,
+                      help="classes reported (default: %default)")
+    options, args = parser.parse_args()
+
+    if options.snapshot is not None:
+        doc = DataObjectCache()
+        doc.load_from_snapshot(options.snapshot)
+    else:
+        doc = build_doc(options.disks)
+    report(measure(doc), options.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
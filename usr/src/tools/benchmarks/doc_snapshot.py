@@ -0,0 +1,221 @@
+#!/usr/bin/python2.6
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+# Copyright (c) 2012, Oracle and/or its affiliates. All rights reserved.
+#
+'''
+Benchmark of DataObjectCache snapshots.
+
+Builds synthetic DOC trees shaped like the result of target discovery:
+disks holding partitions holding slices, each object with a handful of
+attributes (names, sizes, flags, lists of strings, a small plain object),
+and for each tree size reports the size of a snapshot and the time taken
+to write it and to load it into a new DataObjectCache, in these formats:
+
+    pickle0     the whole tree pickled with pickle protocol 0, as
+                snapshots were written before they had a format of
+                their own
+    binary      a full snapshot in the current format
+    compressed  a full snapshot in the current format, compressed
+    delta       an incremental snapshot after 1% of the objects changed,
+                taken on top of the 'binary' snapshot
+
+Snapshots are written to a temporary directory; use -d to write them
+somewhere else, e.g. to the tmpfs the engine keeps its snapshots in.
+
+Run with the proto area on the PYTHONPATH, as for the unit tests:
+
+    python2.6 doc_snapshot.py -s 1000,10000,100000 -r 3
+'''
+import optparse
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from cStringIO import StringIO
+
+from solaris_install.data_object import DataObject
+from solaris_install.data_object.cache import DataObjectCache
+
+FORMATS = ('pickle0', 'binary', 'compressed', 'delta')
+# Partitions of a disk, and slices of a partition
+PARTITIONS = 4
+SLICES = 4
+
+
+class Geometry(object):
+    '''A plain object held by an attribute, like DiskGeometry'''
+
+    def __init__(self, blocksize, cylsize):
+        self.blocksize = blocksize
+        self.cylsize = cylsize
+
+
+class BenchObject(DataObject):
+    '''A DataObject with the attributes of a discovered target object'''
+
+    def __init__(self, name, rand):
+        super(BenchObject, self).__init__(name)
+        self.action = "preserve"
+        self.in_use = rand.random() < 0.1
+        self.size = rand.randint(1, 1 << 40)
+        self.start_sector = rand.randint(0, 1 << 32)
+        self.ctds = ["c%dt%dd0" % (rand.randint(0, 8), rand.randint(0, 64))]
+        self.geometry = Geometry(512, rand.choice([16065, 32130]))
+
+    def to_xml(self):
+        return None
+
+    @classmethod
+    def can_handle(cls, element):
+        return False
+
+    @classmethod
+    def from_xml(cls, element):
+        return None
+
+
+def build_tree(doc, nodes, rand):
+    '''Add about nodes objects to the persistent tree of doc'''
+    per_disk = 1 + PARTITIONS * (1 + SLICES)
+    targets = BenchObject("targets", rand)
+    for disk_num in range(max(1, nodes // per_disk)):
+        disk = BenchObject("disk%d" % disk_num, rand)
+        for part_num in range(PARTITIONS):
+            part = BenchObject("p%d" % part_num, rand)
+            for slice_num in range(SLICES):
+                part.insert_children(BenchObject("s%d" % slice_num, rand))
+            disk.insert_children(part)
+        targets.insert_children(disk)
+    doc.persistent.insert_children(targets)
+
+
+def change_tree(doc, fraction, rand):
+    '''Change the attributes of a fraction of the objects of doc'''
+    objects = doc.persistent.get_descendants(class_type=BenchObject)
+    for obj in rand.sample(objects, max(1, int(len(objects) * fraction))):
+        obj.size = rand.randint(1, 1 << 40)
+        obj.ctds.append("c9t0d0")
+
+
+def timed(func, *args):
+    '''Return the time taken by func(*args)'''
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def save_pickle0(doc, path):
+    '''Write the persistent tree of doc as snapshots used to be written'''
+    with open(path, 'wb') as outfile:
+        pickle.dump(doc.persistent, outfile)
+
+
+def run(directory, nodes, repeat, rand):
+    '''Time each format for a tree of about nodes objects, returning
+    {format: (objects, bytes, bytes of parents, save seconds,
+    load seconds)}'''
+    doc = DataObjectCache()
+    build_tree(doc, nodes, rand)
+    count = len(doc.persistent.get_descendants(class_type=BenchObject))
+
+    results = dict()
+    for fmt in FORMATS:
+        path = os.path.join(directory, fmt)
+        saves = list()
+        loads = list()
+        for attempt in range(repeat):
+            # a snapshot to a file object ends the current chain, so that
+            # the next snapshot to a file is a full snapshot
+            doc.take_snapshot(StringIO())
+            if fmt == 'pickle0':
+                saves.append(timed(save_pickle0, doc, path))
+            elif fmt == 'delta':
+                base = os.path.join(directory, 'binary')
+                doc.take_snapshot(base)
+                change_tree(doc, 0.01, rand)
+                saves.append(timed(doc.take_snapshot, path))
+            else:
+                saves.append(timed(doc.take_snapshot, path,
+                                   fmt == 'compressed'))
+            loads.append(timed(DataObjectCache().load_from_snapshot, path))
+        parents = 0
+        if fmt == 'delta':
+            # the snapshot can't be loaded without its parent
+            parents = os.path.getsize(base)
+        results[fmt] = (count, os.path.getsize(path), parents, min(saves),
+                        min(loads))
+    return results
+
+
+def report(all_results):
+    '''Print the results of each tree size, and how many times smaller or
+    faster than pickle0 each format is. The size of a delta snapshot is
+    followed by the size of the snapshot it was taken on top of.'''
+    print "%-8s %-11s %14s %9s %9s %7s %7s %7s" % \
+        ('objects', 'format', 'bytes', 'save ms', 'load ms', 'size x',
+         'save x', 'load x')
+    for results in all_results:
+        legacy = results['pickle0']
+        for fmt in FORMATS:
+            count, size, parents, save, load = results[fmt]
+            size_text = str(size)
+            if parents:
+                size_text += "+%d" % parents
+            print "%-8d %-11s %14s %9.1f %9.1f %7.2f %7.2f %7.2f" % \
+                (count, fmt, size_text, save * 1000, load * 1000,
+                 float(legacy[1]) / (size + parents), legacy[3] / save,
+                 legacy[4] / load)
+        print
+
+
+def main():
+    '''Parse the options and run the benchmark'''
+    parser = optparse.OptionParser(usage="%prog [-s sizes] [-r repeat] "
+                                   "[-d dir]")
+    parser.add_option("-s", "--sizes", default="1000,10000,100000",
+                      help="comma separated numbers of objects of the "
+                           "trees (default: %default)")
+    parser.add_option("-r", "--repeat", type="int", default=3,
+                      help="times each snapshot is written and loaded; "
+                           "the best time is reported (default: %default)")
+    parser.add_option("-d", "--dir", default=None,
+                      help="write the snapshots in this (existing) "
+                           "directory")
+    options, args = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(',')]
+
+    rand = random.Random(1)
+    directory = tempfile.mkdtemp(prefix='doc_snapshot', dir=options.dir)
+    try:
+        report([run(directory, nodes, options.repeat, rand)
+                for nodes in sizes])
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())